@@ -36,15 +36,217 @@ tests that verify their correctness. These implementations are available under
 the submodules 'cbientropy' and 'pybientropy'.
 
 Aliases of C versions of BiEn and TBiEn are included at the top level of this
-module for convenience.
+module for convenience, along with the batch and pairwise functions, the top-k
+search, the multi-scale pyramid, the sampled estimate of TBiEn and the scanner
+of randomness statistics from the C extension. On PyPy, the scalar, batch and
+ragged functions use the cffi binding in 'cffibientropy' instead. The functions
+computing exact results consult the persistent cache in 'bientropy.cache' when
+it is enabled, and 'bientropy.tune()' chooses the fastest engine of each length
+of string on the current host.
 '''
+import functools
+import platform
 
 from . import pybientropy
+from . import cache
+from . import tuning
 try:
-    from .cbientropy import bien, tbien
+    from . import cbientropy
 except ImportError as e:
-    print(e)
+    cbientropy = None
+    _cext_error = e
+try:
+    from . import cffibientropy
+except ImportError:
+    cffibientropy = None
+
+# The native implementation behind the top-level functions
+if cffibientropy is not None and \
+        (platform.python_implementation() == 'PyPy' or cbientropy is None):
+    _native = cffibientropy
+else:
+    _native = cbientropy
+
+if _native is not None:
+    _bien, _tbien = _native.bien, _native.tbien
+else:
+    print(_cext_error)
     import warnings
     warnings.warn('Unable to import C extension. Using slower Python '
         'implementations instead', Warning)
-    from .pybientropy import bien, tbien
+    from .pybientropy import bien as _bien, tbien as _tbien
+
+
+def bien(bits, unpacked=False):
+    """
+    BiEntropy, or BiEn for short, of the input, using the C extension if it
+    is available, with the engine of the active dispatch table if there is
+    one, see bientropy.tuning. Results are looked up in the persistent cache
+    if one has been enabled with bientropy.cache.enable().
+
+    Parameters
+    ----------
+    bits : bytes object, bitstring-like object or bit array
+        the input bitstring on which to operate, which may be a
+        one-dimensional NumPy array of bool with one bit per element
+    unpacked : bool
+        read a bytes-like object or array of uint8 as one bit per byte, each
+        0 or 1, rather than as packed bits
+
+    Returns
+    -------
+    float
+        the BiEntropy of the input
+    """
+    fun = _bien
+    if unpacked:
+        fun = functools.partial(_bien, unpacked=True)
+    engine = None
+    if tuning.ACTIVE is not None:
+        engine = tuning.scalar_engine('bien', bits, unpacked)
+        fun = tuning.scalar_function('bien', bits, unpacked) or fun
+    if cache.ACTIVE is None:
+        return fun(bits)
+    return cache.ACTIVE.score('bien', fun, bits, unpacked, engine)
+
+
+def tbien(bits, unpacked=False):
+    """
+    The logarithmic weighting BiEntropy, or TBiEn for short, of the input,
+    using the C extension if it is available, with the engine of the active
+    dispatch table if there is one, see bientropy.tuning. Results are looked
+    up in the persistent cache if one has been enabled with
+    bientropy.cache.enable().
+
+    Parameters
+    ----------
+    bits : bytes object, bitstring-like object or bit array
+        the input bitstring on which to operate, which may be a
+        one-dimensional NumPy array of bool with one bit per element
+    unpacked : bool
+        read a bytes-like object or array of uint8 as one bit per byte, each
+        0 or 1, rather than as packed bits
+
+    Returns
+    -------
+    float
+        the TBiEntropy of the input
+    """
+    fun = _tbien
+    if unpacked:
+        fun = functools.partial(_tbien, unpacked=True)
+    engine = None
+    if tuning.ACTIVE is not None:
+        engine = tuning.scalar_engine('tbien', bits, unpacked)
+        fun = tuning.scalar_function('tbien', bits, unpacked) or fun
+    if cache.ACTIVE is None:
+        return fun(bits)
+    return cache.ACTIVE.score('tbien', fun, bits, unpacked, engine)
+
+
+def _summarize(scores, summary):
+    # add scores to a Summary if one was given, as the C extension does
+    if summary is not None:
+        summary.add(scores)
+    return scores
+
+
+if _native is not None:
+    def bien_batch(data, record_bytes=None, bits=None, engine=None,
+                   summary=None, unpacked=False):
+        """
+        BiEn of each record in a batch; see cbientropy.bien_batch. Results
+        are looked up in the persistent cache if one has been enabled, and
+        added to the bientropy.Summary given as summary. Without an engine,
+        the engine of the active dispatch table is used, see
+        bientropy.tuning.
+        """
+        if cache.ACTIVE is not None:
+            scores = cache.ACTIVE.score_batch('bien', data, record_bytes,
+                                              bits, engine, unpacked)
+        else:
+            scores = None
+            if engine is None and tuning.ACTIVE is not None:
+                scores = tuning.batch_scores('bien', data, record_bytes,
+                                             bits, unpacked)
+            if scores is None:
+                scores = _native.bien_batch(data, record_bytes, bits,
+                                            engine, unpacked=unpacked)
+        return _summarize(scores, summary)
+
+    def tbien_batch(data, record_bytes=None, bits=None, engine=None,
+                    summary=None, unpacked=False):
+        """
+        TBiEn of each record in a batch; see cbientropy.tbien_batch. Results
+        are looked up in the persistent cache if one has been enabled, and
+        added to the bientropy.Summary given as summary. Without an engine,
+        the engine of the active dispatch table is used, see
+        bientropy.tuning.
+        """
+        if cache.ACTIVE is not None:
+            scores = cache.ACTIVE.score_batch('tbien', data, record_bytes,
+                                              bits, engine, unpacked)
+        else:
+            scores = None
+            if engine is None and tuning.ACTIVE is not None:
+                scores = tuning.batch_scores('tbien', data, record_bytes,
+                                             bits, unpacked)
+            if scores is None:
+                scores = _native.tbien_batch(data, record_bytes, bits,
+                                             engine, unpacked=unpacked)
+        return _summarize(scores, summary)
+
+    def bien_ragged(data, offsets, bit_lengths=None, threads=None,
+                    summary=None, weights=None):
+        """
+        BiEn of each record in a ragged batch, or with weights, the custom
+        weighting of each length; see cbientropy.bien_ragged. Results are
+        looked up in the persistent cache if one has been enabled, except
+        those of custom weightings, and added to the bientropy.Summary
+        given as summary.
+        """
+        if weights is not None:
+            scores = _native.bien_ragged(data, offsets, bit_lengths,
+                                         threads, weights=weights)
+        elif cache.ACTIVE is None:
+            scores = _native.bien_ragged(data, offsets, bit_lengths,
+                                         threads)
+        else:
+            scores = cache.ACTIVE.score_ragged('bien', data, offsets,
+                                               bit_lengths, threads)
+        return _summarize(scores, summary)
+
+    def tbien_ragged(data, offsets, bit_lengths=None, threads=None,
+                     summary=None, weights=None):
+        """
+        TBiEn of each record in a ragged batch, or with weights, the custom
+        weighting of each length; see cbientropy.tbien_ragged. Results are
+        looked up in the persistent cache if one has been enabled, except
+        those of custom weightings, and added to the bientropy.Summary
+        given as summary.
+        """
+        if weights is not None:
+            scores = _native.tbien_ragged(data, offsets, bit_lengths,
+                                          threads, weights=weights)
+        elif cache.ACTIVE is None:
+            scores = _native.tbien_ragged(data, offsets, bit_lengths,
+                                          threads)
+        else:
+            scores = cache.ACTIVE.score_ragged('tbien', data, offsets,
+                                               bit_lengths, threads)
+        return _summarize(scores, summary)
+
+
+if cbientropy is not None:
+    bien_pairwise = cbientropy.bien_pairwise
+    tbien_pairwise = cbientropy.tbien_pairwise
+    topk = cbientropy.topk
+    pyramid = cbientropy.pyramid
+    tbien_estimate = cbientropy.tbien_estimate
+    scan_metrics = cbientropy.scan_metrics
+    Summary = cbientropy.Summary
+
+tune = tuning.tune
+# route calls through the table saved by tune() on this host, if any and
+# unless BIENTROPY_NO_TUNING is set
+tuning.load_default()
@@ -0,0 +1,254 @@
+'''
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+The command line interface of the package:
+
+python -m bientropy serve (--socket PATH | --port PORT) [options]
+    run the scoring daemon of bientropy.server
+python -m bientropy loadgen (--socket PATH | --port PORT) [options]
+    measure the throughput and latency of a running daemon
+python -m bientropy stats (--socket PATH | --port PORT)
+    print the metrics of a running daemon
+python -m bientropy coordinate --port PORT --record-bytes N [options] FILE...
+    score files across workers with bientropy.distributed
+python -m bientropy worker --connect HOST:PORT [options]
+    score the shards handed out by a coordinator
+python -m bientropy tune [--budget SECONDS] [--report] [--path PATH]
+    choose the fastest engines of this host with bientropy.tuning
+python -m bientropy index FILE --output INDEX [options]
+    scan a file and write the index of bientropy.index
+python -m bientropy query INDEX [--lo N] [--hi N] [--min-score X] [options]
+    print the offsets and scores of the blocks of an index within bounds
+'''
+from __future__ import print_function
+import argparse
+import json
+import sys
+
+
+def _address(args):
+    if args.socket is not None:
+        return args.socket
+    return (args.host, args.port)
+
+
+def _add_address(parser):
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--socket', help='the path of a Unix domain socket')
+    group.add_argument('--port', type=int, help='a TCP port')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='the host for TCP (default 127.0.0.1)')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bientropy')
+    commands = parser.add_subparsers(dest='command')
+
+    serve = commands.add_parser('serve', help='run the scoring daemon')
+    _add_address(serve)
+    serve.add_argument('--max-batch', type=int, default=4096,
+                       help='the largest batch (default 4096)')
+    serve.add_argument('--max-delay-ms', type=float, default=2.0,
+                       help='how long a batch waits to fill (default 2)')
+    serve.add_argument('--threads', type=int, default=None,
+                       help='the threads scoring each batch (default: CPUs)')
+    serve.add_argument('--max-pending', type=int, default=4096,
+                       help='the unanswered requests after which a client '
+                       'is not read (default 4096)')
+
+    loadgen = commands.add_parser('loadgen', help='load a running daemon')
+    _add_address(loadgen)
+    loadgen.add_argument('--clients', type=int, default=4)
+    loadgen.add_argument('--requests', type=int, default=10000,
+                         help='the requests sent by each client')
+    loadgen.add_argument('--bits', type=int, default=256)
+    loadgen.add_argument('--pipeline', type=int, default=32,
+                         help='the requests in flight per client')
+    loadgen.add_argument('--metric', choices=['bien', 'tbien'],
+                         default='tbien')
+
+    stats = commands.add_parser('stats', help='print the daemon\'s metrics')
+    _add_address(stats)
+
+    coordinate = commands.add_parser(
+        'coordinate', help='score files across workers')
+    coordinate.add_argument('files', nargs='+', metavar='FILE')
+    coordinate.add_argument('--port', type=int, required=True)
+    coordinate.add_argument('--host', default='127.0.0.1',
+                            help='the address to listen on (default '
+                            '127.0.0.1); workers are not authenticated, so '
+                            'only use 0.0.0.0 on a trusted network')
+    coordinate.add_argument('--record-bytes', type=int, required=True)
+    coordinate.add_argument('--bits', type=int, default=None,
+                            help='the bits of each record (default all)')
+    coordinate.add_argument('--metric', choices=['bien', 'tbien'],
+                            default='tbien')
+    coordinate.add_argument('--shard-mb', type=float, default=64.0,
+                            help='the size of each shard (default 64)')
+    coordinate.add_argument('--lease-timeout', type=float, default=None,
+                            help='seconds before a held shard is also '
+                            'given to an idle worker')
+    # a summary is all the coordinator keeps, so there are no scores to write
+    scores = coordinate.add_mutually_exclusive_group()
+    scores.add_argument('--bins', type=int, default=None,
+                        help='summarize the scores in this many bins '
+                        'instead of writing them')
+    scores.add_argument('--output', default=None,
+                        help='write the scores as float64 to this file')
+
+    worker = commands.add_parser('worker', help='score shards')
+    worker.add_argument('--connect', required=True, metavar='HOST:PORT')
+    worker.add_argument('--threads', type=int, default=None,
+                        help='the threads scoring each shard (default: CPUs)')
+    worker.add_argument('--name', default=None)
+
+    tune = commands.add_parser('tune', help='choose the fastest engines')
+    tune.add_argument('--budget', type=float, default=0.01,
+                      help='seconds to time each engine for each length '
+                      '(default 0.01)')
+    tune.add_argument('--report', action='store_true',
+                      help='print the saved table rather than tuning')
+    tune.add_argument('--path', default=None,
+                      help='the table (default: in the cache directory)')
+
+    index = commands.add_parser('index', help='write the index of a file')
+    index.add_argument('file', metavar='FILE')
+    index.add_argument('--output', required=True, metavar='INDEX')
+    index.add_argument('--block-bytes', type=int, default=4096)
+    index.add_argument('--superblock-blocks', type=int, default=64,
+                       help='the blocks of each summary (default 64)')
+    index.add_argument('--fields', default=None,
+                       help='the fields kept, separated by commas '
+                       '(default all)')
+    index.add_argument('--threads', type=int, default=None,
+                       help='the threads scanning (default: CPUs)')
+
+    query = commands.add_parser('query', help='query the index of a file')
+    query.add_argument('index', metavar='INDEX')
+    query.add_argument('--lo', type=lambda x: int(x, 0), default=0,
+                       help='the first byte of the range (default 0)')
+    query.add_argument('--hi', type=lambda x: int(x, 0), default=None,
+                       help='the byte after the range (default the end)')
+    query.add_argument('--min-score', type=float, default=None)
+    query.add_argument('--max-score', type=float, default=None)
+    query.add_argument('--field', default='tbien')
+    query.add_argument('--count', action='store_true',
+                       help='print only the number of blocks')
+
+    args = parser.parse_args(argv)
+    if args.command == 'serve':
+        from .server import serve as run_server
+        print('Serving on %s' % (_address(args),), file=sys.stderr)
+        run_server(_address(args), max_batch=args.max_batch,
+                   max_delay=args.max_delay_ms/1e3, threads=args.threads,
+                   max_pending=args.max_pending)
+    elif args.command == 'loadgen':
+        from .client import load_test
+        result = load_test(_address(args), args.clients, args.requests,
+                           args.bits, args.pipeline, args.metric)
+        print('Requests:    %d in %.2f s' % (result['requests'],
+                                            result['seconds']))
+        print('Throughput:  %.0f requests/s' % result['throughput'])
+        print('Latency:     p50 %.3f ms, p99 %.3f ms, max %.3f ms' % (
+            result['latency_p50_ms'], result['latency_p99_ms'],
+            result['latency_max_ms']))
+        print('Server:      mean batch %.1f, max queue depth %d' % (
+            result['server']['mean_batch'],
+            result['server']['max_queue_depth']))
+    elif args.command == 'stats':
+        from .client import Client
+        with Client(_address(args)) as client:
+            print(json.dumps(client.stats(), indent=2, sort_keys=True))
+    elif args.command == 'coordinate':
+        from .distributed import Coordinator, make_shards
+        summary = None
+        if args.bins is not None:
+            from . import Summary
+            summary = Summary(args.bins)
+        shards = make_shards(args.files, args.record_bytes,
+                             int(args.shard_mb*(1 << 20)))
+        coordinator = Coordinator(shards, args.record_bytes, args.metric,
+                                  args.bits, summary,
+                                  (args.host, args.port),
+                                  lease_timeout=args.lease_timeout)
+        print('Coordinating %d shards on %s' % (len(shards),
+                                                coordinator.address),
+              file=sys.stderr)
+        result = coordinator.run()
+        if args.output is not None:
+            result['scores'].astype('<f8').tofile(args.output)
+        print('Records:     %d in %.2f s' % (result['records'],
+                                            result['seconds']))
+        print('Retries:     %d, steals %d' % (result['retries'],
+                                              result['steals']))
+        for name, stats in sorted(result['workers'].items()):
+            print('Worker %s: %d shards, %.0f records/s, %.2f MB/s' % (
+                name, stats['shards'], stats['records_per_s'],
+                stats['mb_per_s']))
+        if summary is not None:
+            print('Mean %.6f, min %.6f, max %.6f' % (
+                summary.mean, summary.min, summary.max))
+    elif args.command == 'worker':
+        import warnings
+        from .distributed import Worker
+        warnings.filterwarnings('ignore', 'The BiEn algorithm is not suitable')
+        host, _, port = args.connect.rpartition(':')
+        totals = Worker((host, int(port)), args.name, args.threads).run()
+        print('Scored %d records in %d shards' % (totals['records'],
+                                                  totals['shards']),
+              file=sys.stderr)
+    elif args.command == 'tune':
+        from . import tuning
+        if args.report:
+            table = tuning.DispatchTable.load(args.path)
+        else:
+            table = tuning.tune(budget=args.budget, path=args.path)
+            print('Saved to %s' % (args.path or tuning.default_path()),
+                  file=sys.stderr)
+        print(table.report())
+    elif args.command == 'index':
+        from . import index as entropy_index
+        fields = args.fields.split(',') if args.fields else None
+        with entropy_index.write(args.output, args.file, args.block_bytes,
+                                 fields, args.superblock_blocks,
+                                 args.threads) as result:
+            print('Indexed %d blocks of %d bytes' % (len(result),
+                                                     result.block_bytes),
+                  file=sys.stderr)
+    elif args.command == 'query':
+        from . import index as entropy_index
+        with entropy_index.open(args.index) as result:
+            if args.count:
+                print(result.count(args.lo, args.hi, args.min_score,
+                                   args.max_score, args.field))
+            else:
+                offsets, scores = result.query(args.lo, args.hi,
+                                               args.min_score,
+                                               args.max_score, args.field)
+                for offset, score in zip(offsets, scores):
+                    print('0x%x %r' % (offset, float(score)))
+    else:
+        parser.print_help()
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+'''
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+This file builds the cffi binding of the C engine in ext/bientropy.c, which
+is used instead of the C extension on PyPy, where extensions written against
+the CPython API run slowly. setup.py builds it automatically on PyPy; to
+build it in place elsewhere, such as for benchmarking, run this file from the
+root of the source tree:
+
+    python bientropy/_cffi_build.py
+'''
+import os
+import sys
+from os.path import join
+
+from cffi import FFI
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+EXT = join(os.path.dirname(HERE), 'ext')
+
+ffibuilder = FFI()
+
+# The plain C interface of the engine, see ext/bientropy.h
+ffibuilder.cdef('''
+#define BIN_ENGINE_VERSION ...
+#define BIN_METRIC_BIEN ...
+#define BIN_METRIC_TBIEN ...
+#define BIN_ENGINE_AUTO ...
+#define BIN_ENGINE_WORDS ...
+#define BIN_ENGINE_BITSLICE ...
+#define BIN_BITSLICE_MAX_BITS ...
+
+double bin_bien_bytes(const unsigned char *data, size_t nbits);
+double bin_tbien_bytes(const unsigned char *data, size_t nbits);
+int bin_pack_bits(const unsigned char *src, size_t n, ptrdiff_t stride,
+                  unsigned char *dst);
+int bin_batch(const unsigned char *data, size_t nrec, size_t stride,
+              size_t nbits, int metric, int engine, double *out);
+int bin_ragged(const unsigned char *data, const int64_t *offsets,
+               const int64_t *bit_lengths, size_t nrec, int metric,
+               double *out);
+''')
+
+include_dirs = [EXT]
+library_dirs = []
+libraries = ['gmp']
+if sys.platform == 'win32':
+    # as in setup.py, MPIR stands in for GMP on Windows
+    libraries = ['mpir']
+    if 'CONDA_PREFIX' in os.environ:
+        CONDA_LIB = join(os.environ['CONDA_PREFIX'], 'Library')
+        include_dirs.append(join(CONDA_LIB, 'include'))
+        library_dirs.append(join(CONDA_LIB, 'lib'))
+
+ffibuilder.set_source(
+    'bientropy._cffibientropy',
+    '#include "bientropy.h"',
+    sources=[os.path.relpath(join(EXT, 'bientropy.c'))],
+    include_dirs=include_dirs,
+    library_dirs=library_dirs,
+    libraries=libraries)
+
+if __name__ == '__main__':
+    ffibuilder.compile(verbose=True)
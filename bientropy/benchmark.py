@@ -53,13 +53,40 @@ Table of raw times (in ms):
 
 This output is highly machine-dependent, but can be used to compare the
 implementations in this package to other implementations.
+
+The batch engines of the C extension are then timed on batches of short
+records, scoring them one record at a time with tbien() and with a prepared
+Metric, with the word-level batch engine, and with the bit-sliced batch
+engine. For example:
+
+Table of TBiEn batch times per record (in us):
+| Bits  | Loop    | Metric  | Words   | BitSlc  |
+|    16 | 4.4e+00 | 1.7e-01 | 5.4e-01 | 1.2e-01 |
+|    32 | 8.0e+00 | 3.4e-01 | 1.1e+00 | 1.9e-01 |
+|    64 | 1.6e+01 | 7.5e-01 | 2.4e+00 | 4.9e-01 |
+
+Finally, if the cffi binding has been built, tbien() of the C extension,
+which uses GMP, is compared to tbien() of the cffi binding, which uses the
+word-level engine. For example:
+
+Table of TBiEn times per call (in us):
+| Bytes | CExt    | cffi    |
+|     8 | 1.6e+01 | 3.4e+00 |
+|    64 | 1.5e+02 | 3.3e+01 |
+|   512 | 1.9e+03 | 5.9e+02 |
 '''
 from __future__ import print_function
 import timeit
 from . import pybientropy
 from . import cbientropy
+try:
+    from . import cffibientropy
+except ImportError:
+    cffibientropy = None
 
 BYTE_LENGTHS = [16, 32, 64, 128, 256, 512, 1024]
+BATCH_BITS = [16, 32, 64]
+BATCH_SIZE = 4096
 FMAP = {cbientropy.bien: pybientropy.bien,
         cbientropy.tbien: pybientropy.tbien}
 
@@ -107,3 +134,41 @@ if __name__ == '__main__':
                     cbientropy.bien, cbientropy.tbien]:
             print(' | %1.1e'%(RESULTS[byte_len][fun]/t), end='')
         print(' |')
+
+    print('\nTable of TBiEn batch times per record (in us):')
+    print('| Bits  | Loop    | Metric  | Words   | BitSlc  |')
+
+    for n_bits in BATCH_BITS:
+        print('| %5d'%n_bits, end='')
+        setup = ('import os, numpy; '
+                 'from bientropy.cbientropy import tbien, tbien_batch, '
+                 'Metric; '
+                 'data = os.urandom(%d*%d); '
+                 'recs = [data[i:i+%d] for i in range(0, len(data), %d)]; '
+                 'metric = Metric("tbien", %d)' % (
+                     BATCH_SIZE, n_bits//8, n_bits//8, n_bits//8, n_bits))
+        for stmt in ['[tbien(rec) for rec in recs]',
+                     '[metric(rec) for rec in recs]',
+                     'tbien_batch(data, %d, engine="words")'%(n_bits//8),
+                     'tbien_batch(data, %d, engine="bitslice")'%(n_bits//8)]:
+            timer = timeit.Timer(stmt=stmt, setup=setup)
+            t = timer.timeit(5)
+            print(' | %1.1e'%(t/5/BATCH_SIZE*1e6), end='')
+        print(' |')
+
+    if cffibientropy is not None:
+        print('\nTable of TBiEn times per call (in us):')
+        print('| Bytes | CExt    | cffi    |')
+
+        for byte_len in [8, 64, 512]:
+            print('| %5d'%byte_len, end='')
+            for module in ['cbientropy', 'cffibientropy']:
+                timer = timeit.Timer(
+                    stmt='tbien(data)',
+                    setup='import os; '
+                          'from bientropy.%s import tbien; '
+                          'data = os.urandom(%d)' % (module, byte_len))
+                n_iters = get_n_iters(byte_len)*100
+                t = timer.timeit(n_iters)
+                print(' | %1.1e'%(t/n_iters*1e6), end='')
+            print(' |')
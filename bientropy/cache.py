@@ -0,0 +1,494 @@
+'''
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+This module implements an opt-in, persistent cache of results for recurring
+scans of the same data. Results are stored in an SQLite database in a local
+directory, keyed by a hash of the content, the metric, the length in bits and
+the implementation that computed them, so a rescan of unchanged data costs
+about as much as hashing it.
+
+The cache is enabled for the whole package with enable(), after which the
+top-level bien() and tbien(), the top-level batch functions and the file
+scorers in bientropy.files consult it. Each result is kept with the name and
+version of the engine that computed it, including the engine chosen by the
+active dispatch table of bientropy.tuning, so the C extension and the pure
+Python implementation, or two versions of either, can share a database
+without seeing each other's results. The database is stamped with the
+version of its layout and of the hash, and is cleared when those change.
+'''
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+
+from . import pybientropy
+
+# The cache used by the package, set by enable()
+ACTIVE = None
+
+# Strings shorter than this are scored directly, since computing them costs
+# less than looking them up
+MIN_BITS = 2048
+
+MAX_ENTRIES = 10000000
+
+SCHEMA_VERSION = 2
+
+if hasattr(hashlib, 'blake2b'):
+    HASH_NAME = 'blake2b'
+    def _new_hash():
+        return hashlib.blake2b(digest_size=20)
+else:
+    HASH_NAME = 'sha1'
+    _new_hash = hashlib.sha1
+
+
+def default_directory():
+    """
+    The per-user cache directory: %LOCALAPPDATA%\\bientropy on Windows and
+    $XDG_CACHE_HOME/bientropy or ~/.cache/bientropy elsewhere.
+    """
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+    else:
+        base = os.environ.get('XDG_CACHE_HOME',
+                              os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'bientropy')
+
+
+def engine_name(engine=None):
+    """
+    The name and version of the implementation computing results, such as
+    'c-3' for version 3 of the engines of the C extension. It changes
+    whenever the results of the engines might change. Given the name of an
+    engine of bientropy.tuning, it is the name of that engine instead, such
+    as 'c-3/words', or that of the pure Python implementation for 'python'.
+    """
+    from . import _native
+    if _native is not None and engine != 'python':
+        if engine is not None:
+            return 'c-%d/%s' % (_native.ENGINE_VERSION, engine)
+        return 'c-%d' % _native.ENGINE_VERSION
+    return 'py-%s' % pybientropy.__version__
+
+
+def engine_stamp():
+    """
+    The version stamp of the implementation whose results are cached or
+    tuned, including the layout of the database and the hash of the keys.
+    """
+    return '%d/%s/%s' % (SCHEMA_VERSION, engine_name(), HASH_NAME)
+
+
+def _database_stamp():
+    # the results of every engine are kept, so the database only depends on
+    # its own layout and the hash of the keys
+    return '%d/%s' % (SCHEMA_VERSION, HASH_NAME)
+
+
+def bit_array(bits, unpacked=False):
+    """
+    The NumPy array of an unpacked bit array, with one bit per element, or
+    None if bits is packed, following the rules of the C extension: arrays of
+    bool are unpacked, and so are bytes-like objects and arrays of uint8 if
+    unpacked is set.
+    """
+    if not unpacked:
+        if getattr(getattr(bits, 'dtype', None), 'kind', None) != 'b':
+            return None
+        import numpy as np
+        return np.asarray(bits)
+    import numpy as np
+    if isinstance(bits, bytes):
+        bits = np.frombuffer(bits, dtype=np.uint8)
+    arr = np.asarray(bits)
+    if arr.dtype.kind != 'b':
+        if arr.dtype not in (np.uint8, np.int8):
+            raise TypeError('An unpacked bit array must hold bool or uint8.')
+        if np.any(arr.view(np.uint8) > 1):
+            raise ValueError('An unpacked bit array must hold only 0 and 1.')
+    return arr
+
+
+def as_bit_bytes(bits, unpacked=False):
+    """
+    Convert a binary string, bitstring-like object or one-dimensional bit
+    array to a binary string and its length in bits, following the rules of
+    the C extension.
+    """
+    arr = bit_array(bits, unpacked)
+    if arr is not None:
+        import numpy as np
+        if arr.ndim != 1:
+            raise ValueError('A one-dimensional bit array is required.')
+        return np.packbits(arr).tobytes(), len(arr)
+    if isinstance(bits, bytes):
+        return bits, len(bits)*8
+    if hasattr(bits, 'tobytes'):
+        return bits.tobytes(), len(bits)
+    raise TypeError(
+        'A binary string or an object with both a tobytes() method and a '
+        'len() method that returns the length in bits is required.')
+
+
+def digest(data, nbits):
+    """
+    The hash of the first nbits bits of a bytes-like object, ignoring any
+    bits after them.
+    """
+    view = memoryview(data)
+    n_bytes = (nbits + 7)//8
+    h = _new_hash()
+    if nbits % 8:
+        h.update(view[:n_bytes - 1])
+        last = bytearray(view[n_bytes - 1:n_bytes])
+        last[0] &= (0xff << (8 - nbits % 8)) & 0xff
+        h.update(last)
+    else:
+        h.update(view[:n_bytes])
+    return h.digest()
+
+
+class ResultCache(object):
+    """
+    A persistent cache of results in an SQLite database.
+
+    Parameters
+    ----------
+    directory : str
+        the directory holding the database; defaults to default_directory()
+    max_entries : int
+        the number of results to keep; the least recently used results are
+        evicted beyond this
+    min_bits : int
+        strings shorter than this are not cached
+    """
+
+    def __init__(self, directory=None, max_entries=MAX_ENTRIES,
+                 min_bits=MIN_BITS):
+        if directory is None:
+            directory = default_directory()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.path = os.path.join(directory, 'results.sqlite')
+        self.max_entries = max_entries
+        self.min_bits = min_bits
+        self.engine = engine_name()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS meta ('
+                'name TEXT PRIMARY KEY, value TEXT)')
+            row = self._db.execute(
+                "SELECT value FROM meta WHERE name = 'stamp'").fetchone()
+            if row is None or row[0] != _database_stamp():
+                self._db.execute('DROP TABLE IF EXISTS results')
+                self._db.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('stamp', ?)",
+                    (_database_stamp(),))
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                'digest BLOB, metric TEXT, bits INTEGER, engine TEXT, '
+                'score REAL, used INTEGER, '
+                'PRIMARY KEY (digest, metric, bits, engine))')
+            self._db.execute(
+                'CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+        self._count = self._db.execute(
+            'SELECT COUNT(*) FROM results').fetchone()[0]
+        self._tick = self._db.execute(
+            'SELECT MAX(used) FROM results').fetchone()[0] or 0
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        'Close the database'
+        self._db.close()
+
+    def clear(self):
+        'Remove every result'
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM results')
+            self._count = 0
+
+    def _engine(self, engine):
+        # the name results of an engine of bientropy.tuning are kept under
+        return self.engine if engine is None else engine_name(engine)
+
+    def lookup(self, metric, keys, engine=None):
+        """
+        Look up results of this engine, or of the engine of bientropy.tuning
+        named by engine, by (digest, bits) keys, marking those found as used.
+
+        Returns
+        -------
+        dict
+            the score of each key that was found
+        """
+        found = {}
+        engine = self._engine(engine)
+        with self._lock, self._db:
+            self._tick += 1
+            for digest_, nbits in keys:
+                row = self._db.execute(
+                    'SELECT score FROM results WHERE digest = ? AND '
+                    'metric = ? AND bits = ? AND engine = ?',
+                    (digest_, metric, nbits, engine)).fetchone()
+                if row is not None:
+                    found[(digest_, nbits)] = row[0]
+            self._db.executemany(
+                'UPDATE results SET used = ? WHERE digest = ? AND '
+                'metric = ? AND bits = ? AND engine = ?',
+                [(self._tick, digest_, metric, nbits, engine)
+                 for digest_, nbits in found])
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def store(self, metric, results, engine=None):
+        """
+        Store results of this engine, or of the engine of bientropy.tuning
+        named by engine, given as a dict of scores by (digest, bits) key,
+        then evict the least recently used results beyond max_entries.
+        """
+        if not results:
+            return
+        engine = self._engine(engine)
+        with self._lock, self._db:
+            self._tick += 1
+            self._db.executemany(
+                'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                [(sqlite3.Binary(digest_), metric, nbits, engine,
+                  float(score), self._tick)
+                 for (digest_, nbits), score in results.items()])
+            self._count += len(results)
+            if self._count > self.max_entries:
+                self._count = self._db.execute(
+                    'SELECT COUNT(*) FROM results').fetchone()[0]
+            if self._count > self.max_entries:
+                # evict a little extra so that this is not done every time
+                excess = self._count - self.max_entries + \
+                    self.max_entries//10
+                self._db.execute(
+                    'DELETE FROM results WHERE rowid IN ('
+                    'SELECT rowid FROM results ORDER BY used LIMIT ?)',
+                    (excess,))
+                self._count = self._db.execute(
+                    'SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def score(self, metric, fun, bits, unpacked=False, engine=None):
+        """
+        Score one string with fun, or look its result up.
+
+        Parameters
+        ----------
+        metric : str
+            the name of the metric, such as 'tbien'
+        fun : callable
+            the function computing the metric
+        bits : bytes, bitstring-like object or bit array
+            the input string
+        unpacked : bool
+            whether bytes hold one bit each; see bit_array()
+        engine : str
+            the name of the engine of bientropy.tuning that fun runs, if not
+            the default engine
+        """
+        data, nbits = as_bit_bytes(bits, unpacked)
+        if nbits < self.min_bits:
+            return fun(bits)
+        key = (digest(data, nbits), nbits)
+        found = self.lookup(metric, [key], engine)
+        if key in found:
+            return found[key]
+        result = fun(bits)
+        self.store(metric, {key: result}, engine)
+        return result
+
+    def score_records(self, metric, records, threads=None, engine=None):
+        """
+        Score a list of (bytes-like object, bits) records, looking up the
+        long ones and computing the rest as one ragged batch or, given the
+        name of a batch engine of bientropy.tuning, with that engine, in
+        which case the records must all have the same length.
+
+        Returns
+        -------
+        numpy.ndarray
+            the score of each record
+        """
+        import numpy as np
+        from . import _native
+        ragged = getattr(_native, metric + '_ragged')
+
+        keys = [(digest(data, nbits), nbits) if nbits >= self.min_bits
+                else None
+                for data, nbits in records]
+        found = self.lookup(metric, [key for key in keys if key is not None],
+                            engine)
+        todo = [i for i, key in enumerate(keys) if key not in found]
+        scores = np.empty(len(records), dtype=np.float64)
+        for i, key in enumerate(keys):
+            if key in found:
+                scores[i] = found[key]
+        if todo:
+            chunks = [memoryview(records[i][0])[:(records[i][1] + 7)//8]
+                      for i in todo]
+            offsets = np.cumsum([0] + [len(chunk) for chunk in chunks])
+            if engine is not None:
+                from . import tuning
+                nbits = records[todo[0]][1]
+                scores[todo] = tuning.BATCH_ENGINES[engine](
+                    metric, b''.join(chunks), (nbits + 7)//8, nbits)
+            else:
+                bit_lengths = np.array([records[i][1] for i in todo],
+                                       dtype=np.int64)
+                scores[todo] = ragged(b''.join(chunks), offsets,
+                                      bit_lengths, threads)
+            self.store(metric, dict((keys[i], scores[i]) for i in todo
+                                    if keys[i] is not None), engine)
+        return scores
+
+    def score_batch(self, metric, data, record_bytes=None, bits=None,
+                    engine=None, unpacked=False):
+        """
+        Score a batch of records as the batch functions of the C extension
+        do, looking up records of at least min_bits bits. Without an engine,
+        the records are scored by the engine of the active dispatch table,
+        if any, see bientropy.tuning.
+        """
+        import numpy as np
+        from . import _native, tuning
+        batch = getattr(_native, metric + '_batch')
+        routed = None
+        if engine is None and tuning.ACTIVE is not None:
+            # the engine the batch functions use without a cache
+            routed = tuning.batch_engine(metric, data, record_bytes, bits,
+                                         unpacked)
+
+        arr = bit_array(data, unpacked) if _is_buffer(data) and \
+            (unpacked or not isinstance(data, bytes)) else None
+        if arr is not None:
+            # pack the rows as the C extension does
+            if arr.ndim != 2:
+                raise ValueError('A bit array of records must be '
+                                 'two-dimensional, with one record per row.')
+            if record_bytes is not None:
+                raise TypeError('record_bytes does not apply to bit arrays.')
+            if bits is None:
+                bits = arr.shape[1]
+            elif bits > arr.shape[1]:
+                raise ValueError('The number of bits must not exceed the '
+                                 'length of the records in bits.')
+            data = np.packbits(arr, axis=1)
+
+        if not isinstance(data, bytes) and _is_buffer(data):
+            view = memoryview(data)
+            if view.ndim >= 2 and record_bytes is None:
+                record_bytes = view.nbytes//view.shape[0] \
+                    if view.shape[0] else 1
+            if view.format != 'B' or view.ndim != 1:
+                view = view.cast('B')
+        elif isinstance(data, bytes):
+            # as the C extension does, rather than iterating over the bytes
+            if record_bytes is None:
+                raise TypeError('record_bytes is required for '
+                                'one-dimensional buffers.')
+            view = memoryview(data)
+        else:
+            records = [as_bit_bytes(rec, unpacked) for rec in data]
+            if all(nbits < self.min_bits for _, nbits in records):
+                return batch(data, engine=engine, unpacked=unpacked)
+            return self.score_records(metric, records)
+
+        if record_bytes is None or \
+                (bits if bits is not None else record_bytes*8) < \
+                self.min_bits:
+            if routed is not None:
+                return tuning.BATCH_ENGINES[routed](metric, view,
+                                                    record_bytes, bits)
+            return batch(data, record_bytes, bits, engine)
+        if bits is None:
+            bits = record_bytes*8
+        return self.score_records(
+            metric, [(view[i:i + record_bytes], bits)
+                     for i in range(0, len(view), record_bytes)],
+            engine=routed)
+
+    def score_ragged(self, metric, data, offsets, bit_lengths=None,
+                     threads=None):
+        """
+        Score a ragged batch of records as the ragged functions of the C
+        extension do, looking up records of at least min_bits bits.
+        """
+        view = memoryview(data)
+        records = []
+        for i in range(len(offsets) - 1):
+            start, stop = int(offsets[i]), int(offsets[i + 1])
+            nbits = (stop - start)*8 if bit_lengths is None \
+                else int(bit_lengths[i])
+            records.append((view[start:stop], nbits))
+        return self.score_records(metric, records, threads)
+
+
+def _is_buffer(obj):
+    try:
+        memoryview(obj)
+    except TypeError:
+        return False
+    return True
+
+
+def enable(directory=None, max_entries=MAX_ENTRIES, min_bits=MIN_BITS):
+    """
+    Enable the persistent cache for the package.
+
+    Parameters
+    ----------
+    directory : str
+        the directory holding the database; defaults to default_directory()
+    max_entries : int
+        the number of results to keep
+    min_bits : int
+        strings shorter than this are not cached
+
+    Returns
+    -------
+    ResultCache
+        the cache, which is also available as bientropy.cache.ACTIVE
+    """
+    global ACTIVE
+    disable()
+    ACTIVE = ResultCache(directory, max_entries, min_bits)
+    return ACTIVE
+
+
+def disable():
+    'Disable and close the persistent cache, if it is enabled'
+    global ACTIVE
+    if ACTIVE is not None:
+        ACTIVE.close()
+        ACTIVE = None
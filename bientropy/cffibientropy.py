@@ -0,0 +1,338 @@
+'''
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+This module implements the metrics with the C engine in ext/bientropy.c
+through a cffi binding, built by _cffi_build.py. It provides the scalar,
+batch and ragged functions of the C extension with the same arguments, and
+is used for the top-level functions of the package on PyPy, where cffi calls
+are much faster than calls into extensions written against the CPython API.
+'''
+import warnings
+
+from ._cffibientropy import ffi, lib
+
+ENGINE_VERSION = lib.BIN_ENGINE_VERSION
+
+ENGINES = {None: lib.BIN_ENGINE_AUTO,
+           'auto': lib.BIN_ENGINE_AUTO,
+           'words': lib.BIN_ENGINE_WORDS,
+           'bitslice': lib.BIN_ENGINE_BITSLICE}
+
+
+def _bit_array(bits, unpacked):
+    """
+    A C-contiguous view of an unpacked bit array, with one bit per element,
+    or None if bits is not one, as in the C extension
+    """
+    try:
+        view = memoryview(bits)
+    except TypeError:
+        if unpacked:
+            raise TypeError('An unpacked bit array is required.')
+        return None
+    if view.itemsize == 1 and (view.format.lstrip('@=<>!') == '?' or
+                               unpacked and view.format in ('B', 'b')):
+        if not view.c_contiguous:
+            import numpy as np
+            view = memoryview(np.ascontiguousarray(bits))
+        return view
+    if unpacked:
+        raise TypeError('An unpacked bit array must hold bool or uint8.')
+    return None
+
+
+def _pack_rows(view):
+    'Pack the rows of a view from _bit_array() into (bits+7)//8 bytes each'
+    nrows = view.shape[0] if view.ndim == 2 else 1
+    nbits = view.shape[-1]
+    record_bytes = (nbits + 7)//8
+    packed = bytearray(nrows*record_bytes)
+    if nrows*nbits > 0:
+        src = ffi.from_buffer(view.cast('B'))
+        dst = ffi.from_buffer(packed)
+        for r in range(nrows):
+            if lib.bin_pack_bits(src + r*nbits, nbits, 1,
+                                 dst + r*record_bytes) < 0:
+                raise ValueError('An unpacked bit array must hold only 0 '
+                                 'and 1.')
+    return bytes(packed)
+
+
+def _bit_bytes(bits, unpacked=False):
+    'The binary string and length in bits of an input, as in the C extension'
+    if isinstance(bits, bytes) and not unpacked:
+        return bits, len(bits)*8
+    view = _bit_array(bits, unpacked)
+    if view is not None:
+        if view.ndim != 1:
+            raise ValueError('A one-dimensional bit array is required.')
+        return _pack_rows(view), view.shape[0]
+    if hasattr(bits, 'tobytes'):
+        bytestr = bits.tobytes()
+        if not isinstance(bytestr, bytes):
+            raise ValueError("The result of the object's tobytes() method "
+                             "must be a binary string.")
+        if len(bytestr)*8 < len(bits) or len(bytestr) > len(bits)//8 + 1:
+            raise TypeError("The result of the object's len() method must "
+                            "be the number of bits in the string.")
+        return bytestr, len(bits)
+    raise TypeError(
+        'A binary string or an object with both a tobytes() method and a '
+        'len() method that returns the length in bits is required.')
+
+
+def _warn_bien(nbits):
+    if nbits > 32:
+        warnings.warn('The BiEn algorithm is not suitable for binary strings '
+                      'longer than 32 bits.', Warning, stacklevel=3)
+
+
+def bien(bits, unpacked=False):
+    """
+    BiEntropy, or BiEn for short, of the input; see cbientropy.bien.
+
+    Parameters
+    ----------
+    bits : bytes object, bitstring-like object or bit array
+        the input bitstring on which to operate
+    unpacked : bool
+        read a bytes-like object or array of uint8 as one bit per byte
+
+    Returns
+    -------
+    float
+        the BiEntropy of the input
+    """
+    bytestr, nbits = _bit_bytes(bits, unpacked)
+    if nbits < 2:
+        raise ValueError('The input string is too short for the word-level '
+                         'engine.')
+    _warn_bien(nbits)
+    result = lib.bin_bien_bytes(bytestr, nbits)
+    if result < 0:
+        raise MemoryError()
+    return result
+
+
+def tbien(bits, unpacked=False):
+    """
+    The logarithmic weighting BiEntropy, or TBiEn for short, of the input;
+    see cbientropy.tbien.
+
+    Parameters
+    ----------
+    bits : bytes object, bitstring-like object or bit array
+        the input bitstring on which to operate
+    unpacked : bool
+        read a bytes-like object or array of uint8 as one bit per byte
+
+    Returns
+    -------
+    float
+        the TBiEntropy of the input
+    """
+    bytestr, nbits = _bit_bytes(bits, unpacked)
+    if nbits < 2:
+        raise ValueError('The input string is too short for the TBiEn '
+                         'algorithm.')
+    result = lib.bin_tbien_bytes(bytestr, nbits)
+    if result < 0:
+        raise MemoryError()
+    return result
+
+
+def _batch(metric, data, record_bytes, bits, engine, unpacked=False):
+    import numpy as np
+
+    if engine not in ENGINES:
+        raise ValueError("Unknown engine '%s'; expected 'auto', 'words' or "
+                         "'bitslice'." % engine)
+    if isinstance(data, bytes) and record_bytes is None and not unpacked or \
+            not _is_buffer(data):
+        if record_bytes is not None or bits is not None:
+            raise TypeError('record_bytes and bits only apply to buffers of '
+                            'records.')
+        records = [_bit_bytes(rec, unpacked) for rec in data]
+        lengths = set(nbits for _, nbits in records)
+        if len(lengths) > 1:
+            if engine == 'bitslice':
+                raise ValueError('The bitslice engine requires records of '
+                                 'the same length.')
+            return _ragged_records(metric, records)
+        if not records:
+            return np.empty(0, dtype=np.float64)
+        nbits = lengths.pop()
+        record_bytes = len(records[0][0])
+        data = b''.join(bytestr for bytestr, _ in records)
+        bits = nbits
+    else:
+        bit_view = _bit_array(data, unpacked)
+        if bit_view is not None:
+            # the rows are packed into a buffer of their own
+            if bit_view.ndim != 2:
+                raise ValueError('A bit array of records must be '
+                                 'two-dimensional, with one record per row.')
+            if record_bytes is not None:
+                raise TypeError('record_bytes does not apply to bit arrays.')
+            if bits is None:
+                bits = bit_view.shape[1]
+            elif bits > bit_view.shape[1]:
+                raise ValueError('The number of bits must not exceed the '
+                                 'length of the records in bits.')
+            record_bytes = (bit_view.shape[1] + 7)//8
+            data = _pack_rows(bit_view)
+
+    view = memoryview(data)
+    if view.ndim >= 2:
+        nrec = view.shape[0]
+        rb = view.nbytes//nrec if nrec else 0
+        if record_bytes is not None and record_bytes != rb:
+            raise ValueError('record_bytes does not match the shape of the '
+                             'data.')
+        record_bytes = rb
+    else:
+        if record_bytes is None:
+            raise TypeError('record_bytes is required for one-dimensional '
+                            'buffers.')
+        if record_bytes <= 0 or view.nbytes % record_bytes != 0:
+            raise ValueError('The length of the data must be a multiple of '
+                             'record_bytes.')
+        nrec = view.nbytes//record_bytes
+    if bits is None:
+        bits = record_bytes*8
+    if bits > record_bytes*8:
+        raise ValueError('The number of bits must not exceed the length of '
+                         'the records in bits.')
+    if nrec > 0:
+        _check_bits(metric, bits, bits, engine)
+
+    out = np.empty(nrec, dtype=np.float64)
+    if nrec > 0 and lib.bin_batch(
+            ffi.from_buffer(view.cast('B') if view.format != 'B' or
+                            view.ndim != 1 else view),
+            nrec, record_bytes, bits, metric, ENGINES[engine],
+            ffi.from_buffer('double[]', out)) < 0:
+        raise MemoryError()
+    return out
+
+
+def _is_buffer(obj):
+    try:
+        memoryview(obj)
+    except TypeError:
+        return False
+    return True
+
+
+def _check_bits(metric, min_bits, max_bits, engine):
+    if min_bits < 2:
+        raise ValueError('The records are too short for the batch engines.')
+    if engine == 'bitslice' and max_bits > lib.BIN_BITSLICE_MAX_BITS:
+        raise ValueError('The bitslice engine only supports records of up to '
+                         '64 bits.')
+    if metric == lib.BIN_METRIC_BIEN:
+        _warn_bien(max_bits)
+
+
+def _ragged_records(metric, records):
+    import numpy as np
+    offsets = np.cumsum([0] + [len(bytestr) for bytestr, _ in records],
+                        dtype=np.int64)
+    bit_lengths = np.array([nbits for _, nbits in records], dtype=np.int64)
+    return _ragged(metric, b''.join(bytestr for bytestr, _ in records),
+                   offsets, bit_lengths)
+
+
+def _ragged(metric, data, offsets, bit_lengths):
+    import numpy as np
+
+    view = memoryview(data)
+    offsets = np.ascontiguousarray(offsets, dtype=np.int64)
+    if offsets.ndim != 1 or len(offsets) < 1:
+        raise ValueError('offsets must be a one-dimensional array of N+1 '
+                         'offsets.')
+    nrec = len(offsets) - 1
+    if np.any(offsets[1:] < offsets[:-1]) or offsets[0] < 0 or \
+            offsets[-1] > view.nbytes:
+        raise ValueError('The offsets must be non-decreasing and within the '
+                         'data.')
+    if bit_lengths is None:
+        lengths = (offsets[1:] - offsets[:-1])*8
+    else:
+        bit_lengths = np.ascontiguousarray(bit_lengths, dtype=np.int64)
+        if bit_lengths.shape != (nrec,):
+            raise ValueError('bit_lengths must hold one length per record.')
+        if np.any(bit_lengths > (offsets[1:] - offsets[:-1])*8):
+            raise ValueError('Each bit length must not exceed the length of '
+                             'its record in bits.')
+        lengths = bit_lengths
+    if nrec > 0:
+        _check_bits(metric, lengths.min(), lengths.max(), None)
+
+    out = np.empty(nrec, dtype=np.float64)
+    if nrec > 0 and lib.bin_ragged(
+            ffi.from_buffer(view.cast('B') if view.format != 'B' or
+                            view.ndim != 1 else view),
+            ffi.from_buffer('int64_t[]', offsets),
+            ffi.from_buffer('int64_t[]', bit_lengths)
+            if bit_lengths is not None else ffi.NULL,
+            nrec, metric, ffi.from_buffer('double[]', out)) < 0:
+        raise MemoryError()
+    return out
+
+
+def bien_batch(data, record_bytes=None, bits=None, engine=None,
+               summary=None, unpacked=False):
+    """
+    BiEn of each record in a batch; see cbientropy.bien_batch.
+    """
+    scores = _batch(lib.BIN_METRIC_BIEN, data, record_bytes, bits, engine,
+                    unpacked)
+    if summary is not None:
+        summary.add(scores)
+    return scores
+
+
+def tbien_batch(data, record_bytes=None, bits=None, engine=None,
+                summary=None, unpacked=False):
+    """
+    TBiEn of each record in a batch; see cbientropy.tbien_batch.
+    """
+    scores = _batch(lib.BIN_METRIC_TBIEN, data, record_bytes, bits, engine,
+                    unpacked)
+    if summary is not None:
+        summary.add(scores)
+    return scores
+
+
+def bien_ragged(data, offsets, bit_lengths=None, threads=None):
+    """
+    BiEn of each record in a ragged batch; see cbientropy.bien_ragged. The
+    records are scored in the calling thread, so threads is ignored.
+    """
+    return _ragged(lib.BIN_METRIC_BIEN, data, offsets, bit_lengths)
+
+
+def tbien_ragged(data, offsets, bit_lengths=None, threads=None):
+    """
+    TBiEn of each record in a ragged batch; see cbientropy.tbien_ragged. The
+    records are scored in the calling thread, so threads is ignored.
+    """
+    return _ragged(lib.BIN_METRIC_TBIEN, data, offsets, bit_lengths)
@@ -0,0 +1,260 @@
+'''
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+This module implements the client of the scoring daemon in bientropy.server
+and a load generator that measures its throughput and latency. The client
+needs neither the C extension nor NumPy.
+
+To run the load generator against a running server:
+python -m bientropy loadgen --socket /tmp/bientropy.sock
+'''
+from __future__ import print_function
+import json
+import os
+import socket
+import threading
+
+from . import cache
+from .server import REQUEST, RESPONSE, LENGTH, OP_SCORE, OP_STATS, \
+    METRICS, STATUS_OK, STATUS_INVALID, recv_exact, _clock, _percentile
+
+_METRIC_CODES = dict((name, code) for code, name in METRICS.items())
+
+# The most requests score_many() has in flight, well within the max_pending
+# of the server, which stops reading a connection beyond that
+WINDOW = 1024
+
+
+class Client(object):
+    """
+    A connection to a scoring daemon. A client may be used by one thread at
+    a time.
+
+    Parameters
+    ----------
+    address : str or tuple
+        the path of the server's Unix domain socket, or its (host, port)
+    timeout : float
+        the timeout of socket operations in seconds, or None to wait
+    """
+
+    def __init__(self, address, timeout=None):
+        if isinstance(address, tuple):
+            self._sock = socket.create_connection(address, timeout)
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.settimeout(timeout)
+            self._sock.connect(address)
+        self._next_id = 0
+
+    def close(self):
+        'Close the connection'
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _request(self, bits, metric, unpacked=False):
+        if metric not in _METRIC_CODES:
+            raise ValueError("Unknown metric '%s'; expected 'bien' or "
+                             "'tbien'." % metric)
+        data, nbits = cache.as_bit_bytes(bits, unpacked)
+        data = data[:(nbits + 7)//8]
+        request_id = self._next_id
+        self._next_id = (self._next_id + 1) & 0xffffffff
+        return request_id, REQUEST.pack(OP_SCORE, _METRIC_CODES[metric], 0,
+                                         request_id, nbits) + data
+
+    def _response(self):
+        header = recv_exact(self._sock, RESPONSE.size)
+        if header is None:
+            raise EOFError('The server closed the connection.')
+        op, status, _, request_id, value = RESPONSE.unpack(header)
+        payload = None
+        if status != STATUS_OK or op == OP_STATS:
+            length, = LENGTH.unpack(recv_exact(self._sock, LENGTH.size))
+            payload = recv_exact(self._sock, length) if length else b''
+        if status == STATUS_INVALID:
+            raise ValueError(payload.decode('utf-8'))
+        if status != STATUS_OK:
+            raise RuntimeError(payload.decode('utf-8'))
+        return request_id, value, payload
+
+    def score(self, bits, metric='tbien', unpacked=False):
+        """
+        Score one string.
+
+        Parameters
+        ----------
+        bits : bytes, bitstring-like object or bit array
+            the input string, as for bientropy.tbien()
+        metric : str
+            'bien' or 'tbien'
+        unpacked : bool
+            read bytes as one bit per byte; see bientropy.tbien()
+
+        Returns
+        -------
+        float
+            the score
+        """
+        _, request = self._request(bits, metric, unpacked)
+        self._sock.sendall(request)
+        return self._response()[1]
+
+    def score_many(self, strings, metric='tbien'):
+        """
+        Score several strings, sending up to WINDOW requests before reading
+        their responses so that the server can batch them.
+
+        Parameters
+        ----------
+        strings : iterable
+            the input strings
+        metric : str
+            'bien' or 'tbien'
+
+        Returns
+        -------
+        list of float
+            the score of each string
+        """
+        ids, requests = [], []
+        for bits in strings:
+            request_id, request = self._request(bits, metric)
+            ids.append(request_id)
+            requests.append(request)
+        scores = {}
+        error = None
+        for start in range(0, len(requests), WINDOW):
+            window = requests[start:start + WINDOW]
+            self._sock.sendall(b''.join(window))
+            for _ in window:
+                try:
+                    request_id, value, _ = self._response()
+                    scores[request_id] = value
+                except (ValueError, RuntimeError) as e:
+                    # read the other responses before raising
+                    error = e
+        if error is not None:
+            raise error
+        return [scores[request_id] for request_id in ids]
+
+    def stats(self):
+        """
+        The metrics of the server; see bientropy.server.Server.stats().
+
+        Returns
+        -------
+        dict
+        """
+        self._sock.sendall(REQUEST.pack(OP_STATS, 0, 0, 0, 0))
+        return json.loads(self._response()[2].decode('utf-8'))
+
+
+class _Bits(object):
+    'The first nbits bits of a binary string, as a bitstring-like object'
+
+    def __init__(self, data, nbits):
+        self._data = data
+        self._nbits = nbits
+
+    def tobytes(self):
+        return self._data
+
+    def __len__(self):
+        return self._nbits
+
+
+def load_test(address, clients=4, requests=10000, bits=256, pipeline=32,
+              metric='tbien'):
+    """
+    Measure the throughput and latency of a scoring daemon with several
+    concurrent clients, each keeping a window of pipeline requests of random
+    strings in flight.
+
+    Parameters
+    ----------
+    address : str or tuple
+        the address of the server
+    clients : int
+        the number of concurrent connections
+    requests : int
+        the number of requests sent by each client
+    bits : int
+        the length of each string in bits
+    pipeline : int
+        the number of requests each client sends before reading responses
+    metric : str
+        'bien' or 'tbien'
+
+    Returns
+    -------
+    dict
+        the number of requests, the time taken, the throughput in requests
+        per second, the 50th and 99th percentiles and the maximum of the
+        latencies seen by the clients, from sending a window of requests to
+        receiving all of its responses, in milliseconds, and the metrics of
+        the server
+    """
+    nbytes = (bits + 7)//8
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def run():
+        try:
+            local = []
+            with Client(address) as client:
+                for start in range(0, requests, pipeline):
+                    window = [_Bits(os.urandom(nbytes), bits)
+                              for _ in range(min(pipeline, requests - start))]
+                    sent = _clock()
+                    client.score_many(window, metric)
+                    local.extend([_clock() - sent]*len(window))
+            with lock:
+                latencies.extend(local)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(clients)]
+    started = _clock()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = _clock() - started
+    if errors:
+        raise errors[0]
+    latencies.sort()
+    with Client(address) as client:
+        server_stats = client.stats()
+    return {'requests': len(latencies),
+            'seconds': elapsed,
+            'throughput': len(latencies)/elapsed,
+            'latency_p50_ms': _percentile(latencies, 0.5)*1e3,
+            'latency_p99_ms': _percentile(latencies, 0.99)*1e3,
+            'latency_max_ms': latencies[-1]*1e3 if latencies else
+                              float('nan'),
+            'server': server_stats}
@@ -76,3 +76,20 @@ if __name__ == '__main__':
                     Bits(uint=x, length=4).bin,
                     Bits(uint=y, length=4).bin,
                     tber), end='\n' if i%4 == 3 else '')
+
+    try:
+        from bientropy.cbientropy import bien_range, tbien_range
+    except ImportError:
+        pass
+    else:
+        # The same tables can be computed for every 8-bit value at once, in
+        # the C extension without creating a Bits object for each value
+        biens = bien_range(0, 256, 8)
+        tbiens = tbien_range(0, 256, 8)
+        for a in range(256):
+            check_key = Bits(uint=a, length=8).bin
+            assert BIENTROPY_8BITS[check_key] == round(biens[a], 2)
+            assert TBIENTROPY_8BITS[check_key] == round(tbiens[a], 2)
+
+        # Histogram of TBiEn over all 16-bit strings
+        print(tbien_range(0, 2**16, 16, bins=10))
@@ -0,0 +1,665 @@
+'''
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+This module spreads the scoring of corpora split over several hosts across
+workers connected to one coordinator by TCP. The corpus is a list of files
+or byte ranges of files, cut by make_shards() into shards of whole records.
+Every worker must be able to read the files at the same paths, such as on a
+shared file system.
+
+The coordinator hands each worker up to `prefetch` shards at a time, so a
+worker always has its next shard queued. A worker that runs out of work
+steals a queued shard from the worker with the most queued, which drops it
+unless it has already started it. The shards of a worker that disconnects
+are retried elsewhere, as are those that fail, up to max_attempts times,
+and a shard held longer than lease_timeout is also given to an idle worker,
+the first result winning. The scores are gathered in shard order, or merged
+into a Summary as they arrive.
+
+To run, on the coordinating host and on each worker host:
+python -m bientropy coordinate --host 0.0.0.0 --port 7600 --record-bytes 4096
+    FILE...
+python -m bientropy worker --connect HOST:7600
+
+The messages are JSON, each with a binary payload, so that no worker or
+coordinator unpickles anything from the network, and the coordinator checks
+every message it receives, down to the histogram of each summary. There is
+no authentication: the coordinator listens on localhost unless told
+otherwise, and should only listen more widely on a trusted network.
+'''
+from __future__ import print_function
+import collections
+import json
+import numbers
+import os
+import socket
+import struct
+import threading
+import time
+
+from .server import recv_exact, _clock
+
+# Message header: length of the JSON message, length of the payload
+HEADER = struct.Struct('!II')
+
+SHARD_BYTES = 64 << 20
+PREFETCH = 2
+MAX_ATTEMPTS = 3
+
+
+def send_message(sock, message, payload=b''):
+    'Send a JSON message and its binary payload'
+    data = json.dumps(message).encode('utf-8')
+    sock.sendall(HEADER.pack(len(data), len(payload)) + data + payload)
+
+
+def recv_message(sock):
+    """
+    Receive a message sent by send_message().
+
+    Returns
+    -------
+    tuple
+        the message and its payload, or None if the connection was closed
+    """
+    header = recv_exact(sock, HEADER.size)
+    if header is None:
+        return None
+    length, payload_length = HEADER.unpack(header)
+    message = json.loads(recv_exact(sock, length).decode('utf-8'))
+    payload = recv_exact(sock, payload_length) if payload_length else b''
+    return message, payload
+
+
+def make_shards(sources, record_bytes, shard_bytes=SHARD_BYTES):
+    """
+    Cut files or byte ranges of files into shards of whole records.
+
+    Parameters
+    ----------
+    sources : list
+        paths of files, or (path, offset, length) tuples of byte ranges; any
+        bytes after the last whole record of each are not scored
+    record_bytes : int
+        the size of each record
+    shard_bytes : int
+        the largest size of a shard, rounded down to whole records
+
+    Returns
+    -------
+    list of dict
+        the path, offset and length of each shard, in order
+    """
+    per_shard = max(1, shard_bytes//record_bytes)
+    shards = []
+    for source in sources:
+        if isinstance(source, (tuple, list)):
+            path, offset, length = source
+        else:
+            path, offset, length = source, 0, os.path.getsize(source)
+        path = os.path.abspath(path)
+        records = length//record_bytes
+        for first in range(0, records, per_shard):
+            count = min(per_shard, records - first)
+            shards.append({'path': path,
+                           'offset': offset + first*record_bytes,
+                           'length': count*record_bytes})
+    return shards
+
+
+def _summary_args(summary):
+    # the arguments and state of a Summary, which are plain numbers
+    _, args, state = summary.__reduce__()
+    return list(args), list(state)
+
+
+def _is_int(value):
+    return isinstance(value, numbers.Integral) and not isinstance(value, bool)
+
+
+def _summary_from(args, state=None):
+    from . import Summary
+    summary = Summary(*args)
+    if state is not None:
+        summary.__setstate__(tuple(state))
+    return summary
+
+
+class _WorkerState(object):
+    'The coordinator\'s view of one connected worker'
+
+    def __init__(self, sock, name):
+        self.sock = sock
+        self.name = name
+        self.lock = threading.Lock()
+        # the ids of the shards the worker holds, in the order it takes them
+        self.assigned = []
+        self.open = True
+
+    def send(self, message, payload=b''):
+        with self.lock:
+            if not self.open:
+                return
+            try:
+                send_message(self.sock, message, payload)
+            except (socket.error, OSError):
+                self.open = False
+
+
+class Coordinator(object):
+    """
+    Hands shards of a corpus to workers and gathers their results.
+
+    Parameters
+    ----------
+    shards : list of dict
+        the shards, see make_shards()
+    record_bytes : int
+        the size of each record
+    metric : str
+        'bien' or 'tbien'
+    bits : int
+        the length of each record in bits, if less than 8*record_bytes
+    summary : Summary
+        if given, the workers summarize their scores, with the same bins,
+        and the summaries are merged into this one instead of the scores
+        being returned
+    address : tuple
+        the (host, port) to listen on; port 0 picks a free port, see the
+        address attribute. Any host that can connect is trusted, so the
+        default is localhost
+    prefetch : int
+        the number of shards each worker holds at a time
+    lease_timeout : float
+        the seconds after which a shard still held by one worker is also
+        given to an idle worker, or None to wait for it
+    max_attempts : int
+        the number of times a shard is tried before the run fails
+    """
+
+    def __init__(self, shards, record_bytes, metric='tbien', bits=None,
+                 summary=None, address=('127.0.0.1', 0), prefetch=PREFETCH,
+                 lease_timeout=None, max_attempts=MAX_ATTEMPTS):
+        if metric not in ('bien', 'tbien'):
+            raise ValueError("Unknown metric '%s'; expected 'bien' or "
+                             "'tbien'." % metric)
+        self.shards = list(shards)
+        self.summary = summary
+        self.prefetch = prefetch
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self._config = {'type': 'config', 'metric': metric,
+                        'record_bytes': record_bytes, 'bits': bits,
+                        'summary': None if summary is None else
+                                   _summary_args(summary)[0]}
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(address)
+        self._listener.listen(64)
+        self.address = self._listener.getsockname()
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._pending = collections.deque(range(len(self.shards)))
+        self._attempts = [0]*len(self.shards)
+        self._issued = {}
+        self._results = {}
+        self._workers = []
+        self._stats = {}
+        self._failure = None
+        self._finished = False
+        self._retries = 0
+        self._steals = 0
+
+    def _assign(self, worker, shard_id, sends):
+        # give a shard to a worker; the message is sent outside of the lock
+        worker.assigned.append(shard_id)
+        self._issued[shard_id] = _clock()
+        message = {'type': 'shard', 'id': shard_id}
+        message.update(self.shards[shard_id])
+        sends.append((worker, message))
+
+    def _dispatch(self, worker, sends):
+        # top up a worker's shards from the queue, or by stealing
+        while worker.open and len(worker.assigned) < self.prefetch:
+            if self._pending:
+                self._assign(worker, self._pending.popleft(), sends)
+                continue
+            # the first shard of a worker may have started, but not the rest
+            victims = [w for w in self._workers
+                       if w is not worker and len(w.assigned) > 1]
+            if not victims:
+                break
+            victim = max(victims, key=lambda w: len(w.assigned))
+            shard_id = victim.assigned.pop()
+            sends.append((victim, {'type': 'revoke', 'id': shard_id}))
+            self._assign(worker, shard_id, sends)
+            self._steals += 1
+
+    def _holders(self, shard_id):
+        return [w for w in self._workers if shard_id in w.assigned]
+
+    def _retry(self, shard_id, reason):
+        # put a lost or failed shard back at the front of the queue
+        if shard_id in self._results or self._holders(shard_id):
+            return
+        self._attempts[shard_id] += 1
+        if self._attempts[shard_id] >= self.max_attempts:
+            self._failure = 'Shard %d failed %d times: %s' % (
+                shard_id, self._attempts[shard_id], reason)
+            self._cond.notify_all()
+            return
+        self._retries += 1
+        self._pending.appendleft(shard_id)
+
+    def _send_all(self, sends):
+        for worker, message in sends:
+            worker.send(message)
+
+    def _accept_loop(self):
+        while True:
+            try:
+                sock, _ = self._listener.accept()
+            except (socket.error, OSError):
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            thread = threading.Thread(target=self._worker_loop, args=(sock,))
+            thread.daemon = True
+            thread.start()
+
+    def _worker_loop(self, sock):
+        worker = None
+        try:
+            received = recv_message(sock)
+            if received is None or not isinstance(received[0], dict) or \
+                    received[0].get('type') != 'hello':
+                sock.close()
+                return
+            worker = _WorkerState(sock, received[0].get('name', '?'))
+            worker.send(self._config)
+            sends = []
+            with self._lock:
+                if self._finished:
+                    worker.send({'type': 'done'})
+                    return
+                self._workers.append(worker)
+                self._stats.setdefault(worker.name, {
+                    'shards': 0, 'records': 0, 'bytes': 0, 'seconds': 0.0})
+                self._dispatch(worker, sends)
+            self._send_all(sends)
+            while True:
+                received = recv_message(sock)
+                if received is None:
+                    break
+                self._handle(worker, received[0], received[1])
+        except (socket.error, OSError, EOFError, ValueError):
+            pass
+        finally:
+            if worker is not None:
+                self._disconnect(worker)
+            sock.close()
+
+    def _check_message(self, message):
+        # a message that is not a well-formed result or error raises
+        # ValueError, which drops the worker and retries its shards
+        if not isinstance(message, dict) or \
+                message.get('type') not in ('result', 'error'):
+            raise ValueError('Unexpected message from a worker.')
+        shard_id = message.get('id')
+        if not _is_int(shard_id) or not 0 <= shard_id < len(self.shards):
+            raise ValueError('A message from a worker names no shard.')
+        if message['type'] == 'result' and (
+                not _is_int(message.get('records')) or
+                not isinstance(message.get('seconds'), numbers.Real) or
+                (self.summary is not None and
+                 not isinstance(message.get('summary'), list))):
+            raise ValueError('A result from a worker is missing fields.')
+
+    def _decode(self, message, payload):
+        # the scores or summary of a result, or ValueError if they do not
+        # cover the records of the shard; Summary.__setstate__ rejects a
+        # histogram that is negative or does not add up to its count
+        import numpy as np
+        shard_id = message['id']
+        records = self.shards[shard_id]['length'] \
+            // self._config['record_bytes']
+        if message['records'] != records:
+            raise ValueError('The result of shard %d has %d records rather '
+                             'than %d.' % (shard_id, message['records'],
+                                           records))
+        if self.summary is None:
+            if len(payload) != 8*records:
+                raise ValueError('The result of shard %d has %d bytes rather '
+                                 'than %d.' % (shard_id, len(payload),
+                                               8*records))
+            return np.frombuffer(payload, dtype='<f8').astype(np.float64)
+        try:
+            summary = _summary_from(self._config['summary'],
+                                    message['summary'])
+        except (TypeError, ValueError) as e:
+            raise ValueError('The summary of shard %d is invalid: %s' % (
+                shard_id, e))
+        if summary.count != records:
+            raise ValueError('The summary of shard %d has %d records rather '
+                             'than %d.' % (shard_id, summary.count, records))
+        return summary
+
+    def _handle(self, worker, message, payload):
+        self._check_message(message)
+        if message['type'] == 'result':
+            try:
+                result = self._decode(message, payload)
+            except ValueError as e:
+                # retried like a shard that failed
+                message = {'type': 'error', 'id': message['id'],
+                           'message': str(e)}
+        sends = []
+        with self._lock:
+            shard_id = message['id']
+            if shard_id in worker.assigned:
+                worker.assigned.remove(shard_id)
+            if message['type'] == 'result':
+                if shard_id not in self._results:
+                    if self.summary is None:
+                        self._results[shard_id] = result
+                    else:
+                        self.summary.merge(result)
+                        self._results[shard_id] = None
+                    stats = self._stats[worker.name]
+                    stats['shards'] += 1
+                    stats['records'] += message['records']
+                    stats['bytes'] += self.shards[shard_id]['length']
+                    stats['seconds'] += message['seconds']
+                    # drop the copies given out after a lease expired
+                    for other in self._holders(shard_id):
+                        other.assigned.remove(shard_id)
+                        sends.append((other, {'type': 'revoke',
+                                              'id': shard_id}))
+                    if len(self._results) == len(self.shards):
+                        self._cond.notify_all()
+            else:
+                self._retry(shard_id, message.get('message', 'error'))
+            self._dispatch(worker, sends)
+        self._send_all(sends)
+
+    def _disconnect(self, worker):
+        sends = []
+        with self._lock:
+            worker.open = False
+            if worker in self._workers:
+                self._workers.remove(worker)
+            lost, worker.assigned = worker.assigned, []
+            for shard_id in reversed(lost):
+                self._retry(shard_id, 'the worker %s disconnected'
+                            % worker.name)
+            for other in self._workers:
+                self._dispatch(other, sends)
+        self._send_all(sends)
+
+    def _expire_leases(self):
+        # give shards held too long to idle workers as well
+        sends = []
+        now = _clock()
+        with self._lock:
+            for worker in list(self._workers):
+                if not worker.assigned:
+                    continue
+                shard_id = worker.assigned[0]
+                if now - self._issued[shard_id] < self.lease_timeout:
+                    continue
+                idle = [w for w in self._workers if not w.assigned]
+                if not idle:
+                    break
+                self._assign(idle[0], shard_id, sends)
+                self._retries += 1
+        self._send_all(sends)
+
+    def run(self, timeout=None):
+        """
+        Serve workers until every shard has been scored.
+
+        Parameters
+        ----------
+        timeout : float
+            the most seconds to wait, or None to wait for ever
+
+        Returns
+        -------
+        dict
+            'scores', the scores of every record in shard order as a NumPy
+            array of float64, or None with a summary; 'records', 'bytes' and
+            'seconds', the totals and the time taken; 'retries' and
+            'steals', the numbers of shards given out again and taken from
+            one worker for another; and 'workers', for each worker by name,
+            its numbers of shards, records and bytes, its busy seconds and
+            its throughput in records and MB per busy second
+        """
+        import numpy as np
+        started = _clock()
+        thread = threading.Thread(target=self._accept_loop)
+        thread.daemon = True
+        thread.start()
+        try:
+            with self._lock:
+                while len(self._results) < len(self.shards) and \
+                        self._failure is None:
+                    wait = 0.5
+                    if timeout is not None:
+                        remaining = started + timeout - _clock()
+                        if remaining <= 0:
+                            self._failure = 'The run timed out.'
+                            break
+                        wait = min(wait, remaining)
+                    self._cond.wait(wait)
+                    if self.lease_timeout is not None:
+                        self._lock.release()
+                        try:
+                            self._expire_leases()
+                        finally:
+                            self._lock.acquire()
+                self._finished = True
+                workers = list(self._workers)
+        finally:
+            self._close()
+        for worker in workers:
+            worker.send({'type': 'done'})
+        if self._failure is not None:
+            raise RuntimeError(self._failure)
+        elapsed = _clock() - started
+        workers = {}
+        for name, stats in self._stats.items():
+            stats = dict(stats)
+            busy = stats['seconds']
+            stats['records_per_s'] = stats['records']/busy if busy else 0.0
+            stats['mb_per_s'] = stats['bytes']/1e6/busy if busy else 0.0
+            workers[name] = stats
+        scores = None
+        if self.summary is None:
+            parts = [self._results[i] for i in range(len(self.shards))]
+            scores = np.concatenate(parts) if parts else np.zeros(0)
+        return {'scores': scores,
+                'records': sum(s['records'] for s in workers.values()),
+                'bytes': sum(s['bytes'] for s in workers.values()),
+                'seconds': elapsed,
+                'retries': self._retries,
+                'steals': self._steals,
+                'workers': workers}
+
+    def _close(self):
+        try:
+            self._listener.shutdown(socket.SHUT_RDWR)
+        except (socket.error, OSError):
+            pass
+        self._listener.close()
+
+
+class Worker(object):
+    """
+    Scores the shards handed out by a coordinator with the batch and ragged
+    functions of the package.
+
+    Parameters
+    ----------
+    address : tuple
+        the (host, port) of the coordinator
+    name : str
+        the name reported with the worker's throughput; defaults to the
+        host name and process id
+    threads : int
+        the number of threads scoring each shard; defaults to the number of
+        CPUs
+    connect_timeout : float
+        how long to keep trying to connect, for workers started before the
+        coordinator
+    """
+
+    def __init__(self, address, name=None, threads=None,
+                 connect_timeout=30.0):
+        self.address = tuple(address)
+        self.name = name or '%s:%d' % (socket.gethostname(), os.getpid())
+        self.threads = threads
+        self.connect_timeout = connect_timeout
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._done = False
+        self._config = None
+
+    def _connect(self):
+        deadline = _clock() + self.connect_timeout
+        while True:
+            try:
+                return socket.create_connection(self.address)
+            except (socket.error, OSError):
+                if _clock() >= deadline:
+                    raise
+                time.sleep(0.2)
+
+    def _read_loop(self, sock):
+        try:
+            while True:
+                received = recv_message(sock)
+                if received is None:
+                    break
+                message = received[0]
+                with self._cond:
+                    if message['type'] == 'config':
+                        self._config = message
+                    elif message['type'] == 'shard':
+                        self._queue.append(message)
+                    elif message['type'] == 'revoke':
+                        # too late if it has been started
+                        for shard in list(self._queue):
+                            if shard['id'] == message['id']:
+                                self._queue.remove(shard)
+                    elif message['type'] == 'done':
+                        break
+                    self._cond.notify_all()
+        except (socket.error, OSError, EOFError, ValueError):
+            pass
+        finally:
+            with self._cond:
+                self._done = True
+                self._cond.notify_all()
+
+    def score(self, shard):
+        """
+        Score the records of one shard.
+
+        Returns
+        -------
+        numpy.ndarray
+            the score of each record, as float64
+        """
+        import numpy as np
+        from . import bien_batch, tbien_batch, bien_ragged, tbien_ragged
+        config = self._config
+        record_bytes = config['record_bytes']
+        bits = config['bits']
+        with open(shard['path'], 'rb') as f:
+            f.seek(shard['offset'])
+            data = f.read(shard['length'])
+        if len(data) != shard['length']:
+            raise IOError('%s is shorter than expected.' % shard['path'])
+        if (bits or 8*record_bytes) <= 64:
+            # the bit-sliced engine is fastest for short records
+            fun = bien_batch if config['metric'] == 'bien' else tbien_batch
+            return fun(data, record_bytes, bits)
+        # the ragged functions spread the records over the CPUs
+        fun = bien_ragged if config['metric'] == 'bien' else tbien_ragged
+        nrec = len(data)//record_bytes
+        offsets = np.arange(nrec + 1, dtype=np.int64)*record_bytes
+        bit_lengths = None
+        if bits is not None:
+            bit_lengths = np.full(nrec, bits, dtype=np.int64)
+        return fun(data, offsets, bit_lengths, self.threads)
+
+    def run(self):
+        """
+        Connect to the coordinator and score shards until it has no more.
+
+        Returns
+        -------
+        dict
+            the numbers of shards and records scored and the busy seconds
+        """
+        sock = self._connect()
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        totals = {'shards': 0, 'records': 0, 'seconds': 0.0}
+        reader = threading.Thread(target=self._read_loop, args=(sock,))
+        reader.daemon = True
+        try:
+            send_message(sock, {'type': 'hello', 'name': self.name})
+            reader.start()
+            while True:
+                with self._cond:
+                    while not self._queue and not self._done:
+                        self._cond.wait()
+                    if not self._queue:
+                        break
+                    shard = self._queue.popleft()
+                started = _clock()
+                try:
+                    scores = self.score(shard)
+                except Exception as e:
+                    send_message(sock, {'type': 'error', 'id': shard['id'],
+                                        'message': str(e)})
+                    continue
+                seconds = _clock() - started
+                message = {'type': 'result', 'id': shard['id'],
+                           'records': len(scores), 'seconds': seconds}
+                payload = b''
+                if self._config['summary'] is not None:
+                    summary = _summary_from(self._config['summary'])
+                    summary.add(scores)
+                    message['summary'] = _summary_args(summary)[1]
+                else:
+                    payload = scores.astype('<f8').tobytes()
+                send_message(sock, message, payload)
+                totals['shards'] += 1
+                totals['records'] += len(scores)
+                totals['seconds'] += seconds
+        except (socket.error, OSError):
+            pass
+        finally:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except (socket.error, OSError):
+                pass
+            sock.close()
+        return totals
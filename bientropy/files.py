@@ -0,0 +1,131 @@
+'''
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+This module scores long strings stored in files without reading them into
+memory. The input file is memory-mapped read-only and the working row of the
+derivative triangle is kept in a memory-mapped scratch file, so the resident
+memory is bounded by what the operating system chooses to cache rather than
+by the length of the input.
+
+Results are looked up in the persistent cache of 'bientropy.cache' when it is
+enabled, in which case an unchanged file costs about as much as hashing it.
+'''
+import mmap
+import os
+import tempfile
+
+from . import cache
+from . import cbientropy
+
+
+def _score_file(metric, path, offset, length, bits, scratch_dir):
+    fun = getattr(cbientropy, metric + '_scratch')
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if length is None:
+            length = size - offset
+        if offset < 0 or length < 0 or offset + length > size:
+            raise ValueError('The byte range is outside of the file.')
+        if bits is None:
+            bits = length*8
+        if bits > length*8:
+            raise ValueError('The number of bits must not exceed the length '
+                             'of the byte range in bits.')
+        # mmap offsets must be aligned to the allocation granularity
+        start = offset - offset % mmap.ALLOCATIONGRANULARITY
+        data_map = mmap.mmap(f.fileno(), offset - start + length,
+                             access=mmap.ACCESS_READ, offset=start)
+    try:
+        if hasattr(data_map, 'madvise'):
+            data_map.madvise(mmap.MADV_SEQUENTIAL)
+        data = memoryview(data_map)[offset - start:]
+        try:
+            if cache.ACTIVE is not None and bits >= cache.ACTIVE.min_bits:
+                key = (cache.digest(data, bits), bits)
+                found = cache.ACTIVE.lookup(metric, [key])
+                if key in found:
+                    return found[key]
+            with tempfile.TemporaryFile(dir=scratch_dir) as scratch_file:
+                scratch_len = max(8, (bits + 63)//64*8)
+                scratch_file.truncate(scratch_len)
+                scratch_map = mmap.mmap(scratch_file.fileno(), scratch_len)
+                try:
+                    result = fun(data, bits, scratch_map)
+                finally:
+                    scratch_map.close()
+            if cache.ACTIVE is not None and bits >= cache.ACTIVE.min_bits:
+                cache.ACTIVE.store(metric, {key: result})
+            return result
+        finally:
+            data.release()
+    finally:
+        data_map.close()
+
+
+def bien_file(path, offset=0, length=None, bits=None, scratch_dir=None):
+    """
+    BiEn of a byte range of a file, computed out of core.
+
+    Parameters
+    ----------
+    path : str
+        the file to read
+    offset : int
+        the offset of the first byte of the string in the file
+    length : int
+        the number of bytes in the string; defaults to the rest of the file
+    bits : int
+        the length of the string in bits, if less than 8*length
+    scratch_dir : str
+        the directory for the scratch file; defaults to the system temporary
+        directory
+
+    Returns
+    -------
+    float
+        the BiEntropy of the input
+    """
+    return _score_file('bien', path, offset, length, bits, scratch_dir)
+
+
+def tbien_file(path, offset=0, length=None, bits=None, scratch_dir=None):
+    """
+    TBiEn of a byte range of a file, computed out of core.
+
+    Parameters
+    ----------
+    path : str
+        the file to read
+    offset : int
+        the offset of the first byte of the string in the file
+    length : int
+        the number of bytes in the string; defaults to the rest of the file
+    bits : int
+        the length of the string in bits, if less than 8*length
+    scratch_dir : str
+        the directory for the scratch file; defaults to the system temporary
+        directory
+
+    Returns
+    -------
+    float
+        the TBiEntropy of the input
+    """
+    return _score_file('tbien', path, offset, length, bits, scratch_dir)
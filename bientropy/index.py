@@ -0,0 +1,345 @@
+'''
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+This module keeps the statistics of a scan in an index file, so that later
+questions about regions of the data, such as which blocks between two offsets
+have a TBiEn above 0.9, are answered without reading the data again.
+
+write() scans a file or buffer with cbientropy.scan_metrics() and writes the
+index; open() memory-maps it. The index file holds:
+- a header of 8 magic bytes, the length of a JSON description as a
+  little-endian uint32, and the description, padded to HEADER_ALIGN bytes
+- the records of scan_metrics(), one per block, with the fields chosen
+- the minimum of each field over each superblock of consecutive blocks
+- the maximum of each field over each superblock
+
+A query first compares its bounds with the summaries of the superblocks in
+its range, and reads the records of only those superblocks that may hold
+both matching and non-matching blocks.
+'''
+import io
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b'BIENIDX1'
+HEADER_ALIGN = 64
+BLOCK_BYTES = 4096
+SUPERBLOCK_BLOCKS = 64
+# about how many bytes of data are scanned at a time by write()
+CHUNK_BYTES = 64 << 20
+
+try:
+    _PATH_TYPES = (str, unicode)
+except NameError:
+    _PATH_TYPES = (str,)
+
+
+def _source(data):
+    # the data as a buffer, its path if it is a file, and how to close it
+    if isinstance(data, _PATH_TYPES):
+        with io.open(data, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return b'', data, size, lambda: None
+            data_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(data_map, 'madvise'):
+            data_map.madvise(mmap.MADV_SEQUENTIAL)
+        return data_map, data, size, data_map.close
+    view = memoryview(data)
+    size = getattr(view, 'nbytes', len(view)*view.itemsize)
+    view.release()
+    return data, None, size, lambda: None
+
+
+def _summarize(records, superblock_blocks):
+    # the minimum and maximum of each field over each superblock
+    starts = np.arange(0, len(records), superblock_blocks)
+    mins = np.empty(len(starts), records.dtype)
+    maxs = np.empty(len(starts), records.dtype)
+    for name in records.dtype.names:
+        mins[name] = np.minimum.reduceat(records[name], starts)
+        maxs[name] = np.maximum.reduceat(records[name], starts)
+    return mins, maxs
+
+
+def _within(scores, min_score, max_score):
+    keep = np.ones(len(scores), bool)
+    if min_score is not None:
+        keep &= scores >= min_score
+    if max_score is not None:
+        keep &= scores <= max_score
+    return keep
+
+
+def write(path, data, block_bytes=BLOCK_BYTES, fields=None,
+          superblock_blocks=SUPERBLOCK_BLOCKS, threads=None):
+    """
+    Scan data with cbientropy.scan_metrics() and write the statistics of its
+    blocks to an index file.
+
+    Parameters
+    ----------
+    path : str
+        the index file to write
+    data : str or bytes-like object
+        the path of the file to scan, which is memory-mapped and scanned a
+        chunk at a time, or a buffer
+    block_bytes : int
+        the size of each block in bytes; the last block is shorter if the
+        length of the data is not a multiple of block_bytes
+    fields : list of str
+        the fields of scan_metrics() to keep; defaults to all of them
+    superblock_blocks : int
+        the number of blocks summarized by each minimum and maximum
+    threads : int
+        the number of threads scanning; defaults to the number of CPUs
+
+    Returns
+    -------
+    Index
+        the index, opened
+    """
+    from . import cbientropy
+    if block_bytes < 1 or superblock_blocks < 1:
+        raise ValueError('The sizes of blocks and superblocks must be '
+                         'positive.')
+    scan_dtype = cbientropy.scan_metrics(b'\0', 1).dtype
+    if fields is None:
+        fields = scan_dtype.names
+    for name in fields:
+        if name not in scan_dtype.names:
+            raise ValueError("Unknown field '%s'; expected some of %s." % (
+                name, ', '.join(scan_dtype.names)))
+    dtype = np.dtype([(name, scan_dtype[name]) for name in fields])
+    buf, source, size, close = _source(data)
+    try:
+        nblocks = (size + block_bytes - 1)//block_bytes
+        nsuper = (nblocks + superblock_blocks - 1)//superblock_blocks
+        description = {
+            'block_bytes': block_bytes,
+            'superblock_blocks': superblock_blocks,
+            'blocks': nblocks,
+            'data_bytes': size,
+            'fields': [[name, dtype[name].str] for name in fields]}
+        if source is not None:
+            description['source'] = os.path.abspath(source)
+            description['source_mtime'] = os.stat(source).st_mtime
+        text = json.dumps(description, sort_keys=True).encode('utf-8')
+        header = MAGIC + struct.pack('<I', len(text)) + text
+        header += b' '*(-len(header) % HEADER_ALIGN)
+        # whole superblocks per chunk, so that each is summarized once
+        chunk_blocks = max(1, CHUNK_BYTES//(block_bytes*superblock_blocks)) \
+            * superblock_blocks
+        mins, maxs = [], []
+        with io.open(path, 'wb') as f:
+            f.write(header)
+            view = memoryview(buf).cast('B') \
+                if hasattr(memoryview, 'cast') else memoryview(buf)
+            try:
+                for first in range(0, nblocks, chunk_blocks):
+                    chunk = view[first*block_bytes:
+                                 (first + chunk_blocks)*block_bytes]
+                    try:
+                        stats = cbientropy.scan_metrics(chunk, block_bytes,
+                                                        threads)
+                    finally:
+                        chunk.release()
+                    records = np.empty(len(stats), dtype)
+                    for name in fields:
+                        records[name] = stats[name]
+                    f.write(records.tobytes())
+                    chunk_mins, chunk_maxs = _summarize(records,
+                                                        superblock_blocks)
+                    mins.append(chunk_mins)
+                    maxs.append(chunk_maxs)
+            finally:
+                view.release()
+            for part in mins + maxs:
+                f.write(part.tobytes())
+    finally:
+        close()
+    return Index(path)
+
+
+class Index(object):
+    """
+    An index file written by write(), memory-mapped read-only.
+
+    Parameters
+    ----------
+    path : str
+        the index file
+    source : str
+        if given, the file that was scanned, whose size and modification time
+        must match those recorded in the index
+
+    Attributes
+    ----------
+    records : numpy.memmap
+        the statistics of each block, a structured array
+    mins, maxs : numpy.memmap
+        the minimum and maximum of each field over each superblock
+    block_bytes, superblock_blocks, data_bytes : int
+        the sizes of the blocks, superblocks and data
+    description : dict
+        the description in the header
+    """
+
+    def __init__(self, path, source=None):
+        with io.open(path, 'rb') as f:
+            head = f.read(len(MAGIC) + 4)
+            if len(head) < len(MAGIC) + 4 or head[:len(MAGIC)] != MAGIC:
+                raise ValueError('%s is not an index file.' % path)
+            length, = struct.unpack('<I', head[len(MAGIC):])
+            description = json.loads(f.read(length).decode('utf-8'))
+            file_bytes = os.fstat(f.fileno()).st_size
+        self.path = path
+        self.description = description
+        self.block_bytes = description['block_bytes']
+        self.superblock_blocks = description['superblock_blocks']
+        self.data_bytes = description['data_bytes']
+        self.dtype = np.dtype([(str(name), str(code)) for name, code
+                               in description['fields']])
+        nblocks = description['blocks']
+        nsuper = (nblocks + self.superblock_blocks - 1) \
+            // self.superblock_blocks
+        offset = len(MAGIC) + 4 + length
+        offset += -offset % HEADER_ALIGN
+        if file_bytes != offset + (nblocks + 2*nsuper)*self.dtype.itemsize:
+            raise ValueError('The index file %s is truncated.' % path)
+        if source is not None and (
+                os.path.getsize(source) != self.data_bytes or
+                os.stat(source).st_mtime !=
+                description.get('source_mtime')):
+            raise ValueError('%s has changed since it was indexed.' % source)
+        self.records = self.mins = self.maxs = np.zeros(0, self.dtype)
+        if nblocks:
+            self.records = np.memmap(path, self.dtype, 'r', offset,
+                                     (nblocks,))
+            offset += nblocks*self.dtype.itemsize
+            self.mins = np.memmap(path, self.dtype, 'r', offset, (nsuper,))
+            offset += nsuper*self.dtype.itemsize
+            self.maxs = np.memmap(path, self.dtype, 'r', offset, (nsuper,))
+
+    def __len__(self):
+        return len(self.records)
+
+    def _field(self, field):
+        if field not in self.dtype.names:
+            raise ValueError("The index has no field '%s'; it has %s." % (
+                field, ', '.join(self.dtype.names)))
+
+    def _superblocks(self, lo, hi, field, min_score, max_score):
+        # the blocks in the byte range, and which of the superblocks over
+        # them hold only matching blocks and which may hold some
+        self._field(field)
+        if hi is None or hi > self.data_bytes:
+            hi = self.data_bytes
+        lo = max(lo, 0)
+        first = lo//self.block_bytes
+        last = max(first, (hi + self.block_bytes - 1)//self.block_bytes)
+        if lo >= hi:
+            last = first
+        s0 = first//self.superblock_blocks
+        s1 = (last + self.superblock_blocks - 1)//self.superblock_blocks
+        mins = np.asarray(self.mins[field][s0:s1])
+        maxs = np.asarray(self.maxs[field][s0:s1])
+        inside = np.ones(len(mins), bool)
+        outside = np.zeros(len(mins), bool)
+        if min_score is not None:
+            inside &= mins >= min_score
+            outside |= maxs < min_score
+        if max_score is not None:
+            inside &= maxs <= max_score
+            outside |= mins > max_score
+        return first, last, s0, inside, outside
+
+    def _blocks(self, superblocks, first, last):
+        # the blocks of some superblocks that are within [first, last)
+        blocks = (superblocks[:, None]*self.superblock_blocks +
+                  np.arange(self.superblock_blocks)).ravel()
+        return blocks[(blocks >= first) & (blocks < last)]
+
+    def query(self, lo=0, hi=None, min_score=None, max_score=None,
+              field='tbien'):
+        """
+        The blocks that overlap a byte range of the data and whose value of
+        a field is within bounds.
+
+        Parameters
+        ----------
+        lo, hi : int
+            the byte range of the data, [lo, hi); defaults to all of it
+        min_score, max_score : float
+            the least and greatest values of the blocks returned, inclusive;
+            defaults to no bound
+        field : str
+            the field compared with the bounds
+
+        Returns
+        -------
+        offsets : numpy.ndarray
+            the offsets in bytes of the blocks in the data, in order
+        scores : numpy.ndarray
+            the values of the field of those blocks
+        """
+        first, last, s0, inside, outside = self._superblocks(
+            lo, hi, field, min_score, max_score)
+        candidates = np.flatnonzero(~outside) + s0
+        blocks = self._blocks(candidates, first, last)
+        scores = np.asarray(self.records[field][blocks])
+        keep = _within(scores, min_score, max_score)
+        return blocks[keep].astype(np.int64)*self.block_bytes, scores[keep]
+
+    def count(self, lo=0, hi=None, min_score=None, max_score=None,
+              field='tbien'):
+        """
+        The number of blocks that query() would return, reading the records
+        of only the superblocks whose summaries do not settle the count.
+        """
+        first, last, s0, inside, outside = self._superblocks(
+            lo, hi, field, min_score, max_score)
+        total = len(self._blocks(np.flatnonzero(inside) + s0, first, last))
+        partial = np.flatnonzero(~inside & ~outside) + s0
+        blocks = self._blocks(partial, first, last)
+        scores = np.asarray(self.records[field][blocks])
+        return total + int(np.count_nonzero(
+            _within(scores, min_score, max_score)))
+
+    def close(self):
+        'Drop the maps of the index, which are unmapped once unreferenced'
+        self.records = self.mins = self.maxs = np.zeros(0, self.dtype)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open(path, source=None):
+    """
+    Open an index file written by write(); see Index.
+    """
+    return Index(path, source)
@@ -0,0 +1,100 @@
+'''
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+This module scores the rows, columns or other vectors along one axis of
+N-dimensional arrays of bits or integers, such as SRAM PUF maps and images,
+with the nd functions of the C extension. The vectors are read in place
+through the strides of the array, so no axis is transposed or copied.
+
+For example, the TBiEn of every column of a two-dimensional array of bool,
+and of every row of bit-plane 0 of an image of uint8:
+
+tbien(puf_map, axis=0)
+tbien(image, axis=1, bitplane=0)
+'''
+import numpy as np
+
+from . import cbientropy
+
+
+def _score(metric, arr, axis, bitplane, threads):
+    fun = getattr(cbientropy, metric + '_nd')
+    arr = np.asarray(arr)
+    if bitplane != 'all':
+        return fun(arr, axis, bitplane, threads)
+    nplanes = 1 if arr.dtype == np.bool_ else 8*arr.dtype.itemsize
+    return np.stack([fun(arr, axis, k, threads) for k in range(nplanes)],
+                    axis=-1)
+
+
+def bien(arr, axis=-1, bitplane=None, threads=None):
+    """
+    BiEn of each vector along an axis of an N-dimensional array.
+
+    Parameters
+    ----------
+    arr : array_like
+        an array of bool, with one bit per element, or of integers of 1, 2,
+        4 or 8 bytes in native byte order, with any strides
+    axis : int
+        the axis along which the vectors run; defaults to the last
+    bitplane : int or 'all'
+        score bit-plane k of integers, bit k of each element from 0 for the
+        least significant bit, or every bit-plane with 'all'; by default
+        each element of an integer array contributes all of its bits, from
+        the most significant
+    threads : int
+        the number of threads; defaults to the number of CPUs
+
+    Returns
+    -------
+    numpy.ndarray
+        the BiEntropy of each vector, as float64, in the shape of arr
+        without axis, followed by an axis of bit-planes for 'all'
+    """
+    return _score('bien', arr, axis, bitplane, threads)
+
+
+def tbien(arr, axis=-1, bitplane=None, threads=None):
+    """
+    TBiEn of each vector along an axis of an N-dimensional array.
+
+    Parameters
+    ----------
+    arr : array_like
+        an array of bool, with one bit per element, or of integers of 1, 2,
+        4 or 8 bytes in native byte order, with any strides
+    axis : int
+        the axis along which the vectors run; defaults to the last
+    bitplane : int or 'all'
+        score bit-plane k of integers, bit k of each element from 0 for the
+        least significant bit, or every bit-plane with 'all'; by default
+        each element of an integer array contributes all of its bits, from
+        the most significant
+    threads : int
+        the number of threads; defaults to the number of CPUs
+
+    Returns
+    -------
+    numpy.ndarray
+        the TBiEntropy of each vector, as float64, in the shape of arr
+        without axis, followed by an axis of bit-planes for 'all'
+    """
+    return _score('tbien', arr, axis, bitplane, threads)
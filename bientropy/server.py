@@ -0,0 +1,521 @@
+'''
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+This module implements a local scoring daemon, so that several processes
+scoring small inputs share one loaded extension and one pool of threads
+rather than each scoring its inputs one call at a time. It listens on a Unix
+domain socket or a localhost TCP port, merges the requests arriving from all
+its connections into batches, and scores each batch with the ragged
+functions of the native implementation, which spread the records over the
+CPUs with the GIL released. While a batch is scored, the next one gathers.
+
+To run:
+python -m bientropy serve --socket /tmp/bientropy.sock
+
+The protocol is binary and may be pipelined. Each request is a header
+packed as REQUEST, holding an operation, a metric, a request id and a length
+in bits, followed by the string in (bits+7)//8 bytes. Each response is a
+header packed as RESPONSE, holding the operation, a status, the request id
+and the score. Responses with an error status and responses to OP_STATS are
+followed by a payload of LENGTH bytes, an error message or the metrics of
+the server as JSON. Responses on a connection may come in any order and are
+matched to requests by id. See bientropy.client for the client library.
+
+Each connection has its own thread writing its responses, so a client that
+does not read them holds up nobody else, and a connection with max_pending
+requests unanswered is not read from until some are written.
+'''
+from __future__ import print_function
+import collections
+import errno
+import json
+import os
+import signal
+import socket
+import stat
+import struct
+import threading
+import time
+import warnings
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# Request header: operation, metric, flags, request id, length in bits
+REQUEST = struct.Struct('!BBHII')
+# Response header: operation, status, flags, request id, score
+RESPONSE = struct.Struct('!BBHId')
+# Length of the payload after an error or OP_STATS response
+LENGTH = struct.Struct('!I')
+
+OP_SCORE = 1
+OP_STATS = 2
+
+METRICS = {0: 'bien', 1: 'tbien'}
+
+STATUS_OK = 0
+STATUS_INVALID = 1
+STATUS_ERROR = 2
+
+# Requests longer than this are refused
+MAX_BITS = 1 << 20
+
+MAX_BATCH = 4096
+MAX_DELAY = 0.002
+# A connection is not read while this many of its requests are unanswered
+MAX_PENDING = 4096
+
+# The number of recent latencies kept for the percentiles in stats()
+LATENCY_WINDOW = 10000
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+
+def recv_exact(sock, n):
+    """
+    Receive exactly n bytes from a socket.
+
+    Returns
+    -------
+    bytes
+        the data, or None if the connection was closed before any of it
+    """
+    chunks = []
+    while n > 0:
+        chunk = sock.recv(min(n, 1 << 20))
+        if not chunk:
+            if chunks:
+                raise EOFError('The connection closed mid-message.')
+            return None
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b''.join(chunks)
+
+
+def _percentile(values, q):
+    # the nearest-rank percentile of a sorted list
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(q*len(values)))]
+
+
+def _remove_stale_socket(path):
+    # remove the socket file of a server that did not clean up, but nothing
+    # else: not other files, and not the socket of a server still listening
+    try:
+        mode = os.stat(path).st_mode
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return
+        raise
+    if not stat.S_ISSOCK(mode):
+        raise socket.error(errno.EEXIST,
+                           '%s exists and is not a socket' % path)
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except socket.error as e:
+        if e.errno != errno.ECONNREFUSED:
+            raise
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise socket.error(errno.EADDRINUSE,
+                       'A server is already listening on %s' % path)
+
+
+class _Connection(object):
+    """
+    A client connection. Its responses are queued by the reader and the
+    batcher and written by a thread of its own, and pending counts the
+    requests read but not yet answered on the wire.
+    """
+
+    def __init__(self, sock, max_pending):
+        self.sock = sock
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.open = True
+        self.reading = True
+        self.pending = 0
+        self._outbox = []
+        self.writer = threading.Thread(target=self._write_loop)
+        self.writer.daemon = True
+
+    def admit(self):
+        'Wait for room for one more request; False once closed'
+        with self.lock:
+            while self.open and self.pending >= self.max_pending:
+                self.changed.wait()
+            if not self.open:
+                return False
+            self.pending += 1
+            return True
+
+    def send(self, data, answered=1):
+        'Queue responses answering a number of admitted requests'
+        with self.lock:
+            if self.open:
+                self._outbox.append((data, answered))
+                self.changed.notify_all()
+
+    def finish(self):
+        'Stop reading; the writer stops once every request is answered'
+        with self.lock:
+            self.reading = False
+            self.changed.notify_all()
+
+    def close(self):
+        'Drop the responses not yet written and wake both threads'
+        with self.lock:
+            self.open = False
+            self.changed.notify_all()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except (socket.error, OSError):
+            pass
+
+    def _write_loop(self):
+        while True:
+            with self.lock:
+                while self.open and not self._outbox and \
+                        (self.reading or self.pending):
+                    self.changed.wait()
+                if not self.open or not self._outbox:
+                    return
+                outbox, self._outbox = self._outbox, []
+            try:
+                self.sock.sendall(b''.join(data for data, _ in outbox))
+            except (socket.error, OSError):
+                self.close()
+                return
+            with self.lock:
+                self.pending -= sum(answered for _, answered in outbox)
+                self.changed.notify_all()
+
+
+class Server(object):
+    """
+    A scoring daemon.
+
+    Parameters
+    ----------
+    address : str or tuple
+        the path of a Unix domain socket, or a (host, port) pair for TCP;
+        port 0 picks a free port, see the address attribute. A socket file
+        left at the path by a server that is no longer listening is
+        replaced; any other file is an error
+    max_batch : int
+        the largest number of requests scored in one batch
+    max_delay : float
+        how long in seconds the first request of a batch waits for others
+        to join it
+    threads : int
+        the number of threads scoring each batch; defaults to the number of
+        CPUs
+    max_bits : int
+        the longest request accepted, in bits
+    max_pending : int
+        the most requests of one connection read but not yet answered;
+        beyond it the connection is not read until responses are written
+    """
+
+    def __init__(self, address, max_batch=MAX_BATCH, max_delay=MAX_DELAY,
+                 threads=None, max_bits=MAX_BITS, max_pending=MAX_PENDING):
+        from . import _native
+        if _native is None:
+            raise ImportError('The server requires the C extension or the '
+                              'cffi binding.')
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.threads = threads
+        self.max_bits = max_bits
+        self.max_pending = max_pending
+        if isinstance(address, tuple):
+            family = socket.AF_INET
+            self._unix_path = None
+        else:
+            family = socket.AF_UNIX
+            _remove_stale_socket(address)
+            self._unix_path = address
+        self._listener = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR,
+                                      1)
+        self._listener.bind(address)
+        self._listener.listen(64)
+        self.address = self._listener.getsockname()
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._closed = False
+        self._threads = []
+        self._connections = set()
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self._started = _clock()
+        self._counts = {'requests': 0, 'errors': 0, 'batches': 0,
+                        'batched_requests': 0, 'max_queue_depth': 0}
+
+    def stats(self):
+        """
+        The metrics of the server.
+
+        Returns
+        -------
+        dict
+            the numbers of requests, errors, batches and open connections;
+            the mean batch size; the current and greatest number of requests
+            waiting in the queue; and the 50th and 99th percentiles and the
+            maximum of the latencies of recent requests, from receipt to
+            response, in milliseconds
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+            result = dict(self._counts)
+            result['connections'] = len(self._connections)
+        batched = result.pop('batched_requests')
+        result['mean_batch'] = \
+            float(batched)/result['batches'] if result['batches'] else 0.0
+        result['queue_depth'] = self._queue.qsize()
+        result['latency_p50_ms'] = _percentile(latencies, 0.5)*1e3
+        result['latency_p99_ms'] = _percentile(latencies, 0.99)*1e3
+        result['latency_max_ms'] = \
+            latencies[-1]*1e3 if latencies else float('nan')
+        result['uptime_s'] = _clock() - self._started
+        return result
+
+    def start(self):
+        'Serve in background threads; see shutdown()'
+        for target in [self._accept_loop, self._batch_loop]:
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def serve_forever(self):
+        'Serve until shutdown() is called or the process is interrupted'
+        self.start()
+        try:
+            while not self._stop.wait(1.0):
+                pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        'Stop serving and close every connection'
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._stop.set()
+        try:
+            # wake the accept loop
+            self._listener.shutdown(socket.SHUT_RDWR)
+        except (socket.error, OSError):
+            pass
+        self._listener.close()
+        self._queue.put(None)
+        with self._lock:
+            connections = list(self._connections)
+        for conn in connections:
+            conn.close()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        if self._unix_path is not None and os.path.exists(self._unix_path):
+            os.unlink(self._unix_path)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def _accept_loop(self):
+        while not self._stop.is_set():
+            try:
+                sock, _ = self._listener.accept()
+            except (socket.error, OSError):
+                break
+            if sock.family == socket.AF_INET:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = _Connection(sock, self.max_pending)
+            with self._lock:
+                self._connections.add(conn)
+            conn.writer.start()
+            thread = threading.Thread(target=self._read_loop, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def _reply_error(self, conn, op, status, request_id, message):
+        payload = message.encode('utf-8')
+        conn.send(RESPONSE.pack(op, status, 0, request_id, float('nan')) +
+                  LENGTH.pack(len(payload)) + payload)
+        with self._lock:
+            self._counts['errors'] += 1
+
+    def _read_loop(self, conn):
+        try:
+            while not self._stop.is_set():
+                header = recv_exact(conn.sock, REQUEST.size)
+                if header is None:
+                    break
+                op, metric, _, request_id, nbits = REQUEST.unpack(header)
+                if op == OP_SCORE and nbits <= self.max_bits:
+                    data = recv_exact(conn.sock, (nbits + 7)//8)
+                    if data is None:
+                        break
+                # every request is answered once, and counts until it is
+                if not conn.admit():
+                    break
+                if op == OP_STATS:
+                    payload = json.dumps(self.stats()).encode('utf-8')
+                    conn.send(RESPONSE.pack(op, STATUS_OK, 0, request_id,
+                                            0.0) +
+                              LENGTH.pack(len(payload)) + payload)
+                    continue
+                if op != OP_SCORE:
+                    # the rest of the stream cannot be parsed
+                    self._reply_error(conn, op, STATUS_INVALID, request_id,
+                                      'Unknown operation %d.' % op)
+                    break
+                if nbits > self.max_bits:
+                    self._reply_error(conn, op, STATUS_INVALID, request_id,
+                                      'Requests are limited to %d bits.'
+                                      % self.max_bits)
+                    break
+                arrived = _clock()
+                with self._lock:
+                    self._counts['requests'] += 1
+                if metric not in METRICS:
+                    self._reply_error(conn, op, STATUS_INVALID, request_id,
+                                      'Unknown metric %d.' % metric)
+                elif nbits < 2:
+                    self._reply_error(conn, op, STATUS_INVALID, request_id,
+                                      'The input string is too short.')
+                else:
+                    self._queue.put((conn, request_id, metric, data, nbits,
+                                     arrived))
+        except (socket.error, OSError, EOFError):
+            pass
+        finally:
+            # the writer answers what was read, unless the server stops or
+            # the client goes away
+            conn.finish()
+            conn.writer.join()
+            with self._lock:
+                self._connections.discard(conn)
+            conn.sock.close()
+
+    def _next_batch(self):
+        # block for the first request, then gather until the batch is full
+        # or max_delay has passed
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = _clock() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - _clock()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _batch_loop(self):
+        import numpy as np
+        from . import bien_ragged, tbien_ragged
+        ragged = {'bien': bien_ragged, 'tbien': tbien_ragged}
+
+        while True:
+            depth = self._queue.qsize()
+            batch = self._next_batch()
+            if batch is None:
+                return
+            with self._lock:
+                self._counts['batches'] += 1
+                self._counts['batched_requests'] += len(batch)
+                self._counts['max_queue_depth'] = max(
+                    self._counts['max_queue_depth'], depth + 1)
+            replies = collections.defaultdict(list)
+            for metric, name in METRICS.items():
+                items = [item for item in batch if item[2] == metric]
+                if not items:
+                    continue
+                offsets = np.cumsum([0] + [len(item[3]) for item in items])
+                bit_lengths = np.array([item[4] for item in items],
+                                       dtype=np.int64)
+                try:
+                    scores = ragged[name](
+                        b''.join(item[3] for item in items), offsets,
+                        bit_lengths, self.threads)
+                except Exception as e:
+                    for item in items:
+                        self._reply_error(item[0], OP_SCORE, STATUS_ERROR,
+                                          item[1], str(e))
+                    continue
+                for item, score in zip(items, scores):
+                    replies[item[0]].append(
+                        RESPONSE.pack(OP_SCORE, STATUS_OK, 0, item[1],
+                                      score))
+            for conn, frames in replies.items():
+                conn.send(b''.join(frames), len(frames))
+            done = _clock()
+            with self._lock:
+                self._latencies.extend(done - item[5] for item in batch)
+
+
+def serve(address, **kwargs):
+    """
+    Run a scoring daemon until it is interrupted or terminated.
+
+    Parameters
+    ----------
+    address : str or tuple
+        the path of a Unix domain socket, or a (host, port) pair for TCP
+    kwargs
+        the options of Server
+    """
+    # BiEn of long strings is scored on request, so the warning that it is
+    # not suited to them would only fill the log. The filters are global and
+    # catch_warnings() is not thread-safe, so they are set once, here, for
+    # the whole process rather than around each batch.
+    warnings.filterwarnings('ignore', 'The BiEn algorithm is not suitable')
+    server = Server(address, **kwargs)
+    if threading.current_thread().name == 'MainThread':
+        # stop cleanly on SIGTERM, removing the socket file
+        signal.signal(signal.SIGTERM, lambda *args: server._stop.set())
+    server.serve_forever()
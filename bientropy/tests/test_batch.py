@@ -0,0 +1,296 @@
+'''
+NOTICE
+
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+This file tests the batch functions of the C extension against the functions
+that score one string at a time.
+'''
+from __future__ import print_function
+import os
+import sys
+import warnings
+
+if sys.version_info.major > 2:
+    from unittest import TestCase, main, skipIf
+else:
+    from unittest2 import TestCase, main, skipIf
+
+import numpy as np
+from bitstring import Bits
+from bientropy.testvectors import BIENTROPY_8BITS, TBIENTROPY_8BITS
+try:
+    from bientropy import cbientropy
+    NO_CEXT = ''
+except ImportError as e:
+    # Allow some tests to be skipped
+    NO_CEXT = 'C extension not available'
+
+
+def random_records(n_bits, n_recs):
+    'A list of random bitstrings of the given length'
+    return [Bits(bytes=os.urandom((n_bits + 7)//8))[:n_bits]
+            for _ in range(n_recs)]
+
+
+@skipIf(NO_CEXT, NO_CEXT)
+class BatchTests(TestCase):
+    'Test the batch engines'
+
+    def assert_batch_equal(self, result, expected):
+        'Compare a batch result with a list of expected values'
+        self.assertEqual(result.dtype, np.float64)
+        self.assertEqual(result.shape, (len(expected),))
+        np.testing.assert_allclose(result, expected, rtol=0, atol=1e-12)
+
+
+    def test_engines(self):
+        '''
+        Check that the word-level and bit-sliced engines match the GMP engine
+        for record lengths up to and just above one word, including partial
+        groups of 64 records.
+        '''
+        for n_bits in [2, 3, 8, 17, 32, 63, 64, 65, 100]:
+            recs = random_records(n_bits, 70)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                for fun, batch_fun in [
+                        (cbientropy.bien, cbientropy.bien_batch),
+                        (cbientropy.tbien, cbientropy.tbien_batch)]:
+                    expected = [fun(rec) for rec in recs]
+                    engines = ['auto', 'words']
+                    if n_bits <= 64:
+                        engines.append('bitslice')
+                    for engine in engines:
+                        with self.subTest(n_bits=n_bits, fun=fun,
+                                          engine=engine):
+                            self.assert_batch_equal(
+                                batch_fun(recs, engine=engine), expected)
+
+
+    def test_buffers(self):
+        'Check two-dimensional arrays and flat buffers of records'
+        arr = np.frombuffer(os.urandom(4*100), dtype=np.uint8).reshape(100, 4)
+        expected = [cbientropy.tbien(rec.tobytes()) for rec in arr]
+        self.assert_batch_equal(cbientropy.tbien_batch(arr), expected)
+        self.assert_batch_equal(cbientropy.tbien_batch(arr.tobytes(), 4),
+                                expected)
+        self.assert_batch_equal(
+            cbientropy.tbien_batch(bytearray(arr.tobytes()), 4, bits=29),
+            [cbientropy.tbien(Bits(bytes=rec.tobytes())[:29]) for rec in arr])
+        self.assert_batch_equal(cbientropy.tbien_batch(b'', 4), [])
+        self.assert_batch_equal(cbientropy.tbien_batch([]), [])
+
+
+    def test_mixed_lengths(self):
+        'Check that a sequence of records of different lengths is scored'
+        recs = [b'\xde\xad\xbe\xef', Bits('0b1011'), os.urandom(100)]
+        self.assert_batch_equal(cbientropy.tbien_batch(recs),
+                                [cbientropy.tbien(rec) for rec in recs])
+        with self.assertRaises(ValueError):
+            cbientropy.tbien_batch(recs, engine='bitslice')
+
+
+    def test_warn_bien_long(self):
+        'Check that BiEn of a batch of long records warns once'
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            cbientropy.bien_batch(random_records(33, 40))
+            self.assertEqual(len(w), 1)
+
+
+    def test_errors(self):
+        'Check that bad batches are rejected'
+        for fun in [cbientropy.bien_batch, cbientropy.tbien_batch]:
+            with self.subTest(fun=fun):
+                with self.assertRaises(TypeError):
+                    fun(b'\x00'*16, bits=8)
+                with self.assertRaises(TypeError):
+                    fun(np.zeros(16, dtype=np.uint8))
+                with self.assertRaises(ValueError):
+                    fun(b'\x00'*15, 4)
+                with self.assertRaises(ValueError):
+                    fun(b'\x00'*16, 4, bits=33)
+                with self.assertRaises(ValueError):
+                    fun(b'\x00'*16, 4, bits=1)
+                with self.assertRaises(ValueError):
+                    fun(b'\x00'*18, 9, engine='bitslice')
+                with self.assertRaises(ValueError):
+                    fun(b'\x00'*16, 4, engine='simd')
+                with self.assertRaises(TypeError):
+                    fun([b'\x00', 42])
+
+
+@skipIf(NO_CEXT, NO_CEXT)
+class RangeTests(TestCase):
+    'Test the integer range sweeps'
+
+    def test_8bits(self):
+        'Check every 8-bit value against the tables from the paper'
+        biens = cbientropy.bien_range(0, 256, 8)
+        tbiens = cbientropy.tbien_range(0, 256, 8)
+        for value in range(256):
+            key = Bits(uint=value, length=8).bin
+            with self.subTest(key=key):
+                self.assertEqual(round(biens[value], 2), BIENTROPY_8BITS[key])
+                self.assertEqual(round(tbiens[value], 2),
+                                 TBIENTROPY_8BITS[key])
+
+
+    def test_ranges(self):
+        '''
+        Check unaligned ranges, including ones ending at the largest 64-bit
+        integers, split over various numbers of threads
+        '''
+        for start, stop, length in [(0, 4, 2), (3, 5, 3), (7, 509, 9),
+                                    (1000, 1000, 12), (2**20 - 70, 2**20, 20),
+                                    (2**64 - 200, 2**64 - 1, 64)]:
+            expected = [cbientropy.tbien(Bits(uint=value, length=length))
+                        for value in range(start, stop)]
+            for threads in [1, 3, 64]:
+                with self.subTest(start=start, stop=stop, threads=threads):
+                    result = cbientropy.tbien_range(start, stop, length,
+                                                    threads=threads)
+                    np.testing.assert_allclose(result, expected, rtol=0,
+                                               atol=1e-12)
+
+
+    def test_histogram(self):
+        'Check that the histogram-only mode counts every score once'
+        scores = cbientropy.tbien_range(5, 2**12, 12)
+        np.testing.assert_array_equal(
+            cbientropy.tbien_range(5, 2**12, 12, bins=None), scores)
+        expected, _ = np.histogram(scores, bins=20, range=(0, 1))
+        for threads in [1, 4]:
+            with self.subTest(threads=threads):
+                hist = cbientropy.tbien_range(5, 2**12, 12, bins=20,
+                                              threads=threads)
+                self.assertEqual(hist.dtype, np.int64)
+                self.assertEqual(list(hist), list(expected))
+
+
+    def test_errors(self):
+        'Check that bad ranges are rejected'
+        for fun in [cbientropy.bien_range, cbientropy.tbien_range]:
+            for args, kwargs, error in [
+                    ((0, 17, 4), {}, ValueError),
+                    ((3, 2, 4), {}, ValueError),
+                    ((0, 4, 1), {}, ValueError),
+                    ((0, 4, 65), {}, ValueError),
+                    ((-1, 4, 4), {}, OverflowError),
+                    ((0, 4, 4), {'bins': -1}, ValueError),
+                    ((0, 4, 4), {'bins': 0}, ValueError),
+                    ((0, 4, 4), {'bins': 2.5}, TypeError),
+                    ((0, 4, 4), {'threads': 0}, ValueError)]:
+                with self.subTest(fun=fun, args=args, kwargs=kwargs):
+                    with self.assertRaises(error):
+                        fun(*args, **kwargs)
+
+
+@skipIf(NO_CEXT, NO_CEXT)
+class RaggedTests(TestCase):
+    'Test the ragged batches of records'
+
+    def setUp(self):
+        self.recs = [os.urandom(n_bytes) for n_bytes in [1, 5, 40, 3, 17, 2]]
+        self.data = b''.join(self.recs)
+        self.offsets = np.cumsum([0] + [len(rec) for rec in self.recs])
+
+
+    def test_ragged(self):
+        'Check records of different lengths, with 32- and 64-bit offsets'
+        for dtype in [np.int32, np.int64]:
+            for threads in [1, 4]:
+                with self.subTest(dtype=dtype, threads=threads):
+                    np.testing.assert_allclose(
+                        cbientropy.tbien_ragged(
+                            self.data, self.offsets.astype(dtype),
+                            threads=threads),
+                        [cbientropy.tbien(rec) for rec in self.recs],
+                        rtol=0, atol=1e-12)
+
+
+    def test_bit_lengths(self):
+        'Check records with lengths that are not multiples of 8 bits'
+        bit_lengths = np.array([len(rec)*8 - 5 + 3*(i % 2)
+                                for i, rec in enumerate(self.recs)])
+        expected = [cbientropy.tbien(Bits(bytes=rec)[:n_bits])
+                    for rec, n_bits in zip(self.recs, bit_lengths)]
+        np.testing.assert_allclose(
+            cbientropy.tbien_ragged(self.data, self.offsets, bit_lengths),
+            expected, rtol=0, atol=1e-12)
+
+
+    def test_schedule(self):
+        'Check that long records split across threads give the same results'
+        recs = [os.urandom(n_bytes)
+                for n_bytes in [5000, 7, 4097, 1, 300, 9000, 2, 4096]]
+        data = b''.join(recs)
+        offsets = np.cumsum([0] + [len(rec) for rec in recs])
+        for fun in [cbientropy.bien_ragged, cbientropy.tbien_ragged]:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                ref = fun(data, offsets, threads=1)
+                if fun is cbientropy.tbien_ragged:
+                    np.testing.assert_allclose(
+                        ref, [cbientropy.tbien(rec) for rec in recs],
+                        rtol=0, atol=1e-12)
+                for threads in [2, 3, 16]:
+                    with self.subTest(fun=fun, threads=threads):
+                        np.testing.assert_array_equal(
+                            fun(data, offsets, threads=threads), ref)
+                batch = cbientropy.bien_batch \
+                    if fun is cbientropy.bien_ragged \
+                    else cbientropy.tbien_batch
+                np.testing.assert_array_equal(batch(recs), ref)
+
+
+    def test_slice(self):
+        'Check that offsets may start past the beginning of the data'
+        result = cbientropy.tbien_ragged(self.data, self.offsets[2:])
+        np.testing.assert_allclose(
+            result, [cbientropy.tbien(rec) for rec in self.recs[2:]],
+            rtol=0, atol=1e-12)
+        self.assertEqual(
+            cbientropy.tbien_ragged(self.data, self.offsets[:1]).shape, (0,))
+
+
+    def test_errors(self):
+        'Check that bad offsets and bit lengths are rejected'
+        for fun in [cbientropy.bien_ragged, cbientropy.tbien_ragged]:
+            for offsets, bit_lengths, error in [
+                    (self.offsets.astype(np.float64), None, TypeError),
+                    (self.offsets.astype(np.int16), None, TypeError),
+                    (self.offsets[:0], None, ValueError),
+                    (self.offsets + 1, None, ValueError),
+                    (self.offsets[::-1].copy(), None, ValueError),
+                    (np.array([0, 0, 2]), None, ValueError),
+                    (self.offsets, np.zeros(2, dtype=np.int64), ValueError),
+                    (self.offsets, self.offsets[1:]*8 + 1, ValueError)]:
+                with self.subTest(fun=fun, offsets=offsets,
+                                  bit_lengths=bit_lengths):
+                    with warnings.catch_warnings():
+                        warnings.simplefilter('ignore')
+                        with self.assertRaises(error):
+                            fun(self.data, offsets, bit_lengths)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+'''
+NOTICE
+
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+This file tests unpacked bit arrays, with one bit per element, against the
+same strings packed by NumPy.
+'''
+from __future__ import print_function
+import shutil
+import sys
+import tempfile
+import warnings
+
+if sys.version_info.major > 2:
+    from unittest import TestCase, main, skipIf
+else:
+    from unittest2 import TestCase, main, skipIf
+
+import numpy as np
+from bitstring import Bits
+try:
+    import bientropy
+    from bientropy import cache
+    from bientropy import cbientropy
+    NO_CEXT = ''
+except ImportError as e:
+    # Allow some tests to be skipped
+    NO_CEXT = 'C extension not available'
+try:
+    from bientropy import cffibientropy
+except ImportError:
+    cffibientropy = None
+
+
+def implementations():
+    'The modules providing the scalar and batch functions'
+    if cffibientropy is None:
+        return [cbientropy, bientropy]
+    return [cbientropy, cffibientropy, bientropy]
+
+
+@skipIf(NO_CEXT, NO_CEXT)
+class BitArrayTests(TestCase):
+    'Test unpacked bit arrays'
+
+    def test_scalar(self):
+        'Check that bool and 0/1 arrays score as the packed string does'
+        rng = np.random.RandomState(1)
+        for nbits in [2, 7, 8, 9, 31, 64, 100, 1001]:
+            bits = rng.rand(nbits) < 0.5
+            rand_s = Bits(bytes=np.packbits(bits).tobytes())[:nbits]
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                ref_bien = cbientropy.bien(rand_s)
+            ref_tbien = cbientropy.tbien(rand_s)
+            for mod in implementations():
+                with self.subTest(nbits=nbits, mod=mod.__name__):
+                    for arr, unpacked in [(bits, False),
+                                          (bits.astype(np.uint8), True),
+                                          (bits.astype(np.uint8).tobytes(),
+                                           True),
+                                          (bits[::-1][::-1], False)]:
+                        # unpacked is the second argument of every binding
+                        self.assertAlmostEqual(mod.tbien(arr, unpacked),
+                                               ref_tbien, places=12)
+                        with warnings.catch_warnings():
+                            warnings.simplefilter('ignore')
+                            self.assertAlmostEqual(mod.bien(arr, unpacked),
+                                                   ref_bien, places=12)
+
+
+    def test_strided(self):
+        'Check that strided arrays are packed in place'
+        rng = np.random.RandomState(2)
+        bits = rng.rand(300, 90) < 0.5
+        for view in [bits[:, ::3], bits[::2, 5:77], bits.T[:40]]:
+            ref = cbientropy.tbien_batch(np.packbits(view, axis=1),
+                                         bits=view.shape[1])
+            for mod in implementations():
+                with self.subTest(shape=view.shape, mod=mod.__name__):
+                    np.testing.assert_allclose(mod.tbien_batch(view), ref,
+                                               rtol=0, atol=1e-12)
+                    self.assertAlmostEqual(mod.tbien(view[7]), ref[7],
+                                           places=12)
+
+
+    def test_batch(self):
+        'Check the batch functions on two-dimensional bit arrays'
+        rng = np.random.RandomState(3)
+        for nbits in [2, 13, 32, 64, 65, 200]:
+            bits = rng.rand(100, nbits) < 0.5
+            packed = np.packbits(bits, axis=1)
+            for metric in ['bien', 'tbien']:
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore')
+                    ref = getattr(cbientropy, metric + '_batch')(
+                        packed, bits=nbits)
+                    for mod in implementations():
+                        with self.subTest(nbits=nbits, metric=metric,
+                                          mod=mod.__name__):
+                            fun = getattr(mod, metric + '_batch')
+                            np.testing.assert_allclose(
+                                fun(bits), ref, rtol=0, atol=1e-12)
+                            np.testing.assert_allclose(
+                                fun(bits.astype(np.uint8), unpacked=True),
+                                ref, rtol=0, atol=1e-12)
+                            np.testing.assert_allclose(
+                                fun(list(bits)), ref, rtol=0, atol=1e-12)
+                            if nbits > 2:
+                                np.testing.assert_allclose(
+                                    fun(bits, bits=nbits - 1),
+                                    fun(bits[:, :-1]), rtol=0, atol=1e-12)
+
+
+    def test_cache(self):
+        'Check that bit arrays are cached under the digest of packed strings'
+        directory = tempfile.mkdtemp()
+        try:
+            active = cache.enable(directory, min_bits=64)
+            bits = np.random.RandomState(4).rand(50, 100) < 0.5
+            packed = np.packbits(bits, axis=1)
+            ref = cbientropy.tbien_batch(packed, bits=100)
+            np.testing.assert_allclose(bientropy.tbien_batch(bits), ref,
+                                       rtol=0, atol=1e-12)
+            self.assertEqual(active.misses, 50)
+            # the same strings given packed are found in the cache
+            np.testing.assert_allclose(
+                bientropy.tbien_batch(packed, bits=100), ref,
+                rtol=0, atol=1e-12)
+            self.assertEqual(active.hits, 50)
+            self.assertAlmostEqual(
+                bientropy.tbien(bits[3].astype(np.uint8), unpacked=True),
+                ref[3], places=12)
+            self.assertEqual(active.hits, 51)
+        finally:
+            cache.disable()
+            shutil.rmtree(directory)
+
+
+    def test_errors(self):
+        'Check that malformed bit arrays are rejected'
+        bits = np.zeros((4, 16), dtype=bool)
+        for mod in implementations():
+            with self.subTest(mod=mod.__name__):
+                with self.assertRaises(ValueError):
+                    mod.tbien(np.array([0, 1, 2], dtype=np.uint8),
+                              unpacked=True)
+                with self.assertRaises(TypeError):
+                    mod.tbien(np.zeros(8), unpacked=True)
+                with self.assertRaises(ValueError):
+                    mod.tbien(bits)
+                with self.assertRaises(ValueError):
+                    mod.tbien_batch(bits[0])
+                with self.assertRaises(TypeError):
+                    mod.tbien_batch(bits, 2)
+                with self.assertRaises(ValueError):
+                    mod.tbien_batch(bits, bits=17)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+'''
+NOTICE
+
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+This file tests the persistent cache of results.
+'''
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+import warnings
+
+if sys.version_info.major > 2:
+    from unittest.mock import patch
+    from unittest import TestCase, main, skipIf
+else:
+    from mock import patch
+    from unittest2 import TestCase, main, skipIf
+
+import numpy as np
+from bitstring import Bits
+import bientropy
+from bientropy import cache
+try:
+    from bientropy import cbientropy
+    from bientropy.files import tbien_file
+    NO_CEXT = ''
+except ImportError as e:
+    # Allow some tests to be skipped
+    NO_CEXT = 'C extension not available'
+
+
+class CacheTests(TestCase):
+    'Test the persistent cache'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = cache.enable(self.directory, min_bits=64)
+
+    def tearDown(self):
+        cache.disable()
+        shutil.rmtree(self.directory)
+
+
+    def test_digest(self):
+        'Check that only the first bits of the input are hashed'
+        self.assertEqual(cache.digest(b'\xff\xf0', 12),
+                         cache.digest(b'\xff\xff\xff', 12))
+        self.assertNotEqual(cache.digest(b'\xff\xf0', 12),
+                            cache.digest(b'\xff\xe0', 12))
+
+
+    def test_score(self):
+        'Check that results are computed once and then looked up'
+        ti = os.urandom(32)
+        expected = bientropy.tbien(ti)
+        self.assertEqual(self.cache.misses, 1)
+        self.assertEqual(bientropy.tbien(Bits(bytes=ti)), expected)
+        self.assertEqual(self.cache.hits, 1)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            self.assertAlmostEqual(
+                bientropy.bien(Bits(bytes=ti)[:40]),
+                bientropy.pybientropy.bien(Bits(bytes=ti)[:40]), places=12)
+        self.assertEqual(len(self.cache), 1)
+
+
+    def test_short(self):
+        'Check that strings shorter than min_bits bypass the cache'
+        bientropy.tbien(b'\xde\xad')
+        self.assertEqual(self.cache.hits + self.cache.misses, 0)
+        self.assertEqual(len(self.cache), 0)
+
+
+    def test_persistent(self):
+        'Check that results survive reopening the cache'
+        ti = os.urandom(32)
+        expected = bientropy.tbien(ti)
+        reopened = cache.enable(self.directory, min_bits=64)
+        with patch('bientropy._tbien') as mock_tbien:
+            self.assertEqual(bientropy.tbien(ti), expected)
+            mock_tbien.assert_not_called()
+        self.assertEqual(reopened.hits, 1)
+
+
+    def test_version_stamp(self):
+        '''
+        Check that results are kept apart by the engine that computed them and
+        dropped when the layout of the database changes
+        '''
+        ti = os.urandom(32)
+        key = (cache.digest(ti, 256), 256)
+        expected = bientropy.tbien(ti)
+        cache.disable()
+        with patch('bientropy.cache.engine_name', return_value='other'):
+            other = cache.enable(self.directory, min_bits=64)
+        self.assertEqual(other.lookup('tbien', [key]), {})
+        other.store('tbien', {key: 0.5})
+        reopened = cache.enable(self.directory, min_bits=64)
+        self.assertEqual(reopened.lookup('tbien', [key]), {key: expected})
+        self.assertEqual(len(reopened), 2)
+        cache.disable()
+        with patch('bientropy.cache.SCHEMA_VERSION', 0):
+            reopened = cache.enable(self.directory, min_bits=64)
+        self.assertEqual(len(reopened), 0)
+
+
+    def test_eviction(self):
+        'Check that the least recently used results are evicted'
+        cache.enable(self.directory, max_entries=10, min_bits=64)
+        first = os.urandom(16)
+        bientropy.tbien(first)
+        for _ in range(9):
+            bientropy.tbien(os.urandom(16))
+        # use the first result again, so that it is the most recent
+        bientropy.tbien(first)
+        bientropy.tbien(os.urandom(16))
+        self.assertLessEqual(len(cache.ACTIVE), 10)
+        self.assertEqual(cache.ACTIVE.lookup(
+            'tbien', [(cache.digest(first, 128), 128)]).get(
+                (cache.digest(first, 128), 128)), bientropy.tbien(first))
+
+
+    @skipIf(NO_CEXT, NO_CEXT)
+    def test_batch(self):
+        'Check that the batch functions look up long records'
+        arr = np.frombuffer(os.urandom(16*20), dtype=np.uint8).reshape(20, 16)
+        expected = cbientropy.tbien_batch(arr)
+        np.testing.assert_allclose(bientropy.tbien_batch(arr), expected,
+                                   rtol=0, atol=1e-12)
+        self.assertEqual(self.cache.misses, 20)
+        np.testing.assert_allclose(bientropy.tbien_batch(arr.tobytes(), 16),
+                                   expected, rtol=0, atol=1e-12)
+        self.assertEqual(self.cache.hits, 20)
+        recs = [bytes(rec) for rec in arr[:5]] + [b'\x01\x02']
+        np.testing.assert_allclose(
+            bientropy.tbien_batch(recs),
+            [cbientropy.tbien(rec) for rec in recs], rtol=0, atol=1e-12)
+        self.assertEqual(self.cache.hits, 25)
+        # as the C extension, a flat buffer needs the size of its records
+        with self.assertRaises(TypeError) as raised:
+            bientropy.tbien_batch(arr.tobytes())
+        self.assertIn('record_bytes', str(raised.exception))
+
+
+    @skipIf(NO_CEXT, NO_CEXT)
+    def test_ragged(self):
+        'Check that the ragged functions look up long records'
+        recs = [os.urandom(n_bytes) for n_bytes in [2, 9, 30, 9]]
+        offsets = np.cumsum([0] + [len(rec) for rec in recs])
+        bit_lengths = np.array([len(rec)*8 - 1 for rec in recs])
+        expected = cbientropy.tbien_ragged(b''.join(recs), offsets,
+                                           bit_lengths)
+        for _ in range(2):
+            np.testing.assert_allclose(
+                bientropy.tbien_ragged(b''.join(recs), offsets, bit_lengths),
+                expected, rtol=0, atol=1e-12)
+        self.assertEqual(self.cache.misses, 3)
+        self.assertEqual(self.cache.hits, 3)
+
+
+    @skipIf(NO_CEXT, NO_CEXT)
+    def test_file(self):
+        'Check that files are looked up by their content'
+        ti = os.urandom(300)
+        fd, path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(ti)
+        expected = cbientropy.tbien(ti[10:])
+        self.assertAlmostEqual(tbien_file(path, offset=10), expected,
+                               places=12)
+        with patch('bientropy.cbientropy.tbien_scratch') as mock_scratch:
+            self.assertAlmostEqual(tbien_file(path, offset=10), expected,
+                                   places=12)
+            mock_scratch.assert_not_called()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+'''
+NOTICE
+
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+This file tests the cffi binding against the C extension.
+'''
+from __future__ import print_function
+import os
+import sys
+import warnings
+
+if sys.version_info.major > 2:
+    from unittest import TestCase, main, skipIf
+else:
+    from unittest2 import TestCase, main, skipIf
+
+from bitstring import Bits
+try:
+    import numpy as np
+    from bientropy import cbientropy
+    from bientropy import cffibientropy
+    NO_CFFI = ''
+except ImportError as e:
+    # Allow some tests to be skipped
+    NO_CFFI = 'cffi binding or C extension not available'
+
+
+@skipIf(NO_CFFI, NO_CFFI)
+class CffiTests(TestCase):
+    'Test the cffi binding'
+
+    def test_scalar(self):
+        'Check the scalar functions on bytes and bitstrings'
+        for s_len in [1, 4, 8, 9, 33, 100]:
+            ti = os.urandom(s_len)
+            for bits in set([s_len*8, s_len*8 - 5, 2]):
+                rand_s = Bits(bytes=ti)[:bits]
+                with self.subTest(s_len=s_len, bits=bits):
+                    with warnings.catch_warnings():
+                        warnings.simplefilter('ignore')
+                        self.assertAlmostEqual(cffibientropy.bien(rand_s),
+                                               cbientropy.bien(rand_s),
+                                               places=12)
+                    self.assertAlmostEqual(cffibientropy.tbien(rand_s),
+                                           cbientropy.tbien(rand_s),
+                                           places=12)
+        self.assertEqual(cffibientropy.ENGINE_VERSION,
+                         cbientropy.ENGINE_VERSION)
+
+
+    def test_batch(self):
+        'Check the batch functions on buffers and lists, with each engine'
+        data = os.urandom(200*5)
+        recs = [data[i:i + 5] for i in range(0, len(data), 5)]
+        array = np.frombuffer(data, dtype=np.uint8).reshape(200, 5)
+        for engine in [None, 'words']:
+            for name in ['bien_batch', 'tbien_batch']:
+                with self.subTest(engine=engine, name=name):
+                    fun = getattr(cffibientropy, name)
+                    with warnings.catch_warnings():
+                        warnings.simplefilter('ignore')
+                        ref = getattr(cbientropy, name)(data, 5,
+                                                        engine=engine)
+                        np.testing.assert_allclose(
+                            fun(data, 5, engine=engine), ref, atol=1e-12)
+                        np.testing.assert_allclose(
+                            fun(array, engine=engine), ref, atol=1e-12)
+                        np.testing.assert_allclose(
+                            fun(recs, engine=engine), ref, atol=1e-12)
+        np.testing.assert_allclose(
+            cffibientropy.tbien_batch(data[:400], 2, bits=13,
+                                      engine='bitslice'),
+            cbientropy.tbien_batch(data[:400], 2, bits=13,
+                                   engine='bitslice'), atol=1e-12)
+
+
+    def test_ragged(self):
+        'Check the ragged functions and lists of mixed lengths'
+        recs = [os.urandom(n) for n in [1, 3, 9, 70, 3, 2]]
+        data = b''.join(recs)
+        offsets = np.cumsum([0] + [len(rec) for rec in recs])
+        bit_lengths = np.array([8, 20, 65, 500, 2, 16])
+        for name in ['bien_ragged', 'tbien_ragged']:
+            with self.subTest(name=name), warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                np.testing.assert_allclose(
+                    getattr(cffibientropy, name)(data, offsets, bit_lengths),
+                    getattr(cbientropy, name)(data, offsets, bit_lengths),
+                    atol=1e-12)
+        np.testing.assert_allclose(cffibientropy.tbien_batch(recs),
+                                   cbientropy.tbien_ragged(data, offsets),
+                                   atol=1e-12)
+
+
+    def test_errors(self):
+        'Check that invalid inputs are rejected'
+        with self.assertRaises(ValueError):
+            cffibientropy.tbien(b'')
+        with self.assertRaises(TypeError):
+            cffibientropy.tbien(1)
+        with self.assertRaises(ValueError):
+            cffibientropy.tbien_batch(b'\x00'*5, 2)
+        with self.assertRaises(ValueError):
+            cffibientropy.tbien_batch(b'\x00'*4, 2, bits=17)
+        with self.assertRaises(ValueError):
+            cffibientropy.tbien_batch(b'\x00'*18, 9, engine='bitslice')
+        with self.assertRaises(ValueError):
+            cffibientropy.tbien_ragged(b'\x00'*4, [0, 3, 2, 4])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+'''
+NOTICE
+
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+This file tests the derivative iterator of the C extension against the
+binary derivatives of the Python implementation.
+'''
+from __future__ import print_function
+import os
+import sys
+
+if sys.version_info.major > 2:
+    from unittest import TestCase, main, skipIf
+else:
+    from unittest2 import TestCase, main, skipIf
+
+import numpy as np
+from bitstring import Bits
+from bientropy import pybientropy
+try:
+    from bientropy import cbientropy
+    NO_CEXT = ''
+except ImportError as e:
+    # Allow some tests to be skipped
+    NO_CEXT = 'C extension not available'
+
+
+def level_bits(level, length):
+    'The bits of a level yielded by iter_derivatives()'
+    return Bits(bytes=bytes(level), length=length)
+
+
+@skipIf(NO_CEXT, NO_CEXT)
+class DerivativeTests(TestCase):
+    'Test the derivative iterator'
+
+    def test_levels(self):
+        'Check every level of strings of several lengths'
+        for n in [1, 2, 7, 8, 9, 63, 64, 65, 130, 200]:
+            bits = Bits(bytes=os.urandom((n + 7)//8), length=n)
+            with self.subTest(n=n):
+                levels = [bytes(v)
+                          for v in cbientropy.iter_derivatives(bits)]
+                self.assertEqual(len(levels), n - 1)
+                for k, level in enumerate(levels):
+                    self.assertEqual(len(level), (n - k + 7)//8)
+                    self.assertEqual(level_bits(level, n - k),
+                                     pybientropy.bin_deriv_k(bits, k))
+                    # the bits past the level are zero
+                    self.assertEqual(
+                        Bits(bytes=level)[n - k:].count(1), 0)
+
+
+    def test_range(self):
+        'Check start_k and stop_k, which jump straight to the first level'
+        bits = Bits(bytes=os.urandom(40))
+        for start_k, stop_k in [(0, 1), (5, 9), (100, 110), (257, 320),
+                                (319, 320), (10, 10), (20, 10)]:
+            with self.subTest(start_k=start_k, stop_k=stop_k):
+                levels = [bytes(v) for v in cbientropy.iter_derivatives(
+                    bits, start_k, stop_k)]
+                self.assertEqual(len(levels), max(0, stop_k - start_k))
+                for k, level in zip(range(start_k, stop_k), levels):
+                    self.assertEqual(level_bits(level, 320 - k),
+                                     pybientropy.bin_deriv_k(bits, k))
+
+
+    def test_buffer(self):
+        'Check that the levels are read-only views of one reused buffer'
+        it = cbientropy.iter_derivatives(b'\xde\xad')
+        first = next(it)
+        self.assertTrue(first.readonly)
+        self.assertEqual(first.tobytes(), b'\xde\xad')
+        with self.assertRaises(TypeError):
+            first[0] = 0
+        second = next(it)
+        # the first view now shows the second level
+        self.assertEqual(first.tobytes(), second.tobytes())
+        # the views keep the buffer alive
+        del it
+        self.assertEqual(second.tobytes(), b'c\xf6')
+
+
+    def test_inputs(self):
+        'Check binary strings and bit arrays'
+        data = os.urandom(9)
+        ref = [bytes(v) for v in cbientropy.iter_derivatives(data)]
+        arr = np.unpackbits(np.frombuffer(data, np.uint8))
+        for args in [(arr.astype(bool),), (arr, 0, None, True)]:
+            with self.subTest(dtype=args[0].dtype):
+                self.assertEqual(
+                    [bytes(v) for v in cbientropy.iter_derivatives(*args)],
+                    ref)
+
+
+    def test_errors(self):
+        'Check that invalid arguments are rejected'
+        with self.assertRaises(ValueError):
+            cbientropy.iter_derivatives(b'')
+        for start_k, stop_k in [(-1, None), (17, None), (0, 17), (0, -1),
+                                (3, -2)]:
+            with self.subTest(start_k=start_k, stop_k=stop_k):
+                with self.assertRaises(ValueError):
+                    cbientropy.iter_derivatives(b'\x00\x01', start_k,
+                                                stop_k)
+        with self.assertRaises(TypeError):
+            cbientropy.iter_derivatives(u'abc')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,350 @@
+'''
+NOTICE
+
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+This file tests the coordinator and workers of bientropy.distributed on
+localhost, with worker processes, worker threads and misbehaving workers.
+'''
+from __future__ import print_function
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import warnings
+
+if sys.version_info.major > 2:
+    from unittest import TestCase, main, skipIf
+else:
+    from unittest2 import TestCase, main, skipIf
+
+import numpy as np
+try:
+    from bientropy import cbientropy
+    import bientropy
+    from bientropy.distributed import (Coordinator, Worker, make_shards,
+                                       send_message, recv_message)
+    from bientropy.__main__ import main as command
+    NO_CEXT = ''
+except ImportError as e:
+    # Allow some tests to be skipped
+    NO_CEXT = 'C extension not available'
+
+
+def start_worker(address):
+    'Run a worker in a thread of this process'
+    thread = threading.Thread(target=Worker(address, threads=1).run)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def misbehave(address, shards, events):
+    """
+    A worker that takes `shards` shards and then drops its connection when
+    the event is set
+    """
+    sock = socket.create_connection(address)
+    send_message(sock, {'type': 'hello', 'name': 'faulty'})
+    taken = 0
+    while taken < shards:
+        received = recv_message(sock)
+        if received is None:
+            break
+        if received[0]['type'] == 'shard':
+            taken += 1
+    events[0].set()
+    events[1].wait(30)
+    sock.close()
+
+
+def answer_badly(address, replies, dropped):
+    """
+    A worker that answers each shard with the next of `replies`, functions of
+    the shard message giving a message and payload, and then records whether
+    the coordinator dropped its connection
+    """
+    sock = socket.create_connection(address)
+    send_message(sock, {'type': 'hello', 'name': 'faulty'})
+    replies = list(replies)
+    while True:
+        received = recv_message(sock)
+        if received is None:
+            dropped.append(True)
+            break
+        if received[0]['type'] == 'shard' and replies:
+            send_message(sock, *replies.pop(0)(received[0]))
+    sock.close()
+
+
+@skipIf(NO_CEXT, NO_CEXT)
+class DistributedTests(TestCase):
+    'Test the distributed coordinator and workers'
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        rng = np.random.RandomState(3)
+        self.paths = []
+        self.records = []
+        for n in [300, 1000, 50]:
+            data = rng.randint(0, 256, (n, 16)).astype(np.uint8)
+            data[::7] &= 0x11
+            path = os.path.join(self.tmp, 'corpus%d' % n)
+            with open(path, 'wb') as f:
+                f.write(data.tobytes())
+                # a partial record, which is not scored
+                f.write(b'\x01\x02\x03')
+            self.paths.append(path)
+            self.records.append(data)
+        self.data = np.concatenate(self.records)
+        # the workers in threads of this process score BiEn of long records
+        self.warnings = warnings.catch_warnings()
+        self.warnings.__enter__()
+        warnings.filterwarnings('ignore', 'The BiEn algorithm is not suitable')
+
+
+    def tearDown(self):
+        self.warnings.__exit__(None, None, None)
+        shutil.rmtree(self.tmp)
+
+
+    def reference(self, metric='tbien', bits=None):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            return getattr(bientropy, metric + '_batch')(self.data, bits=bits)
+
+
+    def test_shards(self):
+        'Check that shards cover whole records of files and byte ranges'
+        shards = make_shards(self.paths, 16, 100*16)
+        self.assertEqual([s['length']//16 for s in shards],
+                         [100]*3 + [100]*10 + [50])
+        shards = make_shards([(self.paths[0], 32, 16*10 + 5)], 16, 48)
+        self.assertEqual([(s['offset'], s['length']) for s in shards],
+                         [(32, 48), (80, 48), (128, 48), (176, 16)])
+
+
+    def test_processes(self):
+        'Score files with several worker processes'
+        shards = make_shards(self.paths, 16, 64*16)
+        coordinator = Coordinator(shards, 16, address=('127.0.0.1', 0))
+        top = os.path.dirname(os.path.dirname(bientropy.__file__))
+        procs = [subprocess.Popen(
+            [sys.executable, '-m', 'bientropy', 'worker', '--connect',
+             '127.0.0.1:%d' % coordinator.address[1], '--name', 'w%d' % i],
+            cwd=top, stderr=subprocess.PIPE) for i in range(3)]
+        try:
+            result = coordinator.run(timeout=120)
+        finally:
+            for proc in procs:
+                proc.communicate()
+        np.testing.assert_array_equal(result['scores'], self.reference())
+        self.assertEqual(result['records'], len(self.data))
+        self.assertEqual(result['bytes'], self.data.size)
+        self.assertEqual(sum(s['shards'] for s in result['workers'].values()),
+                         len(shards))
+        for stats in result['workers'].values():
+            if stats['shards']:
+                self.assertGreater(stats['records_per_s'], 0)
+
+
+    def test_options(self):
+        'Check the metric, lengths in bits, long records and summaries'
+        for metric, bits, record_bytes in [('bien', None, 16),
+                                           ('tbien', 100, 16),
+                                           ('tbien', None, 32)]:
+            with self.subTest(metric=metric, bits=bits,
+                              record_bytes=record_bytes):
+                shards = make_shards(self.paths, record_bytes, 256)
+                summary = bientropy.Summary(50)
+                coordinator = Coordinator(shards, record_bytes, metric, bits,
+                                          summary, ('127.0.0.1', 0))
+                for _ in range(2):
+                    start_worker(coordinator.address)
+                result = coordinator.run(timeout=60)
+                self.assertIsNone(result['scores'])
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore')
+                    data = np.concatenate([
+                        r.reshape(-1, record_bytes) for r in
+                        [r.ravel()[:len(r.ravel())//record_bytes*
+                                   record_bytes] for r in self.records]])
+                    ref = bientropy.Summary(50)
+                    getattr(bientropy, metric + '_batch')(data, bits=bits,
+                                                          summary=ref)
+                self.assertEqual(summary.count, ref.count)
+                self.assertAlmostEqual(summary.mean, ref.mean, 12)
+                np.testing.assert_array_equal(summary.histogram()[0],
+                                              ref.histogram()[0])
+
+
+    def test_lost_worker(self):
+        'Check that the shards of a dropped worker are retried'
+        shards = make_shards(self.paths, 16, 32*16)
+        coordinator = Coordinator(shards, 16, address=('127.0.0.1', 0))
+        events = [threading.Event(), threading.Event()]
+        thread = threading.Thread(target=misbehave,
+                                  args=(coordinator.address, 2, events))
+        thread.start()
+        outcome = []
+        runner = threading.Thread(
+            target=lambda: outcome.append(coordinator.run(timeout=60)))
+        runner.start()
+        events[0].wait(30)
+        start_worker(coordinator.address)
+        events[1].set()
+        runner.join()
+        thread.join()
+        result = outcome[0]
+        np.testing.assert_array_equal(result['scores'], self.reference())
+        self.assertGreaterEqual(result['retries'], 2)
+
+
+    def test_stalled_worker(self):
+        'Check that shards are stolen from and leased away from a stall'
+        shards = make_shards(self.paths, 16, 32*16)
+        coordinator = Coordinator(shards, 16, address=('127.0.0.1', 0),
+                                  prefetch=3, lease_timeout=0.2)
+        events = [threading.Event(), threading.Event()]
+        thread = threading.Thread(target=misbehave,
+                                  args=(coordinator.address, 3, events))
+        thread.start()
+        outcome = []
+        runner = threading.Thread(
+            target=lambda: outcome.append(coordinator.run(timeout=60)))
+        runner.start()
+        events[0].wait(30)
+        start_worker(coordinator.address)
+        runner.join()
+        events[1].set()
+        thread.join()
+        result = outcome[0]
+        np.testing.assert_array_equal(result['scores'], self.reference())
+        self.assertGreaterEqual(result['steals'], 1)
+        self.assertGreaterEqual(result['retries'], 1)
+        self.assertEqual(result['workers']['faulty']['shards'], 0)
+
+
+    def test_bad_messages(self):
+        '''
+        Check that results not covering their shard are retried and that
+        malformed messages drop the worker
+        '''
+        shards = make_shards(self.paths, 16, 32*16)
+        for replies in [
+                [lambda m: ({'type': 'result', 'id': m['id'],
+                             'records': 32, 'seconds': 0.0}, b'\0'*8),
+                 lambda m: ({'type': 'result', 'records': 32,
+                             'seconds': 0.0}, b'')],
+                [lambda m: ({'type': 'result', 'id': m['id'],
+                             'records': 31, 'seconds': 0.0}, b'\0'*31*8),
+                 lambda m: ({'type': 'other', 'id': m['id']}, b'')],
+                [lambda m: ({'type': 'error', 'id': len(shards)}, b'')],
+                [lambda m: (['result'], b'')]]:
+            with self.subTest(replies=len(replies)):
+                coordinator = Coordinator(shards, 16,
+                                          address=('127.0.0.1', 0))
+                dropped = []
+                thread = threading.Thread(
+                    target=answer_badly,
+                    args=(coordinator.address, replies, dropped))
+                thread.start()
+                outcome = []
+                runner = threading.Thread(
+                    target=lambda: outcome.append(
+                        coordinator.run(timeout=60)))
+                runner.start()
+                thread.join(30)
+                start_worker(coordinator.address)
+                runner.join()
+                self.assertEqual(dropped, [True])
+                np.testing.assert_array_equal(outcome[0]['scores'],
+                                              self.reference())
+                self.assertGreaterEqual(outcome[0]['retries'], len(replies))
+
+
+    def test_bad_summaries(self):
+        'Check that summaries inconsistent with their counts are retried'
+        shards = make_shards(self.paths, 16, 32*16)
+        summary = bientropy.Summary(50)
+        coordinator = Coordinator(shards, 16, summary=summary,
+                                  address=('127.0.0.1', 0), max_attempts=10)
+        def state(hist, below=0):
+            return [32, 0.5, 0.01, 0.1, 0.9, below, 0, hist]
+        replies = [
+            lambda m: ({'type': 'result', 'id': m['id'], 'records': 32,
+                        'seconds': 0.0, 'summary': state([0]*50)}, b''),
+            lambda m: ({'type': 'result', 'id': m['id'], 'records': 32,
+                        'seconds': 0.0,
+                        'summary': state([64, -32] + [0]*48)}, b''),
+            lambda m: ({'type': 'result', 'id': m['id'], 'records': 32,
+                        'seconds': 0.0,
+                        'summary': state([33] + [0]*49, below=-1)}, b''),
+            # no summary, which drops the worker
+            lambda m: ({'type': 'result', 'id': m['id'], 'records': 32,
+                        'seconds': 0.0}, b'')]
+        dropped = []
+        thread = threading.Thread(
+            target=answer_badly, args=(coordinator.address, replies, dropped))
+        thread.start()
+        outcome = []
+        runner = threading.Thread(
+            target=lambda: outcome.append(coordinator.run(timeout=60)))
+        runner.start()
+        thread.join(30)
+        start_worker(coordinator.address)
+        runner.join()
+        self.assertEqual(dropped, [True])
+        self.assertGreaterEqual(outcome[0]['retries'], len(replies))
+        ref = bientropy.Summary(50)
+        bientropy.tbien_batch(self.data, summary=ref)
+        self.assertEqual(summary.count, ref.count)
+        self.assertEqual(summary.outside, ref.outside)
+        np.testing.assert_array_equal(summary.histogram()[0],
+                                      ref.histogram()[0])
+
+
+    def test_failures(self):
+        'Check that a shard failing max_attempts times fails the run'
+        shards = make_shards(self.paths, 16, 32*16)
+        shards[3]['path'] = os.path.join(self.tmp, 'missing')
+        coordinator = Coordinator(shards, 16, address=('127.0.0.1', 0),
+                                  max_attempts=2)
+        start_worker(coordinator.address)
+        with self.assertRaises(RuntimeError):
+            coordinator.run(timeout=60)
+        coordinator = Coordinator(make_shards(self.paths, 16), 16,
+                                  address=('127.0.0.1', 0))
+        with self.assertRaises(RuntimeError):
+            coordinator.run(timeout=0.5)
+        with self.assertRaises(ValueError):
+            Coordinator([], 16, 'xyz')
+        # with a summary there are no scores to write
+        with self.assertRaises(SystemExit):
+            command(['coordinate', '--port', '0', '--record-bytes', '16',
+                     '--bins', '10', '--output',
+                     os.path.join(self.tmp, 'scores'), self.paths[0]])
+
+
+if __name__ == '__main__':
+    main()
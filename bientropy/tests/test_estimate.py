@@ -0,0 +1,141 @@
+'''
+NOTICE
+
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+This file tests the sampled estimate of TBiEn.
+'''
+from __future__ import print_function
+import os
+import sys
+
+if sys.version_info.major > 2:
+    from unittest import TestCase, main, skipIf
+else:
+    from unittest2 import TestCase, main, skipIf
+
+import numpy as np
+from bitstring import Bits
+try:
+    from bientropy import cbientropy
+    NO_CEXT = ''
+except ImportError as e:
+    # Allow some tests to be skipped
+    NO_CEXT = 'C extension not available'
+
+
+@skipIf(NO_CEXT, NO_CEXT)
+class EstimateTests(TestCase):
+    'Test the sampled estimate of TBiEn'
+
+    def test_exact(self):
+        'Check that TBiEn is computed exactly when every level is sampled'
+        ti = os.urandom(8)
+        for bits in [2, 30, 64]:
+            with self.subTest(bits=bits):
+                ref = cbientropy.tbien(Bits(bytes=ti)[:bits])
+                est, lo, hi = cbientropy.tbien_estimate(ti, samples=64,
+                                                        bits=bits)
+                self.assertAlmostEqual(est, ref, places=12)
+                self.assertEqual((lo, hi), (est, est))
+
+
+    def test_unbiased(self):
+        '''
+        Check that the mean of many estimates converges on TBiEn, which
+        requires every sampled level to be computed correctly, and that the
+        intervals cover it about as often as their confidence level says, for
+        structured and random strings of several lengths.
+        '''
+        rand = np.random.RandomState(0)
+        for ti, samples in [
+                (b'\x00'*20 + b'\xde\xad\xbe\xef'*5 + b'\xff'*10, 16),
+                (rand.bytes(256), 200), (rand.bytes(512), 64),
+                (rand.bytes(4096), 16)]:
+            with self.subTest(bits=len(ti)*8, samples=samples):
+                ref = cbientropy.tbien(ti)
+                ests = [cbientropy.tbien_estimate(ti, samples=samples,
+                                                  seed=seed)
+                        for seed in range(1000)]
+                mean = sum(est for est, _, _ in ests)/len(ests)
+                self.assertAlmostEqual(mean, ref, delta=0.0005)
+                covered = sum(lo <= ref <= hi for _, lo, hi in ests)
+                self.assertGreater(covered, 0.90*len(ests))
+                self.assertLess(covered, 0.98*len(ests))
+                for est, lo, hi in ests:
+                    self.assertTrue(0 <= lo <= est <= hi <= 1)
+
+
+    def test_periodic(self):
+        '''
+        Check that the intervals still cover TBiEn of a periodic string, most
+        of whose levels are all zero, so that most strata sample only zeros
+        '''
+        ti = b'\x5a\x3c'*256
+        ref = cbientropy.tbien(ti)
+        ests = [cbientropy.tbien_estimate(ti, samples=32, seed=seed)
+                for seed in range(200)]
+        covered = sum(lo <= ref <= hi for _, lo, hi in ests)
+        self.assertGreater(covered, 0.95*len(ests))
+
+
+    def test_reproducible(self):
+        'Check that a seed gives the same estimate on any number of threads'
+        ti = os.urandom(4096)
+        ref = cbientropy.tbien_estimate(ti, samples=20, seed=42, threads=1)
+        for threads in [2, 3, 20]:
+            with self.subTest(threads=threads):
+                self.assertEqual(
+                    cbientropy.tbien_estimate(ti, samples=20, seed=42,
+                                              threads=threads), ref)
+        self.assertEqual(
+            cbientropy.tbien_estimate(bytearray(ti), samples=20, seed=42),
+            ref)
+        self.assertNotEqual(
+            cbientropy.tbien_estimate(ti, samples=20, seed=43), ref)
+
+
+    def test_confidence(self):
+        'Check that a higher confidence level widens the interval'
+        ti = os.urandom(64)
+        est, lo, hi = cbientropy.tbien_estimate(ti, samples=32, seed=1)
+        est99, lo99, hi99 = cbientropy.tbien_estimate(ti, samples=32, seed=1,
+                                                      confidence=0.99)
+        self.assertEqual(est, est99)
+        self.assertLessEqual(lo99, lo)
+        self.assertGreaterEqual(hi99, hi)
+
+
+    def test_errors(self):
+        'Check that bad arguments are rejected'
+        with self.assertRaises(ValueError):
+            cbientropy.tbien_estimate(b'\x80', bits=1)
+        with self.assertRaises(ValueError):
+            cbientropy.tbien_estimate(b'\x80', bits=9)
+        with self.assertRaises(ValueError):
+            cbientropy.tbien_estimate(b'\xde\xad', samples=1)
+        with self.assertRaises(ValueError):
+            cbientropy.tbien_estimate(b'\xde\xad', confidence=1.0)
+        with self.assertRaises(TypeError):
+            cbientropy.tbien_estimate(u'text')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+'''
+NOTICE
+
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+This file tests the out-of-core scorers of files and the engine working in
+scratch space against the GMP implementation.
+'''
+from __future__ import print_function
+import os
+import sys
+import tempfile
+import warnings
+
+if sys.version_info.major > 2:
+    from unittest import TestCase, main, skipIf
+else:
+    from unittest2 import TestCase, main, skipIf
+
+import numpy as np
+from bitstring import Bits
+try:
+    from bientropy import cbientropy
+    from bientropy.files import bien_file, tbien_file
+    NO_CEXT = ''
+except ImportError as e:
+    # Allow some tests to be skipped
+    NO_CEXT = 'C extension not available'
+
+
+@skipIf(NO_CEXT, NO_CEXT)
+class FileTests(TestCase):
+    'Test the out-of-core scorers'
+
+    def test_scratch_vs_gmp(self):
+        '''
+        Check that the engine working in scratch space matches the GMP engine
+        for lengths around the word boundaries.
+        '''
+        for s_len in [1, 2, 7, 8, 9, 16, 17, 33, 100]:
+            ti = os.urandom(s_len)
+            for bits in set([s_len*8, s_len*8 - 5, 2]):
+                rand_s = Bits(bytes=ti)[:bits]
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore')
+                    ref_bien = cbientropy.bien(rand_s)
+                ref_tbien = cbientropy.tbien(rand_s)
+                with self.subTest(s_len=s_len, bits=bits):
+                    self.assertAlmostEqual(cbientropy.bien_scratch(ti, bits),
+                                           ref_bien, places=12)
+                    self.assertAlmostEqual(cbientropy.tbien_scratch(ti, bits),
+                                           ref_tbien, places=12)
+
+
+    def test_scratch_buffer(self):
+        '''
+        Check that a caller-provided scratch buffer is used and that its size
+        and alignment are checked
+        '''
+        ti = os.urandom(100)
+        scratch = np.zeros(13, np.uint64)
+        self.assertAlmostEqual(
+            cbientropy.tbien_scratch(ti, scratch=scratch),
+            cbientropy.tbien(ti), places=12)
+        self.assertTrue(scratch.any())
+        with self.assertRaises(ValueError):
+            cbientropy.tbien_scratch(ti, scratch=np.zeros(12, np.uint64))
+        with self.assertRaises(BufferError):
+            cbientropy.tbien_scratch(ti, scratch=b'\x00'*8*13)
+        misaligned = np.zeros(14*8 + 1, np.uint8)[1:]
+        with self.assertRaises(ValueError):
+            cbientropy.tbien_scratch(ti, scratch=misaligned)
+        self.assertFalse(misaligned.any())
+
+
+    def test_error_short(self):
+        'Check that strings that are too short are rejected'
+        for fun in [cbientropy.bien_scratch, cbientropy.tbien_scratch]:
+            with self.subTest(fun=fun):
+                with self.assertRaises(ValueError):
+                    fun(b'')
+                with self.assertRaises(ValueError):
+                    fun(b'\x80', 1)
+                with self.assertRaises(ValueError):
+                    fun(b'\x80', 9)
+
+
+    def test_file(self):
+        'Check that files are scored in place, with offsets and lengths'
+        ti = os.urandom(5000)
+        fd, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(ti)
+            self.assertAlmostEqual(tbien_file(path), cbientropy.tbien(ti),
+                                   places=12)
+            self.assertAlmostEqual(
+                tbien_file(path, offset=4099, length=300),
+                cbientropy.tbien(ti[4099:4399]), places=12)
+            self.assertAlmostEqual(
+                bien_file(path, offset=3, length=4, bits=30),
+                cbientropy.bien(Bits(bytes=ti[3:7])[:30]), places=12)
+            with self.assertRaises(ValueError):
+                tbien_file(path, offset=4999, length=2)
+        finally:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+'''
+NOTICE
+
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+This file tests the index files of scans against filtering the results of
+scan_metrics() directly.
+'''
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+
+if sys.version_info.major > 2:
+    from unittest.mock import patch
+    from unittest import TestCase, main, skipIf
+else:
+    from mock import patch
+    from unittest2 import TestCase, main, skipIf
+
+import numpy as np
+try:
+    from bientropy import cbientropy
+    from bientropy import index
+    NO_CEXT = ''
+except ImportError as e:
+    # Allow some tests to be skipped
+    NO_CEXT = 'C extension not available'
+
+
+def reference(stats, block_bytes, lo, hi, min_score, max_score, field):
+    'The offsets and scores of the blocks within bounds, by filtering'
+    offsets = np.arange(len(stats))*block_bytes
+    scores = stats[field]
+    end = len(stats)*block_bytes if hi is None else hi
+    keep = (offsets + block_bytes > lo) & (offsets < end) & (lo < end)
+    if min_score is not None:
+        keep &= scores >= min_score
+    if max_score is not None:
+        keep &= scores <= max_score
+    return offsets[keep], scores[keep]
+
+
+@skipIf(NO_CEXT, NO_CEXT)
+class IndexTests(TestCase):
+    'Test the index files of scans'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'data.idx')
+        # random blocks with runs of constant and weak blocks among them
+        data = bytearray(os.urandom(512*700 + 100))
+        data[512*100:512*180] = b'\0'*512*80
+        data[512*400:512*600:3] = b'\x0f'*len(data[512*400:512*600:3])
+        self.data = bytes(data)
+        self.source = os.path.join(self.directory, 'data.bin')
+        with open(self.source, 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+    def test_write(self):
+        'Check that files and buffers, scanned in chunks, give the scan'
+        stats = cbientropy.scan_metrics(self.data, 512)
+        for data in [self.source, self.data, bytearray(self.data)]:
+            for chunk_bytes in [512*16, 1 << 20]:
+                with self.subTest(data=type(data),
+                                  chunk_bytes=chunk_bytes), \
+                        patch.object(index, 'CHUNK_BYTES', chunk_bytes):
+                    with index.write(self.path, data, 512,
+                                     superblock_blocks=8) as idx:
+                        self.assertEqual(len(idx), len(stats))
+                        self.assertEqual(idx.data_bytes, len(self.data))
+                        np.testing.assert_array_equal(
+                            np.asarray(idx.records), stats)
+                        self.assertEqual(len(idx.mins), 88)
+                        np.testing.assert_array_equal(
+                            idx.maxs['tbien'][:3],
+                            [stats['tbien'][i:i + 8].max()
+                             for i in range(0, 24, 8)])
+        with index.write(self.path, self.source, 512,
+                         ['tbien', 'runs']) as idx:
+            self.assertEqual(idx.dtype.names, ('tbien', 'runs'))
+            np.testing.assert_array_equal(idx.records['runs'],
+                                          stats['runs'])
+
+
+    def test_query(self):
+        'Check range and threshold queries against filtering the scan'
+        stats = cbientropy.scan_metrics(self.data, 512)
+        index.write(self.path, self.source, 512, superblock_blocks=16)
+        bounds = [(0, None), (0, 512), (511, 513), (512*90, 512*650 + 7),
+                  (512*700, None), (300, 300), (10**9, None)]
+        with index.open(self.path, self.source) as idx:
+            for lo, hi in bounds:
+                for min_score, max_score in [(None, None), (0.9, None),
+                                             (None, 0.5), (0.2, 0.95)]:
+                    for field in ['tbien', 'bien', 'runs']:
+                        with self.subTest(lo=lo, hi=hi, min_score=min_score,
+                                          max_score=max_score, field=field):
+                            offsets, scores = idx.query(
+                                lo, hi, min_score, max_score, field)
+                            ref = reference(stats, 512, lo, hi, min_score,
+                                            max_score, field)
+                            np.testing.assert_array_equal(offsets, ref[0])
+                            np.testing.assert_array_equal(scores, ref[1])
+                            self.assertEqual(idx.count(
+                                lo, hi, min_score, max_score, field),
+                                len(ref[0]))
+
+
+    def test_empty(self):
+        'Check the index of an empty file'
+        with open(self.source, 'wb'):
+            pass
+        with index.write(self.path, self.source) as idx:
+            self.assertEqual(len(idx), 0)
+            offsets, scores = idx.query(min_score=0.5)
+            self.assertEqual((len(offsets), len(scores)), (0, 0))
+            self.assertEqual(idx.count(), 0)
+
+
+    def test_errors(self):
+        'Check that invalid, truncated and stale indexes are rejected'
+        with self.assertRaises(ValueError):
+            index.write(self.path, self.data, fields=['tbien', 'xyz'])
+        with self.assertRaises(ValueError):
+            index.write(self.path, self.data, 0)
+        index.write(self.path, self.source, 512).close()
+        with index.open(self.path) as idx:
+            with self.assertRaises(ValueError):
+                idx.query(field='xyz')
+        with open(self.path, 'rb') as f:
+            contents = f.read()
+        with open(self.path, 'wb') as f:
+            f.write(contents[:-1])
+        with self.assertRaises(ValueError):
+            index.open(self.path)
+        with open(self.path, 'wb') as f:
+            f.write(b'not an index')
+        with self.assertRaises(ValueError):
+            index.open(self.path)
+        index.write(self.path, self.source, 512).close()
+        with open(self.source, 'ab') as f:
+            f.write(b'\0')
+        with self.assertRaises(ValueError):
+            index.open(self.path, self.source)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+'''
+NOTICE
+
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+This file tests metrics prepared for fixed lengths against the GMP
+implementation.
+'''
+from __future__ import print_function
+import os
+import sys
+import warnings
+
+if sys.version_info.major > 2:
+    from unittest import TestCase, main, skipIf
+else:
+    from unittest2 import TestCase, main, skipIf
+
+import numpy as np
+from bitstring import Bits
+from bientropy import pybientropy
+try:
+    from bientropy import cbientropy
+    import bientropy
+    NO_CEXT = ''
+except ImportError as e:
+    # Allow some tests to be skipped
+    NO_CEXT = 'C extension not available'
+
+
+@skipIf(NO_CEXT, NO_CEXT)
+class MetricTests(TestCase):
+    'Test prepared metrics'
+
+    def test_metric_vs_gmp(self):
+        '''
+        Check that prepared metrics match the GMP engine for lengths with and
+        without the table of entropies, for binary strings and bitstrings.
+        '''
+        for bits in [2, 7, 32, 64, 65, 256, 511, 512, 513, 2000]:
+            ti = os.urandom((bits + 7)//8)
+            rand_s = Bits(bytes=ti)[:bits]
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                bien = cbientropy.Metric('bien', bits)
+                ref_bien = cbientropy.bien(rand_s)
+            tbien = cbientropy.Metric(kind='tbien', bits=bits)
+            ref_tbien = cbientropy.tbien(rand_s)
+            with self.subTest(bits=bits):
+                self.assertAlmostEqual(bien(ti), ref_bien, places=12)
+                self.assertAlmostEqual(tbien(ti), ref_tbien, places=12)
+                self.assertAlmostEqual(tbien(rand_s), ref_tbien, places=12)
+                self.assertAlmostEqual(tbien(bytearray(ti)), ref_tbien,
+                                       places=12)
+
+
+    def test_batch(self):
+        'Check that batches match the batch functions'
+        for bits in [12, 64, 100]:
+            arr = np.frombuffer(os.urandom(70*((bits + 7)//8)),
+                                dtype=np.uint8).reshape(70, -1)
+            ref = cbientropy.tbien_batch(arr, bits=bits)
+            metric = cbientropy.Metric('tbien', bits)
+            with self.subTest(bits=bits):
+                np.testing.assert_allclose(metric.batch(arr), ref,
+                                           rtol=0, atol=1e-12)
+                np.testing.assert_allclose(metric.batch(arr.tobytes()), ref,
+                                           rtol=0, atol=1e-12)
+                np.testing.assert_allclose(
+                    metric.batch([bytes(rec) for rec in arr]), ref,
+                    rtol=0, atol=1e-12)
+        # rows may be longer than the records
+        wide = np.zeros((3, 8), dtype=np.uint8)
+        wide[:, 0] = [0x00, 0x5a, 0xff]
+        np.testing.assert_allclose(
+            cbientropy.Metric('tbien', 8).batch(wide),
+            [cbientropy.tbien(bytes(bytearray([b]))) for b in [0, 0x5a, 0xff]],
+            rtol=0, atol=1e-12)
+        self.assertEqual(len(cbientropy.Metric('tbien', 8).batch([])), 0)
+
+
+    def test_weights(self):
+        '''
+        Check uniform and custom weightings against weighted averages of the
+        entropies from the Python implementation, with and without the
+        table of entropies.
+        '''
+        for bits in [9, 64, 520]:
+            rand_s = Bits(bytes=os.urandom((bits + 7)//8))[:bits]
+            entropies = []
+            deriv = rand_s
+            for k in range(bits - 1):
+                p = float(deriv.count(1))/len(deriv)
+                entropies.append(
+                    -sum(q*np.log2(q) for q in [p, 1 - p] if q > 0))
+                deriv = pybientropy.bin_deriv(deriv)
+            weights = np.random.rand(bits - 1)
+            weights[:bits//2] = 0
+            for kind, ref in [
+                    ('uniform', np.mean(entropies)),
+                    (weights, np.dot(weights, entropies)/weights.sum()),
+                    (list(weights), np.dot(weights, entropies)/weights.sum())]:
+                with self.subTest(bits=bits, kind=type(kind)):
+                    metric = cbientropy.Metric(kind, bits)
+                    self.assertAlmostEqual(metric(rand_s), ref, places=12)
+                    self.assertAlmostEqual(
+                        metric.batch([rand_s.tobytes()]*3)[2], ref,
+                        places=12)
+        metric = cbientropy.Metric(np.log2(np.arange(2, 65)), 64)
+        self.assertEqual(metric.kind, 'custom')
+        data = os.urandom(8*100)
+        np.testing.assert_allclose(metric.batch(data),
+                                   cbientropy.tbien_batch(data, 8), atol=1e-12)
+        np.testing.assert_allclose(metric.weights,
+                                   cbientropy.Metric('tbien', 64).weights,
+                                   rtol=1e-12)
+
+
+    def test_ragged(self):
+        '''
+        Check that ragged batches with a weighting for each length match the
+        Metric of each length, for records split across threads too
+        '''
+        def weights(nbits):
+            # the top half of the levels
+            w = np.ones(nbits - 1)
+            w[:nbits//2] = 0
+            return w
+        sizes = [1, 8, 65, 8, 1, 4100, 65]
+        data = os.urandom(sum(sizes))
+        offsets = np.cumsum([0] + sizes)
+        ref = [cbientropy.Metric(weights(n*8), n*8)(data[a:b])
+               for a, b, n in zip(offsets[:-1], offsets[1:], sizes)]
+        calls = []
+        def logged(nbits):
+            calls.append(nbits)
+            return weights(nbits)
+        for fun in [cbientropy.tbien_ragged, bientropy.bien_ragged]:
+            for threads in [1, 4]:
+                with self.subTest(fun=fun, threads=threads):
+                    del calls[:]
+                    np.testing.assert_allclose(
+                        fun(data, offsets, threads=threads, weights=logged),
+                        ref, rtol=0, atol=1e-12)
+                    self.assertEqual(calls, sorted(set(calls)))
+                    self.assertEqual(len(calls), 4)
+        # the built-in kinds are the ragged functions of that metric
+        bit_lengths = np.array(sizes)*8 - 3
+        np.testing.assert_allclose(
+            cbientropy.bien_ragged(data, offsets, bit_lengths,
+                                   weights=lambda n: 'tbien'),
+            cbientropy.tbien_ragged(data, offsets, bit_lengths), rtol=0,
+            atol=1e-12)
+        with self.assertRaises(TypeError):
+            cbientropy.tbien_ragged(data, offsets, weights='uniform')
+        with self.assertRaises(ValueError):
+            cbientropy.tbien_ragged(data, offsets, weights=lambda n: [1.0])
+        with self.assertRaises(ZeroDivisionError):
+            cbientropy.tbien_ragged(data, offsets, weights=lambda n: 1/0)
+
+
+    def test_attributes(self):
+        'Check the attributes and representation of metrics'
+        metric = cbientropy.Metric(kind='tbien', bits=256)
+        self.assertEqual(metric.kind, 'tbien')
+        self.assertEqual(metric.bits, 256)
+        self.assertEqual(repr(metric), "Metric(kind='tbien', bits=256)")
+
+
+    def test_errors(self):
+        'Check that bad metrics and inputs are rejected'
+        with self.assertRaises(ValueError):
+            cbientropy.Metric('entropy', 8)
+        with self.assertRaises(ValueError):
+            cbientropy.Metric('tbien', 1)
+        with self.assertWarns(Warning):
+            cbientropy.Metric('bien', 33)
+        with self.assertRaises(ValueError):
+            cbientropy.Metric([1.0]*6, 8)
+        with self.assertRaises(ValueError):
+            cbientropy.Metric([1.0]*6 + [-1.0], 8)
+        with self.assertRaises(ValueError):
+            cbientropy.Metric([1.0]*6 + [float('inf')], 8)
+        with self.assertRaises(ValueError):
+            cbientropy.Metric([0.0]*7, 8)
+        with self.assertRaises(TypeError):
+            cbientropy.Metric(['a']*7, 8)
+        with self.assertRaises(TypeError):
+            cbientropy.Metric(2, 8)
+        metric = cbientropy.Metric('tbien', 12)
+        with self.assertRaises(ValueError):
+            metric(b'\x00')
+        with self.assertRaises(ValueError):
+            metric(b'\x00\x00\x00')
+        with self.assertRaises(ValueError):
+            metric(Bits('0x000'*2))
+        with self.assertRaises(TypeError):
+            metric(u'text')
+        with self.assertRaises(TypeError):
+            metric(b'\x00\x00', b'\x00\x00')
+        with self.assertRaises(TypeError):
+            metric(bits=b'\x00\x00')
+        with self.assertRaises(ValueError):
+            metric.batch(b'\x00'*3)
+        with self.assertRaises(ValueError):
+            metric.batch([b'\x00\x00', b'\x00'])
+
+
+if __name__ == '__main__':
+    main()
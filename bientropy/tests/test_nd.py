@@ -0,0 +1,155 @@
+'''
+NOTICE
+
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+This file tests the scores of vectors along the axes of N-dimensional arrays
+against the batch functions on copies made with NumPy.
+'''
+from __future__ import print_function
+import sys
+import warnings
+
+if sys.version_info.major > 2:
+    from unittest import TestCase, main, skipIf
+else:
+    from unittest2 import TestCase, main, skipIf
+
+import numpy as np
+try:
+    from bientropy import cbientropy
+    from bientropy import nd
+    NO_CEXT = ''
+except ImportError as e:
+    # Allow some tests to be skipped
+    NO_CEXT = 'C extension not available'
+
+
+def reference(metric, bits, axis):
+    'Score the vectors of a bool array along an axis by copying them'
+    moved = np.moveaxis(bits, axis, -1)
+    rows = np.ascontiguousarray(
+        np.packbits(moved.reshape(-1, moved.shape[-1]), axis=1))
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        scores = getattr(cbientropy, metric + '_batch')(
+            rows, bits=moved.shape[-1])
+    return scores.reshape(moved.shape[:-1])
+
+
+@skipIf(NO_CEXT, NO_CEXT)
+class NDTests(TestCase):
+    'Test the scores of vectors along axes'
+
+    def test_bool(self):
+        'Check rows, columns and other axes of bool arrays'
+        rng = np.random.RandomState(1)
+        for shape in [(40,), (13, 70), (5, 6, 33), (3, 4, 5, 6)]:
+            bits = rng.rand(*shape) < 0.5
+            for axis in range(-1, len(shape)):
+                for metric in ['bien', 'tbien']:
+                    with self.subTest(shape=shape, axis=axis, metric=metric):
+                        with warnings.catch_warnings():
+                            warnings.simplefilter('ignore')
+                            scores = getattr(nd, metric)(bits, axis=axis)
+                        ref = reference(metric, bits, axis)
+                        self.assertEqual(np.shape(scores), ref.shape)
+                        np.testing.assert_allclose(scores, ref, rtol=0,
+                                                   atol=1e-12)
+
+
+    def test_strided(self):
+        'Check views with steps, negative strides and transposes'
+        bits = np.random.RandomState(2).rand(60, 90) < 0.5
+        for view in [bits[::3, 5:80:2], bits[::-1, ::-2], bits.T,
+                     np.broadcast_to(bits[0], (4, 90))]:
+            for axis in [0, 1]:
+                with self.subTest(shape=view.shape, axis=axis):
+                    np.testing.assert_allclose(
+                        nd.tbien(view, axis=axis),
+                        reference('tbien', np.array(view), axis),
+                        rtol=0, atol=1e-12)
+
+
+    def test_bitplanes(self):
+        'Check bit-planes and whole elements of integer arrays'
+        rng = np.random.RandomState(3)
+        for dtype in [np.uint8, np.int8, np.uint16, np.int32, np.uint64]:
+            info = np.iinfo(dtype)
+            arr = rng.randint(0, 256, (9, 17, 24)).astype(np.uint8) \
+                .view(dtype)
+            nplanes = 8*arr.dtype.itemsize
+            for axis in [0, 1, 2]:
+                with self.subTest(dtype=info.dtype.name, axis=axis):
+                    planes = nd.tbien(arr, axis=axis, bitplane='all')
+                    unsigned = arr.view('u%d' % arr.dtype.itemsize)
+                    for k in [0, 1, nplanes - 1]:
+                        plane = (unsigned >> k) & 1 == 1
+                        ref = reference('tbien', plane, axis)
+                        np.testing.assert_allclose(
+                            nd.tbien(arr, axis=axis, bitplane=k), ref,
+                            rtol=0, atol=1e-12)
+                        np.testing.assert_allclose(planes[..., k], ref,
+                                                   rtol=0, atol=1e-12)
+                    # all the bits of each element, from the most
+                    # significant
+                    big = np.ascontiguousarray(np.moveaxis(arr, axis, -1),
+                                               arr.dtype.newbyteorder('>'))
+                    ref = cbientropy.tbien_batch(big.view(np.uint8).reshape(
+                        -1, big.shape[-1]*arr.dtype.itemsize))
+                    np.testing.assert_allclose(
+                        nd.tbien(arr, axis=axis),
+                        ref.reshape(big.shape[:-1]), rtol=0, atol=1e-12)
+
+
+    def test_threads(self):
+        'Check that the results do not depend on the number of threads'
+        bits = np.random.RandomState(4).rand(37, 200) < 0.5
+        ref = nd.tbien(bits, axis=0, threads=1)
+        for threads in [2, 3, 64]:
+            with self.subTest(threads=threads):
+                np.testing.assert_array_equal(
+                    nd.tbien(bits, axis=0, threads=threads), ref)
+
+
+    def test_errors(self):
+        'Check that invalid arrays and arguments are rejected'
+        bits = np.zeros((4, 16), dtype=bool)
+        with self.assertRaises(ValueError):
+            nd.tbien(bits, axis=2)
+        with self.assertRaises(ValueError):
+            nd.tbien(bits, bitplane=1)
+        with self.assertRaises(ValueError):
+            nd.tbien(bits[:, :1])
+        with self.assertRaises(ValueError):
+            nd.tbien(np.zeros(4, dtype=np.uint16), bitplane=16)
+        with self.assertRaises(ValueError):
+            nd.tbien(np.zeros(4, dtype='>u2' if sys.byteorder == 'little'
+                              else '<u2'))
+        with self.assertRaises(TypeError):
+            nd.tbien(np.zeros((4, 4)))
+        with self.assertRaises(TypeError):
+            cbientropy.tbien_nd(bits, threads=0.5)
+        self.assertEqual(nd.tbien(np.zeros((0, 16), dtype=bool)).shape,
+                         (0,))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+'''
+NOTICE
+
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+This file tests the pairwise functions against XORing the records in NumPy.
+'''
+from __future__ import print_function
+import os
+import sys
+import warnings
+
+if sys.version_info.major > 2:
+    from unittest import TestCase, main, skipIf
+else:
+    from unittest2 import TestCase, main, skipIf
+
+try:
+    import numpy as np
+    from bientropy import cbientropy
+    NO_CEXT = ''
+except ImportError as e:
+    # Allow some tests to be skipped
+    NO_CEXT = 'C extension not available'
+
+
+def xor_scores(batch, arr, bits):
+    'The scores of the pairs of rows of arr, XORed in NumPy and batched'
+    n = len(arr)
+    i, j = np.triu_indices(n, 1)
+    out = np.zeros((n, n))
+    out[i, j] = out[j, i] = batch(np.ascontiguousarray(arr[i] ^ arr[j]),
+                                  bits=bits)
+    return out
+
+
+@skipIf(NO_CEXT, NO_CEXT)
+class PairwiseTests(TestCase):
+    'Test the pairwise functions'
+
+    def test_matrix(self):
+        '''
+        Check the full and condensed results for record lengths around the
+        word boundaries and for numbers of records that span several tiles.
+        '''
+        for n_rec, n_bytes in [(5, 1), (40, 8), (30, 9), (300, 16), (40, 220), (7, 100)]:
+            arr = np.frombuffer(os.urandom(n_rec*n_bytes),
+                                dtype=np.uint8).reshape(n_rec, n_bytes)
+            for bits in set([n_bytes*8, n_bytes*8 - 3]):
+                ref = xor_scores(cbientropy.tbien_batch, arr, bits)
+                for threads in [1, 3]:
+                    with self.subTest(n_rec=n_rec, n_bytes=n_bytes,
+                                      bits=bits, threads=threads):
+                        np.testing.assert_allclose(
+                            cbientropy.tbien_pairwise(arr, bits,
+                                                      threads=threads),
+                            ref, atol=1e-12)
+                        np.testing.assert_allclose(
+                            cbientropy.tbien_pairwise(arr, bits,
+                                                      condensed=True,
+                                                      threads=threads),
+                            ref[np.triu_indices(n_rec, 1)], atol=1e-12)
+
+
+    def test_bien(self):
+        'Check BiEn of pairs of short records'
+        arr = np.frombuffer(os.urandom(20*4),
+                            dtype=np.uint8).reshape(20, 4)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            np.testing.assert_allclose(
+                cbientropy.bien_pairwise(arr, 20),
+                xor_scores(cbientropy.bien_batch, arr, 20), atol=1e-12)
+
+
+    def test_edges(self):
+        'Check tiny inputs and the rejection of invalid ones'
+        arr = np.zeros((1, 4), dtype=np.uint8)
+        self.assertEqual(cbientropy.tbien_pairwise(arr).shape, (1, 1))
+        self.assertEqual(
+            cbientropy.tbien_pairwise(arr, condensed=True).shape, (0,))
+        self.assertEqual(
+            cbientropy.tbien_pairwise(np.zeros((0, 4), dtype=np.uint8)).shape,
+            (0, 0))
+        with self.assertRaises(ValueError):
+            cbientropy.tbien_pairwise(b'\x00'*8)
+        with self.assertRaises(ValueError):
+            cbientropy.tbien_pairwise(arr, bits=33)
+        with self.assertRaises(ValueError):
+            cbientropy.tbien_pairwise(arr, bits=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+'''
+NOTICE
+
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+This file tests the multi-scale pyramid against scoring each scale with the
+batch functions.
+'''
+from __future__ import print_function
+import mmap
+import os
+import sys
+import tempfile
+import warnings
+
+if sys.version_info.major > 2:
+    from unittest import TestCase, main, skipIf
+else:
+    from unittest2 import TestCase, main, skipIf
+
+import numpy as np
+try:
+    from bientropy import cbientropy
+    import bientropy
+    NO_CEXT = ''
+except ImportError as e:
+    # Allow some tests to be skipped
+    NO_CEXT = 'C extension not available'
+
+
+def reference(data, size, metric='tbien'):
+    'The scores of the whole blocks of one size, from the batch functions'
+    n = len(data)//size
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return getattr(cbientropy, metric + '_batch')(data[:n*size], size)
+
+
+@skipIf(NO_CEXT, NO_CEXT)
+class PyramidTests(TestCase):
+    'Test the multi-scale pyramid'
+
+    def test_scales(self):
+        'Check every scale of several pyramids against the batch functions'
+        rng = np.random.RandomState(5)
+        data = rng.randint(0, 256, 4096*3 + 1000).astype(np.uint8)
+        # some structure, so that the levels are not all near one half
+        data[:2048] &= 0x0f
+        data[5000:6000] = 0
+        data = data.tobytes()
+        for sizes in [[64, 512, 4096], [4096, 64, 512], [1, 2, 8, 24],
+                      [3], [100, 1000], [7, 700]]:
+            for metric in ['bien', 'tbien']:
+                with self.subTest(sizes=sizes, metric=metric):
+                    with warnings.catch_warnings():
+                        warnings.simplefilter('ignore')
+                        result = bientropy.pyramid(data, sizes, metric)
+                    self.assertEqual(len(result), len(sizes))
+                    for size, scores in zip(sizes, result):
+                        np.testing.assert_allclose(
+                            scores, reference(data, size, metric),
+                            rtol=0, atol=1e-12)
+
+
+    def test_threads(self):
+        'Check that the result does not depend on the number of threads'
+        data = os.urandom(512*37 + 100)
+        ref = cbientropy.pyramid(data, [16, 128, 512], threads=1)
+        for threads in [2, 3, 8, 64]:
+            with self.subTest(threads=threads):
+                result = cbientropy.pyramid(data, [16, 128, 512],
+                                            threads=threads)
+                for a, b in zip(result, ref):
+                    np.testing.assert_array_equal(a, b)
+
+
+    def test_inputs(self):
+        'Check memory-mapped files, arrays and short buffers'
+        data = os.urandom(8192)
+        ref = cbientropy.pyramid(data, [64, 1024])
+        with tempfile.TemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            data_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                result = cbientropy.pyramid(data_map, [64, 1024])
+            finally:
+                data_map.close()
+        for a, b in zip(result, ref):
+            np.testing.assert_array_equal(a, b)
+        result = cbientropy.pyramid(np.frombuffer(data, np.uint8),
+                                    (64, 1024))
+        for a, b in zip(result, ref):
+            np.testing.assert_array_equal(a, b)
+        # shorter than the largest block
+        small, large = cbientropy.pyramid(data[:1000], [64, 1024])
+        self.assertEqual((len(small), len(large)), (15, 0))
+        small, large = cbientropy.pyramid(b'', [64, 1024])
+        self.assertEqual((len(small), len(large)), (0, 0))
+
+
+    def test_errors(self):
+        'Check that invalid arguments are rejected'
+        for sizes in [[], [0], [64, 100], [64, 64], list(range(1, 40))]:
+            with self.subTest(sizes=sizes):
+                with self.assertRaises(ValueError):
+                    cbientropy.pyramid(b'\x00'*1000, sizes)
+        with self.assertRaises(TypeError):
+            cbientropy.pyramid(b'\x00'*1000, 64)
+        with self.assertRaises(ValueError):
+            cbientropy.pyramid(b'\x00'*1000, [64], 'xyz')
+
+
+if __name__ == '__main__':
+    main()
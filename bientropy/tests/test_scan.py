@@ -0,0 +1,117 @@
+'''
+NOTICE
+
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+This file tests the single-pass scanner of randomness statistics.
+'''
+from __future__ import print_function
+import math
+import os
+import sys
+import warnings
+
+if sys.version_info.major > 2:
+    from unittest import TestCase, main, skipIf
+else:
+    from unittest2 import TestCase, main, skipIf
+
+from bitstring import Bits
+try:
+    from bientropy import cbientropy, scan_metrics
+    NO_CEXT = ''
+except ImportError as e:
+    # Allow some tests to be skipped
+    NO_CEXT = 'C extension not available'
+
+
+def byte_stats(block):
+    'The Shannon entropy and chi-square statistic of the bytes of a block'
+    counts = [0]*256
+    for byte in bytearray(block):
+        counts[byte] += 1
+    expected = len(block)/256.0
+    entropy = -sum(c/float(len(block))*math.log(c/float(len(block)), 2)
+                   for c in counts if c)
+    chi2 = sum((c - expected)**2/expected for c in counts)
+    return entropy, chi2
+
+
+@skipIf(NO_CEXT, NO_CEXT)
+class ScanTests(TestCase):
+    'Test the scanner'
+
+    def test_scan_vs_reference(self):
+        '''
+        Check every statistic of every block, including a short last block,
+        against separate computations.
+        '''
+        data = os.urandom(300) + b'\x00'*40 + b'\x55'*40 + b'\x0f'
+        for block_bytes in [1, 40, 64]:
+            for threads in [1, 3]:
+                result = scan_metrics(data, block_bytes, threads=threads)
+                blocks = [data[i:i + block_bytes]
+                          for i in range(0, len(data), block_bytes)]
+                self.assertEqual(len(result), len(blocks))
+                for rec, block in zip(result, blocks):
+                    with self.subTest(block_bytes=block_bytes,
+                                      threads=threads, block=block):
+                        bits = Bits(bytes=block)
+                        with warnings.catch_warnings():
+                            warnings.simplefilter('ignore')
+                            self.assertAlmostEqual(
+                                rec['bien'], cbientropy.bien(block),
+                                places=12)
+                        self.assertAlmostEqual(
+                            rec['tbien'], cbientropy.tbien(block), places=12)
+                        self.assertEqual(
+                            rec['monobit'],
+                            bits.count(1)/float(len(bits)) - 0.5)
+                        self.assertEqual(
+                            rec['runs'],
+                            1 + sum(bits[i] != bits[i + 1]
+                                    for i in range(len(bits) - 1)))
+                        entropy, chi2 = byte_stats(block)
+                        self.assertAlmostEqual(rec['entropy'], entropy,
+                                               places=12)
+                        self.assertAlmostEqual(rec['chi2'], chi2, places=9)
+
+
+    def test_empty(self):
+        'Check that empty data gives no blocks'
+        result = scan_metrics(b'', 16)
+        self.assertEqual(len(result), 0)
+        self.assertEqual(result.dtype.names,
+                         ('bien', 'tbien', 'entropy', 'monobit', 'runs',
+                          'chi2'))
+
+
+    def test_errors(self):
+        'Check that bad arguments are rejected'
+        with self.assertRaises(ValueError):
+            scan_metrics(b'\x00', 0)
+        with self.assertRaises(ValueError):
+            scan_metrics(b'\x00', 1, threads=0)
+        with self.assertRaises(TypeError):
+            scan_metrics(u'text', 1)
+
+
+if __name__ == '__main__':
+    main()
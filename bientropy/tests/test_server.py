@@ -0,0 +1,221 @@
+'''
+NOTICE
+
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+This file tests the scoring daemon and its client against the scalar
+functions.
+'''
+from __future__ import print_function
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import warnings
+
+if sys.version_info.major > 2:
+    from unittest import TestCase, main, skipIf
+else:
+    from unittest2 import TestCase, main, skipIf
+
+import numpy as np
+from bitstring import Bits
+try:
+    from bientropy import cbientropy
+    from bientropy.server import Server, REQUEST, OP_SCORE
+    from bientropy.client import Client, load_test
+    NO_CEXT = ''
+except ImportError as e:
+    # Allow some tests to be skipped
+    NO_CEXT = 'C extension not available'
+
+
+@skipIf(NO_CEXT, NO_CEXT)
+class ServerTests(TestCase):
+    'Test the scoring daemon'
+
+    def setUp(self):
+        # the server scores BiEn of long strings in its own thread, so the
+        # filter is set for as long as it runs
+        self.warnings = warnings.catch_warnings()
+        self.warnings.__enter__()
+        warnings.filterwarnings('ignore', 'The BiEn algorithm is not suitable')
+        self.server = Server(('127.0.0.1', 0), max_delay=0.01)
+        self.server.start()
+
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.warnings.__exit__(None, None, None)
+
+
+    def reference(self, bits, metric):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            return getattr(cbientropy, metric)(bits)
+
+
+    def test_score(self):
+        'Check single requests of several lengths and both metrics'
+        with Client(self.server.address) as client:
+            for nbits in [2, 7, 8, 64, 100, 1001]:
+                bits = Bits(bytes=os.urandom((nbits + 7)//8))[:nbits]
+                for metric in ['bien', 'tbien']:
+                    with self.subTest(nbits=nbits, metric=metric):
+                        self.assertAlmostEqual(
+                            client.score(bits, metric),
+                            self.reference(bits, metric), places=12)
+            bits = np.random.RandomState(1).rand(50) < 0.5
+            self.assertAlmostEqual(
+                client.score(bits),
+                self.reference(Bits(bytes=np.packbits(bits).tobytes())[:50],
+                               'tbien'), places=12)
+
+
+    def test_pipelined(self):
+        'Check that pipelined requests are batched and matched to their ids'
+        rng = np.random.RandomState(2)
+        strings = [Bits(bytes=os.urandom(32))[:int(n)]
+                   for n in rng.randint(2, 257, 500)]
+        with Client(self.server.address) as client:
+            for metric in ['bien', 'tbien']:
+                with self.subTest(metric=metric):
+                    scores = client.score_many(strings, metric)
+                    np.testing.assert_allclose(
+                        scores, [self.reference(s, metric) for s in strings],
+                        rtol=0, atol=1e-12)
+            stats = client.stats()
+        self.assertEqual(stats['requests'], 1000)
+        self.assertEqual(stats['errors'], 0)
+        self.assertLess(stats['batches'], 1000)
+        self.assertGreater(stats['mean_batch'], 1.0)
+        self.assertGreaterEqual(stats['latency_p99_ms'],
+                                stats['latency_p50_ms'])
+
+
+    def test_clients(self):
+        'Check concurrent clients with the load generator'
+        result = load_test(self.server.address, clients=3, requests=200,
+                           bits=128, pipeline=16)
+        self.assertEqual(result['requests'], 600)
+        self.assertGreater(result['throughput'], 0)
+        self.assertGreaterEqual(result['latency_p99_ms'],
+                                result['latency_p50_ms'])
+        self.assertEqual(result['server']['requests'], 600)
+
+
+    def test_stalled_client(self):
+        '''
+        Check that a client that never reads its responses neither holds up
+        other clients nor fills the queue of the server
+        '''
+        self.server.shutdown()
+        self.server = Server(('127.0.0.1', 0), max_delay=0.001,
+                             max_pending=64)
+        self.server.start()
+        flood = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        flood.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        flood.connect(self.server.address)
+        request = REQUEST.pack(OP_SCORE, 1, 0, 0, 64) + b'\x0f'*8
+        flood.settimeout(0.5)
+        try:
+            # until the server stops reading and the buffers fill
+            for _ in range(10**6):
+                flood.sendall(request*256)
+        except socket.timeout:
+            pass
+        try:
+            with Client(self.server.address, timeout=5) as client:
+                for _ in range(3):
+                    self.assertAlmostEqual(client.score(b'\x0f\x33'),
+                                           cbientropy.tbien(b'\x0f\x33'),
+                                           places=12)
+                    stats = client.stats()
+                    self.assertLessEqual(stats['queue_depth'], 64)
+                    self.assertLessEqual(stats['max_queue_depth'], 66)
+        finally:
+            flood.close()
+
+
+    def test_errors(self):
+        'Check that invalid requests are refused without closing the client'
+        with Client(self.server.address) as client:
+            with self.assertRaises(ValueError):
+                client.score(Bits(bin='1'))
+            with self.assertRaises(ValueError):
+                client.score(b'\x00', 'xyz')
+            with self.assertRaises(ValueError):
+                client.score_many([b'\x0f', Bits(bin='0'), b'\xf0'])
+            self.assertAlmostEqual(client.score(b'\x0f'),
+                                   cbientropy.tbien(b'\x0f'), places=12)
+            self.assertEqual(client.stats()['errors'], 2)
+
+
+@skipIf(NO_CEXT or not hasattr(socket, 'AF_UNIX'),
+        NO_CEXT or 'Unix domain sockets not available')
+class UnixServerTests(TestCase):
+    'Test the scoring daemon on a Unix domain socket'
+
+    def test_unix(self):
+        'Check scoring over a Unix domain socket and its removal'
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'bientropy.sock')
+            with Server(path):
+                with Client(path) as client:
+                    self.assertAlmostEqual(client.score(b'\x0f\x33'),
+                                           cbientropy.tbien(b'\x0f\x33'),
+                                           places=12)
+            self.assertFalse(os.path.exists(path))
+        finally:
+            shutil.rmtree(directory)
+
+
+    def test_existing_path(self):
+        '''
+        Check that a stale socket file is replaced, but not a live socket or
+        another file
+        '''
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'bientropy.sock')
+            stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            stale.bind(path)
+            stale.close()
+            with Server(path):
+                with self.assertRaises(socket.error):
+                    Server(path)
+                with Client(path) as client:
+                    self.assertAlmostEqual(client.score(b'\x0f\x33'),
+                                           cbientropy.tbien(b'\x0f\x33'),
+                                           places=12)
+            with open(path, 'w') as f:
+                f.write('data')
+            with self.assertRaises(socket.error):
+                Server(path)
+            with open(path) as f:
+                self.assertEqual(f.read(), 'data')
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
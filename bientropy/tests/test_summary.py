@@ -0,0 +1,238 @@
+'''
+NOTICE
+
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+This file tests streaming summaries of scores against NumPy.
+'''
+from __future__ import print_function
+import math
+import os
+import pickle
+import sys
+
+if sys.version_info.major > 2:
+    from unittest import TestCase, main, skipIf
+else:
+    from unittest2 import TestCase, main, skipIf
+
+import numpy as np
+try:
+    from bientropy import cbientropy
+    import bientropy
+    NO_CEXT = ''
+except ImportError as e:
+    # Allow some tests to be skipped
+    NO_CEXT = 'C extension not available'
+
+
+@skipIf(NO_CEXT, NO_CEXT)
+class SummaryTests(TestCase):
+    'Test streaming summaries'
+
+    def assertSameSummary(self, a, b):
+        'Check that two summaries agree, exactly where merging is exact'
+        self.assertEqual(a.count, b.count)
+        self.assertEqual(a.min, b.min)
+        self.assertEqual(a.max, b.max)
+        self.assertEqual(a.outside, b.outside)
+        np.testing.assert_array_equal(a.histogram()[0], b.histogram()[0])
+        self.assertAlmostEqual(a.mean, b.mean, places=12)
+        self.assertAlmostEqual(a.variance, b.variance, places=12)
+
+
+    def test_moments(self):
+        'Check the moments and extremes against NumPy'
+        rng = np.random.RandomState(1)
+        values = rng.beta(8, 2, 10000)
+        s = cbientropy.Summary()
+        s.add(values)
+        self.assertEqual(s.count, len(values))
+        self.assertAlmostEqual(s.mean, values.mean(), places=12)
+        self.assertAlmostEqual(s.variance, values.var(), places=12)
+        self.assertAlmostEqual(s.std, values.std(), places=12)
+        self.assertEqual(s.min, values.min())
+        self.assertEqual(s.max, values.max())
+        self.assertEqual(s.outside, (0, 0))
+
+
+    def test_add(self):
+        'Check that numbers, strided arrays and sequences are added alike'
+        values = np.random.RandomState(2).rand(101)
+        ref = cbientropy.Summary()
+        ref.add(values[::-3])
+        for obj in [values[::-3].copy(), list(values[::-3]),
+                    memoryview(values[::-3].copy())]:
+            s = cbientropy.Summary()
+            s.add(obj)
+            self.assertSameSummary(s, ref)
+        s = cbientropy.Summary()
+        for x in values[::-3]:
+            s.add(float(x))
+        self.assertSameSummary(s, ref)
+        # other dtypes are converted one value at a time
+        s = cbientropy.Summary()
+        s.add(values[::-3].astype(np.float32))
+        self.assertEqual(s.count, ref.count)
+        # NaNs are ignored
+        s.add(float('nan'))
+        self.assertEqual(s.count, ref.count)
+
+
+    def test_histogram(self):
+        'Check the histogram and the values outside of its range'
+        values = np.random.RandomState(3).rand(5000)*1.2 - 0.1
+        s = cbientropy.Summary(bins=50)
+        s.add(values)
+        counts, edges = s.histogram()
+        ref_counts, ref_edges = np.histogram(values, 50, (0.0, 1.0))
+        np.testing.assert_allclose(edges, ref_edges)
+        np.testing.assert_array_equal(counts, ref_counts)
+        self.assertEqual(s.outside, ((values < 0).sum(), (values > 1).sum()))
+
+
+    def test_quantiles(self):
+        'Check the estimates of quantiles and fractions against NumPy'
+        values = np.random.RandomState(4).beta(2, 5, 20000)
+        s = cbientropy.Summary(bins=200)
+        s.add(values)
+        for q in [0.0, 0.01, 0.25, 0.5, 0.9, 0.999, 1.0]:
+            with self.subTest(q=q):
+                self.assertLessEqual(
+                    abs(s.quantile(q) - np.quantile(values, q)), 1.0/200)
+        for x in [0.0, 0.1, 0.3, 0.5, 1.0]:
+            with self.subTest(x=x):
+                self.assertAlmostEqual(s.fraction_below(x),
+                                       (values < x).mean(), places=12)
+        self.assertEqual(s.quantile(0.0), values.min())
+        self.assertEqual(s.quantile(1.0), values.max())
+        self.assertTrue(math.isnan(cbientropy.Summary().quantile(0.5)))
+
+
+    def test_merge(self):
+        'Check that merged summaries match one summary of every value'
+        values = np.random.RandomState(5).rand(9999)
+        ref = cbientropy.Summary(bins=100)
+        ref.add(values)
+        merged = cbientropy.Summary(bins=100)
+        for part in np.array_split(values, 7):
+            s = cbientropy.Summary(bins=100)
+            s.add(part)
+            merged.merge(s)
+        merged.merge(cbientropy.Summary(bins=100))
+        self.assertSameSummary(merged, ref)
+        # a summary merged with itself counts every value twice
+        ref.add(values)
+        merged.merge(merged)
+        self.assertSameSummary(merged, ref)
+
+
+    def test_pickle(self):
+        'Check that summaries survive pickling, as from worker processes'
+        s = cbientropy.Summary(bins=30, lo=-1.0, hi=2.0)
+        s.add(np.random.RandomState(6).randn(1000))
+        t = pickle.loads(pickle.dumps(s))
+        self.assertSameSummary(s, t)
+        self.assertEqual(t.mean, s.mean)
+        self.assertEqual(t.variance, s.variance)
+        self.assertIn('bins=30', repr(t))
+        # an infinite value leaves the sum of squares NaN
+        s.add(float('inf'))
+        self.assertEqual(pickle.loads(pickle.dumps(s)).outside, s.outside)
+
+
+    def test_setstate(self):
+        'Check that inconsistent states are rejected, leaving the summary'
+        s = cbientropy.Summary(bins=4)
+        s.add([0.1, 0.3, 0.6, 0.9, 1.5])
+        state = s.__reduce__()[2]
+        for bad in [(4, 0.5, 0.1, 0.1, 0.9, 0, 0, [9, 'x', 0, 0]),
+                    (4, 0.5, 0.1, 0.1, 0.9, 0, 0, [1, 1, 1]),
+                    (-1, 0.5, 0.1, 0.1, 0.9, 0, 0, [0, 0, 0, 0]),
+                    (4, 0.5, 0.1, 0.1, 0.9, 0, 0, [2, 2, 2, -2]),
+                    (4, 0.5, -0.1, 0.1, 0.9, 0, 0, [1, 1, 1, 1]),
+                    (4, 0.5, 0.1, 0.9, 0.1, 0, 0, [1, 1, 1, 1]),
+                    (4, 0.5, 0.1, 0.1, 0.9, 1, 0, [1, 1, 1, 1]),
+                    (4, 0.5, 0.1, 0.1, 0.9, -1, 1, [1, 1, 1, 1]),
+                    (4, 0.5, 0.1, 0.1, 0.9, 0, 0, [0, 0, 0, 0]),
+                    (2**62, 0.5, 0.1, 0.1, 0.9, 0, 0, [2**62, 2**62, 0, 0])]:
+            with self.subTest(state=bad):
+                with self.assertRaises((TypeError, ValueError)):
+                    s.__setstate__(bad)
+                self.assertEqual(s.__reduce__()[2], state)
+        s.__setstate__((4, 0.5, 0.1, 0.1, 0.9, 0, 0, [1, 1, 1, 1]))
+        self.assertEqual(s.count, 4)
+        self.assertEqual(s.outside, (0, 0))
+
+
+    def test_feeds(self):
+        'Check that the batch, ragged and scan functions add their results'
+        data = os.urandom(64*100)
+        for fun in [cbientropy.tbien_batch, bientropy.tbien_batch]:
+            with self.subTest(fun=fun):
+                s = cbientropy.Summary()
+                scores = fun(data, 64, summary=s)
+                ref = cbientropy.Summary()
+                ref.add(scores)
+                self.assertSameSummary(s, ref)
+        offsets = np.arange(0, len(data) + 1, 100)
+        for fun in [cbientropy.tbien_ragged, bientropy.tbien_ragged]:
+            with self.subTest(fun=fun):
+                s = cbientropy.Summary()
+                scores = fun(data, offsets, summary=s)
+                ref = cbientropy.Summary()
+                ref.add(scores)
+                self.assertSameSummary(s, ref)
+        summaries = {'tbien': cbientropy.Summary(),
+                     'runs': cbientropy.Summary(bins=10, hi=1000.0)}
+        results = cbientropy.scan_metrics(data, 256, summaries=summaries)
+        for name, ref in [('tbien', cbientropy.Summary()),
+                          ('runs', cbientropy.Summary(bins=10, hi=1000.0))]:
+            with self.subTest(name=name):
+                ref.add(results[name].astype(np.float64))
+                self.assertSameSummary(summaries[name], ref)
+
+
+    def test_errors(self):
+        'Check that invalid summaries and arguments are rejected'
+        for kwargs in [dict(bins=0), dict(lo=1.0, hi=1.0),
+                       dict(hi=float('inf'))]:
+            with self.subTest(kwargs=kwargs):
+                with self.assertRaises(ValueError):
+                    cbientropy.Summary(**kwargs)
+        s = cbientropy.Summary()
+        with self.assertRaises(ValueError):
+            s.merge(cbientropy.Summary(bins=10))
+        with self.assertRaises(TypeError):
+            s.merge([0.5])
+        with self.assertRaises(ValueError):
+            s.quantile(1.5)
+        with self.assertRaises(TypeError):
+            s.add('abc')
+        with self.assertRaises(TypeError):
+            cbientropy.tbien_batch(b'\x00'*8, 8, summary=[])
+        with self.assertRaises(ValueError):
+            cbientropy.scan_metrics(b'\x00'*8, 8, summaries={'x': s})
+        with self.assertRaises(TypeError):
+            cbientropy.scan_metrics(b'\x00'*8, 8, summaries={'tbien': 1})
+
+
+if __name__ == '__main__':
+    main()
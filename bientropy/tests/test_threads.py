@@ -0,0 +1,162 @@
+'''
+NOTICE
+
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+This file stress tests the C extension from parallel threads and
+sub-interpreters, which it supports through multi-phase initialization and
+by releasing the GIL while computing.
+'''
+from __future__ import print_function
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import warnings
+
+if sys.version_info.major > 2:
+    from unittest import TestCase, main, skipIf
+else:
+    from unittest2 import TestCase, main, skipIf
+
+try:
+    from bientropy import cbientropy
+    NO_CEXT = ''
+except ImportError as e:
+    # Allow some tests to be skipped
+    NO_CEXT = 'C extension not available'
+
+try:
+    import _interpreters as interpreters
+except ImportError:
+    try:
+        import _xxsubinterpreters as interpreters
+    except ImportError:
+        interpreters = None
+
+CPUS = multiprocessing.cpu_count()
+
+
+def run_threads(fun, args_list):
+    'Run fun once per tuple of arguments, each in its own thread'
+    errors = []
+    def target(*args):
+        try:
+            fun(*args)
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=target, args=args)
+               for args in args_list]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+@skipIf(NO_CEXT, NO_CEXT)
+class ThreadTests(TestCase):
+    'Stress test the C extension from several threads'
+
+    def test_threads_agree(self):
+        'Check that concurrent calls give the same results as serial calls'
+        inputs = [os.urandom(64 + i) for i in range(16)]
+        funs = [cbientropy.tbien, cbientropy.tbien_scratch,
+                lambda x: cbientropy.tbien_batch([x])[0],
+                lambda x: cbientropy.tbien_estimate(x, samples=8, seed=1,
+                                                    threads=2)[0]]
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            funs.append(cbientropy.bien)
+            expected = [[fun(x) for x in inputs] for fun in funs]
+            results = [[None]*len(inputs) for fun in funs]
+            def work(f, i):
+                for _ in range(20):
+                    results[f][i] = funs[f](inputs[i])
+            run_threads(work, [(f, i) for f in range(len(funs))
+                               for i in range(len(inputs))])
+        self.assertEqual(results, expected)
+
+
+    def test_shared_iterator(self):
+        'Check that threads sharing a derivative iterator take turns'
+        data = os.urandom(512)
+        nbits = len(data)*8
+        it = cbientropy.iter_derivatives(data)
+        lengths = []
+        def work():
+            for level in it:
+                lengths.append(len(level))
+        run_threads(work, [()]*8)
+        # each level is yielded once, exported whole
+        self.assertEqual(sorted(lengths, reverse=True),
+                         [(nbits - k + 7)//8 for k in range(nbits - 1)])
+
+
+    @skipIf(CPUS < 2, 'More than one CPU is required')
+    def test_scaling(self):
+        '''
+        Check that threads scoring at the same time run faster than one
+        thread doing all the work, which requires the GIL to be released.
+        '''
+        data = os.urandom(2048)
+        calls = 4*min(CPUS, 4)
+        def work(n):
+            for _ in range(n):
+                cbientropy.tbien(data)
+        start = time.time()
+        work(calls)
+        serial = time.time() - start
+        start = time.time()
+        run_threads(work, [(calls//min(CPUS, 4),)]*min(CPUS, 4))
+        parallel = time.time() - start
+        # leave plenty of room for busy machines
+        self.assertLess(parallel, serial/1.3)
+
+
+    @skipIf(interpreters is None, 'Sub-interpreters are not available')
+    def test_subinterpreters(self):
+        'Check that the module loads and scores in parallel sub-interpreters'
+        code = '\n'.join([
+            'import sys',
+            'sys.path[:0] = %r' % sys.path,
+            'from bientropy import cbientropy',
+            'assert cbientropy.ENGINE_VERSION == %d' %
+            cbientropy.ENGINE_VERSION,
+            'for _ in range(20):',
+            '    assert abs(cbientropy.tbien(%r) - %r) < 1e-12' %
+            (b'\xde\xad\xbe\xef', cbientropy.tbien(b'\xde\xad\xbe\xef')),
+            '    cbientropy.tbien_scratch(%r)' % (b'\x5a'*512,),
+            ])
+        def work():
+            # some versions of Python hang destroying an interpreter from a
+            # thread other than the one that ran it
+            interp = interpreters.create()
+            try:
+                interpreters.run_string(interp, code)
+            finally:
+                interpreters.destroy(interp)
+        run_threads(work, [()]*(min(CPUS, 4) + 1))
+
+
+if __name__ == '__main__':
+    main()
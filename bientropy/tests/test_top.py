@@ -0,0 +1,118 @@
+'''
+NOTICE
+
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+This file tests the engine computing BiEn from the top levels of the
+derivative triangle against the GMP implementation.
+'''
+from __future__ import print_function
+import os
+import sys
+import warnings
+
+if sys.version_info.major > 2:
+    from unittest import TestCase, main, skipIf
+else:
+    from unittest2 import TestCase, main, skipIf
+
+from bitstring import Bits
+try:
+    from bientropy import cbientropy
+    NO_CEXT = ''
+except ImportError as e:
+    # Allow some tests to be skipped
+    NO_CEXT = 'C extension not available'
+
+
+@skipIf(NO_CEXT, NO_CEXT)
+class TopTests(TestCase):
+    'Test the top-level BiEn engine'
+
+    def setUp(self):
+        self.warnings = warnings.catch_warnings()
+        self.warnings.__enter__()
+        warnings.simplefilter('ignore')
+
+
+    def tearDown(self):
+        self.warnings.__exit__(None, None, None)
+
+
+    def assertClose(self, first, second):
+        'Check that two results agree to about the precision of a double'
+        self.assertLessEqual(abs(first - second), 4e-16*abs(second))
+
+
+    def test_random(self):
+        '''
+        Check random strings of lengths on either side of the number of
+        levels computed at first, with and without a partial last byte.
+        '''
+        for s_len in [1, 2, 8, 9, 16, 17, 100, 500]:
+            for _ in range(10):
+                ti = os.urandom(s_len)
+                for bits in set([s_len*8, s_len*8 - 3, 2]):
+                    rand_s = Bits(bytes=ti)[:bits]
+                    with self.subTest(s_len=s_len, bits=bits):
+                        self.assertClose(
+                            cbientropy.bien(rand_s, engine='top'),
+                            cbientropy.bien(rand_s, engine='gmp'))
+
+
+    def test_ordered(self):
+        '''
+        Check strings whose top levels have little or no entropy, for which
+        more levels are needed to reach the precision of a double.
+        '''
+        for pattern in [b'\x00', b'\xff', b'\x55', b'\x33', b'\x0f',
+                        b'\x01\x00', b'\x80\x00\x00\x00']:
+            for reps in [8, 31, 100]:
+                for ti in [pattern*reps, b'\x80' + pattern*reps,
+                           pattern*reps + b'\x01']:
+                    with self.subTest(ti=ti):
+                        self.assertClose(cbientropy.bien(ti, engine='top'),
+                                         cbientropy.bien(ti, engine='gmp'))
+
+
+    def test_default(self):
+        'Check that long strings use the top-level engine by default'
+        ti = os.urandom(2)
+        self.assertEqual(cbientropy.bien(ti),
+                         cbientropy.bien(ti, engine='gmp'))
+        ti = os.urandom(1000)
+        self.assertEqual(cbientropy.bien(ti),
+                         cbientropy.bien(ti, engine='top'))
+        self.assertAlmostEqual(cbientropy.bien_scratch(ti),
+                               cbientropy.bien(ti), places=14)
+
+
+    def test_errors(self):
+        'Check that invalid engines and short strings are rejected'
+        with self.assertRaises(ValueError):
+            cbientropy.bien(b'\x00', engine='fast')
+        with self.assertRaises(ValueError):
+            cbientropy.bien(b'', engine='top')
+        with self.assertRaises(ValueError):
+            cbientropy.bien(Bits('0b1'), engine='top')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+'''
+NOTICE
+
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+This file tests the top-k search against sorting every score of the batch
+functions.
+'''
+from __future__ import print_function
+import os
+import sys
+import warnings
+
+if sys.version_info.major > 2:
+    from unittest import TestCase, main, skipIf
+else:
+    from unittest2 import TestCase, main, skipIf
+
+import numpy as np
+try:
+    from bientropy import cbientropy
+    import bientropy
+    NO_CEXT = ''
+except ImportError as e:
+    # Allow some tests to be skipped
+    NO_CEXT = 'C extension not available'
+
+
+def reference(data, k, metric, largest, bits=None):
+    'The indices and scores of the best k records, by sorting every score'
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        scores = getattr(cbientropy, metric + '_batch')(data, bits=bits)
+    # ties go to the earlier record
+    order = np.lexsort((np.arange(len(scores)),
+                        -scores if largest else scores))[:k]
+    return order, scores[order]
+
+
+@skipIf(NO_CEXT, NO_CEXT)
+class TopKTests(TestCase):
+    'Test the top-k search'
+
+    def test_search(self):
+        'Check the best records of short and long records'
+        rng = np.random.RandomState(1)
+        for nbytes in [4, 8, 32, 100]:
+            data = rng.randint(0, 256, (3000, nbytes)).astype(np.uint8)
+            # a few weak records among random ones
+            data[::101] &= 0x0f
+            for metric in ['bien', 'tbien']:
+                for largest in [False, True]:
+                    for k in [1, 7, 50]:
+                        with self.subTest(nbytes=nbytes, metric=metric,
+                                          largest=largest, k=k):
+                            with warnings.catch_warnings():
+                                warnings.simplefilter('ignore')
+                                idx, scores = bientropy.topk(
+                                    data, k, metric, largest)
+                            ref_idx, ref_scores = reference(
+                                data, k, metric, largest)
+                            np.testing.assert_array_equal(idx, ref_idx)
+                            np.testing.assert_allclose(
+                                scores, ref_scores, rtol=0, atol=1e-12)
+
+
+    def test_threads(self):
+        'Check that merging the heaps of several threads is exact'
+        data = np.frombuffer(os.urandom(40*5000), np.uint8).reshape(-1, 40)
+        ref = cbientropy.topk(data, 25, threads=1)
+        for threads in [2, 3, 8]:
+            with self.subTest(threads=threads):
+                idx, scores = cbientropy.topk(data, 25, threads=threads)
+                np.testing.assert_array_equal(idx, ref[0])
+                np.testing.assert_array_equal(scores, ref[1])
+
+
+    def test_ties(self):
+        'Check that ties go to the earlier record'
+        data = np.tile(np.frombuffer(os.urandom(32), np.uint8), (100, 1))
+        data[50] = 0
+        idx, scores = cbientropy.topk(data, 5, threads=3)
+        np.testing.assert_array_equal(idx, [50, 0, 1, 2, 3])
+        idx, scores = cbientropy.topk(data, 5, largest=True, threads=3)
+        np.testing.assert_array_equal(idx, [0, 1, 2, 3, 4])
+
+
+    def test_inputs(self):
+        'Check flat buffers, lengths in bits and bit arrays'
+        data = os.urandom(24*500)
+        ref = reference(np.frombuffer(data, np.uint8).reshape(-1, 24), 10,
+                        'tbien', False, bits=190)
+        for args, kwargs in [((data, 10), dict(record_bytes=24, bits=190)),
+                             ((np.unpackbits(np.frombuffer(data, np.uint8)
+                                             .reshape(-1, 24), axis=1)
+                               [:, :190].astype(bool), 10), {})]:
+            with self.subTest(kwargs=kwargs):
+                idx, scores = cbientropy.topk(*args, **kwargs)
+                np.testing.assert_array_equal(idx, ref[0])
+                np.testing.assert_allclose(scores, ref[1], rtol=0,
+                                           atol=1e-12)
+        # k beyond the number of records returns every record
+        idx, scores = cbientropy.topk(data, 1000, record_bytes=24)
+        self.assertEqual(len(idx), 500)
+        self.assertTrue(np.all(np.diff(scores) >= 0))
+        idx, scores = cbientropy.topk(b'', 3, record_bytes=8)
+        self.assertEqual((len(idx), len(scores)), (0, 0))
+
+
+    def test_metric(self):
+        'Check searches with a prepared Metric of any weighting'
+        data = np.frombuffer(os.urandom(30*2000), np.uint8).reshape(-1, 30)
+        weights = np.ones(239)
+        weights[:120] = 0
+        for kind in ['tbien', 'uniform', weights]:
+            metric = cbientropy.Metric(kind, 240)
+            scores = metric.batch(data)
+            for largest in [False, True]:
+                with self.subTest(kind=metric.kind, largest=largest):
+                    idx, best = cbientropy.topk(data, 20, metric, largest)
+                    order = np.lexsort((np.arange(len(scores)),
+                                        -scores if largest else scores))
+                    np.testing.assert_array_equal(idx, order[:20])
+                    np.testing.assert_allclose(best, scores[order[:20]],
+                                               rtol=0, atol=1e-12)
+        short = np.ascontiguousarray(data[:, :4])
+        metric = cbientropy.Metric(np.arange(1.0, 32.0), 32)
+        idx, best = cbientropy.topk(short, 5, metric=metric)
+        np.testing.assert_allclose(best, np.sort(metric.batch(short))[:5],
+                                   rtol=0, atol=1e-12)
+
+
+    def test_errors(self):
+        'Check that invalid arguments are rejected'
+        data = np.zeros((10, 8), np.uint8)
+        with self.assertRaises(ValueError):
+            cbientropy.topk(data, 0)
+        with self.assertRaises(ValueError):
+            cbientropy.topk(data, 3, 'xyz')
+        with self.assertRaises(TypeError):
+            cbientropy.topk(b'\x00'*80, 3)
+        with self.assertRaises(ValueError):
+            cbientropy.topk(data, 3, bits=65)
+        with self.assertRaises(ValueError):
+            cbientropy.topk(data, 3, cbientropy.Metric('tbien', 32))
+        with self.assertRaises(TypeError):
+            cbientropy.topk(data, 3, 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+'''
+NOTICE
+
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+This file tests the engine autotuner and the routing of calls through its
+dispatch table.
+'''
+from __future__ import print_function
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+
+if sys.version_info.major > 2:
+    from unittest.mock import patch
+    from unittest import TestCase, main, skipIf
+else:
+    from mock import patch
+    from unittest2 import TestCase, main, skipIf
+
+import numpy as np
+from bitstring import Bits
+import bientropy
+from bientropy import cache, tuning
+try:
+    from bientropy import cbientropy
+    NO_CEXT = ''
+except ImportError as e:
+    # Allow some tests to be skipped
+    NO_CEXT = 'C extension not available'
+
+
+def counting(engines, name):
+    'A copy of engines whose engine name counts its calls in a list'
+    calls = []
+    fun = engines[name]
+    def count(metric, *args):
+        calls.append(metric)
+        return fun(metric, *args)
+    engines = dict(engines)
+    engines[name] = count
+    return engines, calls
+
+
+@skipIf(NO_CEXT, NO_CEXT)
+class TuningTests(TestCase):
+    'Test the engine autotuner'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'dispatch.json')
+        self.previous = tuning.ACTIVE
+
+    def tearDown(self):
+        tuning.ACTIVE = self.previous
+        shutil.rmtree(self.directory)
+
+
+    def test_tune(self):
+        'Check that every bucket is timed and the table saved and loaded'
+        table = tuning.tune([16, 64, 300], [16, 100], [8, 64], budget=1e-4,
+                            path=self.path)
+        self.assertIs(tuning.ACTIVE, table)
+        for metric in ['bien', 'tbien']:
+            with self.subTest(metric=metric):
+                rows = table.table['scalar'][metric]
+                self.assertEqual([r['bits'] for r in rows], [16, 64, 300])
+                for row in rows:
+                    self.assertEqual(row['engine'],
+                                     min(row['seconds'],
+                                         key=row['seconds'].get))
+                # the pure Python implementation only times short strings
+                self.assertNotIn('python', rows[-1]['seconds'])
+                rows = table.table['batch'][metric]
+                self.assertEqual([(r['bits'], r['records']) for r in rows],
+                                 [(16, 8), (16, 64), (100, 8), (100, 64)])
+                # the bitslice engine only takes records of up to 64 bits
+                self.assertNotIn('bitslice', rows[-1]['seconds'])
+        self.assertNotIn('top', table.table['scalar']['tbien'][0]['seconds'])
+        loaded = tuning.load(self.path)
+        self.assertEqual(loaded.table, table.table)
+        self.assertIn('tbien', loaded.report())
+        tuning.disable()
+        self.assertIsNone(tuning.ACTIVE)
+        self.assertEqual(tuning.report(), 'No dispatch table is active.')
+
+
+    def test_time(self):
+        'Check that a cold first call is not timed and slow calls run once'
+        calls = []
+        def cold():
+            calls.append(None)
+            if len(calls) == 1:
+                time.sleep(0.1)
+        self.assertLess(tuning._time(cold, 0.01), 0.05)
+        self.assertGreater(len(calls), 3)
+        del calls[:]
+        def slow():
+            calls.append(None)
+            time.sleep(0.02)
+        self.assertGreaterEqual(tuning._time(slow, 0.01), 0.015)
+        # the warm-up call and the timed one
+        self.assertEqual(len(calls), 2)
+
+
+    def test_lookup(self):
+        'Check the engines chosen by length of string and size of batch'
+        table = tuning.DispatchTable()
+        self.assertIsNone(table.scalar_engine('bien', 100))
+        self.assertIsNone(table.batch_engine('bien', 100, 10))
+        table.table['scalar']['bien'] = [
+            {'bits': 32, 'engine': 'words', 'seconds': {}},
+            {'bits': 256, 'engine': 'top', 'seconds': {}}]
+        table.table['batch']['tbien'] = [
+            {'bits': 64, 'records': 32, 'engine': 'words', 'seconds': {}},
+            {'bits': 64, 'records': 1024, 'engine': 'bitslice',
+             'seconds': {}},
+            {'bits': 512, 'records': 32, 'engine': 'cffi', 'seconds': {}},
+            {'bits': 512, 'records': 1024, 'engine': 'ragged',
+             'seconds': {}}]
+        table = tuning.DispatchTable(table.table)
+        for nbits, engine in [(1, 'words'), (32, 'words'), (33, 'top'),
+                              (10000, 'top')]:
+            with self.subTest(nbits=nbits):
+                self.assertEqual(table.scalar_engine('bien', nbits), engine)
+        self.assertIsNone(table.scalar_engine('tbien', 8))
+        for nbits, nrec, engine in [(8, 1, 'words'), (64, 33, 'bitslice'),
+                                    (64, 10**6, 'bitslice'),
+                                    (65, 32, 'cffi'), (4096, 2000, 'ragged')]:
+            with self.subTest(nbits=nbits, nrec=nrec):
+                self.assertEqual(table.batch_engine('tbien', nbits, nrec),
+                                 engine)
+
+
+    def test_override(self):
+        'Check that overrides replace the buckets they cover'
+        table = tuning.DispatchTable()
+        table.override('tbien', 'gmp')
+        self.assertEqual(table.scalar_engine('tbien', 5), 'gmp')
+        self.assertEqual(table.scalar_engine('tbien', 10**6), 'gmp')
+        table.override('tbien', 'words', max_bits=128)
+        self.assertEqual(table.scalar_engine('tbien', 128), 'words')
+        # longer strings keep the engine of the earlier override
+        self.assertEqual(table.scalar_engine('tbien', 129), 'gmp')
+        table.override('bien', 'bitslice', batch=True)
+        self.assertEqual(table.batch_engine('bien', 64, 5), 'bitslice')
+        # longer records than bitslice takes go to the default engine
+        self.assertIsNone(table.batch_engine('bien', 65, 5))
+        for args in [('xbien', 'gmp'), ('bien', 'nope'),
+                     ('tbien', 'top'), ('bien', 'gmp', True),
+                     ('bien', 'bitslice', True, 100)]:
+            with self.subTest(args=args):
+                with self.assertRaises(ValueError):
+                    table.override(*args)
+
+
+    def test_stale(self):
+        'Check that tables of another version or host are rejected'
+        tuning.tune([16], [16], [8], budget=1e-4, path=self.path,
+                    activate=False)
+        for key, value in [('stamp', 'other'), ('host', 'other/x86'),
+                           ('version', 0)]:
+            with self.subTest(key=key):
+                with open(self.path) as f:
+                    table = json.load(f)
+                table[key] = value
+                path = os.path.join(self.directory, 'stale.json')
+                with open(path, 'w') as f:
+                    json.dump(table, f)
+                with self.assertRaises(ValueError):
+                    tuning.load(path)
+        with patch.object(tuning, 'default_path', return_value=os.path.join(
+                self.directory, 'missing.json')):
+            tuning.load_default()
+        self.assertIsNone(tuning.ACTIVE)
+
+
+    def test_routing(self):
+        'Check that the top-level functions call the chosen engines'
+        tuning.disable()
+        data = os.urandom(8*100)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            expected = [bientropy.bien(data[:8]),
+                        bientropy.tbien(data[:8]),
+                        bientropy.bien_batch(data, 8),
+                        bientropy.tbien_batch(data, 8)]
+        for name in tuning._available()[0]:
+            engines, calls = counting(tuning.SCALAR_ENGINES, name)
+            with self.subTest(name=name), \
+                    patch.object(tuning, 'SCALAR_ENGINES', engines), \
+                    warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                tuning.disable()
+                tuning.override('bien', name)
+                if name != 'top':
+                    tuning.override('tbien', name)
+                for bits in [data[:8], Bits(bytes=data[:8]),
+                             np.unpackbits(np.frombuffer(data[:8],
+                                                         np.uint8))]:
+                    unpacked = isinstance(bits, np.ndarray)
+                    self.assertAlmostEqual(
+                        bientropy.bien(bits, unpacked), expected[0],
+                        places=12)
+                    self.assertAlmostEqual(
+                        bientropy.tbien(bits, unpacked), expected[1],
+                        places=12)
+                self.assertEqual(calls.count('bien'), 3)
+                self.assertEqual(calls.count('tbien'),
+                                 0 if name == 'top' else 3)
+        for name in tuning._available()[1]:
+            engines, calls = counting(tuning.BATCH_ENGINES, name)
+            with self.subTest(name=name), \
+                    patch.object(tuning, 'BATCH_ENGINES', engines), \
+                    warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                tuning.disable()
+                tuning.override('bien', name, batch=True)
+                tuning.override('tbien', name, batch=True)
+                array = np.frombuffer(data, np.uint8).reshape(-1, 8)
+                for i, fun in [(2, bientropy.bien_batch),
+                               (3, bientropy.tbien_batch)]:
+                    np.testing.assert_allclose(fun(data, 8), expected[i],
+                                               rtol=0, atol=1e-12)
+                    np.testing.assert_allclose(fun(array), expected[i],
+                                               rtol=0, atol=1e-12)
+                    # an explicit engine is not routed
+                    fun(data, 8, engine='words')
+                self.assertEqual(len(calls), 4)
+
+
+
+    def test_opt_out(self):
+        'Check that the environment variable keeps the saved table unused'
+        tuning.tune([16], [16], [8], budget=1e-4, path=self.path,
+                    activate=False)
+        with patch.object(tuning, 'default_path', return_value=self.path):
+            with patch.dict(os.environ, {tuning.NO_TUNING_VARIABLE: '1'}):
+                tuning.load_default()
+                self.assertIsNone(tuning.ACTIVE)
+            with patch.dict(os.environ, {tuning.NO_TUNING_VARIABLE: ''}):
+                tuning.load_default()
+                self.assertIsNotNone(tuning.ACTIVE)
+
+
+    def test_cache(self):
+        '''
+        Check that with a cache enabled, calls and cache misses are routed
+        through the table and their results kept under the engine that ran
+        '''
+        data = os.urandom(64*40)
+        expected = [bientropy.tbien(data[:64]),
+                    bientropy.tbien_batch(data, 64),
+                    bientropy.tbien_batch(data, 8)]
+        scalar, scalar_calls = counting(tuning.SCALAR_ENGINES, 'python')
+        batch, batch_calls = counting(tuning.BATCH_ENGINES, 'ragged')
+        try:
+            results = cache.enable(self.directory, min_bits=256)
+            with patch.object(tuning, 'SCALAR_ENGINES', scalar), \
+                    patch.object(tuning, 'BATCH_ENGINES', batch):
+                tuning.disable()
+                tuning.override('tbien', 'python')
+                tuning.override('tbien', 'ragged', batch=True)
+                for _ in range(2):
+                    self.assertAlmostEqual(bientropy.tbien(data[:64]),
+                                           expected[0], places=12)
+                    np.testing.assert_allclose(
+                        bientropy.tbien_batch(data, 64), expected[1],
+                        rtol=0, atol=1e-12)
+                    # short records are not cached, but still routed
+                    np.testing.assert_allclose(
+                        bientropy.tbien_batch(data, 8), expected[2],
+                        rtol=0, atol=1e-12)
+            # the second round is looked up, except the short records
+            self.assertEqual(len(scalar_calls), 1)
+            self.assertEqual(len(batch_calls), 3)
+            key = (cache.digest(data[:64], 512), 512)
+            self.assertEqual(results.lookup('tbien', [key]), {})
+            self.assertIn(key, results.lookup('tbien', [key], 'python'))
+            self.assertIn(key, results.lookup('tbien', [key], 'ragged'))
+            self.assertEqual(cache.engine_name('ragged'),
+                             cache.engine_name() + '/ragged')
+        finally:
+            cache.disable()
+
+
+if __name__ == '__main__':
+    main()
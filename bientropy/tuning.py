@@ -0,0 +1,598 @@
+'''
+Copyright 2018 National Technology & Engineering Solutions of Sandia, LLC
+(NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+Government retains certain rights in this software.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+---
+
+This module chooses, for each metric and length of string, the fastest of
+the engines that compute the same scores on the current host. tune() times
+the engines on random strings of a few lengths, and batches of a few sizes,
+and saves the fastest of each as a dispatch table in the per-user cache
+directory. The top-level bien(), tbien(), bien_batch() and tbien_batch()
+route their calls through the active table, including the results they
+compute for the persistent cache, which are kept under the name of the
+engine that ran. The table saved for this host and engine version is
+activated when the package is imported, unless the environment variable
+BIENTROPY_NO_TUNING is set to a non-empty value; tune() and load() then
+activate a table explicitly.
+
+The engines of single strings are:
+- 'gmp', the GMP implementation, cbientropy.bien(engine='gmp') and
+  cbientropy.tbien()
+- 'top', the top levels of BiEn only, cbientropy.bien(engine='top')
+- 'words', a cbientropy.Metric prepared for the length, which looks the
+  weighted entropies up in a table for strings of up to 512 bits
+- 'cffi', the word-level engine through the cffi binding
+- 'python', the pure Python implementation in pybientropy
+
+and those of batches of fixed-length records are:
+- 'words' and 'bitslice', the engines of cbientropy.bien_batch()
+- 'ragged', cbientropy.bien_ragged(), which scores on every CPU
+- 'cffi', the batch function of the cffi binding
+
+The engines agree to about the precision of a double. A string or batch
+longer than the longest length timed takes the engine of that length.
+'''
+from __future__ import print_function
+import bisect
+import json
+import os
+import platform
+import time
+import warnings
+
+from bitstring import Bits
+
+from . import cache
+
+TABLE_VERSION = 1
+# The upper bounds of the buckets of lengths in bits, and of batch sizes
+LENGTHS = [8, 16, 32, 64, 128, 256, 512, 1024, 4096, 16384]
+BATCH_LENGTHS = [8, 16, 32, 64, 128, 256, 512, 1024]
+BATCH_SIZES = [32, 1024, 16384]
+# The longest strings timed with the pure Python implementation
+PYTHON_MAX_BITS = 256
+# The most prepared metrics kept by the 'words' engine
+MAX_METRICS = 256
+# Set to a non-empty value to keep load_default() from activating a table
+NO_TUNING_VARIABLE = 'BIENTROPY_NO_TUNING'
+
+ACTIVE = None
+
+_metrics = {}
+
+
+def _metric(metric, nbits):
+    # the prepared metric of a length, kept for the next call
+    key = (metric, nbits)
+    m = _metrics.get(key)
+    if m is None:
+        from . import cbientropy
+        if len(_metrics) >= MAX_METRICS:
+            _metrics.clear()
+        m = _metrics[key] = cbientropy.Metric(metric, nbits)
+    return m
+
+
+def _gmp(metric, bits, nbits, unpacked):
+    from . import cbientropy
+    if metric == 'bien':
+        return cbientropy.bien(bits, unpacked, engine='gmp')
+    return cbientropy.tbien(bits, unpacked)
+
+
+def _top(metric, bits, nbits, unpacked):
+    from . import cbientropy
+    return cbientropy.bien(bits, unpacked, engine='top')
+
+
+def _words(metric, bits, nbits, unpacked):
+    if unpacked or cache.bit_array(bits) is not None:
+        bits = cache.as_bit_bytes(bits, unpacked)[0]
+    return _metric(metric, nbits)(bits)
+
+
+def _cffi(metric, bits, nbits, unpacked):
+    from . import cffibientropy
+    return getattr(cffibientropy, metric)(bits, unpacked)
+
+
+def _python(metric, bits, nbits, unpacked):
+    from . import pybientropy
+    data, nbits = cache.as_bit_bytes(bits, unpacked)
+    return getattr(pybientropy, metric)(Bits(bytes=data, length=nbits))
+
+
+def _batch_native(engine):
+    def score(metric, data, record_bytes, bits):
+        from . import cbientropy
+        return getattr(cbientropy, metric + '_batch')(data, record_bytes,
+                                                      bits, engine)
+    return score
+
+
+def _batch_ragged(metric, data, record_bytes, bits):
+    import numpy as np
+    from . import cbientropy
+    data = memoryview(data).cast('B') if hasattr(memoryview, 'cast') \
+        else data
+    nrec = len(data)//record_bytes
+    offsets = np.arange(nrec + 1, dtype=np.int64)*record_bytes
+    bit_lengths = None
+    if bits is not None:
+        bit_lengths = np.full(nrec, bits, dtype=np.int64)
+    return getattr(cbientropy, metric + '_ragged')(
+        data[:nrec*record_bytes], offsets, bit_lengths)
+
+
+def _batch_cffi(metric, data, record_bytes, bits):
+    from . import cffibientropy
+    return getattr(cffibientropy, metric + '_batch')(data, record_bytes,
+                                                     bits)
+
+
+# The engines by name: functions of (metric, bits, nbits, unpacked) for
+# single strings and of (metric, data, record_bytes, bits) for batches
+SCALAR_ENGINES = {'gmp': _gmp, 'top': _top, 'words': _words, 'cffi': _cffi,
+                  'python': _python}
+BATCH_ENGINES = {'words': _batch_native('words'),
+                 'bitslice': _batch_native('bitslice'),
+                 'ragged': _batch_ragged, 'cffi': _batch_cffi}
+
+
+def _available():
+    # the names of the engines that can run here
+    try:
+        from . import cbientropy
+    except ImportError:
+        cbientropy = None
+    try:
+        from . import cffibientropy
+    except ImportError:
+        cffibientropy = None
+    scalar, batch = ['python'], []
+    if cbientropy is not None:
+        scalar += ['gmp', 'top', 'words']
+        batch += ['words', 'bitslice', 'ragged']
+    if cffibientropy is not None:
+        scalar.append('cffi')
+        batch.append('cffi')
+    return scalar, batch
+
+
+def _supports(engine, metric, nbits):
+    # whether an engine computes a metric of strings of a length
+    if engine == 'top':
+        return metric == 'bien' and nbits >= 2
+    if engine == 'bitslice':
+        return nbits <= 64
+    return True
+
+
+def default_path():
+    'The path of the dispatch table in the per-user cache directory'
+    return os.path.join(cache.default_directory(), 'dispatch.json')
+
+
+def _host():
+    return '%s/%s' % (platform.node(), platform.machine())
+
+
+class DispatchTable(object):
+    """
+    The fastest engine of each metric by length of string and, for batches,
+    by number of records.
+
+    Parameters
+    ----------
+    table : dict
+        the table, as tune() makes it or load() reads it; defaults to an
+        empty table, in which every call takes the default engines until
+        override() sets some
+    """
+
+    def __init__(self, table=None):
+        if table is None:
+            table = {'version': TABLE_VERSION, 'stamp': cache.engine_stamp(),
+                     'host': _host(), 'scalar': {}, 'batch': {}}
+        self.table = table
+        # the upper bounds of the buckets and their engines, for bisection
+        self._scalar = {}
+        for metric, rows in table['scalar'].items():
+            self._scalar[metric] = ([r['bits'] for r in rows],
+                                    [r['engine'] for r in rows])
+        self._batch = {}
+        for metric, rows in table['batch'].items():
+            lengths = sorted(set(r['bits'] for r in rows))
+            engines = []
+            for length in lengths:
+                sub = sorted((r['records'], r['engine']) for r in rows
+                             if r['bits'] == length)
+                engines.append(([s[0] for s in sub], [s[1] for s in sub]))
+            self._batch[metric] = (lengths, engines)
+
+    def scalar_engine(self, metric, nbits):
+        """
+        The engine of a string of nbits bits, or None for the default
+        """
+        buckets = self._scalar.get(metric)
+        if not buckets:
+            return None
+        i = min(bisect.bisect_left(buckets[0], nbits), len(buckets[0]) - 1)
+        return buckets[1][i]
+
+    def batch_engine(self, metric, nbits, nrec):
+        """
+        The engine of a batch of nrec records of nbits bits, or None for the
+        default
+        """
+        buckets = self._batch.get(metric)
+        if not buckets:
+            return None
+        i = min(bisect.bisect_left(buckets[0], nbits), len(buckets[0]) - 1)
+        sizes, engines = buckets[1][i]
+        engine = engines[min(bisect.bisect_left(sizes, nrec),
+                             len(sizes) - 1)]
+        # a longer record than the bucket was timed with may not fit
+        if not _supports(engine, metric, nbits):
+            return None
+        return engine
+
+    def override(self, metric, engine, batch=False, max_bits=None):
+        """
+        Route the calls of one metric to an engine, whatever the timings.
+
+        Parameters
+        ----------
+        metric : str
+            'bien' or 'tbien'
+        engine : str
+            the name of the engine
+        batch : bool
+            set the engine of the batch functions rather than of bien() and
+            tbien()
+        max_bits : int
+            the longest strings routed to the engine; defaults to all
+        """
+        if metric not in ('bien', 'tbien'):
+            raise ValueError("Unknown metric '%s'; expected 'bien' or "
+                             "'tbien'." % metric)
+        engines = BATCH_ENGINES if batch else SCALAR_ENGINES
+        if engine not in engines:
+            raise ValueError("Unknown engine '%s'; expected one of %s." % (
+                engine, ', '.join(sorted(engines))))
+        if max_bits is None and engine == 'bitslice':
+            max_bits = 64
+        if not _supports(engine, metric, max_bits or 2):
+            raise ValueError("The engine '%s' does not compute %s of "
+                             "strings of that length." % (engine, metric))
+        kind = 'batch' if batch else 'scalar'
+        # one bucket up to max_bits, above the buckets that are kept; the
+        # last bucket also takes every longer string
+        rows = [r for r in self.table[kind].get(metric, [])
+                if max_bits is not None and r['bits'] > max_bits]
+        row = {'bits': max_bits or (BATCH_LENGTHS if batch else LENGTHS)[-1],
+               'engine': engine, 'seconds': {}}
+        if batch:
+            row['records'] = BATCH_SIZES[-1]
+        rows.insert(0, row)
+        self.table[kind][metric] = rows
+        self.__init__(self.table)
+
+    def report(self):
+        """
+        A table of the engine chosen for each bucket and of the time per
+        string of every engine timed, in microseconds.
+        """
+        lines = ['%-7s %-6s %7s %8s  %-9s %s' % (
+            'kind', 'metric', 'bits', 'records', 'engine', 'us per string')]
+        for kind in ('scalar', 'batch'):
+            for metric in sorted(self.table[kind]):
+                for row in self.table[kind][metric]:
+                    timings = ' '.join(
+                        '%s=%.3g' % (name, 1e6*seconds) for name, seconds
+                        in sorted(row['seconds'].items()))
+                    lines.append('%-7s %-6s %7d %8s  %-9s %s' % (
+                        kind, metric, row['bits'],
+                        row.get('records', '-'), row['engine'], timings))
+        return '\n'.join(lines)
+
+    def save(self, path=None):
+        'Write the table as JSON, by default to default_path()'
+        path = path or default_path()
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(self.table, f, indent=1, sort_keys=True)
+        # readers never see a partly written table
+        _replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=None):
+        """
+        Read a table written by save().
+
+        Raises
+        ------
+        ValueError
+            if the table was made for another host or engine version
+        """
+        with open(path or default_path()) as f:
+            table = json.load(f)
+        if table.get('version') != TABLE_VERSION or \
+                table.get('stamp') != cache.engine_stamp():
+            raise ValueError('The dispatch table was made for another '
+                             'version of the engines.')
+        if table.get('host') != _host():
+            raise ValueError('The dispatch table was made on another host.')
+        return cls(table)
+
+
+def _replace(src, dst):
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else:
+        if os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+def _time(fun, budget, repeats=3):
+    # the best time per call of repeats runs of about budget/repeats seconds
+    # each, after an untimed call that warms the caches and any lazy set-up,
+    # or the time of one call if that alone takes longer than the budget
+    fun()
+    calls, start = 0, time.time()
+    while True:
+        fun()
+        calls += 1
+        elapsed = time.time() - start
+        if elapsed >= budget/repeats or calls >= 1000000:
+            break
+    best = elapsed/calls
+    if calls == 1 and elapsed >= budget:
+        return best
+    for _ in range(repeats - 1):
+        start = time.time()
+        for _ in range(calls):
+            fun()
+        best = min(best, (time.time() - start)/calls)
+    return best
+
+
+def _random_bytes(nbytes, seed):
+    import random
+    rng = random.Random(seed)
+    return bytes(bytearray(rng.randrange(256) for _ in range(nbytes)))
+
+
+def tune(lengths=None, batch_lengths=None, batch_sizes=None, budget=0.01,
+         path=None, save=True, activate=True):
+    """
+    Time the available engines on this host and choose the fastest of each
+    metric for each length of string and size of batch.
+
+    Parameters
+    ----------
+    lengths : list of int
+        the lengths in bits of the single strings timed, which are the upper
+        bounds of the buckets of lengths; defaults to LENGTHS
+    batch_lengths : list of int
+        the lengths in bits of the records of the batches timed; defaults
+        to BATCH_LENGTHS
+    batch_sizes : list of int
+        the numbers of records of the batches timed; defaults to BATCH_SIZES
+    budget : float
+        about how many seconds to time each engine for each bucket
+    path : str
+        where to save the table; defaults to default_path()
+    save : bool
+        save the table
+    activate : bool
+        route the calls of the package through the table
+
+    Returns
+    -------
+    DispatchTable
+        the table, whose report() lists the engines chosen and their times
+    """
+    global ACTIVE
+    with warnings.catch_warnings():
+        # BiEn of long strings warns on every call
+        warnings.simplefilter('ignore')
+        table = _tune(lengths, batch_lengths, batch_sizes, budget)
+    if save:
+        table.save(path)
+    if activate:
+        ACTIVE = table
+    return table
+
+
+def _tune(lengths, batch_lengths, batch_sizes, budget):
+    scalar_names, batch_names = _available()
+    table = DispatchTable()
+    for metric in ('bien', 'tbien'):
+        rows = []
+        for nbits in sorted(lengths or LENGTHS):
+            data = _random_bytes((nbits + 7)//8, nbits)
+            bits = Bits(bytes=data, length=nbits)
+            seconds = {}
+            for name in scalar_names:
+                if not _supports(name, metric, nbits) or \
+                        (name == 'python' and nbits > PYTHON_MAX_BITS):
+                    continue
+                fun = SCALAR_ENGINES[name]
+                seconds[name] = _time(
+                    lambda: fun(metric, bits, nbits, False), budget)
+            rows.append({'bits': nbits, 'seconds': seconds,
+                         'engine': min(seconds, key=seconds.get)})
+        table.table['scalar'][metric] = rows
+        rows = []
+        for nbits in sorted(batch_lengths or BATCH_LENGTHS):
+            record_bytes = (nbits + 7)//8
+            for nrec in sorted(batch_sizes or BATCH_SIZES):
+                data = _random_bytes(record_bytes*nrec, nrec + nbits)
+                seconds = {}
+                for name in batch_names:
+                    if not _supports(name, metric, nbits):
+                        continue
+                    fun = BATCH_ENGINES[name]
+                    seconds[name] = _time(
+                        lambda: fun(metric, data, record_bytes, nbits),
+                        budget)/nrec
+                rows.append({'bits': nbits, 'records': nrec,
+                             'seconds': seconds,
+                             'engine': min(seconds, key=seconds.get)})
+        table.table['batch'][metric] = rows
+    return DispatchTable(table.table)
+
+
+def load(path=None):
+    """
+    Activate a table saved by tune().
+
+    Returns
+    -------
+    DispatchTable
+        the table, which is also available as bientropy.tuning.ACTIVE
+    """
+    global ACTIVE
+    ACTIVE = DispatchTable.load(path)
+    return ACTIVE
+
+
+def override(metric, engine, batch=False, max_bits=None):
+    """
+    Route the calls of one metric to an engine, in the active table or, if
+    there is none, in a new empty one; see DispatchTable.override().
+    """
+    global ACTIVE
+    if ACTIVE is None:
+        ACTIVE = DispatchTable()
+    ACTIVE.override(metric, engine, batch, max_bits)
+    return ACTIVE
+
+
+def disable():
+    'Stop routing calls through a dispatch table'
+    global ACTIVE
+    ACTIVE = None
+
+
+def report():
+    'The report of the active table, see DispatchTable.report()'
+    if ACTIVE is None:
+        return 'No dispatch table is active.'
+    return ACTIVE.report()
+
+
+def _scalar_bits(bits, unpacked):
+    # the length of a string in bits, or None if it has no length
+    try:
+        return len(bits)*8 if isinstance(bits, bytes) and not unpacked \
+            else len(bits)
+    except TypeError:
+        return None
+
+
+def scalar_engine(metric, bits, unpacked):
+    """
+    The name of the active table's engine for one string, or None to use
+    the default engine
+    """
+    nbits = _scalar_bits(bits, unpacked)
+    if nbits is None:
+        return None
+    return ACTIVE.scalar_engine(metric, nbits)
+
+
+def scalar_function(metric, bits, unpacked):
+    """
+    The function of the active table's engine for one string, taking the
+    string, or None to use the default engine
+    """
+    name = scalar_engine(metric, bits, unpacked)
+    if name is None:
+        return None
+    fun, nbits = SCALAR_ENGINES[name], _scalar_bits(bits, unpacked)
+    return lambda b: fun(metric, b, nbits, unpacked)
+
+
+def _batch_route(metric, data, record_bytes, bits, unpacked):
+    # the engine of a batch and the flat buffer and record size to give it,
+    # or None to use the default engine
+    if unpacked:
+        return None
+    if record_bytes is None:
+        shape = getattr(data, 'shape', None)
+        dtype = getattr(data, 'dtype', None)
+        if shape is None or len(shape) != 2 or dtype is None or \
+                dtype.itemsize != 1 or dtype.kind == 'b':
+            return None
+        record_bytes = shape[1]
+        import numpy as np
+        data = np.ascontiguousarray(data).reshape(-1)
+    elif not cache._is_buffer(data):
+        return None
+    if record_bytes < 1:
+        return None
+    view = memoryview(data)
+    nbytes = getattr(view, 'nbytes', len(view)*view.itemsize)
+    nbits = bits if bits is not None else 8*record_bytes
+    name = ACTIVE.batch_engine(metric, nbits, nbytes//record_bytes)
+    if name is None:
+        return None
+    return name, data, record_bytes
+
+
+def batch_engine(metric, data, record_bytes, bits, unpacked):
+    """
+    The name of the active table's engine for a batch, or None to use the
+    default engine; see batch_scores()
+    """
+    route = _batch_route(metric, data, record_bytes, bits, unpacked)
+    return route[0] if route is not None else None
+
+
+def batch_scores(metric, data, record_bytes, bits, unpacked):
+    """
+    Score a batch with the active table's engine, or return None to use the
+    default engine. Only flat buffers with record_bytes and two-dimensional
+    arrays of uint8 are routed.
+    """
+    route = _batch_route(metric, data, record_bytes, bits, unpacked)
+    if route is None:
+        return None
+    name, data, record_bytes = route
+    return BATCH_ENGINES[name](metric, data, record_bytes, bits)
+
+
+def load_default():
+    """
+    Activate the saved table of this host, if there is one and the
+    environment variable named by NO_TUNING_VARIABLE is not set
+    """
+    global ACTIVE
+    if os.environ.get(NO_TUNING_VARIABLE):
+        ACTIVE = None
+        return
+    try:
+        ACTIVE = DispatchTable.load()
+    except (IOError, OSError, ValueError, KeyError):
+        ACTIVE = None
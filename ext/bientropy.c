@@ -23,6 +23,8 @@
 ******************************************************************************/
 
 #include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
 #include <gmp.h>
 #define _USE_MATH_DEFINES // should define M_LOG2E
 #include <math.h>
@@ -37,6 +39,13 @@ static double log2(double n)
 
 #include "bientropy.h"
 
+#if defined(_MSC_VER)
+#include <intrin.h>
+#define POPCOUNT64(x) ((size_t)__popcnt64(x))
+#else
+#define POPCOUNT64(x) ((size_t)__builtin_popcountll(x))
+#endif
+
 /** brief mpz_bin_d - The binary derivative is computed using the exclusive or
  * (XOR) of all adjacent bit positions in a bitstring.
  *
@@ -240,3 +249,1607 @@ double tbien(mpz_bin s)
 
     return (retval);
 }
+
+/** brief bin_entropy - The Shannon binary entropy of a string of length len
+ * with the given number of ones, computed the same way as in bien() and
+ * tbien().
+ */
+static double bin_entropy(size_t ones, size_t len)
+{
+    double p, e, g;
+
+    p = ((double)ones)/len;
+    if (p == 0) {
+        e = 0.0;
+    } else {
+        e = -p*log2(p);
+    }
+    if (p == 1) {
+        g = 0.0;
+    } else {
+        g = -1*(1-p)*log2(1-p);
+    }
+    return (e + g);
+}
+
+/** brief bin_weight - The (unnormalized) weight of derivative level k of a
+ * string of nbits bits under the given metric. BiEn weights are scaled by
+ * 2^-(n-1) so that they stay representable for long strings; the scale
+ * cancels out in the weighted average.
+ */
+static double bin_weight(int metric, size_t nbits, size_t k)
+{
+    if (metric == BIN_METRIC_BIEN) {
+        if (nbits - 1 - k > 1100) {
+            return 0.0;
+        }
+        return ldexp(1.0, -(int)(nbits - 1 - k));
+    }
+    if (metric == BIN_METRIC_UNIFORM) {
+        return 1.0;
+    }
+    return log2((double)k + 2);
+}
+
+/** brief popcount_range - Count the ones in bit positions [lo, hi) of an
+ * array of words, where bit 0 is the most significant bit of the first word.
+ */
+static size_t popcount_range(const uint64_t *w, size_t lo, size_t hi)
+{
+    size_t i, count = 0, wlo, whi;
+    uint64_t m;
+
+    if (lo >= hi) {
+        return 0;
+    }
+    wlo = lo/64;
+    whi = (hi - 1)/64;
+    m = ~(uint64_t)0 >> (lo % 64);
+    if (wlo == whi) {
+        if (hi % 64) {
+            m &= ~(~(uint64_t)0 >> (hi % 64));
+        }
+        return POPCOUNT64(w[wlo] & m);
+    }
+    count = POPCOUNT64(w[wlo] & m);
+    for (i = wlo + 1; i < whi; i++) {
+        count += POPCOUNT64(w[i]);
+    }
+    m = ~(uint64_t)0;
+    if (hi % 64) {
+        m = ~(m >> (hi % 64));
+    }
+    return count + POPCOUNT64(w[whi] & m);
+}
+
+/** brief deriv_words - Replace a string held in nwords words with its binary
+ * derivative, in place. The last bit of the result is only valid if the
+ * string was followed by more (zero) bits, so callers track the length.
+ */
+static void deriv_words(uint64_t *w, size_t nwords)
+{
+    size_t i;
+
+    for (i = 0; i + 1 < nwords; i++) {
+        w[i] ^= (w[i] << 1) | (w[i+1] >> 63);
+    }
+    w[nwords-1] ^= w[nwords-1] << 1;
+}
+
+/** brief bin_import_row - Load a big-endian byte string into an array of
+ * bin_row_words(nbits) words, zeroing any bits past nbits.
+ */
+void bin_import_row(uint64_t *w, const unsigned char *data, size_t nbits)
+{
+    size_t i, j, nwords = bin_row_words(nbits), nbytes = (nbits + 7)/8;
+    uint64_t v;
+
+    for (i = 0; i < nwords; i++) {
+        v = 0;
+        for (j = 0; j < 8; j++) {
+            v <<= 8;
+            if (i*8 + j < nbytes) {
+                v |= data[i*8 + j];
+            }
+        }
+        w[i] = v;
+    }
+    if (nbits % 64) {
+        w[nwords-1] &= ~(~(uint64_t)0 >> (nbits % 64));
+    }
+}
+
+/** brief bin_pack_bits - Pack an unpacked bit array, with one bit per byte
+ * such as an array of bool, into a big-endian byte string of (n+7)/8 bytes,
+ * zeroing any bits past n. Contiguous input is packed eight bytes at a time.
+ *
+ * param src const unsigned char* the first element
+ * param n size_t the number of elements
+ * param stride ptrdiff_t the distance between elements in bytes
+ * param dst unsigned char* the packed string
+ *
+ * return int 0 on success, -1 if an element is neither 0 nor 1
+ */
+int bin_pack_bits(const unsigned char *src, size_t n, ptrdiff_t stride,
+                  unsigned char *dst)
+{
+    size_t i = 0, j;
+    uint64_t v;
+    unsigned char b;
+
+    if (stride == 1) {
+        for (; i + 8 <= n; i += 8) {
+            // the first byte in the low bits, whatever the byte order
+            v = 0;
+            for (j = 0; j < 8; j++) {
+                v |= (uint64_t)src[i + j] << (8*j);
+            }
+            if (v & ~(uint64_t)0x0101010101010101)
+                return -1;
+            // moves bit 8*j to bit 63-j without carries
+            dst[i/8] = (unsigned char)((v*(uint64_t)0x8040201008040201) >> 56);
+        }
+    }
+    for (; i < n; i += 8) {
+        b = 0;
+        for (j = 0; j < 8; j++) {
+            b <<= 1;
+            if (i + j < n) {
+                unsigned char x = src[(ptrdiff_t)(i + j)*stride];
+                if (x > 1)
+                    return -1;
+                b |= x;
+            }
+        }
+        dst[i/8] = b;
+    }
+    return 0;
+}
+
+/** brief bin_pack_strided - Pack a strided vector of unsigned integers in
+ * native byte order into a big-endian byte string, either one bit-plane of
+ * it, with one bit per element, or all of the bits of each element from the
+ * most significant, zeroing any bits past the end.
+ *
+ * param src const unsigned char* the first element
+ * param n size_t the number of elements
+ * param stride ptrdiff_t the distance between elements in bytes
+ * param itemsize size_t the size of each element: 1, 2, 4 or 8 bytes
+ * param bit int the bit-plane, from 0 for the least significant bit, or -1
+ *     for all of the bits
+ * param dst unsigned char* the packed string, of (n+7)/8 bytes for one
+ *     bit-plane or n*itemsize bytes for all of the bits
+ *
+ * return int 0 on success, -1 if itemsize or bit is out of range
+ */
+int bin_pack_strided(const unsigned char *src, size_t n, ptrdiff_t stride,
+                     size_t itemsize, int bit, unsigned char *dst)
+{
+    size_t i, j;
+    uint64_t v;
+    uint8_t v8;
+    uint16_t v16;
+    uint32_t v32;
+
+    if ((itemsize != 1 && itemsize != 2 && itemsize != 4 && itemsize != 8) ||
+            bit >= (int)(8*itemsize))
+        return -1;
+    if (bit >= 0)
+        memset(dst, 0, (n + 7)/8);
+    for (i = 0; i < n; i++) {
+        const unsigned char *p = src + (ptrdiff_t)i*stride;
+        // memcpy() reads elements that need not be aligned
+        switch (itemsize) {
+        case 1: v8 = *p; v = v8; break;
+        case 2: memcpy(&v16, p, 2); v = v16; break;
+        case 4: memcpy(&v32, p, 4); v = v32; break;
+        default: memcpy(&v, p, 8); break;
+        }
+        if (bit >= 0) {
+            dst[i/8] |= (unsigned char)(((v >> bit) & 1) << (7 - i%8));
+        } else {
+            for (j = 0; j < itemsize; j++) {
+                dst[i*itemsize + j] =
+                    (unsigned char)(v >> (8*(itemsize - 1 - j)));
+            }
+        }
+    }
+    return 0;
+}
+
+/** brief bin_row_words - The number of 64-bit words needed to hold a string
+ * of nbits bits; this is the size of the row buffers of the word engines.
+ */
+size_t bin_row_words(size_t nbits)
+{
+    return (nbits + 63)/64;
+}
+
+/** brief bin_score_row - Compute BiEn or TBiEn of a string already loaded
+ * into an array of words, taking the whole row through each level in turn.
+ * The row is overwritten with the derivatives. This is the simplest of the
+ * word-level engines and is best when the row fits in cache.
+ *
+ * param row uint64_t* the input, see bin_import_row()
+ * param nbits size_t the length of the input in bits, at least 2
+ * param metric int BIN_METRIC_BIEN or BIN_METRIC_TBIEN
+ * return double the metric of the input
+ *
+ */
+double bin_score_row(uint64_t *row, size_t nbits, int metric)
+{
+    size_t k, len = nbits;
+    double w, t = 0.0, l = 0.0;
+
+    for (k = 0; k < nbits - 1; k++, len--) {
+        w = bin_weight(metric, nbits, k);
+        t += w*bin_entropy(popcount_range(row, 0, len), len);
+        l += w;
+        deriv_words(row, bin_row_words(len));
+    }
+    return (t/l);
+}
+
+/** brief transpose64 - Transpose a 64x64 bit matrix in place, so that bit j
+ * (counting from the most significant) of word i moves to bit i of word j.
+ */
+static void transpose64(uint64_t *a)
+{
+    int j, k;
+    uint64_t m, t;
+
+    for (j = 32, m = 0x00000000FFFFFFFFULL; j; j >>= 1, m ^= m << j) {
+        for (k = 0; k < 64; k = ((k | j) + 1) & ~j) {
+            t = (a[k] ^ (a[k | j] >> j)) & m;
+            a[k] ^= t;
+            a[k | j] ^= t << j;
+        }
+    }
+}
+
+/** brief bitslice_table - Prepare the table of normalized, weighted
+ * entropies indexed by level k and count of ones c at tab[k*(nbits+1) + c],
+ * so that a score is the sum of one entry per level.
+ *
+ * return double* a table to free(), or NULL if out of memory
+ */
+static double *bitslice_table(size_t nbits, int metric)
+{
+    double *tab, w, l = 0.0;
+    size_t k, cnt;
+
+    tab = (double*)malloc((nbits - 1)*(nbits + 1)*sizeof(double));
+    if (tab == NULL) {
+        return NULL;
+    }
+    for (k = 0; k < nbits - 1; k++) {
+        l += bin_weight(metric, nbits, k);
+    }
+    for (k = 0; k < nbits - 1; k++) {
+        w = bin_weight(metric, nbits, k)/l;
+        for (cnt = 0; cnt <= nbits - k; cnt++) {
+            tab[k*(nbits + 1) + cnt] = w*bin_entropy(cnt, nbits - k);
+        }
+    }
+    return tab;
+}
+
+/** brief bitslice_group - Score the 64 records held as bit-slices in s, one
+ * word per bit position with record r in bit 63-r of each word. One XOR of
+ * adjacent slices takes a derivative step of all 64 records. The ones in
+ * each lane are summed by a bit-sliced ripple-carry counter and the counts
+ * index the table from bitslice_table(). The slices are overwritten.
+ */
+static void bitslice_group(uint64_t *s, size_t nbits, const double *tab,
+                           double *acc)
+{
+    uint64_t c[7], carry, t;
+    size_t k, b, r, j, len, cnt;
+
+    for (r = 0; r < 64; r++) {
+        acc[r] = 0.0;
+    }
+    for (k = 0, len = nbits; k < nbits - 1; k++, len--) {
+        memset(c, 0, sizeof(c));
+        for (b = 0; b < len; b++) {
+            carry = s[b];
+            for (j = 0; carry; j++) {
+                t = c[j] & carry;
+                c[j] ^= carry;
+                carry = t;
+            }
+        }
+        for (r = 0; r < 64; r++) {
+            cnt = 0;
+            for (j = 0; j < 7; j++) {
+                cnt |= (size_t)((c[j] >> (63 - r)) & 1) << j;
+            }
+            acc[r] += tab[k*(nbits + 1) + cnt];
+        }
+        for (b = 0; b + 1 < len; b++) {
+            s[b] ^= s[b+1];
+        }
+    }
+}
+
+/** brief bin_bitslice - Compute BiEn or TBiEn of a batch of records of the
+ * same length of at most 64 bits, given the table from bitslice_table().
+ * Each group of 64 records is transposed into bit-slices and scored by
+ * bitslice_group().
+ */
+static void bin_bitslice(const unsigned char *data, size_t nrec,
+                         size_t stride, size_t nbits, const double *tab,
+                         double *out)
+{
+    double acc[64];
+    uint64_t s[64];
+    size_t g, r, m;
+
+    for (g = 0; g < nrec; g += 64) {
+        m = nrec - g < 64 ? nrec - g : 64;
+        for (r = 0; r < 64; r++) {
+            s[r] = 0;
+            if (r < m) {
+                bin_import_row(s + r, data + (g + r)*stride, nbits);
+            }
+        }
+        transpose64(s);
+        bitslice_group(s, nbits, tab, acc);
+        for (r = 0; r < m; r++) {
+            out[g + r] = acc[r];
+        }
+    }
+}
+
+/** brief bin_batch - Compute BiEn or TBiEn of a batch of records of the same
+ * length stored at a fixed stride.
+ *
+ * param data const unsigned char* the first record, as a big-endian byte
+ * string
+ * param nrec size_t the number of records
+ * param stride size_t the distance between records in bytes
+ * param nbits size_t the length of each record in bits, at least 2
+ * param metric int BIN_METRIC_BIEN or BIN_METRIC_TBIEN
+ * param engine int BIN_ENGINE_AUTO, BIN_ENGINE_WORDS, or BIN_ENGINE_BITSLICE
+ * (only for records of up to BIN_BITSLICE_MAX_BITS bits)
+ * param out double* where to store the nrec results
+ * return int 0 on success, -1 if memory could not be allocated
+ *
+ */
+int bin_batch(const unsigned char *data, size_t nrec, size_t stride,
+              size_t nbits, int metric, int engine, double *out)
+{
+    uint64_t *row;
+    double *tab;
+    size_t i;
+
+    if (engine == BIN_ENGINE_AUTO) {
+        if (nbits <= BIN_BITSLICE_MAX_BITS &&
+            nrec >= BIN_BITSLICE_MIN_RECORDS) {
+            engine = BIN_ENGINE_BITSLICE;
+        } else {
+            engine = BIN_ENGINE_WORDS;
+        }
+    }
+    if (engine == BIN_ENGINE_BITSLICE) {
+        tab = bitslice_table(nbits, metric);
+        if (tab == NULL) {
+            return -1;
+        }
+        bin_bitslice(data, nrec, stride, nbits, tab, out);
+        free(tab);
+        return 0;
+    }
+
+    row = (uint64_t*)malloc(bin_row_words(nbits)*sizeof(uint64_t));
+    if (row == NULL) {
+        return -1;
+    }
+    for (i = 0; i < nrec; i++) {
+        bin_import_row(row, data + i*stride, nbits);
+        out[i] = bin_score_row(row, nbits, metric);
+    }
+    free(row);
+    return 0;
+}
+
+/** brief bin_range - Compute BiEn or TBiEn of every nbits-bit integer in
+ * [start, stop), each taken as a string from its most significant bit, and
+ * store the scores and/or a histogram of them. Integers are scored in
+ * aligned groups of 64 by bitslice_group(); the slices of such a group need
+ * no transposition, since the low six bits of the lanes follow fixed
+ * patterns and every lane shares the higher bits.
+ *
+ * param start uint64_t the first integer
+ * param stop uint64_t one past the last integer, at most 2^nbits
+ * param nbits size_t the length of each string, from 2 to 64 bits
+ * param metric int BIN_METRIC_BIEN or BIN_METRIC_TBIEN
+ * param out double* where to store the stop-start scores, or NULL
+ * param nbins size_t the number of histogram bins over [0, 1], or 0
+ * param hist uint64_t* the histogram to add the scores to, or NULL
+ * return int 0 on success, -1 if memory could not be allocated
+ *
+ */
+int bin_range(uint64_t start, uint64_t stop, size_t nbits, int metric,
+              double *out, size_t nbins, uint64_t *hist)
+{
+    static const uint64_t patterns[6] = {
+        0x5555555555555555ULL, 0x3333333333333333ULL, 0x0F0F0F0F0F0F0F0FULL,
+        0x00FF00FF00FF00FFULL, 0x0000FFFF0000FFFFULL, 0x00000000FFFFFFFFULL};
+    double *tab, acc[64];
+    uint64_t s[64], g, v;
+    size_t b, p, r, r0, r1, bin;
+
+    if (start >= stop) {
+        return 0;
+    }
+    tab = bitslice_table(nbits, metric);
+    if (tab == NULL) {
+        return -1;
+    }
+    for (g = start & ~(uint64_t)63; ; g += 64) {
+        for (b = 0; b < nbits; b++) {
+            p = nbits - 1 - b;
+            if (p < 6) {
+                // lane r holds g + r in bit 63 - r
+                s[b] = patterns[p];
+            } else {
+                s[b] = (g >> p) & 1 ? ~(uint64_t)0 : 0;
+            }
+        }
+        bitslice_group(s, nbits, tab, acc);
+        r0 = g < start ? (size_t)(start - g) : 0;
+        r1 = stop - g < 64 ? (size_t)(stop - g) : 64;
+        for (r = r0; r < r1; r++) {
+            v = g + r;
+            if (out != NULL) {
+                out[v - start] = acc[r];
+            }
+            if (hist != NULL) {
+                bin = (size_t)(acc[r]*nbins);
+                hist[bin < nbins ? bin : nbins - 1]++;
+            }
+        }
+        if (stop - g <= 64) {
+            // the last group, which may end at 2^64
+            break;
+        }
+    }
+    free(tab);
+    return 0;
+}
+
+/** brief shift_xor_words - XOR a string held in nwords words with itself
+ * shifted s bits towards the start. For s = 2^b this takes the string 2^b
+ * levels down the derivative triangle at once. Bits of the result past the
+ * valid length of the input less s are not meaningful.
+ */
+static void shift_xor_words(uint64_t *w, size_t nwords, size_t s)
+{
+    size_t i, q = s/64, r = s % 64;
+    uint64_t v;
+
+    for (i = 0; i + q < nwords; i++) {
+        v = w[i+q] << r;
+        if (r && i + q + 1 < nwords) {
+            v |= w[i+q+1] >> (64 - r);
+        }
+        w[i] ^= v;
+    }
+}
+
+/** brief level_in_place - Replace a string held in an array of words with
+ * its derivative level k, computed as in bin_level_ones(). Each shift
+ * applies to a shorter string than the last, so this costs about two passes
+ * over the input when k is close to nbits.
+ *
+ * return size_t the number of valid bits of level k, nbits-k
+ */
+static size_t level_in_place(uint64_t *w, size_t nbits, size_t k)
+{
+    size_t b, s, len = nbits;
+
+    for (b = sizeof(size_t)*8; b-- > 0; ) {
+        s = (size_t)1 << b;
+        if (k & s) {
+            shift_xor_words(w, bin_row_words(len), s);
+            len -= s;
+        }
+    }
+    return len;
+}
+
+/** brief bin_level_ones - Count the ones in derivative level k of a string
+ * without computing the levels above it. By Lucas's theorem, bit i of level
+ * k is the XOR of the bits i+j of the input for every j whose binary digits
+ * are a subset of those of k, so level k is reached with one shifted XOR per
+ * set bit of k rather than with k derivative steps.
+ *
+ * param row const uint64_t* the input, see bin_import_row()
+ * param work uint64_t* scratch space of bin_row_words(nbits) words
+ * param nbits size_t the length of the input in bits
+ * param k size_t the level, less than nbits
+ * return size_t the number of ones in the nbits-k bits of level k
+ *
+ */
+size_t bin_level_ones(const uint64_t *row, uint64_t *work, size_t nbits,
+                      size_t k)
+{
+    memcpy(work, row, bin_row_words(nbits)*sizeof(uint64_t));
+    return popcount_range(work, 0, level_in_place(work, nbits, k));
+}
+
+/** brief bin_row_level - Replace a string held in an array of words with
+ * its derivative level k in place, as bin_level_ones() reaches it.
+ *
+ * param row uint64_t* the string, see bin_import_row()
+ * param nbits size_t the length of the string in bits
+ * param k size_t the level, less than nbits
+ * return size_t the number of valid bits of level k, nbits-k
+ *
+ */
+size_t bin_row_level(uint64_t *row, size_t nbits, size_t k)
+{
+    return level_in_place(row, nbits, k);
+}
+
+/** brief bin_row_deriv - Replace a string held in an array of words with its
+ * binary derivative in place, one level down the triangle.
+ *
+ * param row uint64_t* the string, as bin_import_row() or a previous call
+ * leaves it
+ * param len size_t the length of the string in bits, at least 2; the
+ * derivative is len-1 bits long
+ *
+ */
+void bin_row_deriv(uint64_t *row, size_t len)
+{
+    deriv_words(row, bin_row_words(len));
+}
+
+/** brief bin_level_pieces - The number of ranges of derivative levels that
+ * a string of nbits bits is scored in, so that the levels of one long string
+ * can be shared out across threads: one for strings of up to BIN_SPLIT_BITS
+ * bits, and about (nbits/BIN_SPLIT_BITS)^2 for longer ones, so that each
+ * range costs about as much as a string of BIN_SPLIT_BITS bits. It depends
+ * only on the length, so a string gets the same result however the work is
+ * shared out.
+ */
+size_t bin_level_pieces(size_t nbits)
+{
+    size_t n;
+
+    if (nbits <= BIN_SPLIT_BITS) {
+        return 1;
+    }
+    n = (nbits + BIN_SPLIT_BITS - 1)/BIN_SPLIT_BITS;
+    // each range starts with about two passes over the string, so keep them
+    // at least 64 levels long on average
+    if (n*n > (nbits - 1)/64) {
+        return (nbits - 1)/64;
+    }
+    return n*n;
+}
+
+/** brief bin_piece_level - The first level of range p of the npieces ranges
+ * of bin_level_pieces(). Level k of a string of n bits is n-k bits long, so
+ * the levels above k cost about n^2 - (n-k)^2 in all, and the ranges of
+ * equal cost start at levels n(1 - sqrt(1 - p/npieces)).
+ *
+ * param nbits size_t the length of the string in bits, at least 2
+ * param npieces size_t the number of ranges
+ * param p size_t the range, up to npieces for the end of the last one
+ * return size_t the level, from 0 to nbits-1
+ *
+ */
+size_t bin_piece_level(size_t nbits, size_t npieces, size_t p)
+{
+    double k;
+
+    if (p >= npieces) {
+        return nbits - 1;
+    }
+    k = (double)nbits*(1.0 - sqrt(1.0 - (double)p/npieces));
+    return k < (double)(nbits - 1) ? (size_t)k : nbits - 1;
+}
+
+/** brief bin_score_levels - Compute the weighted sum of the entropies of
+ * derivative levels [k0, k1) of a string and the sum of their weights. Level
+ * k0 is reached directly as in bin_row_level() and the levels below it are
+ * stepped through as in bin_score_row(); the metric of the string is the
+ * sum of t over ranges covering every level over the sum of l.
+ *
+ * param row uint64_t* the input, see bin_import_row(), which is overwritten
+ * param nbits size_t the length of the input in bits, at least 2
+ * param metric int BIN_METRIC_BIEN or BIN_METRIC_TBIEN
+ * param k0 size_t the first level
+ * param k1 size_t the level after the last, at most nbits-1
+ * param t double* where to store the weighted sum of the entropies
+ * param l double* where to store the sum of the weights
+ *
+ */
+void bin_score_levels(uint64_t *row, size_t nbits, int metric, size_t k0,
+                      size_t k1, double *t, double *l)
+{
+    size_t k, len = nbits;
+    double w;
+
+    *t = *l = 0.0;
+    if (k0 >= k1) {
+        return;
+    }
+    if (k0 > 0) {
+        len = level_in_place(row, nbits, k0);
+    }
+    for (k = k0; k < k1; k++, len--) {
+        w = bin_weight(metric, nbits, k);
+        *t += w*bin_entropy(popcount_range(row, 0, len), len);
+        *l += w;
+        if (k + 1 < k1) {
+            deriv_words(row, bin_row_words(len));
+        }
+    }
+}
+
+/** brief bin_score_split - Compute BiEn or TBiEn with the word-level engine
+ * as bin_score_row() does, in the ranges of levels of bin_level_pieces()
+ * one after another, which is how the results of long strings shared out
+ * across threads are summed.
+ *
+ * param data const unsigned char* the input as a big-endian byte string
+ * param nbits size_t the length of the input in bits, at least 2
+ * param metric int BIN_METRIC_BIEN or BIN_METRIC_TBIEN
+ * param row uint64_t* scratch space of bin_row_words(nbits) words
+ * return double the metric of the input
+ *
+ */
+double bin_score_split(const unsigned char *data, size_t nbits, int metric,
+                       uint64_t *row)
+{
+    size_t p, npieces = bin_level_pieces(nbits);
+    double t, l, t_all = 0.0, l_all = 0.0;
+
+    bin_import_row(row, data, nbits);
+    if (npieces == 1) {
+        return bin_score_row(row, nbits, metric);
+    }
+    for (p = 0; p < npieces; p++) {
+        if (p > 0) {
+            bin_import_row(row, data, nbits);
+        }
+        bin_score_levels(row, nbits, metric,
+                         bin_piece_level(nbits, npieces, p),
+                         bin_piece_level(nbits, npieces, p + 1), &t, &l);
+        t_all += t;
+        l_all += l;
+    }
+    return (t_all/l_all);
+}
+
+/** brief bin_export_row - Store the first nbits bits of an array of words as
+ * a big-endian byte string of (nbits+7)/8 bytes, zeroing any bits past
+ * nbits; the inverse of bin_import_row().
+ */
+void bin_export_row(unsigned char *data, const uint64_t *row, size_t nbits)
+{
+    size_t i, nbytes = (nbits + 7)/8;
+
+    for (i = 0; i < nbytes; i++) {
+        data[i] = (unsigned char)(row[i/8] >> (56 - 8*(i % 8)));
+    }
+    if (nbits % 8) {
+        data[nbytes-1] &= (unsigned char)(0xff << (8 - nbits % 8));
+    }
+}
+
+/** brief bin_bien_top - Compute BiEn of a string from the top of its
+ * derivative triangle only. The weight of level k is 2^-(n-1-k) of the
+ * total, so the levels below the top few dozen add less to the weighted sum
+ * than the rounding error of a double. Level n-1-d is computed directly from
+ * the input with one shifted XOR per set bit of n-1-d, each over a shorter
+ * string than the last, and the d levels above it, which are at most d+1
+ * bits long, are stepped through as usual. Starting from
+ * BIN_BIEN_TOP_LEVELS, d is doubled until the weight of the levels left out,
+ * at most 2^-d, is below 2^-60 of the sum, or until it covers every level.
+ * For most strings this takes O(n) rather than O(n^2) time.
+ *
+ * param data const unsigned char* the input as a big-endian byte string
+ * param nbits size_t the length of the input in bits, at least 2
+ * param row uint64_t* scratch space of bin_row_words(nbits) words
+ * return double the BiEntropy of the input
+ *
+ */
+double bin_bien_top(const unsigned char *data, size_t nbits, uint64_t *row)
+{
+    size_t depth, k, len;
+    double t, l;
+
+    depth = nbits - 1 < BIN_BIEN_TOP_LEVELS ? nbits - 1 : BIN_BIEN_TOP_LEVELS;
+    for (;;) {
+        bin_import_row(row, data, nbits);
+        len = level_in_place(row, nbits, nbits - 1 - depth);
+        // from the lightest level to the heaviest
+        t = 0.0;
+        for (k = nbits - 1 - depth; k < nbits - 1; k++, len--) {
+            t += bin_weight(BIN_METRIC_BIEN, nbits, k)*
+                bin_entropy(popcount_range(row, 0, len), len);
+            deriv_words(row, bin_row_words(len));
+        }
+        if (depth == nbits - 1 || depth > 1100 ||
+                ldexp(1.0, -(int)depth) <= ldexp(t, -60)) {
+            break;
+        }
+        depth = nbits - 1 - depth > depth ? 2*depth : nbits - 1;
+    }
+    l = nbits - 1 > 1100 ? 1.0 : 1.0 - ldexp(1.0, -(int)(nbits - 1));
+    return (t/l);
+}
+
+/** brief splitmix64 - The SplitMix64 generator, used so that sampled
+ * estimates are reproducible from a seed on every platform.
+ */
+static uint64_t splitmix64(uint64_t *state)
+{
+    uint64_t z = (*state += 0x9E3779B97F4A7C15ULL);
+
+    z = (z ^ (z >> 30))*0xBF58476D1CE4E5B9ULL;
+    z = (z ^ (z >> 27))*0x94D049BB133111EBULL;
+    return z ^ (z >> 31);
+}
+
+/** brief uniform01 - A uniform double in [0, 1) from the generator.
+ */
+static double uniform01(uint64_t *state)
+{
+    return (splitmix64(state) >> 11)*(1.0/9007199254740992.0);
+}
+
+/** brief ln_gamma - The natural logarithm of the gamma function by
+ * Stirling's series, accurate to about 1e-10 for x of at least 16. C89 has
+ * no lgamma().
+ */
+static double ln_gamma(double x)
+{
+    double r = 1.0/(x*x);
+
+    return (x - 0.5)*log(x) - x + 0.9189385332046728 +
+        (1.0/12 - r*(1.0/360 - r/1260))/x;
+}
+
+/** brief bin_level_weights - The sum of the TBiEn weights log2(k+2) of
+ * derivative levels [k0, k1), which is log2((k1+1)!/(k0+1)!).
+ */
+double bin_level_weights(size_t k0, size_t k1)
+{
+    double sum = 0.0;
+
+    // short ranges and the first terms, where the series is not accurate,
+    // are summed directly
+    for (; k0 < k1 && (k0 < 16 || k1 - k0 <= 256); k0++) {
+        sum += log2((double)k0 + 2);
+    }
+    if (k0 < k1) {
+        sum += (ln_gamma((double)k1 + 2) - ln_gamma((double)k0 + 2))/
+            log(2.0);
+    }
+    return sum;
+}
+
+/** brief bin_estimate_strata - The number of strata that the derivative
+ * levels of a string of nbits bits are sampled from. The levels of at most
+ * BIN_ESTIMATE_EXACT_BITS bits are computed exactly, and the longer ones are
+ * split into strata whose lengths differ by a factor of at most sqrt(2), or
+ * fewer if there are not two samples for each.
+ *
+ * param nbits size_t the length of the string in bits
+ * param samples size_t the number of levels to sample, at least 2
+ * return size_t the number of strata, 0 if every level is computed exactly
+ *
+ */
+size_t bin_estimate_strata(size_t nbits, size_t samples)
+{
+    size_t nstrata;
+
+    if (nbits <= BIN_ESTIMATE_EXACT_BITS) {
+        return 0;
+    }
+    nstrata = (size_t)ceil(2*log2((double)nbits/BIN_ESTIMATE_EXACT_BITS));
+    if (nstrata > samples/2) {
+        nstrata = samples/2;
+    }
+    if (nstrata > nbits - BIN_ESTIMATE_EXACT_BITS) {
+        nstrata = nbits - BIN_ESTIMATE_EXACT_BITS;
+    }
+    return nstrata < 1 ? 1 : nstrata;
+}
+
+/** brief bin_stratum_level - The first level of stratum s of the nstrata
+ * strata of bin_estimate_strata(). Stratum s holds the levels of between
+ * n(E/n)^(s/nstrata) and n(E/n)^((s+1)/nstrata) bits, where E is
+ * BIN_ESTIMATE_EXACT_BITS, and s = nstrata gives the first level that is
+ * computed exactly.
+ */
+size_t bin_stratum_level(size_t nbits, size_t nstrata, size_t s)
+{
+    double len;
+
+    if (s == 0) {
+        return 0;
+    }
+    if (s >= nstrata) {
+        return nbits - BIN_ESTIMATE_EXACT_BITS;
+    }
+    len = nbits*pow((double)BIN_ESTIMATE_EXACT_BITS/nbits,
+                    (double)s/nstrata);
+    return nbits - (size_t)ceil(len);
+}
+
+/** brief bin_stratum_samples - The number of samples drawn from stratum s.
+ * The entropies of levels of L bits of random data vary by about 1/L and
+ * the weight of a stratum grows about as L, so every stratum gets about the
+ * same number of samples.
+ */
+size_t bin_stratum_samples(size_t samples, size_t nstrata, size_t s)
+{
+    return samples/nstrata + (s < samples % nstrata ? 1 : 0);
+}
+
+/** brief bin_sample_levels - Draw derivative levels of a string of nbits bits
+ * at random, stratum by stratum: bin_stratum_samples() levels of each of the
+ * strata of bin_estimate_strata() in turn, with probabilities proportional
+ * to their TBiEn weights within the stratum, so that the mean entropy of the
+ * levels of a stratum is an unbiased estimate of its weighted mean entropy.
+ * Levels are drawn uniformly and accepted with probability
+ * log2(k+2)/log2(k1+1) for a stratum [k0, k1), which is at least a half.
+ *
+ * param nbits size_t the length of the string in bits, more than
+ * BIN_ESTIMATE_EXACT_BITS
+ * param samples size_t the number of levels to draw, at least 2
+ * param seed uint64_t the seed of the generator
+ * param levels size_t* where to store the levels
+ *
+ */
+void bin_sample_levels(size_t nbits, size_t samples, uint64_t seed,
+                       size_t *levels)
+{
+    size_t s, i, j, k, k0, k1, nstrata = bin_estimate_strata(nbits, samples);
+    double wmax;
+
+    for (s = 0, i = 0; s < nstrata; s++) {
+        k0 = bin_stratum_level(nbits, nstrata, s);
+        k1 = bin_stratum_level(nbits, nstrata, s + 1);
+        wmax = log2((double)k1 + 1);
+        for (j = bin_stratum_samples(samples, nstrata, s); j > 0; j--) {
+            do {
+                k = k0 + (size_t)(uniform01(&seed)*(k1 - k0));
+                if (k >= k1) {
+                    k = k1 - 1;
+                }
+            } while (uniform01(&seed)*wmax >= log2((double)k + 2));
+            levels[i++] = k;
+        }
+    }
+}
+
+/** brief bin_level_entropy - The Shannon entropy of derivative level k of a
+ * string, computed directly with bin_level_ones().
+ */
+double bin_level_entropy(const uint64_t *row, uint64_t *work, size_t nbits,
+                         size_t k)
+{
+    return bin_entropy(bin_level_ones(row, work, nbits, k), nbits - k);
+}
+
+/** brief bin_metric_init - Prepare a metric for strings of a fixed length:
+ * the normalized weight of each level and, for strings of up to
+ * BIN_METRIC_TABLE_MAX_BITS bits, the table of normalized weighted entropies
+ * from bitslice_table(), so that scoring a string takes only popcounts and
+ * a sum.
+ *
+ * param m bin_metric* the metric to fill in
+ * param nbits size_t the length of the strings in bits, at least 2
+ * param metric int BIN_METRIC_BIEN or BIN_METRIC_TBIEN
+ * return int 0 on success, -1 if memory could not be allocated
+ *
+ */
+int bin_metric_init(bin_metric *m, size_t nbits, int metric)
+{
+    double *weights;
+    size_t k;
+    int rc;
+
+    weights = (double*)malloc((nbits - 1)*sizeof(double));
+    if (weights == NULL) {
+        return -1;
+    }
+    for (k = 0; k < nbits - 1; k++) {
+        weights[k] = bin_weight(metric, nbits, k);
+    }
+    rc = bin_metric_init_weights(m, nbits, weights);
+    m->metric = metric;
+    free(weights);
+    return rc;
+}
+
+/** brief bin_metric_init_weights - Prepare a metric with any weighting of
+ * the levels, as bin_metric_init() does for the built-in metrics. The score
+ * of a string is the weighted average of the entropies of its levels.
+ *
+ * param m bin_metric* the metric to fill in; its metric is BIN_METRIC_CUSTOM
+ * param nbits size_t the length of the strings in bits, at least 2
+ * param weights const double* the nbits-1 weights of levels 0 to nbits-2,
+ * which must not be negative and must not all be zero
+ * return int 0 on success, -1 if memory could not be allocated
+ *
+ */
+int bin_metric_init_weights(bin_metric *m, size_t nbits,
+                            const double *weights)
+{
+    size_t k, cnt;
+
+    if (bin_metric_init_plain(m, nbits, BIN_METRIC_CUSTOM, weights) < 0) {
+        return -1;
+    }
+    if (nbits <= BIN_METRIC_TABLE_MAX_BITS) {
+        // as bitslice_table(), from the normalized weights
+        m->table = (double*)malloc((nbits - 1)*(nbits + 1)*sizeof(double));
+        if (m->table == NULL) {
+            free(m->weights);
+            m->weights = NULL;
+            return -1;
+        }
+        for (k = 0; k < nbits - 1; k++) {
+            for (cnt = 0; cnt <= nbits - k; cnt++) {
+                m->table[k*(nbits + 1) + cnt] =
+                    m->weights[k]*bin_entropy(cnt, nbits - k);
+            }
+        }
+    }
+    return 0;
+}
+
+/** brief bin_metric_init_plain - Prepare a metric as bin_metric_init() or,
+ * given weights, bin_metric_init_weights() do, but without the table of
+ * weighted entropies, for metrics that score too few strings to repay
+ * building it, such as those of each length of a ragged batch.
+ *
+ * param m bin_metric* the metric to fill in
+ * param nbits size_t the length of the strings in bits, at least 2
+ * param metric int BIN_METRIC_BIEN, BIN_METRIC_TBIEN or BIN_METRIC_UNIFORM,
+ * or BIN_METRIC_CUSTOM to use weights
+ * param weights const double* the nbits-1 weights of a custom metric, as
+ * for bin_metric_init_weights(), or NULL
+ * return int 0 on success, -1 if memory could not be allocated
+ *
+ */
+int bin_metric_init_plain(bin_metric *m, size_t nbits, int metric,
+                          const double *weights)
+{
+    size_t k;
+    double l = 0.0;
+
+    m->nbits = nbits;
+    m->metric = metric;
+    m->table = NULL;
+    m->weights = (double*)malloc((nbits - 1)*sizeof(double));
+    if (m->weights == NULL) {
+        return -1;
+    }
+    for (k = 0; k < nbits - 1; k++) {
+        m->weights[k] = weights != NULL ? weights[k] :
+            bin_weight(metric, nbits, k);
+        l += m->weights[k];
+    }
+    for (k = 0; k < nbits - 1; k++) {
+        m->weights[k] /= l;
+    }
+    return 0;
+}
+
+/** brief bin_metric_free - Free the tables of a metric.
+ */
+void bin_metric_free(bin_metric *m)
+{
+    free(m->weights);
+    free(m->table);
+    m->weights = NULL;
+    m->table = NULL;
+}
+
+/** brief bin_metric_score - Score a string loaded into an array of words with
+ * a prepared metric. The row is overwritten with the derivatives.
+ *
+ * param m const bin_metric* the metric, see bin_metric_init()
+ * param row uint64_t* the input, see bin_import_row()
+ * return double the metric of the input
+ *
+ */
+double bin_metric_score(const bin_metric *m, uint64_t *row)
+{
+    size_t k, nbits = m->nbits, len = nbits, cnt;
+    double t = 0.0;
+
+    for (k = 0; k < nbits - 1; k++, len--) {
+        cnt = popcount_range(row, 0, len);
+        if (m->table != NULL) {
+            t += m->table[k*(nbits + 1) + cnt];
+        } else {
+            t += m->weights[k]*bin_entropy(cnt, len);
+        }
+        deriv_words(row, bin_row_words(len));
+    }
+    return t;
+}
+
+/** brief metric_level - The weighted entropy of level k of a string under a
+ * prepared metric, given the number of ones in the level.
+ */
+static double metric_level(const bin_metric *m, size_t k, size_t cnt)
+{
+    if (m->table != NULL) {
+        return m->table[k*(m->nbits + 1) + cnt];
+    }
+    return m->weights[k]*bin_entropy(cnt, m->nbits - k);
+}
+
+/** brief bin_metric_score_levels - Compute the weighted sum of the entropies
+ * of derivative levels [k0, k1) of a string under a prepared metric and the
+ * sum of their weights, as bin_score_levels() does for the built-in
+ * metrics.
+ *
+ * param m const bin_metric* the metric, see bin_metric_init()
+ * param row uint64_t* the input, see bin_import_row(), which is overwritten
+ * param k0 size_t the first level
+ * param k1 size_t the level after the last, at most m->nbits-1
+ * param t double* where to store the weighted sum of the entropies
+ * param l double* where to store the sum of the weights
+ *
+ */
+void bin_metric_score_levels(const bin_metric *m, uint64_t *row, size_t k0,
+                             size_t k1, double *t, double *l)
+{
+    size_t k, len = m->nbits;
+
+    *t = *l = 0.0;
+    if (k0 >= k1) {
+        return;
+    }
+    if (k0 > 0) {
+        len = level_in_place(row, m->nbits, k0);
+    }
+    for (k = k0; k < k1; k++, len--) {
+        *t += metric_level(m, k, popcount_range(row, 0, len));
+        *l += m->weights[k];
+        if (k + 1 < k1) {
+            deriv_words(row, bin_row_words(len));
+        }
+    }
+}
+
+/** brief bin_metric_score_bound - Score a string as bin_metric_score() does,
+ * but abandon the derivative loop once the score is known to be above bound
+ * or, with largest, below it. Every level contributes between zero and its
+ * weight, so the partial sum is a lower bound on the score and the partial
+ * sum plus the weight of the remaining levels is an upper bound. This is
+ * the pruning step of top-k searches, where bound is the worst score kept.
+ *
+ * param m const bin_metric* the metric, see bin_metric_init()
+ * param row uint64_t* the input, see bin_import_row(); overwritten
+ * param bound double the score to beat
+ * param largest int nonzero to keep scores above bound, 0 to keep those
+ * below it
+ * return double the metric of the input, or if the loop was abandoned, a
+ * bound on it that is above bound or, with largest, below it
+ *
+ */
+double bin_metric_score_bound(const bin_metric *m, uint64_t *row,
+                              double bound, int largest)
+{
+    size_t k, nbits = m->nbits, len = nbits, cnt;
+    double t = 0.0, rest = 1.0;
+
+    for (k = 0; k < nbits - 1; k++, len--) {
+        cnt = popcount_range(row, 0, len);
+        if (m->table != NULL) {
+            t += m->table[k*(nbits + 1) + cnt];
+        } else {
+            t += m->weights[k]*bin_entropy(cnt, len);
+        }
+        if (!largest) {
+            // sums of non-negative terms never round down
+            if (t > bound)
+                return t;
+        } else {
+            rest -= m->weights[k];
+            // the weights sum to one only to within rounding
+            if (t + rest + BIN_BOUND_MARGIN < bound)
+                return t + rest;
+        }
+        deriv_words(row, bin_row_words(len));
+    }
+    return t;
+}
+
+/** brief bin_metric_score_xor - Score the exclusive or of two strings loaded
+ * into arrays of words with a prepared metric. The XOR is formed as the
+ * words are copied into the scratch row, which is then overwritten with the
+ * derivatives, so comparing two strings takes no more memory traffic than
+ * scoring one.
+ *
+ * param m const bin_metric* the metric, see bin_metric_init()
+ * param a const uint64_t* the first string, see bin_import_row()
+ * param b const uint64_t* the second string
+ * param row uint64_t* scratch space of bin_row_words(m->nbits) words
+ * return double the metric of a XOR b
+ *
+ */
+double bin_metric_score_xor(const bin_metric *m, const uint64_t *a,
+                            const uint64_t *b, uint64_t *row)
+{
+    size_t i, nwords = bin_row_words(m->nbits);
+
+    for (i = 0; i < nwords; i++) {
+        row[i] = a[i] ^ b[i];
+    }
+    return bin_metric_score(m, row);
+}
+
+/** brief bin_metric_batch - Score a batch of records stored at a fixed stride
+ * with a prepared metric, using the bit-sliced engine for batches of short
+ * records as bin_batch() does.
+ *
+ * param m const bin_metric* the metric, see bin_metric_init()
+ * param data const unsigned char* the first record
+ * param nrec size_t the number of records
+ * param stride size_t the distance between records in bytes
+ * param out double* where to store the nrec results
+ * return int 0 on success, -1 if memory could not be allocated
+ *
+ */
+int bin_metric_batch(const bin_metric *m, const unsigned char *data,
+                     size_t nrec, size_t stride, double *out)
+{
+    uint64_t *row;
+    size_t i;
+
+    if (m->nbits <= BIN_BITSLICE_MAX_BITS &&
+        nrec >= BIN_BITSLICE_MIN_RECORDS) {
+        bin_bitslice(data, nrec, stride, m->nbits, m->table, out);
+        return 0;
+    }
+    row = (uint64_t*)malloc(bin_row_words(m->nbits)*sizeof(uint64_t));
+    if (row == NULL) {
+        return -1;
+    }
+    for (i = 0; i < nrec; i++) {
+        bin_import_row(row, data + i*stride, m->nbits);
+        out[i] = bin_metric_score(m, row);
+    }
+    free(row);
+    return 0;
+}
+
+/** brief bin_pyramid_block - Score a block and its sub-blocks at several
+ * block sizes with one chain of derivatives. Level k of a sub-block is the
+ * part of level k of the whole block whose windows lie inside the
+ * sub-block, so only the largest scale pays for deriving. At each level the
+ * row is counted once, in the ranges of the smallest scale that still has
+ * that level and the k-bit gaps between them; the count of a larger
+ * sub-block is then the sum of those of its children and the gaps between
+ * them, and its own gap is that of its last child.
+ *
+ * param row uint64_t* the block, see bin_import_row(); overwritten
+ * param m const bin_metric* the metrics of the scales, largest first; the
+ * first is as long as the block and each length divides the one before
+ * param nscales size_t the number of scales
+ * param counts size_t* scratch space of 2*m[0].nbits/m[nscales-1].nbits
+ * counts
+ * param out double* const* where to store the scores of each scale, one
+ * for each of its m[0].nbits/m[s].nbits sub-blocks
+ *
+ */
+void bin_pyramid_block(uint64_t *row, const bin_metric *m, size_t nscales,
+                       size_t *counts, double *const *out)
+{
+    size_t s, f, j, c, k, nbits = m[0].nbits, len, sub, n, ratio;
+    size_t cnt, gap;
+
+    for (s = 0; s < nscales; s++) {
+        for (j = 0; j < nbits/m[s].nbits; j++) {
+            out[s][j] = 0.0;
+        }
+    }
+    // f is the smallest scale with level k, as the scales run out of levels
+    // from the smallest up
+    f = nscales - 1;
+    for (k = 0, len = nbits; k < nbits - 1; k++, len--) {
+        while (k >= m[f].nbits - 1) {
+            f--;
+        }
+        sub = m[f].nbits;
+        n = nbits/sub;
+        for (j = 0; j < n; j++) {
+            counts[2*j] = popcount_range(row, j*sub, (j + 1)*sub - k);
+            // the gap of the last sub-block is past the end of the level
+            counts[2*j+1] = j + 1 < n ? popcount_range(
+                row, (j + 1)*sub - k, (j + 1)*sub) : 0;
+            out[f][j] += metric_level(&m[f], k, counts[2*j]);
+        }
+        for (s = f; s-- > 0;) {
+            // in place, as each parent is written after its children
+            ratio = m[s].nbits/m[s+1].nbits;
+            n = nbits/m[s].nbits;
+            for (j = 0; j < n; j++) {
+                cnt = 0;
+                for (c = j*ratio; c < (j + 1)*ratio; c++) {
+                    cnt += counts[2*c] + counts[2*c+1];
+                }
+                gap = counts[2*(j + 1)*ratio - 1];
+                counts[2*j] = cnt - gap;
+                counts[2*j+1] = gap;
+                out[s][j] += metric_level(&m[s], k, counts[2*j]);
+            }
+        }
+        deriv_words(row, bin_row_words(len));
+    }
+}
+
+/** brief bin_scan_block - Compute every statistic of the scanner for one
+ * block of bytes in a single read of the data. The bytes are counted for
+ * the byte statistics as they are loaded into the row, and the popcounts of
+ * the derivative chain give both metrics at once; levels 0 and 1 are the
+ * count of ones and the count of changes between adjacent bits, which give
+ * the monobit bias and the number of runs.
+ *
+ * param data const unsigned char* the block
+ * param nbytes size_t the length of the block in bytes, at least 1
+ * param row uint64_t* scratch space of bin_row_words(8*nbytes) words
+ * param out bin_scan_result* where to store the statistics
+ *
+ */
+void bin_scan_block(const unsigned char *data, size_t nbytes, uint64_t *row,
+                    bin_scan_result *out)
+{
+    size_t counts[256], nbits = nbytes*8, nwords = bin_row_words(nbits);
+    size_t i, j, k, len, cnt;
+    uint64_t v;
+    double p, e, t_bien = 0.0, l_bien = 0.0, t_tbien = 0.0, l_tbien = 0.0, w;
+    double expected = nbytes/256.0;
+
+    memset(counts, 0, sizeof(counts));
+    for (i = 0; i < nwords; i++) {
+        v = 0;
+        for (j = 0; j < 8; j++) {
+            v <<= 8;
+            if (i*8 + j < nbytes) {
+                v |= data[i*8 + j];
+                counts[data[i*8 + j]]++;
+            }
+        }
+        row[i] = v;
+    }
+
+    out->entropy = 0.0;
+    out->chi2 = 0.0;
+    for (i = 0; i < 256; i++) {
+        if (counts[i]) {
+            p = (double)counts[i]/nbytes;
+            out->entropy -= p*log2(p);
+        }
+        e = counts[i] - expected;
+        out->chi2 += e*e/expected;
+    }
+
+    for (k = 0, len = nbits; k < nbits - 1; k++, len--) {
+        cnt = popcount_range(row, 0, len);
+        if (k == 0) {
+            out->monobit = (double)cnt/nbits - 0.5;
+        } else if (k == 1) {
+            out->runs = (int64_t)cnt + 1;
+        }
+        e = bin_entropy(cnt, len);
+        w = bin_weight(BIN_METRIC_BIEN, nbits, k);
+        t_bien += w*e;
+        l_bien += w;
+        w = bin_weight(BIN_METRIC_TBIEN, nbits, k);
+        t_tbien += w*e;
+        l_tbien += w;
+        deriv_words(row, bin_row_words(len));
+    }
+    out->bien = t_bien/l_bien;
+    out->tbien = t_tbien/l_tbien;
+}
+
+/** brief bin_score_bytes - Compute BiEn or TBiEn of a big-endian byte string
+ * with the word-level engine. This function, bin_bien_bytes(),
+ * bin_tbien_bytes(), bin_batch() and bin_ragged() make up the plain C
+ * interface of the engine, which takes a pointer, a length in bits and
+ * where to store the results, and is used by the cffi binding. BiEn of
+ * strings of at least BIN_BIEN_TOP_MIN_BITS bits is left to bin_bien_top().
+ *
+ * param data const unsigned char* the input
+ * param nbits size_t the length of the input in bits
+ * param metric int BIN_METRIC_BIEN or BIN_METRIC_TBIEN
+ * return double the metric of the input, or -1 if nbits is less than 2 or
+ * memory could not be allocated
+ *
+ */
+double bin_score_bytes(const unsigned char *data, size_t nbits, int metric)
+{
+    uint64_t stack_row[64], *row = stack_row;
+    size_t nwords = bin_row_words(nbits);
+    double result;
+
+    if (nbits < 2) {
+        return -1.0;
+    }
+    if (nwords > 64) {
+        row = (uint64_t*)malloc(nwords*sizeof(uint64_t));
+        if (row == NULL) {
+            return -1.0;
+        }
+    }
+    if (metric == BIN_METRIC_BIEN && nbits >= BIN_BIEN_TOP_MIN_BITS) {
+        result = bin_bien_top(data, nbits, row);
+    } else {
+        bin_import_row(row, data, nbits);
+        result = bin_score_row(row, nbits, metric);
+    }
+    if (row != stack_row) {
+        free(row);
+    }
+    return result;
+}
+
+/** brief bin_bien_bytes - BiEn of a big-endian byte string, see
+ * bin_score_bytes()
+ */
+double bin_bien_bytes(const unsigned char *data, size_t nbits)
+{
+    return bin_score_bytes(data, nbits, BIN_METRIC_BIEN);
+}
+
+/** brief bin_tbien_bytes - TBiEn of a big-endian byte string, see
+ * bin_score_bytes()
+ */
+double bin_tbien_bytes(const unsigned char *data, size_t nbits)
+{
+    return bin_score_bytes(data, nbits, BIN_METRIC_TBIEN);
+}
+
+/** brief bin_ragged - Compute BiEn or TBiEn of records of different lengths
+ * stored one after another, in the layout of Arrow binary arrays.
+ *
+ * param data const unsigned char* the data buffer
+ * param offsets const int64_t* the nrec+1 offsets in data where each record
+ * starts, followed by the end of the last record
+ * param bit_lengths const int64_t* the length of each record in bits, or
+ * NULL if every bit of its bytes is used; each must be at least 2
+ * param nrec size_t the number of records
+ * param metric int BIN_METRIC_BIEN or BIN_METRIC_TBIEN
+ * param out double* where to store the nrec results
+ * return int 0 on success, -1 if memory could not be allocated
+ *
+ */
+int bin_ragged(const unsigned char *data, const int64_t *offsets,
+               const int64_t *bit_lengths, size_t nrec, int metric,
+               double *out)
+{
+    uint64_t *row;
+    size_t i, nbits, max_bits = 0;
+
+    for (i = 0; i < nrec; i++) {
+        nbits = bit_lengths != NULL ? (size_t)bit_lengths[i]
+            : (size_t)(offsets[i+1] - offsets[i])*8;
+        if (nbits > max_bits) {
+            max_bits = nbits;
+        }
+    }
+    row = (uint64_t*)malloc((bin_row_words(max_bits) + 1)*sizeof(uint64_t));
+    if (row == NULL) {
+        return -1;
+    }
+    for (i = 0; i < nrec; i++) {
+        nbits = bit_lengths != NULL ? (size_t)bit_lengths[i]
+            : (size_t)(offsets[i+1] - offsets[i])*8;
+        out[i] = bin_score_split(data + offsets[i], nbits, metric, row);
+    }
+    free(row);
+    return 0;
+}
+
+/** brief bin_summary_init - Prepare an empty summary of a stream of values:
+ * their count, mean and variance by Welford's method, their extremes, and a
+ * histogram of nbins equal bins over [lo, hi] with counts of the values on
+ * either side. Summaries of parts of a stream are combined with
+ * bin_summary_merge().
+ *
+ * param s bin_summary* the summary to fill in
+ * param nbins size_t the number of bins, at least 1
+ * param lo double the lower edge of the first bin
+ * param hi double the upper edge of the last bin, greater than lo
+ * return int 0 on success, -1 if memory could not be allocated
+ *
+ */
+int bin_summary_init(bin_summary *s, size_t nbins, double lo, double hi)
+{
+    s->nbins = nbins;
+    s->lo = lo;
+    s->hi = hi;
+    s->count = 0;
+    s->mean = 0.0;
+    s->m2 = 0.0;
+    s->min = HUGE_VAL;
+    s->max = -HUGE_VAL;
+    s->below = 0;
+    s->above = 0;
+    s->hist = (int64_t*)calloc(nbins, sizeof(int64_t));
+    return s->hist == NULL ? -1 : 0;
+}
+
+/** brief bin_summary_free - Free the histogram of a summary.
+ */
+void bin_summary_free(bin_summary *s)
+{
+    free(s->hist);
+    s->hist = NULL;
+}
+
+/** brief bin_summary_add - Add one value to a summary. NaNs are ignored.
+ */
+void bin_summary_add(bin_summary *s, double x)
+{
+    double d;
+    size_t b;
+
+    if (x != x) {
+        return;
+    }
+    s->count++;
+    d = x - s->mean;
+    s->mean += d/s->count;
+    s->m2 += d*(x - s->mean);
+    if (x < s->min) {
+        s->min = x;
+    }
+    if (x > s->max) {
+        s->max = x;
+    }
+    if (x < s->lo) {
+        s->below++;
+    } else if (x > s->hi) {
+        s->above++;
+    } else {
+        b = (size_t)((x - s->lo)/(s->hi - s->lo)*s->nbins);
+        s->hist[b < s->nbins ? b : s->nbins - 1]++;
+    }
+}
+
+/** brief bin_summary_add_array - Add n values, stride doubles apart, to a
+ * summary. The stride may be negative.
+ */
+void bin_summary_add_array(bin_summary *s, const double *values, size_t n,
+                           ptrdiff_t stride)
+{
+    size_t i;
+
+    for (i = 0; i < n; i++) {
+        bin_summary_add(s, values[(ptrdiff_t)i*stride]);
+    }
+}
+
+/** brief bin_summary_merge - Add the values summarized by other to s, as if
+ * they had been added one by one. The counts, extremes and histogram are
+ * combined exactly, and the moments by the pairwise formula of Chan et al.,
+ * which is exact up to rounding. Both summaries must have the same bins.
+ */
+void bin_summary_merge(bin_summary *s, const bin_summary *other)
+{
+    size_t b;
+    double d, n;
+
+    if (other->count == 0) {
+        return;
+    }
+    n = (double)s->count + (double)other->count;
+    d = other->mean - s->mean;
+    s->mean += d*((double)other->count/n);
+    s->m2 += other->m2 + d*d*((double)s->count*(double)other->count/n);
+    s->count += other->count;
+    if (other->min < s->min) {
+        s->min = other->min;
+    }
+    if (other->max > s->max) {
+        s->max = other->max;
+    }
+    s->below += other->below;
+    s->above += other->above;
+    for (b = 0; b < s->nbins; b++) {
+        s->hist[b] += other->hist[b];
+    }
+}
+
+/** brief bin_summary_quantile - Estimate a quantile of the values of a
+ * summary from its histogram, interpolating linearly within the bin where
+ * it falls and between the extremes and the range of the histogram for
+ * values outside it. The error is at most the width of one bin.
+ *
+ * param s const bin_summary* the summary
+ * param q double the probability, in [0, 1]
+ * return double the quantile, or NaN if the summary is empty
+ *
+ */
+double bin_summary_quantile(const bin_summary *s, double q)
+{
+    double target, cum, width, x;
+    size_t b;
+
+    if (s->count == 0) {
+        return HUGE_VAL - HUGE_VAL;
+    }
+    target = q*s->count;
+    width = (s->hi - s->lo)/s->nbins;
+    if (s->below > 0 && target <= s->below) {
+        x = s->min + (s->lo - s->min)*(target/s->below);
+    } else {
+        cum = (double)s->below;
+        x = s->max;
+        for (b = 0; b < s->nbins; b++) {
+            if (s->hist[b] > 0 && cum + s->hist[b] >= target) {
+                x = s->lo + (b + (target - cum)/s->hist[b])*width;
+                break;
+            }
+            cum += s->hist[b];
+        }
+        if (b == s->nbins && s->above > 0) {
+            x = s->hi + (s->max - s->hi)*((target - cum)/s->above);
+        }
+    }
+    return x < s->min ? s->min : (x > s->max ? s->max : x);
+}
+
+/** brief bin_summary_fraction_below - Estimate the fraction of the values of
+ * a summary that are less than x, from its histogram. This is exact when x
+ * is an edge of a bin and no values fall on it, and is interpolated
+ * linearly within the bin otherwise.
+ *
+ * param s const bin_summary* the summary
+ * param x double the threshold
+ * return double the fraction, or NaN if the summary is empty
+ *
+ */
+double bin_summary_fraction_below(const bin_summary *s, double x)
+{
+    double cum, pos;
+    size_t b, whole;
+
+    if (s->count == 0) {
+        return HUGE_VAL - HUGE_VAL;
+    }
+    if (x <= s->min) {
+        return 0.0;
+    }
+    if (x > s->max) {
+        return 1.0;
+    }
+    if (x < s->lo) {
+        return s->below*(x - s->min)/(s->lo - s->min)/s->count;
+    }
+    cum = (double)s->below;
+    if (x > s->hi) {
+        for (b = 0; b < s->nbins; b++) {
+            cum += s->hist[b];
+        }
+        cum += s->above*(x - s->hi)/(s->max - s->hi);
+        return cum/s->count;
+    }
+    pos = (x - s->lo)/(s->hi - s->lo)*s->nbins;
+    whole = (size_t)pos;
+    for (b = 0; b < whole && b < s->nbins; b++) {
+        cum += s->hist[b];
+    }
+    if (whole < s->nbins) {
+        cum += s->hist[whole]*(pos - whole);
+    }
+    return cum/s->count;
+}
@@ -18,8 +18,64 @@
 ******************************************************************************/
 
 #include <stdio.h>
+#include <stddef.h>
 #include <gmp.h>
 
+#if defined(_MSC_VER) && (_MSC_VER < 1600)
+// support for VC9/Visual C++ 2008, which does not ship stdint.h
+typedef unsigned __int64 uint64_t;
+typedef __int64 int64_t;
+typedef unsigned __int32 uint32_t;
+typedef __int32 int32_t;
+#else
+#include <stdint.h>
+#endif
+
+// Bumped whenever the result of any engine may change for some input
+#define BIN_ENGINE_VERSION 2
+
+// Metrics understood by the word-level engines; prepared metrics may also
+// weight the levels equally or as the caller chooses
+#define BIN_METRIC_BIEN 0
+#define BIN_METRIC_TBIEN 1
+#define BIN_METRIC_UNIFORM 2
+#define BIN_METRIC_CUSTOM 3
+
+// Engines for batches of records
+#define BIN_ENGINE_AUTO 0
+#define BIN_ENGINE_WORDS 1
+#define BIN_ENGINE_BITSLICE 2
+
+// The bit-sliced engine handles records of up to one word, and is chosen
+// automatically for batches of at least this many records
+#define BIN_BITSLICE_MAX_BITS 64
+#define BIN_BITSLICE_MIN_RECORDS 32
+
+// The pairwise functions work on square tiles of pairs whose records take
+// up about this many bytes
+#define BIN_PAIRWISE_TILE_BYTES 16384
+
+// Prepared metrics keep a table of weighted entropies by level and count of
+// ones for strings of up to this length (about 2 MB at the limit)
+#define BIN_METRIC_TABLE_MAX_BITS 512
+
+// Upper bounds on partial scores in bin_metric_score_bound() are widened by
+// this much to allow for rounding in the sum of the weights
+#define BIN_BOUND_MARGIN 1e-12
+
+// BiEn is computed from the top levels of the derivative triangle, starting
+// with this many, for strings of at least BIN_BIEN_TOP_MIN_BITS bits
+#define BIN_BIEN_TOP_LEVELS 64
+#define BIN_BIEN_TOP_MIN_BITS 64
+
+// Strings longer than this are scored in several ranges of derivative levels
+// of about the cost of a string of this length, see bin_level_pieces()
+#define BIN_SPLIT_BITS 32768
+
+// tbien_estimate() computes the derivative levels of at most this many bits
+// exactly and samples the longer ones
+#define BIN_ESTIMATE_EXACT_BITS 256
+
 struct mpz_bin_struct {
     mpz_t i;
     unsigned len;
@@ -27,9 +83,115 @@ struct mpz_bin_struct {
 
 typedef struct mpz_bin_struct mpz_bin;
 
+// A metric prepared for strings of a fixed length, see bin_metric_init()
+struct bin_metric_struct {
+    size_t nbits;
+    int metric;
+    double *weights; // the normalized weight of each level
+    double *table; // weighted entropies by level and count, or NULL
+};
+
+typedef struct bin_metric_struct bin_metric;
+
+// The statistics of one block from bin_scan_block(), laid out as the
+// records of the structured array returned by scan_metrics()
+struct bin_scan_result_struct {
+    double bien;
+    double tbien;
+    double entropy; // Shannon entropy of the bytes, in bits per byte
+    double monobit; // the fraction of ones less one half
+    int64_t runs; // the number of runs of identical bits
+    double chi2; // chi-square statistic of the byte counts
+};
+
+typedef struct bin_scan_result_struct bin_scan_result;
+
+// A mergeable summary of a stream of values, such as the scores of a
+// corpus, see bin_summary_init()
+struct bin_summary_struct {
+    size_t nbins;
+    double lo, hi; // the range of the histogram
+    int64_t count; // the number of values, not counting NaNs
+    double mean;
+    double m2; // the sum of squared differences from the mean
+    double min, max;
+    int64_t below, above; // the number of values outside [lo, hi]
+    int64_t *hist;
+};
+
+typedef struct bin_summary_struct bin_summary;
+
 mpz_bin mpz_bin_d (mpz_bin x);
 
 mpz_bin mpz_bin_d_k (mpz_bin x, unsigned k);
 
 double bien(mpz_bin s);
 double tbien(mpz_bin s);
+
+size_t bin_row_words(size_t nbits);
+double bin_score_row(uint64_t *row, size_t nbits, int metric);
+size_t bin_level_pieces(size_t nbits);
+size_t bin_piece_level(size_t nbits, size_t npieces, size_t p);
+void bin_score_levels(uint64_t *row, size_t nbits, int metric, size_t k0,
+                      size_t k1, double *t, double *l);
+double bin_score_split(const unsigned char *data, size_t nbits, int metric,
+                       uint64_t *row);
+void bin_import_row(uint64_t *row, const unsigned char *data, size_t nbits);
+int bin_batch(const unsigned char *data, size_t nrec, size_t stride,
+              size_t nbits, int metric, int engine, double *out);
+int bin_range(uint64_t start, uint64_t stop, size_t nbits, int metric,
+              double *out, size_t nbins, uint64_t *hist);
+size_t bin_level_ones(const uint64_t *row, uint64_t *work, size_t nbits,
+                      size_t k);
+double bin_level_entropy(const uint64_t *row, uint64_t *work, size_t nbits,
+                         size_t k);
+size_t bin_row_level(uint64_t *row, size_t nbits, size_t k);
+void bin_row_deriv(uint64_t *row, size_t len);
+void bin_export_row(unsigned char *data, const uint64_t *row, size_t nbits);
+double bin_bien_top(const unsigned char *data, size_t nbits, uint64_t *row);
+double bin_level_weights(size_t k0, size_t k1);
+size_t bin_estimate_strata(size_t nbits, size_t samples);
+size_t bin_stratum_level(size_t nbits, size_t nstrata, size_t s);
+size_t bin_stratum_samples(size_t samples, size_t nstrata, size_t s);
+void bin_sample_levels(size_t nbits, size_t samples, uint64_t seed,
+                       size_t *levels);
+int bin_metric_init(bin_metric *m, size_t nbits, int metric);
+int bin_metric_init_weights(bin_metric *m, size_t nbits,
+                            const double *weights);
+int bin_metric_init_plain(bin_metric *m, size_t nbits, int metric,
+                          const double *weights);
+void bin_metric_free(bin_metric *m);
+double bin_metric_score(const bin_metric *m, uint64_t *row);
+void bin_metric_score_levels(const bin_metric *m, uint64_t *row, size_t k0,
+                             size_t k1, double *t, double *l);
+double bin_metric_score_bound(const bin_metric *m, uint64_t *row,
+                              double bound, int largest);
+double bin_metric_score_xor(const bin_metric *m, const uint64_t *a,
+                            const uint64_t *b, uint64_t *row);
+int bin_metric_batch(const bin_metric *m, const unsigned char *data,
+                     size_t nrec, size_t stride, double *out);
+void bin_pyramid_block(uint64_t *row, const bin_metric *m, size_t nscales,
+                       size_t *counts, double *const *out);
+void bin_scan_block(const unsigned char *data, size_t nbytes, uint64_t *row,
+                    bin_scan_result *out);
+
+// The plain C interface, see bin_score_bytes()
+double bin_score_bytes(const unsigned char *data, size_t nbits, int metric);
+double bin_bien_bytes(const unsigned char *data, size_t nbits);
+double bin_tbien_bytes(const unsigned char *data, size_t nbits);
+int bin_pack_bits(const unsigned char *src, size_t n, ptrdiff_t stride,
+                  unsigned char *dst);
+int bin_pack_strided(const unsigned char *src, size_t n, ptrdiff_t stride,
+                     size_t itemsize, int bit, unsigned char *dst);
+int bin_ragged(const unsigned char *data, const int64_t *offsets,
+               const int64_t *bit_lengths, size_t nrec, int metric,
+               double *out);
+
+int bin_summary_init(bin_summary *s, size_t nbins, double lo, double hi);
+void bin_summary_free(bin_summary *s);
+void bin_summary_add(bin_summary *s, double x);
+void bin_summary_add_array(bin_summary *s, const double *values, size_t n,
+                           ptrdiff_t stride);
+void bin_summary_merge(bin_summary *s, const bin_summary *other);
+double bin_summary_quantile(const bin_summary *s, double q);
+double bin_summary_fraction_below(const bin_summary *s, double x);
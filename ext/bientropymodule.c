@@ -26,48 +26,163 @@
 #define PyString_Check PyBytes_Check
 #define PyString_Size PyBytes_Size
 #define PyString_AsString PyBytes_AsString
+#define PyString_FromStringAndSize PyBytes_FromStringAndSize
 #endif
 
+#include <float.h>
+#include <pythread.h>
+#include <structmember.h>
+
 #include "bientropy.h"
 
-/** brief bientropy_wrapper - translates parameters from Python, calls C-level
- * function, and translates the return object back into Python. Shared by the
- * bien and tbien functions.
+/* Per-module state. The functions share no mutable state between calls, so
+ * the module may be loaded in several sub-interpreters and used without the
+ * GIL; all that is kept is what is looked up once when the module loads.
+ */
+typedef struct {
+    int ncpus; // the default number of threads
+    PyObject *summary_type; // the Summary type, to check arguments
+    PyObject *metric_type; // the Metric type, to check arguments
+    PyObject *derivatives_type; // the type of iter_derivatives() iterators
+} bientropy_state;
+
+/** brief get_state - the state of the module passed as self to the module's
+ * functions. Python 2 has a single interpreter, so it shares one state.
+ */
+static bientropy_state *
+get_state(PyObject *module)
+{
+#if PY_MAJOR_VERSION >= 3
+    return (bientropy_state*)PyModule_GetState(module);
+#else
+    static bientropy_state state;
+    return &state;
+#endif
+}
+
+/** brief get_bit_array - gets a view of an unpacked bit array, with one bit
+ * per element, such as a NumPy array of bool. Arrays of uint8 holding 0 and
+ * 1 are also taken when unpacked is set; otherwise bytes are packed bits.
  *
- * param self PyObject* not used
- * param args PyObject* arguments from the Pythin interpreter
- * param f double(*)(mpz_bin) pointer to the C-level function to use
+ * param obj PyObject* the object to check
+ * param unpacked int whether arrays of bytes hold one bit per byte
+ * param view Py_buffer* where to store the view, which the caller releases
  *
- * return PyObject*
+ * return int 1 if obj is an unpacked bit array, 0 if not, or -1 with an
+ * exception set
+ */
+static int
+get_bit_array(PyObject *obj, int unpacked, Py_buffer *view)
+{
+    const char *format;
+
+    if (!PyObject_CheckBuffer(obj) ||
+            PyObject_GetBuffer(obj, view, PyBUF_STRIDES | PyBUF_FORMAT) < 0) {
+        if (unpacked) {
+            if (!PyErr_Occurred())
+                PyErr_SetString(PyExc_TypeError,
+                                "An unpacked bit array is required.");
+            return -1;
+        }
+        PyErr_Clear();
+        return 0;
+    }
+    format = view->format == NULL ? "B" : view->format;
+    // the byte order does not matter for one-byte elements
+    if (strchr("@=<>!", format[0]) != NULL && format[0] != '\0')
+        format++;
+    if (view->itemsize == 1 && (strcmp(format, "?") == 0 || (unpacked &&
+            (strcmp(format, "B") == 0 || strcmp(format, "b") == 0))))
+        return 1;
+    PyBuffer_Release(view);
+    if (unpacked) {
+        PyErr_SetString(PyExc_TypeError,
+                        "An unpacked bit array must hold bool or uint8.");
+        return -1;
+    }
+    return 0;
+}
+
+/** brief pack_bit_rows - packs the rows of an unpacked bit array from
+ * get_bit_array() into rows of (bits+7)/8 bytes, releasing the GIL while it
+ * works. A one-dimensional array is a single row.
+ *
+ * param view Py_buffer* the array
+ * param dst unsigned char* the packed rows
+ *
+ * return int 0 on success, -1 with an exception set
+ */
+static int
+pack_bit_rows(const Py_buffer *view, unsigned char *dst)
+{
+    Py_ssize_t r, nrows, nbits, row_stride, stride;
+    int rc = 0;
+
+    nrows = view->ndim == 2 ? view->shape[0] : 1;
+    nbits = view->shape[view->ndim - 1];
+    stride = view->strides[view->ndim - 1];
+    row_stride = view->ndim == 2 ? view->strides[0] : 0;
+    Py_BEGIN_ALLOW_THREADS
+    for (r = 0; r < nrows && rc == 0; r++) {
+        rc = bin_pack_bits((const unsigned char*)view->buf + r*row_stride,
+                           nbits, stride, dst + r*((nbits + 7)/8));
+    }
+    Py_END_ALLOW_THREADS
+    if (rc < 0) {
+        PyErr_SetString(PyExc_ValueError,
+                        "An unpacked bit array must hold only 0 and 1.");
+        return -1;
+    }
+    return 0;
+}
+
+/** brief as_bit_bytes - converts a Python object to a binary string holding
+ * its bits from the most significant bit of the first byte. Accepts binary
+ * strings, one-dimensional unpacked bit arrays (see get_bit_array()), which
+ * are packed, and objects with both a tobytes() method and a len() method
+ * that returns the length in bits.
+ *
+ * param in_obj PyObject* the object to convert
+ * param unpacked int whether arrays of bytes hold one bit per byte
+ * param nbits Py_ssize_t* where to store the length of the string in bits
+ *
+ * return PyObject* a new reference to a binary string, or NULL on error
  */
 static PyObject *
-bientropy_wrapper(PyObject *self, PyObject *args, double (*f)(mpz_bin))
+as_bit_bytes(PyObject *in_obj, int unpacked, Py_ssize_t *nbits)
 {
-    PyObject *in_obj = NULL;
-    mpz_bin in;
-    PyObject *retval = NULL;
-    unsigned int slack;
+    Py_buffer view;
+    PyObject *bytestr;
+    int rc;
 
-    // PyArg_ParseTuple returns a borrowed reference for objects
-    if (!PyArg_ParseTuple(args, "O", &in_obj))
+    rc = PyString_Check(in_obj) && !unpacked ? 0 :
+        get_bit_array(in_obj, unpacked, &view);
+    if (rc < 0)
         return NULL;
-
-    mpz_init(in.i);
+    if (rc) {
+        if (view.ndim != 1) {
+            PyErr_SetString(PyExc_ValueError,
+                            "A one-dimensional bit array is required.");
+            PyBuffer_Release(&view);
+            return NULL;
+        }
+        bytestr = PyString_FromStringAndSize(NULL, (view.shape[0] + 7)/8);
+        if (bytestr != NULL && pack_bit_rows(
+                &view, (unsigned char*)PyString_AsString(bytestr)) < 0)
+            Py_CLEAR(bytestr);
+        *nbits = view.shape[0];
+        PyBuffer_Release(&view);
+        return bytestr;
+    }
     if (PyString_Check(in_obj)) {
-        mpz_import(in.i, // rop
-                   PyString_Size(in_obj), //count
-                   1, // order
-                   1, // size
-                   1, // endian
-                   0, // nails
-                   (void*)PyString_AsString(in_obj));
-        in.len = PyString_Size(in_obj)*8;
+        *nbits = PyString_Size(in_obj)*8;
+        Py_INCREF(in_obj);
+        return in_obj;
     } else if (PyObject_HasAttrString(in_obj, "tobytes")) {
         PyObject* tobytes_f = PyObject_GetAttrString(in_obj, "tobytes");
-        PyObject* bytestr = PyObject_CallObject(tobytes_f, NULL);
+        bytestr = PyObject_CallObject(tobytes_f, NULL);
+        Py_DECREF(tobytes_f);
         if (bytestr == NULL) {
-            mpz_clear(in.i);
-            Py_DECREF(tobytes_f);
             return NULL;
         }
         if (!PyString_Check(bytestr)) {
@@ -75,16 +190,12 @@ bientropy_wrapper(PyObject *self, PyObject *args, double (*f)(mpz_bin))
                 PyExc_ValueError,
                 "The result of the object's tobytes() method must be a "
                 "binary string.");
-            mpz_clear(in.i);
-            Py_DECREF(tobytes_f);
             Py_DECREF(bytestr);
             return NULL;
         }
-        slack = PyString_Size(bytestr)*8 - PyObject_Size(in_obj);
 #ifdef DEBUG
         printf("Length of byte string: %ld\n", PyString_Size(bytestr));
         printf("Length of object (bits): %ld\n", PyObject_Size(in_obj));
-        printf("Expected trailing bits: %d (to be shifted out)\n", slack);
 #endif
         if (PyString_Size(bytestr)*8 < PyObject_Size(in_obj) ||
             PyString_Size(bytestr) > (PyObject_Size(in_obj)/8 + 1))
@@ -93,32 +204,50 @@ bientropy_wrapper(PyObject *self, PyObject *args, double (*f)(mpz_bin))
                 PyExc_TypeError,
                 "The result of the object's len() method must be the number "
                 "of bits in the string.");
-            mpz_clear(in.i);
-            Py_DECREF(tobytes_f);
             Py_DECREF(bytestr);
             return NULL;
         }
+        *nbits = PyObject_Size(in_obj);
+        return bytestr;
+    }
+    PyErr_SetString(
+        PyExc_TypeError,
+        "A binary string or an object with both a tobytes() method and "
+        "a len() method that returns the length in bits is required.");
+    return NULL;
+}
 
-        mpz_import(in.i, //rop
-                   PyString_Size(bytestr), //count
-                   1, // order
-                   1, // size
-                   1, // endian
-                   0, // nails
-                   (void*)PyString_AsString(bytestr));
-        mpz_tdiv_q_2exp(in.i, in.i, slack);
-        in.len = PyObject_Size(in_obj);
+/** brief gmp_score - computes a metric of a binary string with a GMP-based
+ * function, releasing the GIL while it runs. Shared by the bien and tbien
+ * functions.
+ *
+ * param bytestr PyObject* the string, from as_bit_bytes()
+ * param nbits Py_ssize_t the length of the string in bits
+ * param f double(*)(mpz_bin) pointer to the C-level function to use
+ *
+ * return PyObject*
+ */
+static PyObject *
+gmp_score(PyObject *bytestr, Py_ssize_t nbits, double (*f)(mpz_bin))
+{
+    mpz_bin in;
+    unsigned int slack;
+    double result;
 
-        Py_DECREF(tobytes_f);
-        Py_DECREF(bytestr);
-    } else {
-        PyErr_SetString(
-            PyExc_TypeError,
-            "A binary string or an object with both a tobytes() method and "
-            "a len() method that returns the length in bits is required.");
-        mpz_clear(in.i);
-        return NULL;
-    }
+    mpz_init(in.i);
+    mpz_import(in.i, // rop
+               PyString_Size(bytestr), //count
+               1, // order
+               1, // size
+               1, // endian
+               0, // nails
+               (void*)PyString_AsString(bytestr));
+    slack = PyString_Size(bytestr)*8 - nbits;
+#ifdef DEBUG
+    printf("Expected trailing bits: %d (to be shifted out)\n", slack);
+#endif
+    mpz_tdiv_q_2exp(in.i, in.i, slack);
+    in.len = nbits;
 
 #ifdef DEBUG
     gmp_printf("The binary string: 0x%Zx, %d bits\n", in.i, in.len);
@@ -141,22 +270,64 @@ bientropy_wrapper(PyObject *self, PyObject *args, double (*f)(mpz_bin))
     }
 
     if (f == bien && in.len > 32) {
-        PyErr_WarnEx(
-            PyExc_Warning,
-            "The BiEn algorithm is not suitable for binary strings "
-            "longer than 32 bits.",
-            1);
+        if (PyErr_WarnEx(
+                PyExc_Warning,
+                "The BiEn algorithm is not suitable for binary strings "
+                "longer than 32 bits.",
+                1) < 0) {
+            mpz_clear(in.i);
+            return NULL;
+        }
     }
 
-    retval = PyFloat_FromDouble(f(in));
+    Py_BEGIN_ALLOW_THREADS
+    result = f(in);
+    Py_END_ALLOW_THREADS
 
     mpz_clear(in.i);
 
+    return PyFloat_FromDouble(result);
+}
+
+/** brief bientropy_wrapper - translates parameters from Python, calls C-level
+ * function, and translates the return object back into Python.
+ *
+ * The GIL is released while the metric is computed.
+ *
+ * param self PyObject* not used
+ * param args PyObject* arguments from the Pythin interpreter
+ * param kwds PyObject* keyword arguments from the Python interpreter
+ * param f double(*)(mpz_bin) pointer to the C-level function to use
+ *
+ * return PyObject*
+ */
+static PyObject *
+bientropy_wrapper(PyObject *self, PyObject *args, PyObject *kwds,
+                  double (*f)(mpz_bin))
+{
+    static char *kwlist[] = {"bits", "unpacked", NULL};
+    PyObject *in_obj = NULL, *unpacked_obj = Py_False, *bytestr, *retval;
+    Py_ssize_t nbits;
+    int unpacked;
+
+    // PyArg_ParseTuple returns a borrowed reference for objects
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|O", kwlist, &in_obj,
+                                     &unpacked_obj))
+        return NULL;
+    unpacked = PyObject_IsTrue(unpacked_obj);
+    if (unpacked < 0)
+        return NULL;
+
+    bytestr = as_bit_bytes(in_obj, unpacked, &nbits);
+    if (bytestr == NULL)
+        return NULL;
+    retval = gmp_score(bytestr, nbits, f);
+    Py_DECREF(bytestr);
     return retval;
 }
 
 #define DOC_BIEN \
-"bien(bits)\n" \
+"bien(bits, unpacked=False, engine=None)\n" \
 "\n" \
 "BiEntropy, or BiEn for short, is a weighted average of the Shannon binary\n" \
 "entropies of the string and the first n-2 binary derivatives of the string\n" \
@@ -164,28 +335,110 @@ bientropy_wrapper(PyObject *self, PyObject *args, double (*f)(mpz_bin))
 "shorter binary strings where n <= 32, approximately.\n" \
 "\n" \
 "This algorithm evaluates the order and disorder of a binary string of\n" \
-"length n in O(n^2) time using O(n) memory.\n" \
+"length n in O(n^2) time using O(n) memory. However, the weights of the\n" \
+"levels of the derivative triangle halve from each level to the one below,\n" \
+"so only the top few dozen levels affect the result in double precision.\n" \
+"Strings of 64 bits or more are scored from the top levels only, starting\n" \
+"from one computed directly from the input, which for most strings takes\n" \
+"O(n) time. The result agrees with the GMP engine to about the precision of\n" \
+"a double.\n" \
 "\n" \
 "Parameters\n" \
 "----------\n" \
-"bits : bytes object or bitstring-like object\n" \
+"bits : bytes object, bitstring-like object or bit array\n" \
 "    the input bitstring on which to operate; this function can accept a\n" \
-"    Python bytes string or bitstring object (any object with a tobytes()\n" \
+"    Python bytes string, a bitstring object (any object with a tobytes()\n" \
 "    method that returns a byte string and a len() method that returns the\n" \
-"    length in bits)\n" \
+"    length in bits) or a one-dimensional NumPy array of bool with one bit\n" \
+"    per element, which is packed as it is read\n" \
+"unpacked : bool, optional\n" \
+"    read a bytes-like object or array of uint8 as one bit per byte, each\n" \
+"    0 or 1, rather than as packed bits\n" \
+"engine : str, optional\n" \
+"    'gmp' to sum every level with GMP, 'top' to use the top levels only,\n" \
+"    or 'auto' (the default) to choose by length\n" \
 "\n" \
 "Returns\n" \
 "-------\n" \
 "float\n" \
 "    the BiEntropy of the input\n"
 static PyObject *
-bientropy_bien(PyObject *self, PyObject *args)
+bientropy_bien(PyObject *self, PyObject *args, PyObject *kwds)
 {
-    return bientropy_wrapper(self, args, bien);
+    // unpacked comes first, as for tbien() and the cffi binding
+    static char *kwlist[] = {"bits", "unpacked", "engine", NULL};
+    PyObject *in_obj = NULL, *unpacked_obj = Py_False, *bytestr, *retval;
+    const char *engine = NULL;
+    Py_ssize_t nbits;
+    uint64_t *row;
+    int top, unpacked;
+    double result;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|Oz", kwlist,
+                                     &in_obj, &unpacked_obj, &engine))
+        return NULL;
+    unpacked = PyObject_IsTrue(unpacked_obj);
+    if (unpacked < 0)
+        return NULL;
+    if (engine == NULL || strcmp(engine, "auto") == 0) {
+        top = -1;
+    } else if (strcmp(engine, "gmp") == 0) {
+        top = 0;
+    } else if (strcmp(engine, "top") == 0) {
+        top = 1;
+    } else {
+        PyErr_Format(PyExc_ValueError,
+                     "Unknown engine '%s'; expected 'auto', 'gmp' or 'top'.",
+                     engine);
+        return NULL;
+    }
+
+    bytestr = as_bit_bytes(in_obj, unpacked, &nbits);
+    if (bytestr == NULL)
+        return NULL;
+    if (top < 0) {
+        top = nbits >= BIN_BIEN_TOP_MIN_BITS;
+    }
+    if (!top) {
+        retval = gmp_score(bytestr, nbits, bien);
+        Py_DECREF(bytestr);
+        return retval;
+    }
+
+    if (nbits < 2) {
+        PyErr_SetString(
+            PyExc_ValueError,
+            "The input string is too short for the top-level engine.");
+        Py_DECREF(bytestr);
+        return NULL;
+    }
+    if (nbits > 32) {
+        if (PyErr_WarnEx(
+                PyExc_Warning,
+                "The BiEn algorithm is not suitable for binary strings "
+                "longer than 32 bits.",
+                1) < 0) {
+            Py_DECREF(bytestr);
+            return NULL;
+        }
+    }
+    row = (uint64_t*)malloc(bin_row_words(nbits)*sizeof(uint64_t));
+    if (row == NULL) {
+        Py_DECREF(bytestr);
+        return PyErr_NoMemory();
+    }
+    Py_BEGIN_ALLOW_THREADS
+    result = bin_bien_top((const unsigned char*)PyString_AsString(bytestr),
+                          nbits, row);
+    Py_END_ALLOW_THREADS
+    free(row);
+    Py_DECREF(bytestr);
+
+    return PyFloat_FromDouble(result);
 }
 
 #define DOC_TBIEN \
-"tbien(bits)\n" \
+"tbien(bits, unpacked=False)\n" \
 "\n" \
 "The logarithmic weighting BiEntropy, or TBiEn for short, gives greater\n" \
 "weight to the higher binary derivatives. As a result, has a slightly faster\n" \
@@ -196,62 +449,4945 @@ bientropy_bien(PyObject *self, PyObject *args)
 "\n" \
 "Parameters\n" \
 "----------\n" \
-"bits : bytes object or bitstring-like object\n" \
+"bits : bytes object, bitstring-like object or bit array\n" \
 "    the input bitstring on which to operate; this function can accept a\n" \
-"    Python bytes string or bitstring object (any object with a tobytes()\n" \
+"    Python bytes string, a bitstring object (any object with a tobytes()\n" \
 "    method that returns a byte string and a len() method that returns the\n" \
-"    length in bits)\n" \
+"    length in bits) or a one-dimensional NumPy array of bool with one bit\n" \
+"    per element, which is packed as it is read\n" \
+"unpacked : bool, optional\n" \
+"    read a bytes-like object or array of uint8 as one bit per byte, each\n" \
+"    0 or 1, rather than as packed bits\n" \
 "\n" \
 "Returns\n" \
 "-------\n" \
 "float\n" \
 "    the TBiEntropy of the input\n"
 static PyObject *
-bientropy_tbien(PyObject *self, PyObject *args)
+bientropy_tbien(PyObject *self, PyObject *args, PyObject *kwds)
 {
-    return bientropy_wrapper(self, args, tbien);
+    return bientropy_wrapper(self, args, kwds, tbien);
 }
 
-static PyMethodDef BiEntropyMethods[] = {
-    {"bien", bientropy_bien, METH_VARARGS, DOC_BIEN},
-    {"tbien", bientropy_tbien, METH_VARARGS, DOC_TBIEN},
-    {NULL, NULL, 0, NULL}
-};
+/** brief bientropy_scratch_wrapper - translates parameters from Python for
+ * the word engine working in caller-provided scratch space. The input is read
+ * through the buffer protocol and the working row is kept either in a
+ * writable buffer (such as a memory-mapped scratch file) or in memory.
+ * Shared by bien_scratch and tbien_scratch.
+ *
+ * param args PyObject* positional arguments from the Python interpreter
+ * param kwds PyObject* keyword arguments from the Python interpreter
+ * param metric int BIN_METRIC_BIEN or BIN_METRIC_TBIEN
+ *
+ * return PyObject*
+ */
+static PyObject *
+bientropy_scratch_wrapper(PyObject *args, PyObject *kwds, int metric)
+{
+    static char *kwlist[] = {"data", "bits", "scratch", NULL};
+    PyObject *data_obj = NULL, *bits_obj = Py_None, *scratch_obj = Py_None;
+    Py_ssize_t nbits;
+    Py_buffer data, scratch;
+    uint64_t *row;
+    size_t row_bytes;
+    double result;
 
-#if PY_MAJOR_VERSION >= 3
-static PyModuleDef BiEntropyModule = {
-    PyModuleDef_HEAD_INIT,
-    "cbientropy", // module name
-    NULL, // doc string
-    -1, // do not support sub-interpreters, use a global state
-    BiEntropyMethods,
-    NULL, // single-phase initialization
-    NULL, // no GC traversal function
-    NULL, // no GC clear function
-    NULL, // no free function
-};
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|OO", kwlist, &data_obj,
+                                     &bits_obj, &scratch_obj))
+        return NULL;
+
+    if (PyObject_GetBuffer(data_obj, &data, PyBUF_SIMPLE) < 0)
+        return NULL;
+
+    if (bits_obj == Py_None) {
+        nbits = data.len*8;
+    } else {
+        nbits = PyNumber_AsSsize_t(bits_obj, PyExc_OverflowError);
+        if (nbits == -1 && PyErr_Occurred()) {
+            PyBuffer_Release(&data);
+            return NULL;
+        }
+        if (nbits < 0 || nbits > data.len*8) {
+            PyErr_SetString(
+                PyExc_ValueError,
+                "The number of bits must be between zero and the length of "
+                "the data in bits.");
+            PyBuffer_Release(&data);
+            return NULL;
+        }
+    }
+
+    if (nbits < 2) {
+        PyErr_SetString(
+            PyExc_ValueError,
+            "The input string must be at least 2 bits long.");
+        PyBuffer_Release(&data);
+        return NULL;
+    }
+
+    row_bytes = bin_row_words(nbits)*sizeof(uint64_t);
+    if (scratch_obj == Py_None) {
+        scratch.obj = NULL;
+        row = (uint64_t*)malloc(row_bytes);
+        if (row == NULL) {
+            PyBuffer_Release(&data);
+            return PyErr_NoMemory();
+        }
+    } else {
+        if (PyObject_GetBuffer(scratch_obj, &scratch, PyBUF_WRITABLE) < 0) {
+            PyBuffer_Release(&data);
+            return NULL;
+        }
+        if ((size_t)scratch.len < row_bytes) {
+            PyErr_Format(
+                PyExc_ValueError,
+                "The scratch buffer must hold at least %zu bytes.",
+                row_bytes);
+            PyBuffer_Release(&scratch);
+            PyBuffer_Release(&data);
+            return NULL;
+        }
+        // the row is worked on as 64-bit words
+        if ((uintptr_t)scratch.buf % sizeof(uint64_t) != 0) {
+            PyErr_SetString(
+                PyExc_ValueError,
+                "The scratch buffer must be aligned to 8 bytes.");
+            PyBuffer_Release(&scratch);
+            PyBuffer_Release(&data);
+            return NULL;
+        }
+        row = (uint64_t*)scratch.buf;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    if (metric == BIN_METRIC_BIEN && (size_t)nbits >= BIN_BIEN_TOP_MIN_BITS) {
+        result = bin_bien_top((const unsigned char*)data.buf, nbits, row);
+    } else {
+        bin_import_row(row, (const unsigned char*)data.buf, nbits);
+        result = bin_score_row(row, nbits, metric);
+    }
+    Py_END_ALLOW_THREADS
+
+    if (scratch.obj == NULL) {
+        free(row);
+    } else {
+        PyBuffer_Release(&scratch);
+    }
+    PyBuffer_Release(&data);
+
+    return PyFloat_FromDouble(result);
+}
+
+#define DOC_SCRATCH_PARAMS \
+"Parameters\n" \
+"----------\n" \
+"data : bytes-like object\n" \
+"    the input bitstring as a big-endian byte string; any object supporting\n" \
+"    the buffer protocol is accepted, including memory-mapped files\n" \
+"bits : int, optional\n" \
+"    the length of the input in bits, if less than 8*len(data)\n" \
+"scratch : writable bytes-like object, optional\n" \
+"    working space for the current derivative of at least 8*ceil(bits/64)\n" \
+"    bytes, aligned to 8 bytes, such as a memory-mapped scratch file;\n" \
+"    allocated in memory if omitted\n" \
+"\n"
+
+#define DOC_BIEN_SCRATCH \
+"bien_scratch(data, bits=None, scratch=None)\n" \
+"\n" \
+"BiEn computed by the word engine with its working row in the given scratch\n" \
+"space. The input is read in place, so long strings can be scored from\n" \
+"memory-mapped files without copying them into memory.\n" \
+"\n" \
+DOC_SCRATCH_PARAMS \
+"Returns\n" \
+"-------\n" \
+"float\n" \
+"    the BiEntropy of the input\n"
+static PyObject *
+bientropy_bien_scratch(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    return bientropy_scratch_wrapper(args, kwds, BIN_METRIC_BIEN);
+}
+
+#define DOC_TBIEN_SCRATCH \
+"tbien_scratch(data, bits=None, scratch=None)\n" \
+"\n" \
+"TBiEn computed by the word engine with its working row in the given\n" \
+"scratch space. The input is read in place, so long strings can be scored\n" \
+"from memory-mapped files without copying them into memory.\n" \
+"\n" \
+DOC_SCRATCH_PARAMS \
+"Returns\n" \
+"-------\n" \
+"float\n" \
+"    the TBiEntropy of the input\n"
+static PyObject *
+bientropy_tbien_scratch(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    return bientropy_scratch_wrapper(args, kwds, BIN_METRIC_TBIEN);
+}
+
+/** brief new_array_of - creates a one-dimensional NumPy array and exposes its
+ * memory for writing. NumPy is imported on first use so that the functions
+ * returning scalars do not depend on it.
+ *
+ * param n Py_ssize_t the number of elements
+ * param dtype PyObject* anything numpy.dtype() accepts
+ * param zero int whether to zero-fill the array
+ * param view Py_buffer* where to store the writable view of the array, which
+ * the caller releases
+ *
+ * return PyObject* a new reference to the array, or NULL on error
+ */
+static PyObject *
+new_array_of(Py_ssize_t n, PyObject *dtype, int zero, Py_buffer *view)
+{
+    PyObject *numpy, *arr;
+
+    numpy = PyImport_ImportModule("numpy");
+    if (numpy == NULL)
+        return NULL;
+    arr = PyObject_CallMethod(numpy, zero ? "zeros" : "empty", "(n)O", n,
+                              dtype);
+    Py_DECREF(numpy);
+    if (arr == NULL)
+        return NULL;
+    if (PyObject_GetBuffer(arr, view, PyBUF_WRITABLE | PyBUF_C_CONTIGUOUS)
+            < 0) {
+        Py_DECREF(arr);
+        return NULL;
+    }
+    return arr;
+}
+
+/** brief new_array - creates a one-dimensional NumPy array of a type named
+ * by a string, such as "float64"; see new_array_of()
+ */
+static PyObject *
+new_array(Py_ssize_t n, const char *dtype, int zero, Py_buffer *view)
+{
+    PyObject *dtype_obj, *arr;
+
+    dtype_obj = Py_BuildValue("s", dtype);
+    if (dtype_obj == NULL)
+        return NULL;
+    arr = new_array_of(n, dtype_obj, zero, view);
+    Py_DECREF(dtype_obj);
+    return arr;
+}
+
+#define new_double_array(n, view) new_array(n, "float64", 0, view)
+
+typedef struct {
+    PyObject_HEAD
+    bin_summary s;
+} SummaryObject;
+
+/* A metric prepared for strings of a fixed length. The tables are filled in
+ * when the object is created and only read afterwards, so one object may be
+ * shared by any number of threads.
+ */
+typedef struct {
+    PyObject_HEAD
+    bin_metric m;
+#if PY_VERSION_HEX >= 0x03090000
+    vectorcallfunc vectorcall;
 #endif
+} MetricObject;
 
-PyMODINIT_FUNC
-#if PY_MAJOR_VERSION >= 3
-PyInit_cbientropy(void)
-#else
-initcbientropy(void)
+/** brief check_summary - checks that the summary argument of a function is
+ * None or a Summary
+ *
+ * return int 0 if it is, -1 with an exception set
+ */
+static int
+check_summary(PyObject *module, PyObject *summary_obj)
+{
+    if (summary_obj == Py_None ||
+            PyObject_TypeCheck(summary_obj,
+                (PyTypeObject*)get_state(module)->summary_type))
+        return 0;
+    PyErr_SetString(PyExc_TypeError, "summary must be a Summary or None.");
+    return -1;
+}
+
+/** brief feed_summary - adds n values, stride doubles apart, to a Summary,
+ * holding its lock on free-threaded builds
+ */
+static void
+feed_summary(PyObject *summary_obj, const double *values, size_t n,
+             ptrdiff_t stride)
+{
+#ifdef Py_BEGIN_CRITICAL_SECTION
+    Py_BEGIN_CRITICAL_SECTION(summary_obj);
 #endif
+    bin_summary_add_array(&((SummaryObject*)summary_obj)->s, values, n,
+                          stride);
+#ifdef Py_BEGIN_CRITICAL_SECTION
+    Py_END_CRITICAL_SECTION();
+#endif
+}
+
+/** brief with_summary - adds the results in a NumPy array of float64 returned
+ * by a batch function to a Summary, if one was given
+ *
+ * return PyObject* the array, or NULL with an exception set
+ */
+static PyObject *
+with_summary(PyObject *retval, PyObject *summary_obj)
 {
-    PyObject* m;
+    Py_buffer view;
+
+    if (retval == NULL || summary_obj == Py_None)
+        return retval;
+    if (PyObject_GetBuffer(retval, &view, PyBUF_C_CONTIGUOUS) < 0) {
+        Py_DECREF(retval);
+        return NULL;
+    }
+    feed_summary(summary_obj, (const double*)view.buf,
+                 view.len/sizeof(double), 1);
+    PyBuffer_Release(&view);
+    return retval;
+}
 
+/** brief default_threads - the number of worker threads to use when the
+ * caller does not say, which is the number of CPUs. This is looked up once,
+ * when the module is loaded.
+ *
+ * return int the number of threads, or -1 with an exception set
+ */
+static int
+default_threads(void)
+{
+    PyObject *os, *count;
+    long n;
+
+    // os.cpu_count() is lighter to load in each interpreter than
+    // multiprocessing, which Python 2 needs
 #if PY_MAJOR_VERSION >= 3
-    m = PyModule_Create(&BiEntropyModule);
-    if (m == NULL)
-      return m;
+    os = PyImport_ImportModule("os");
 #else
-    (void) Py_InitModule("cbientropy", BiEntropyMethods);
-    if (m == NULL)
-      return;
+    os = PyImport_ImportModule("multiprocessing");
 #endif
+    if (os == NULL)
+        return -1;
+    count = PyObject_CallMethod(os, "cpu_count", NULL);
+    Py_DECREF(os);
+    if (count == NULL) {
+        // cpu_count() raises NotImplementedError on some platforms
+        PyErr_Clear();
+        return 1;
+    }
+    if (count == Py_None) {
+        // os.cpu_count() returns None if the number is unknown
+        Py_DECREF(count);
+        return 1;
+    }
+    n = PyLong_AsLong(count);
+    Py_DECREF(count);
+    if (n == -1 && PyErr_Occurred())
+        return -1;
+    return n > 0 ? (int)n : 1;
+}
 
-#if PY_MAJOR_VERSION >= 3
-    return m;
+/** brief parse_threads - converts the threads argument of the parallel
+ * functions, where None means one thread per CPU
+ *
+ * param module PyObject* the module, which holds the number of CPUs
+ * param threads_obj PyObject* the argument
+ *
+ * return int the number of threads, or -1 with an exception set
+ */
+static int
+parse_threads(PyObject *module, PyObject *threads_obj)
+{
+    long n;
+
+    if (threads_obj == Py_None)
+        return get_state(module)->ncpus;
+    n = PyLong_AsLong(threads_obj);
+    if (n == -1 && PyErr_Occurred())
+        return -1;
+    if (n < 1) {
+        PyErr_SetString(PyExc_ValueError,
+                        "The number of threads must be at least one.");
+        return -1;
+    }
+    return n > 1024 ? 1024 : (int)n;
+}
+
+/* Work shared by the threads of run_parallel(): each worker calls fn with
+ * its own index and the number of workers and divides the work itself. */
+typedef void (*parallel_fn)(void *ctx, int worker, int nworkers);
+
+struct parallel_worker {
+    parallel_fn fn;
+    void *ctx;
+    int worker;
+    int nworkers;
+    PyThread_type_lock done;
+};
+
+static void
+parallel_thread(void *arg)
+{
+    struct parallel_worker *w = (struct parallel_worker*)arg;
+
+    w->fn(w->ctx, w->worker, w->nworkers);
+    PyThread_release_lock(w->done);
+}
+
+/** brief run_parallel - runs fn on nthreads threads, including the calling
+ * thread, and waits for all of them. Threads are started with the portable
+ * thread layer of the interpreter, and any that cannot be started run in
+ * the calling thread instead. Call without holding the GIL; fn must not use
+ * the Python API.
+ *
+ * return int 0 on success, -1 if out of memory
+ */
+static int
+run_parallel(int nthreads, parallel_fn fn, void *ctx)
+{
+    struct parallel_worker *workers;
+    int i;
+
+    if (nthreads <= 1) {
+        fn(ctx, 0, 1);
+        return 0;
+    }
+    workers = (struct parallel_worker*)calloc(nthreads,
+                                              sizeof(struct parallel_worker));
+    if (workers == NULL)
+        return -1;
+    for (i = 1; i < nthreads; i++) {
+        workers[i].fn = fn;
+        workers[i].ctx = ctx;
+        workers[i].worker = i;
+        workers[i].nworkers = nthreads;
+        workers[i].done = PyThread_allocate_lock();
+        if (workers[i].done != NULL) {
+            PyThread_acquire_lock(workers[i].done, WAIT_LOCK);
+            if (PyThread_start_new_thread(parallel_thread, &workers[i])
+                    == (unsigned long)-1) {
+                PyThread_release_lock(workers[i].done);
+                PyThread_free_lock(workers[i].done);
+                workers[i].done = NULL;
+            }
+        }
+    }
+    fn(ctx, 0, nthreads);
+    for (i = 1; i < nthreads; i++) {
+        if (workers[i].done == NULL) {
+            fn(ctx, i, nthreads);
+        } else {
+            PyThread_acquire_lock(workers[i].done, WAIT_LOCK);
+            PyThread_release_lock(workers[i].done);
+            PyThread_free_lock(workers[i].done);
+        }
+    }
+    free(workers);
+    return 0;
+}
+
+/** brief parse_engine - converts the name of a batch engine to its constant
+ *
+ * return int the engine, or -1 with an exception set
+ */
+static int
+parse_engine(const char *name)
+{
+    if (name == NULL || strcmp(name, "auto") == 0)
+        return BIN_ENGINE_AUTO;
+    if (strcmp(name, "words") == 0)
+        return BIN_ENGINE_WORDS;
+    if (strcmp(name, "bitslice") == 0)
+        return BIN_ENGINE_BITSLICE;
+    PyErr_Format(PyExc_ValueError,
+                 "Unknown engine '%s'; expected 'auto', 'words' or "
+                 "'bitslice'.", name);
+    return -1;
+}
+
+/** brief parse_metric - converts the name of a metric to its constant
+ *
+ * return int the metric, or -1 with an exception set
+ */
+static int
+parse_metric(const char *name)
+{
+    if (strcmp(name, "bien") == 0)
+        return BIN_METRIC_BIEN;
+    if (strcmp(name, "tbien") == 0)
+        return BIN_METRIC_TBIEN;
+    PyErr_Format(PyExc_ValueError,
+                 "Unknown metric '%s'; expected 'bien' or 'tbien'.", name);
+    return -1;
+}
+
+/** brief metric_weights - reads a sequence of weights for a custom Metric,
+ * one for each of the nbits-1 levels
+ *
+ * return double* the weights, to free(), or NULL with an exception set
+ */
+static double *
+metric_weights(PyObject *kind, Py_ssize_t nbits)
+{
+    PyObject *seq;
+    Py_ssize_t k;
+    double *weights, total = 0.0;
+
+    seq = PySequence_Fast(kind,
+        "kind must be 'bien', 'tbien', 'uniform' or a sequence of weights.");
+    if (seq == NULL)
+        return NULL;
+    if (PySequence_Fast_GET_SIZE(seq) != nbits - 1) {
+        PyErr_Format(PyExc_ValueError,
+                     "There must be one weight for each of the %zd levels.",
+                     nbits - 1);
+        Py_DECREF(seq);
+        return NULL;
+    }
+    weights = (double*)malloc((nbits - 1)*sizeof(double));
+    if (weights == NULL) {
+        Py_DECREF(seq);
+        PyErr_NoMemory();
+        return NULL;
+    }
+    for (k = 0; k < nbits - 1; k++) {
+        weights[k] = PyFloat_AsDouble(PySequence_Fast_GET_ITEM(seq, k));
+        if (weights[k] == -1.0 && PyErr_Occurred())
+            break;
+        // also rejects NaN and infinity
+        if (!(weights[k] >= 0.0 && weights[k] <= DBL_MAX)) {
+            PyErr_SetString(PyExc_ValueError,
+                            "The weights must be finite and not negative.");
+            break;
+        }
+        total += weights[k];
+    }
+    Py_DECREF(seq);
+    if (!PyErr_Occurred() && !(total > 0.0 && total <= DBL_MAX)) {
+        PyErr_SetString(PyExc_ValueError,
+                        "The weights must have a positive, finite sum.");
+    }
+    if (PyErr_Occurred()) {
+        free(weights);
+        return NULL;
+    }
+    return weights;
+}
+
+/** brief parse_kind - reads the kind of a Metric for strings of nbits bits:
+ * 'bien', 'tbien', 'uniform' or a sequence of weights, warning about long
+ * strings for BiEn as bien() does
+ *
+ * param metric int* where to store the metric, BIN_METRIC_CUSTOM for weights
+ * param weights double** where to store the weights from metric_weights(),
+ * or NULL for a built-in metric
+ * return int 0 on success, -1 with an exception set
+ */
+static int
+parse_kind(PyObject *kind_obj, Py_ssize_t nbits, int *metric,
+           double **weights)
+{
+    PyObject *kind_str = NULL;
+    const char *kind = NULL;
+
+    *metric = BIN_METRIC_CUSTOM;
+    *weights = NULL;
+#if PY_MAJOR_VERSION >= 3
+    if (PyUnicode_Check(kind_obj)) {
+        kind_str = PyUnicode_AsUTF8String(kind_obj);
+        if (kind_str == NULL)
+            return -1;
+        kind = PyBytes_AsString(kind_str);
+    }
+#else
+    if (PyString_Check(kind_obj))
+        kind = PyString_AsString(kind_obj);
+#endif
+    if (kind != NULL) {
+        if (strcmp(kind, "bien") == 0) {
+            *metric = BIN_METRIC_BIEN;
+        } else if (strcmp(kind, "tbien") == 0) {
+            *metric = BIN_METRIC_TBIEN;
+        } else if (strcmp(kind, "uniform") == 0) {
+            *metric = BIN_METRIC_UNIFORM;
+        } else {
+            PyErr_Format(PyExc_ValueError,
+                         "Unknown metric '%s'; expected 'bien', 'tbien', "
+                         "'uniform' or a sequence of weights.", kind);
+            Py_XDECREF(kind_str);
+            return -1;
+        }
+        Py_XDECREF(kind_str);
+    } else {
+        *weights = metric_weights(kind_obj, nbits);
+        if (*weights == NULL)
+            return -1;
+    }
+    if (*metric == BIN_METRIC_BIEN && nbits > 32) {
+        if (PyErr_WarnEx(
+                PyExc_Warning,
+                "The BiEn algorithm is not suitable for binary strings "
+                "longer than 32 bits.",
+                1) < 0)
+            return -1;
+    }
+    return 0;
+}
+
+/** brief check_batch_bits - checks the shortest and longest record lengths
+ * of a batch against the metric and the engine, warning once about long
+ * records for BiEn as bien() does
+ *
+ * return int 0 if the batch can be computed, -1 with an exception set
+ */
+static int
+check_batch_bits(Py_ssize_t min_bits, Py_ssize_t max_bits, int metric,
+                 int engine)
+{
+    if (min_bits < 2) {
+        PyErr_SetString(
+            PyExc_ValueError,
+            "The records are too short for the batch engines.");
+        return -1;
+    }
+    if (engine == BIN_ENGINE_BITSLICE && max_bits > BIN_BITSLICE_MAX_BITS) {
+        PyErr_SetString(
+            PyExc_ValueError,
+            "The bitslice engine only supports records of up to 64 bits.");
+        return -1;
+    }
+    if (metric == BIN_METRIC_BIEN && max_bits > 32) {
+        if (PyErr_WarnEx(
+                PyExc_Warning,
+                "The BiEn algorithm is not suitable for binary strings "
+                "longer than 32 bits.",
+                1) < 0)
+            return -1;
+    }
+    return 0;
+}
+
+/** brief index_at - reads element i of an array from get_index_array() */
+static int64_t
+index_at(const Py_buffer *view, Py_ssize_t i)
+{
+    if (view->itemsize == 4) {
+        if (strchr(view->format, 'I') || strchr(view->format, 'L'))
+            return ((const uint32_t*)view->buf)[i];
+        return ((const int32_t*)view->buf)[i];
+    }
+    return ((const int64_t*)view->buf)[i];
+}
+
+// Tasks are bucketed by the binary exponent of their cost
+#define RAGGED_BUCKETS 128
+// The cost of each task beyond its levels, in bits of a level
+#define RAGGED_TASK_COST 256.0
+
+/* One record of a ragged batch, or one range of the levels of a record
+ * longer than BIN_SPLIT_BITS, for a thread to score */
+struct ragged_task {
+    Py_ssize_t rec;
+    Py_ssize_t piece; // the slot of the sums of a range, or -1
+    size_t k0, k1;    // the levels of the range
+    double cost;
+};
+
+struct ragged_ctx {
+    const unsigned char *data;
+    const Py_buffer *offsets;
+    const Py_buffer *bit_lengths;
+    Py_ssize_t nrec;
+    Py_ssize_t max_bits;
+    int metric;
+    // the metrics of the custom weighting of each length of record, in
+    // order of length, or NULL to score by metric
+    const bin_metric *metrics;
+    Py_ssize_t nmetrics;
+    double *out;
+    int failed;
+    // the tasks of a batch of mixed lengths, most costly first, or NULL to
+    // interleave the records of a batch of one length
+    struct ragged_task *tasks;
+    Py_ssize_t ntasks;
+    Py_ssize_t next; // the first task not yet claimed
+    double remaining; // the cost of the tasks not yet claimed
+    double *sums; // the weighted sum of the entropies and the sum of the
+                  // weights of each range of levels
+    PyThread_type_lock lock;
+};
+
+/** brief ragged_bits - the length in bits of record i of a ragged batch */
+static size_t
+ragged_bits(const struct ragged_ctx *ctx, Py_ssize_t i)
+{
+    if (ctx->bit_lengths != NULL)
+        return (size_t)index_at(ctx->bit_lengths, i);
+    return (size_t)(index_at(ctx->offsets, i + 1) -
+                    index_at(ctx->offsets, i))*8;
+}
+
+/** brief ragged_metric - the metric of the records of nbits bits of a ragged
+ * batch with a custom weighting, found by bisection */
+static const bin_metric *
+ragged_metric(const struct ragged_ctx *ctx, size_t nbits)
+{
+    Py_ssize_t lo = 0, hi = ctx->nmetrics - 1, mid;
+
+    while (lo < hi) {
+        mid = lo + (hi - lo)/2;
+        if (ctx->metrics[mid].nbits < nbits)
+            lo = mid + 1;
+        else
+            hi = mid;
+    }
+    return &ctx->metrics[lo];
+}
+
+/** brief ragged_row - scores a whole record of a ragged batch, loaded into
+ * row, which is overwritten */
+static double
+ragged_row(const struct ragged_ctx *ctx, uint64_t *row, size_t nbits)
+{
+    if (ctx->metrics != NULL)
+        return bin_metric_score(ragged_metric(ctx, nbits), row);
+    return bin_score_row(row, nbits, ctx->metric);
+}
+
+/** brief ragged_cost - the estimated cost of scoring levels [k0, k1) of a
+ * string of nbits bits: the total length of the levels, as level k is
+ * nbits-k bits long, and of loading the string, which is about twice as
+ * much when the range starts below the top.
+ */
+static double
+ragged_cost(size_t nbits, size_t k0, size_t k1)
+{
+    double n = (double)nbits;
+
+    return (double)(k1 - k0)*(2*n - (double)k0 - (double)k1 + 1)/2 +
+        (k0 > 0 ? 3*n : n) + RAGGED_TASK_COST;
+}
+
+/** brief ragged_plan - lists the records of a ragged batch as tasks, with
+ * the records longer than BIN_SPLIT_BITS split into the ranges of levels of
+ * bin_level_pieces(). The cost of scoring a record grows with the square of
+ * its length, so the tasks are bucketed by the binary exponent of their
+ * cost, the most costly bucket first and the records in order within each
+ * bucket. Threads claiming the tasks in turn then start on the longest
+ * records and finish on the shortest, which balances the work.
+ *
+ * return int 0 on success, -1 if out of memory
+ */
+static int
+ragged_plan(struct ragged_ctx *ctx)
+{
+    Py_ssize_t i, pos[RAGGED_BUCKETS], npieces = 0;
+    size_t p, np, nbits;
+    struct ragged_task task;
+    int b, pass;
+
+    memset(pos, 0, sizeof(pos));
+    ctx->ntasks = 0;
+    ctx->remaining = 0.0;
+    // count the tasks of each bucket, then place them
+    for (pass = 0; pass < 2; pass++) {
+        npieces = 0;
+        for (i = 0; i < ctx->nrec; i++) {
+            nbits = ragged_bits(ctx, i);
+            np = bin_level_pieces(nbits);
+            for (p = 0; p < np; p++) {
+                task.rec = i;
+                task.piece = np > 1 ? npieces + (Py_ssize_t)p : -1;
+                task.k0 = bin_piece_level(nbits, np, p);
+                task.k1 = bin_piece_level(nbits, np, p + 1);
+                task.cost = ragged_cost(nbits, task.k0, task.k1);
+                frexp(task.cost, &b);
+                b = b < 0 ? 0 : b >= RAGGED_BUCKETS ? RAGGED_BUCKETS - 1 : b;
+                if (pass == 0) {
+                    pos[RAGGED_BUCKETS - 1 - b]++;
+                    ctx->ntasks++;
+                    ctx->remaining += task.cost;
+                } else {
+                    ctx->tasks[pos[RAGGED_BUCKETS - 1 - b]++] = task;
+                }
+            }
+            if (np > 1)
+                npieces += (Py_ssize_t)np;
+        }
+        if (pass == 0) {
+            // the first task of each bucket
+            for (b = 0, i = 0; b < RAGGED_BUCKETS; b++) {
+                Py_ssize_t count = pos[b];
+                pos[b] = i;
+                i += count;
+            }
+            ctx->tasks = (struct ragged_task*)malloc(
+                ctx->ntasks*sizeof(struct ragged_task));
+            ctx->sums = (double*)malloc(
+                (npieces > 0 ? 2*npieces : 1)*sizeof(double));
+            if (ctx->tasks == NULL || ctx->sums == NULL)
+                return -1;
+        }
+    }
+    ctx->next = 0;
+    return 0;
+}
+
+/** brief ragged_claim - claims the next tasks of a ragged batch for one of
+ * nworkers threads, by guided self-scheduling: as many tasks as make up the
+ * share of one worker of half of the cost left, and at least one, so that
+ * the costly tasks at the start are claimed one at a time and the cheap ones
+ * at the end in runs, with little locking.
+ *
+ * param stop Py_ssize_t* where to store the task after the last claimed
+ * return Py_ssize_t the first task claimed, equal to *stop when none are
+ * left
+ */
+static Py_ssize_t
+ragged_claim(struct ragged_ctx *ctx, int nworkers, Py_ssize_t *stop)
+{
+    Py_ssize_t first;
+    double target, cost = 0.0;
+
+    PyThread_acquire_lock(ctx->lock, WAIT_LOCK);
+    first = *stop = ctx->next;
+    target = ctx->remaining/(2*nworkers);
+    while (*stop < ctx->ntasks && (*stop == first || cost < target)) {
+        cost += ctx->tasks[*stop].cost;
+        (*stop)++;
+    }
+    ctx->next = *stop;
+    ctx->remaining -= cost;
+    PyThread_release_lock(ctx->lock);
+    return first;
+}
+
+static void
+ragged_worker(void *arg, int worker, int nworkers)
+{
+    struct ragged_ctx *ctx = (struct ragged_ctx*)arg;
+    const struct ragged_task *task;
+    uint64_t *row;
+    Py_ssize_t i, first, stop;
+    size_t nbits;
+
+    row = (uint64_t*)malloc(bin_row_words(ctx->max_bits)*sizeof(uint64_t));
+    if (row == NULL) {
+        ctx->failed = 1;
+        return;
+    }
+    if (ctx->tasks == NULL) {
+        // records of one length cost the same, so interleave them
+        for (i = worker; i < ctx->nrec; i += nworkers) {
+            nbits = ragged_bits(ctx, i);
+            bin_import_row(row, ctx->data + index_at(ctx->offsets, i),
+                           nbits);
+            ctx->out[i] = ragged_row(ctx, row, nbits);
+        }
+    } else {
+        while ((first = ragged_claim(ctx, nworkers, &stop)) < stop) {
+            for (i = first; i < stop; i++) {
+                task = &ctx->tasks[i];
+                nbits = ragged_bits(ctx, task->rec);
+                bin_import_row(row,
+                               ctx->data + index_at(ctx->offsets, task->rec),
+                               nbits);
+                if (task->piece < 0) {
+                    ctx->out[task->rec] = ragged_row(ctx, row, nbits);
+                } else if (ctx->metrics != NULL) {
+                    bin_metric_score_levels(ragged_metric(ctx, nbits), row,
+                                            task->k0, task->k1,
+                                            &ctx->sums[2*task->piece],
+                                            &ctx->sums[2*task->piece + 1]);
+                } else {
+                    bin_score_levels(row, nbits, ctx->metric, task->k0,
+                                     task->k1, &ctx->sums[2*task->piece],
+                                     &ctx->sums[2*task->piece + 1]);
+                }
+            }
+        }
+    }
+    free(row);
+}
+
+/** brief ragged_score - scores the records of a ragged batch, which have
+ * been checked, on nthreads threads. A batch of one length up to
+ * BIN_SPLIT_BITS is interleaved across the threads; any other is scheduled
+ * by cost with ragged_plan(), and the ranges of the levels of each long
+ * record are summed in order once every thread is done, as in
+ * bin_score_split(), so that the results are those of bin_ragged() whatever
+ * the number of threads. Call without holding the GIL.
+ *
+ * param min_bits Py_ssize_t the length of the shortest record
+ * return int 0 on success, -1 if out of memory
+ */
+static int
+ragged_score(struct ragged_ctx *ctx, int nthreads, Py_ssize_t min_bits)
+{
+    Py_ssize_t i, piece = 0;
+    size_t p, np;
+    double t, l;
+    int rc = -1;
+
+    ctx->failed = 0;
+    ctx->tasks = NULL;
+    ctx->sums = NULL;
+    ctx->lock = NULL;
+    if (ctx->nrec == 0)
+        return 0;
+    if (min_bits != ctx->max_bits || ctx->max_bits > BIN_SPLIT_BITS) {
+        ctx->lock = PyThread_allocate_lock();
+        if (ctx->lock == NULL || ragged_plan(ctx) < 0)
+            goto done;
+        if (nthreads > ctx->ntasks)
+            nthreads = (int)ctx->ntasks;
+    } else if (nthreads > ctx->nrec) {
+        nthreads = (int)ctx->nrec;
+    }
+    if (run_parallel(nthreads, ragged_worker, ctx) < 0 || ctx->failed)
+        goto done;
+    if (ctx->tasks != NULL) {
+        for (i = 0; i < ctx->nrec; i++) {
+            np = bin_level_pieces(ragged_bits(ctx, i));
+            if (np == 1)
+                continue;
+            t = l = 0.0;
+            for (p = 0; p < np; p++, piece++) {
+                t += ctx->sums[2*piece];
+                l += ctx->sums[2*piece + 1];
+            }
+            ctx->out[i] = t/l;
+        }
+    }
+    rc = 0;
+
+done:
+    if (ctx->lock != NULL)
+        PyThread_free_lock(ctx->lock);
+    free(ctx->tasks);
+    free(ctx->sums);
+    return rc;
+}
+
+/** brief batch_sequence - computes a batch given as a sequence of binary
+ * strings or bitstring-like objects. Records of the same length are packed
+ * next to each other so that they can take the fixed-length engines; mixed
+ * lengths are packed as a ragged batch and scheduled by cost across
+ * nthreads threads, see ragged_score().
+ *
+ * return PyObject* a new reference to the array of results, or NULL
+ */
+static PyObject *
+batch_sequence(PyObject *seq_obj, int metric, int engine, int unpacked,
+               int nthreads)
+{
+    PyObject *seq, *items = NULL, *retval = NULL;
+    Py_ssize_t i, nrec, *nbits = NULL, max_bytes = 0, total_bytes = 0;
+    Py_ssize_t min_bits = PY_SSIZE_T_MAX, max_bits = 0;
+    Py_buffer out, offsets_view, bits_view;
+    unsigned char *packed = NULL;
+    int64_t *offsets = NULL;
+    struct ragged_ctx ctx;
+    int fixed = 1, rc = 0;
+
+    seq = PySequence_Fast(seq_obj,
+        "A buffer of records or a sequence of binary strings is required.");
+    if (seq == NULL)
+        return NULL;
+    nrec = PySequence_Fast_GET_SIZE(seq);
+    items = PyList_New(nrec);
+    nbits = (Py_ssize_t*)malloc((nrec > 0 ? nrec : 1)*sizeof(Py_ssize_t));
+    if (items == NULL || nbits == NULL) {
+        if (nbits == NULL)
+            PyErr_NoMemory();
+        goto done;
+    }
+    for (i = 0; i < nrec; i++) {
+        PyObject *bytestr = as_bit_bytes(PySequence_Fast_GET_ITEM(seq, i),
+                                         unpacked, &nbits[i]);
+        if (bytestr == NULL)
+            goto done;
+        PyList_SET_ITEM(items, i, bytestr);
+        if (i > 0 && (nbits[i] != nbits[0] ||
+                      PyString_Size(bytestr) != max_bytes))
+            fixed = 0;
+        if (nbits[i] < min_bits)
+            min_bits = nbits[i];
+        if (nbits[i] > max_bits)
+            max_bits = nbits[i];
+        if (PyString_Size(bytestr) > max_bytes)
+            max_bytes = PyString_Size(bytestr);
+        total_bytes += PyString_Size(bytestr);
+    }
+    if (nrec > 0 && check_batch_bits(min_bits, max_bits, metric, engine) < 0)
+        goto done;
+
+    retval = new_double_array(nrec, &out);
+    if (retval == NULL)
+        goto done;
+
+    if (fixed && nrec > 0) {
+        packed = (unsigned char*)malloc(nrec*max_bytes);
+        if (packed == NULL) {
+            PyErr_NoMemory();
+            Py_CLEAR(retval);
+            PyBuffer_Release(&out);
+            goto done;
+        }
+        for (i = 0; i < nrec; i++) {
+            memcpy(packed + i*max_bytes,
+                   PyString_AsString(PyList_GET_ITEM(items, i)), max_bytes);
+        }
+        Py_BEGIN_ALLOW_THREADS
+        rc = bin_batch(packed, nrec, max_bytes, nbits[0], metric, engine,
+                       (double*)out.buf);
+        Py_END_ALLOW_THREADS
+    } else if (nrec > 0) {
+        if (engine == BIN_ENGINE_BITSLICE) {
+            PyErr_SetString(
+                PyExc_ValueError,
+                "The bitslice engine requires records of the same length.");
+            Py_CLEAR(retval);
+            PyBuffer_Release(&out);
+            goto done;
+        }
+        packed = (unsigned char*)malloc(total_bytes + 1);
+        // the offsets of the records followed by their lengths in bits
+        offsets = (int64_t*)malloc((2*nrec + 1)*sizeof(int64_t));
+        if (packed == NULL || offsets == NULL) {
+            rc = -1;
+        } else {
+            offsets[0] = 0;
+            for (i = 0; i < nrec; i++) {
+                PyObject *bytestr = PyList_GET_ITEM(items, i);
+                memcpy(packed + offsets[i], PyString_AsString(bytestr),
+                       PyString_Size(bytestr));
+                offsets[i+1] = offsets[i] + PyString_Size(bytestr);
+                offsets[nrec+1+i] = nbits[i];
+            }
+            memset(&offsets_view, 0, sizeof(Py_buffer));
+            offsets_view.buf = offsets;
+            offsets_view.itemsize = sizeof(int64_t);
+            bits_view = offsets_view;
+            bits_view.buf = offsets + nrec + 1;
+            ctx.data = packed;
+            ctx.offsets = &offsets_view;
+            ctx.bit_lengths = &bits_view;
+            ctx.nrec = nrec;
+            ctx.max_bits = max_bits;
+            ctx.metric = metric;
+            ctx.metrics = NULL;
+            ctx.out = (double*)out.buf;
+            Py_BEGIN_ALLOW_THREADS
+            rc = ragged_score(&ctx, nthreads, min_bits);
+            Py_END_ALLOW_THREADS
+        }
+    }
+    PyBuffer_Release(&out);
+    if (rc < 0) {
+        PyErr_NoMemory();
+        Py_CLEAR(retval);
+    }
+
+done:
+    free(offsets);
+    free(packed);
+    free(nbits);
+    Py_XDECREF(items);
+    Py_DECREF(seq);
+    return retval;
+}
+
+/** brief batch_bit_array - packs a two-dimensional unpacked bit array from
+ * get_bit_array(), one record per row, for the batch functions
+ *
+ * param view Py_buffer* the array
+ * param rb_obj PyObject* the record_bytes argument, which must be None
+ * param nrec Py_ssize_t* where to store the number of records
+ * param record_bytes Py_ssize_t* where to store the size of packed records
+ * param nbits Py_ssize_t* where to store the length of the rows in bits
+ *
+ * return unsigned char* the packed records, to be freed, or NULL with an
+ * exception set
+ */
+static unsigned char *
+batch_bit_array(const Py_buffer *view, PyObject *rb_obj, Py_ssize_t *nrec,
+                Py_ssize_t *record_bytes, Py_ssize_t *nbits)
+{
+    unsigned char *packed;
+
+    if (view->ndim != 2) {
+        PyErr_SetString(PyExc_ValueError,
+                        "A bit array of records must be two-dimensional, "
+                        "with one record per row.");
+        return NULL;
+    }
+    if (rb_obj != Py_None) {
+        PyErr_SetString(PyExc_TypeError,
+                        "record_bytes does not apply to bit arrays.");
+        return NULL;
+    }
+    *nrec = view->shape[0];
+    *nbits = view->shape[1];
+    *record_bytes = (*nbits + 7)/8;
+    packed = (unsigned char*)malloc(*nrec*(*record_bytes) + 1);
+    if (packed == NULL) {
+        PyErr_NoMemory();
+        return NULL;
+    }
+    if (pack_bit_rows(view, packed) < 0) {
+        free(packed);
+        return NULL;
+    }
+    return packed;
+}
+
+/** brief batch_records - finds the records of a buffer for the batch
+ * functions: the rows of a two-dimensional bit array, which are packed into
+ * a buffer of their own, the rows of a C-contiguous two-dimensional buffer,
+ * such as a NumPy array of uint8, or fixed-size slices of a flat buffer.
+ * On success, release the records with release_records().
+ *
+ * param data_obj PyObject* the data argument
+ * param rb_obj PyObject* the record_bytes argument, or None
+ * param bits_obj PyObject* the bits argument, or None
+ * param unpacked int whether arrays of bytes hold one bit per byte
+ * param data Py_buffer* where to store the view of the data
+ * param packed unsigned char** where to store the packed bit array, or NULL
+ * param nrec Py_ssize_t* where to store the number of records
+ * param record_bytes Py_ssize_t* where to store the distance between records
+ * param nbits Py_ssize_t* where to store the length of the records in bits
+ *
+ * return int 0 on success, -1 with an exception set
+ */
+static int
+batch_records(PyObject *data_obj, PyObject *rb_obj, PyObject *bits_obj,
+              int unpacked, Py_buffer *data, unsigned char **packed,
+              Py_ssize_t *nrec, Py_ssize_t *record_bytes, Py_ssize_t *nbits)
+{
+    Py_ssize_t max_bits = 0;
+    int rc;
+
+    *packed = NULL;
+    rc = get_bit_array(data_obj, unpacked, data);
+    if (rc < 0)
+        return -1;
+    if (rc) {
+        // the rows are packed into a buffer of their own
+        *packed = batch_bit_array(data, rb_obj, nrec, record_bytes,
+                                  &max_bits);
+        PyBuffer_Release(data);
+        if (*packed == NULL)
+            return -1;
+    } else {
+        if (PyObject_GetBuffer(data_obj, data, PyBUF_C_CONTIGUOUS) < 0)
+            return -1;
+        if (data->ndim >= 2) {
+            *nrec = data->shape[0];
+            *record_bytes = *nrec > 0 ? data->len/(*nrec) : 0;
+            if (rb_obj != Py_None &&
+                    PyNumber_AsSsize_t(rb_obj, NULL) != *record_bytes) {
+                PyErr_SetString(
+                    PyExc_ValueError,
+                    "record_bytes does not match the shape of the data.");
+                goto fail;
+            }
+        } else {
+            if (rb_obj == Py_None) {
+                PyErr_SetString(
+                    PyExc_TypeError,
+                    "record_bytes is required for one-dimensional buffers.");
+                goto fail;
+            }
+            *record_bytes = PyNumber_AsSsize_t(rb_obj, PyExc_OverflowError);
+            if (*record_bytes == -1 && PyErr_Occurred())
+                goto fail;
+            if (*record_bytes <= 0 || data->len % *record_bytes != 0) {
+                PyErr_SetString(
+                    PyExc_ValueError,
+                    "The length of the data must be a multiple of "
+                    "record_bytes.");
+                goto fail;
+            }
+            *nrec = data->len/(*record_bytes);
+        }
+        max_bits = *record_bytes*8;
+    }
+
+    if (bits_obj == Py_None) {
+        *nbits = max_bits;
+    } else {
+        *nbits = PyNumber_AsSsize_t(bits_obj, PyExc_OverflowError);
+        if (*nbits == -1 && PyErr_Occurred())
+            goto fail;
+        if (*nbits > max_bits) {
+            PyErr_SetString(
+                PyExc_ValueError,
+                "The number of bits must not exceed the length of the "
+                "records in bits.");
+            goto fail;
+        }
+    }
+    return 0;
+
+fail:
+    if (*packed != NULL) {
+        free(*packed);
+        *packed = NULL;
+    } else {
+        PyBuffer_Release(data);
+    }
+    return -1;
+}
+
+/** brief release_records - releases the records from batch_records()
+ */
+static void
+release_records(Py_buffer *data, unsigned char *packed)
+{
+    if (packed != NULL) {
+        free(packed);
+    } else {
+        PyBuffer_Release(data);
+    }
+}
+
+/** brief bientropy_batch_wrapper - translates parameters from Python for the
+ * batch functions. Records are either rows of a two-dimensional buffer (such
+ * as a NumPy array of uint8), fixed-size slices of a flat buffer, or the
+ * items of a sequence. Shared by bien_batch and tbien_batch.
+ *
+ * param args PyObject* positional arguments from the Python interpreter
+ * param kwds PyObject* keyword arguments from the Python interpreter
+ * param metric int BIN_METRIC_BIEN or BIN_METRIC_TBIEN
+ *
+ * return PyObject* a NumPy array of results
+ */
+static PyObject *
+bientropy_batch_wrapper(PyObject *self, PyObject *args, PyObject *kwds,
+                        int metric)
+{
+    static char *kwlist[] = {"data", "record_bytes", "bits", "engine",
+                             "summary", "unpacked", NULL};
+    PyObject *data_obj = NULL, *rb_obj = Py_None, *bits_obj = Py_None;
+    PyObject *summary_obj = Py_None, *unpacked_obj = Py_False;
+    PyObject *retval = NULL;
+    const char *engine_name = NULL;
+    Py_ssize_t record_bytes, nbits, nrec;
+    Py_buffer data, out;
+    unsigned char *packed;
+    int engine, unpacked, rc;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|OOzOO", kwlist,
+                                     &data_obj, &rb_obj, &bits_obj,
+                                     &engine_name, &summary_obj,
+                                     &unpacked_obj))
+        return NULL;
+
+    engine = parse_engine(engine_name);
+    if (engine < 0)
+        return NULL;
+    if (check_summary(self, summary_obj) < 0)
+        return NULL;
+    unpacked = PyObject_IsTrue(unpacked_obj);
+    if (unpacked < 0)
+        return NULL;
+
+    if (!PyObject_CheckBuffer(data_obj) ||
+            (PyString_Check(data_obj) && rb_obj == Py_None && !unpacked)) {
+        if (rb_obj != Py_None || bits_obj != Py_None) {
+            PyErr_SetString(
+                PyExc_TypeError,
+                "record_bytes and bits only apply to buffers of records.");
+            return NULL;
+        }
+        return with_summary(batch_sequence(data_obj, metric, engine,
+                                           unpacked, get_state(self)->ncpus),
+                            summary_obj);
+    }
+
+    if (batch_records(data_obj, rb_obj, bits_obj, unpacked, &data, &packed,
+                      &nrec, &record_bytes, &nbits) < 0)
+        return NULL;
+
+    if (check_batch_bits(nbits, nbits, metric, engine) < 0)
+        goto done;
+
+    retval = new_double_array(nrec, &out);
+    if (retval == NULL)
+        goto done;
+
+    Py_BEGIN_ALLOW_THREADS
+    rc = bin_batch(packed != NULL ? packed : (const unsigned char*)data.buf,
+                   nrec, record_bytes, nbits, metric, engine,
+                   (double*)out.buf);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&out);
+    if (rc < 0) {
+        Py_CLEAR(retval);
+        PyErr_NoMemory();
+    }
+
+done:
+    release_records(&data, packed);
+    return with_summary(retval, summary_obj);
+}
+
+#define DOC_BATCH_PARAMS \
+"Parameters\n" \
+"----------\n" \
+"data : buffer or sequence\n" \
+"    the records, as either the rows of a C-contiguous two-dimensional\n" \
+"    buffer such as a NumPy array of uint8, a flat buffer cut into records\n" \
+"    of record_bytes bytes, the rows of a two-dimensional NumPy array of\n" \
+"    bool with one bit per element, or a sequence of binary strings,\n" \
+"    bitstring-like objects or one-dimensional arrays of bool; sequences\n" \
+"    of mixed lengths are scored across threads as ragged batches are\n" \
+"record_bytes : int, optional\n" \
+"    the size of each record for a flat buffer\n" \
+"bits : int, optional\n" \
+"    the length of each record in bits, if less than 8*record_bytes\n" \
+"engine : str, optional\n" \
+"    'words' to score one record at a time, 'bitslice' to score records\n" \
+"    of up to 64 bits in bit-sliced groups of 64, or 'auto' (the default)\n" \
+"    to use the bit-sliced engine for batches of at least 32 records of\n" \
+"    the same length of up to 64 bits\n" \
+"summary : Summary, optional\n" \
+"    a summary to add the results to\n" \
+"unpacked : bool, optional\n" \
+"    read a two-dimensional array of uint8, or the items of a sequence, as\n" \
+"    one bit per byte, each 0 or 1, rather than as packed bits; bit arrays\n" \
+"    are packed as they are read, without an intermediate array\n" \
+"\n"
+
+#define DOC_BIEN_BATCH \
+"bien_batch(data, record_bytes=None, bits=None, engine='auto', " \
+"summary=None, unpacked=False)\n" \
+"\n" \
+"BiEn of each record in a batch.\n" \
+"\n" \
+DOC_BATCH_PARAMS \
+"Returns\n" \
+"-------\n" \
+"numpy.ndarray\n" \
+"    the BiEntropy of each record, as float64\n"
+static PyObject *
+bientropy_bien_batch(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    return bientropy_batch_wrapper(self, args, kwds, BIN_METRIC_BIEN);
+}
+
+#define DOC_TBIEN_BATCH \
+"tbien_batch(data, record_bytes=None, bits=None, engine='auto', " \
+"summary=None, unpacked=False)\n" \
+"\n" \
+"TBiEn of each record in a batch.\n" \
+"\n" \
+DOC_BATCH_PARAMS \
+"Returns\n" \
+"-------\n" \
+"numpy.ndarray\n" \
+"    the TBiEntropy of each record, as float64\n"
+static PyObject *
+bientropy_tbien_batch(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    return bientropy_batch_wrapper(self, args, kwds, BIN_METRIC_TBIEN);
+}
+
+struct range_ctx {
+    uint64_t start;
+    uint64_t stop;
+    size_t nbits;
+    int metric;
+    double *out;
+    size_t nbins;
+    uint64_t *hist;
+    int failed;
+};
+
+static void
+range_worker(void *arg, int worker, int nworkers)
+{
+    struct range_ctx *ctx = (struct range_ctx*)arg;
+    uint64_t base, groups, lo, hi, q, rem, w = worker;
+
+    // split on multiples of 64 so that no group is scored twice, taking care
+    // not to overflow near 2**64
+    base = ctx->start & ~(uint64_t)63;
+    groups = (ctx->stop - base)/64 + ((ctx->stop - base) % 64 != 0);
+    q = groups/nworkers;
+    rem = groups % nworkers;
+    lo = 64*(q*w + (w < rem ? w : rem));
+    hi = 64*(q*(w + 1) + (w + 1 < rem ? w + 1 : rem));
+    if (lo == hi)
+        return;
+    lo = lo > ctx->start - base ? base + lo : ctx->start;
+    hi = hi < ctx->stop - base ? base + hi : ctx->stop;
+    if (bin_range(lo, hi, ctx->nbits, ctx->metric,
+                  ctx->out ? ctx->out + (lo - ctx->start) : NULL, ctx->nbins,
+                  ctx->hist ? ctx->hist + ctx->nbins*worker : NULL) < 0)
+        ctx->failed = 1;
+}
+
+/** brief bientropy_range_wrapper - translates parameters from Python for the
+ * range functions, splits the range across threads and either returns the
+ * scores or merges the per-thread histograms. Shared by bien_range and
+ * tbien_range.
+ *
+ * param self PyObject* the module
+ * param args PyObject* positional arguments from the Python interpreter
+ * param kwds PyObject* keyword arguments from the Python interpreter
+ * param metric int BIN_METRIC_BIEN or BIN_METRIC_TBIEN
+ *
+ * return PyObject* a NumPy array of scores or of histogram counts
+ */
+static PyObject *
+bientropy_range_wrapper(PyObject *self, PyObject *args, PyObject *kwds,
+                         int metric)
+{
+    static char *kwlist[] = {"start", "stop", "length", "bins", "threads",
+                             NULL};
+    unsigned long long start, stop;
+    Py_ssize_t length, bins = 0, b;
+    PyObject *start_obj, *stop_obj, *bins_obj = Py_None;
+    PyObject *threads_obj = Py_None, *retval;
+    struct range_ctx ctx;
+    Py_buffer out;
+    int nthreads, i, rc;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "OOn|OO", kwlist,
+                                     &start_obj, &stop_obj, &length,
+                                     &bins_obj, &threads_obj))
+        return NULL;
+
+    // unlike the "K" format, these raise OverflowError when out of range
+    start = PyLong_AsUnsignedLongLong(start_obj);
+    if (start == (unsigned long long)-1 && PyErr_Occurred())
+        return NULL;
+    stop = PyLong_AsUnsignedLongLong(stop_obj);
+    if (stop == (unsigned long long)-1 && PyErr_Occurred())
+        return NULL;
+
+    if (length < 2 || length > 64) {
+        PyErr_SetString(PyExc_ValueError,
+                        "The length must be from 2 to 64 bits.");
+        return NULL;
+    }
+    if (stop < start ||
+            (length < 64 && stop > (1ULL << length))) {
+        PyErr_SetString(
+            PyExc_ValueError,
+            "The range must satisfy 0 <= start <= stop <= 2**length.");
+        return NULL;
+    }
+    // bins is 0 for every score rather than a histogram
+    if (bins_obj != Py_None) {
+        bins = PyNumber_AsSsize_t(bins_obj, PyExc_OverflowError);
+        if (bins == -1 && PyErr_Occurred())
+            return NULL;
+        if (bins < 1) {
+            PyErr_SetString(PyExc_ValueError,
+                            "The number of bins must be positive.");
+            return NULL;
+        }
+    }
+    if (bins == 0 && stop - start > (unsigned long long)PY_SSIZE_T_MAX) {
+        PyErr_SetString(PyExc_OverflowError,
+                        "The range is too large to return every score; "
+                        "use bins for a histogram instead.");
+        return NULL;
+    }
+    if (metric == BIN_METRIC_BIEN && length > 32) {
+        if (PyErr_WarnEx(
+                PyExc_Warning,
+                "The BiEn algorithm is not suitable for binary strings "
+                "longer than 32 bits.",
+                1) < 0)
+            return NULL;
+    }
+    nthreads = parse_threads(self, threads_obj);
+    if (nthreads < 0)
+        return NULL;
+    if ((stop - start)/64 + 1 < (unsigned long long)nthreads)
+        nthreads = (int)((stop - start)/64) + 1;
+
+    ctx.start = start;
+    ctx.stop = stop;
+    ctx.nbits = length;
+    ctx.metric = metric;
+    ctx.out = NULL;
+    ctx.nbins = bins;
+    ctx.hist = NULL;
+    ctx.failed = 0;
+
+    if (bins == 0) {
+        retval = new_double_array((Py_ssize_t)(stop - start), &out);
+        if (retval == NULL)
+            return NULL;
+        ctx.out = (double*)out.buf;
+    } else {
+        retval = new_array(bins, "int64", 1, &out);
+        if (retval == NULL)
+            return NULL;
+        ctx.hist = (uint64_t*)calloc(bins*nthreads, sizeof(uint64_t));
+        if (ctx.hist == NULL) {
+            PyBuffer_Release(&out);
+            Py_DECREF(retval);
+            return PyErr_NoMemory();
+        }
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    rc = run_parallel(nthreads, range_worker, &ctx);
+    Py_END_ALLOW_THREADS
+
+    if (ctx.hist != NULL) {
+        for (i = 0; i < nthreads; i++) {
+            for (b = 0; b < bins; b++) {
+                ((int64_t*)out.buf)[b] += ctx.hist[bins*i + b];
+            }
+        }
+        free(ctx.hist);
+    }
+    PyBuffer_Release(&out);
+    if (rc < 0 || ctx.failed) {
+        Py_DECREF(retval);
+        return PyErr_NoMemory();
+    }
+    return retval;
+}
+
+#define DOC_RANGE_PARAMS \
+"Every integer from start to stop-1 is taken as a string of length bits\n" \
+"from its most significant bit, as by Bits(uint=..., length=length), and\n" \
+"scored by the bit-sliced engine without creating any Python objects. The\n" \
+"range is split across threads.\n" \
+"\n" \
+"Parameters\n" \
+"----------\n" \
+"start : int\n" \
+"    the first integer\n" \
+"stop : int\n" \
+"    one past the last integer, at most 2**length and less than 2**64\n" \
+"length : int\n" \
+"    the length of the strings in bits, from 2 to 64\n" \
+"bins : int, optional\n" \
+"    if not None, return only a histogram of the scores with this many\n" \
+"    bins of equal width over [0, 1], the last bin including 1\n" \
+"threads : int, optional\n" \
+"    the number of threads; defaults to the number of CPUs\n" \
+"\n" \
+"Returns\n" \
+"-------\n" \
+"numpy.ndarray\n" \
+"    the float64 score of each integer in the range, or the int64 count of\n" \
+"    scores in each bin\n"
+
+#define DOC_BIEN_RANGE \
+"bien_range(start, stop, length, bins=None, threads=None)\n" \
+"\n" \
+"BiEn of every integer in a range.\n" \
+"\n" \
+DOC_RANGE_PARAMS
+static PyObject *
+bientropy_bien_range(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    return bientropy_range_wrapper(self, args, kwds, BIN_METRIC_BIEN);
+}
+
+#define DOC_TBIEN_RANGE \
+"tbien_range(start, stop, length, bins=None, threads=None)\n" \
+"\n" \
+"TBiEn of every integer in a range.\n" \
+"\n" \
+DOC_RANGE_PARAMS
+static PyObject *
+bientropy_tbien_range(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    return bientropy_range_wrapper(self, args, kwds, BIN_METRIC_TBIEN);
+}
+
+/** brief get_index_array - gets a read-only view of a one-dimensional array
+ * of 32-bit or 64-bit integers, such as the offsets of Arrow binary arrays
+ *
+ * return int 0 on success, -1 with an exception set
+ */
+static int
+get_index_array(PyObject *obj, Py_buffer *view, const char *name)
+{
+    const char *fmt;
+
+    if (PyObject_GetBuffer(obj, view, PyBUF_C_CONTIGUOUS | PyBUF_FORMAT) < 0)
+        return -1;
+    fmt = view->format != NULL ? view->format : "B";
+    if (*fmt == '<' || *fmt == '=' || *fmt == '@')
+        fmt++;
+    if (view->ndim != 1 || (view->itemsize != 4 && view->itemsize != 8) ||
+            fmt[0] == '\0' || fmt[1] != '\0' ||
+            strchr("iIlLqQ", fmt[0]) == NULL) {
+        PyErr_Format(PyExc_TypeError,
+                     "%s must be a one-dimensional array of 32-bit or 64-bit "
+                     "integers.", name);
+        PyBuffer_Release(view);
+        return -1;
+    }
+    return 0;
+}
+
+/** brief compare_size - orders lengths for qsort() */
+static int
+compare_size(const void *a, const void *b)
+{
+    size_t x = *(const size_t*)a, y = *(const size_t*)b;
+
+    return x < y ? -1 : x > y;
+}
+
+/** brief free_metrics - frees n metrics and the array holding them */
+static void
+free_metrics(bin_metric *metrics, Py_ssize_t n)
+{
+    Py_ssize_t i;
+
+    for (i = 0; i < n; i++)
+        bin_metric_free(&metrics[i]);
+    free(metrics);
+}
+
+/** brief ragged_weights - prepares the metric of each length of record of a
+ * ragged batch, which has been checked, from a function of the length in
+ * bits that returns the kind of a Metric. The function is called once per
+ * length, and the metrics are made without tables, which for records of
+ * many lengths would take more memory and time than scoring them.
+ *
+ * param ctx struct ragged_ctx* the batch, whose nmetrics is set
+ * param weights_obj PyObject* the function
+ * return bin_metric* the metrics in order of length, to free with
+ * free_metrics(), or NULL with an exception set
+ */
+static bin_metric *
+ragged_weights(struct ragged_ctx *ctx, PyObject *weights_obj)
+{
+    PyObject *kind;
+    bin_metric *metrics = NULL;
+    size_t *lengths;
+    Py_ssize_t i, n = 0;
+    double *weights;
+    int metric, rc = -1;
+
+    lengths = (size_t*)malloc(ctx->nrec*sizeof(size_t));
+    if (lengths == NULL)
+        return (bin_metric*)PyErr_NoMemory();
+    for (i = 0; i < ctx->nrec; i++)
+        lengths[i] = ragged_bits(ctx, i);
+    qsort(lengths, ctx->nrec, sizeof(size_t), compare_size);
+    for (i = 0; i < ctx->nrec; i++) {
+        if (n == 0 || lengths[i] != lengths[n - 1])
+            lengths[n++] = lengths[i];
+    }
+    // zeroed, so that metrics not yet made can be freed
+    metrics = (bin_metric*)calloc(n, sizeof(bin_metric));
+    if (metrics == NULL) {
+        PyErr_NoMemory();
+        goto done;
+    }
+    for (i = 0; i < n; i++) {
+        kind = PyObject_CallFunction(weights_obj, "n",
+                                     (Py_ssize_t)lengths[i]);
+        if (kind == NULL)
+            goto done;
+        rc = parse_kind(kind, (Py_ssize_t)lengths[i], &metric, &weights);
+        Py_DECREF(kind);
+        if (rc < 0)
+            goto done;
+        rc = bin_metric_init_plain(&metrics[i], lengths[i], metric, weights);
+        free(weights);
+        if (rc < 0) {
+            PyErr_NoMemory();
+            goto done;
+        }
+    }
+    rc = 0;
+    ctx->nmetrics = n;
+
+done:
+    free(lengths);
+    if (rc < 0 && metrics != NULL) {
+        free_metrics(metrics, n);
+        metrics = NULL;
+    }
+    return metrics;
+}
+
+/** brief bientropy_ragged_wrapper - translates parameters from Python for the
+ * ragged batch functions, which read variable-length records from a data
+ * buffer and an offsets array in the layout of Arrow binary arrays. The
+ * records are checked, and any custom weighting of each length prepared,
+ * with the GIL held, and then scored across threads. Shared by bien_ragged
+ * and tbien_ragged.
+ *
+ * param self PyObject* the module
+ * param args PyObject* positional arguments from the Python interpreter
+ * param kwds PyObject* keyword arguments from the Python interpreter
+ * param metric int BIN_METRIC_BIEN or BIN_METRIC_TBIEN
+ *
+ * return PyObject* a NumPy array of results
+ */
+static PyObject *
+bientropy_ragged_wrapper(PyObject *self, PyObject *args, PyObject *kwds,
+                          int metric)
+{
+    static char *kwlist[] = {"data", "offsets", "bit_lengths", "threads",
+                             "summary", "weights", NULL};
+    PyObject *data_obj, *offsets_obj, *bits_obj = Py_None;
+    PyObject *threads_obj = Py_None, *summary_obj = Py_None, *retval = NULL;
+    PyObject *weights_obj = Py_None;
+    Py_buffer data, offsets, bit_lengths, out;
+    struct ragged_ctx ctx;
+    bin_metric *metrics = NULL;
+    Py_ssize_t i;
+    int64_t start, stop, nbits, min_bits = INT64_MAX;
+    int nthreads, rc;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "OO|OOOO", kwlist,
+                                     &data_obj, &offsets_obj, &bits_obj,
+                                     &threads_obj, &summary_obj,
+                                     &weights_obj))
+        return NULL;
+    nthreads = parse_threads(self, threads_obj);
+    if (nthreads < 0)
+        return NULL;
+    if (check_summary(self, summary_obj) < 0)
+        return NULL;
+    if (weights_obj != Py_None) {
+        if (!PyCallable_Check(weights_obj)) {
+            PyErr_SetString(PyExc_TypeError,
+                            "weights must be callable or None.");
+            return NULL;
+        }
+        // the weighting of each length is checked as it is made
+        metric = BIN_METRIC_CUSTOM;
+    }
+
+    if (PyObject_GetBuffer(data_obj, &data, PyBUF_SIMPLE) < 0)
+        return NULL;
+    if (get_index_array(offsets_obj, &offsets, "offsets") < 0) {
+        PyBuffer_Release(&data);
+        return NULL;
+    }
+    bit_lengths.obj = NULL;
+    if (bits_obj != Py_None &&
+            get_index_array(bits_obj, &bit_lengths, "bit_lengths") < 0)
+        goto done;
+
+    if (offsets.shape[0] < 1) {
+        PyErr_SetString(PyExc_ValueError,
+                        "offsets must have one more element than there are "
+                        "records.");
+        goto done;
+    }
+    ctx.nrec = offsets.shape[0] - 1;
+    if (bit_lengths.obj != NULL && bit_lengths.shape[0] != ctx.nrec) {
+        PyErr_SetString(PyExc_ValueError,
+                        "bit_lengths must have one element per record.");
+        goto done;
+    }
+    ctx.max_bits = 0;
+    for (i = 0; i < ctx.nrec; i++) {
+        start = index_at(&offsets, i);
+        stop = index_at(&offsets, i + 1);
+        if (start < 0 || stop < start || stop > data.len) {
+            PyErr_Format(PyExc_ValueError,
+                         "The offsets of record %zd are outside of the data.",
+                         i);
+            goto done;
+        }
+        nbits = (stop - start)*8;
+        if (bit_lengths.obj != NULL) {
+            if (index_at(&bit_lengths, i) > nbits) {
+                PyErr_Format(PyExc_ValueError,
+                             "The bit length of record %zd is longer than "
+                             "the record.", i);
+                goto done;
+            }
+            nbits = index_at(&bit_lengths, i);
+        }
+        if (nbits < min_bits)
+            min_bits = nbits;
+        if (nbits > ctx.max_bits)
+            ctx.max_bits = nbits;
+    }
+    if (ctx.nrec > 0 &&
+            check_batch_bits(min_bits, ctx.max_bits, metric,
+                             BIN_ENGINE_WORDS) < 0)
+        goto done;
+
+    retval = new_double_array(ctx.nrec, &out);
+    if (retval == NULL)
+        goto done;
+    ctx.data = (const unsigned char*)data.buf;
+    ctx.offsets = &offsets;
+    ctx.bit_lengths = bit_lengths.obj != NULL ? &bit_lengths : NULL;
+    ctx.metric = metric;
+    ctx.metrics = NULL;
+    ctx.out = (double*)out.buf;
+    if (weights_obj != Py_None && ctx.nrec > 0) {
+        metrics = ragged_weights(&ctx, weights_obj);
+        if (metrics == NULL) {
+            PyBuffer_Release(&out);
+            Py_CLEAR(retval);
+            goto done;
+        }
+        ctx.metrics = metrics;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    rc = ragged_score(&ctx, nthreads, min_bits);
+    Py_END_ALLOW_THREADS
+
+    if (metrics != NULL)
+        free_metrics(metrics, ctx.nmetrics);
+    PyBuffer_Release(&out);
+    if (rc < 0) {
+        Py_CLEAR(retval);
+        PyErr_NoMemory();
+    }
+    retval = with_summary(retval, summary_obj);
+
+done:
+    if (bit_lengths.obj != NULL)
+        PyBuffer_Release(&bit_lengths);
+    PyBuffer_Release(&offsets);
+    PyBuffer_Release(&data);
+    return retval;
+}
+
+#define DOC_RAGGED_PARAMS \
+"Records of different lengths are read in place from one data buffer and\n" \
+"an offsets array, as in Arrow binary arrays, so no Python object is made\n" \
+"for each record. The records are shared out across threads by their cost,\n" \
+"which grows with the square of their length: the longest are started\n" \
+"first, and those longer than 32768 bits are split into ranges of\n" \
+"derivative levels that different threads score. The results are in the\n" \
+"order of the records, and do not depend on the number of threads.\n" \
+"\n" \
+"Parameters\n" \
+"----------\n" \
+"data : bytes-like object\n" \
+"    the concatenated records\n" \
+"offsets : array of int32 or int64\n" \
+"    the N+1 offsets in data where each of the N records starts, followed\n" \
+"    by the end of the last record\n" \
+"bit_lengths : array of int32 or int64, optional\n" \
+"    the length of each record in bits, if not every bit of its bytes\n" \
+"threads : int, optional\n" \
+"    the number of threads; defaults to the number of CPUs\n" \
+"summary : Summary, optional\n" \
+"    a summary to add the results to\n" \
+"weights : callable, optional\n" \
+"    a function of the length of a record in bits that returns the\n" \
+"    weighting of its levels in any form Metric takes: 'bien', 'tbien',\n" \
+"    'uniform' or a sequence of bits-1 weights. It is called once for\n" \
+"    each length, and each record is then scored as by the Metric of its\n" \
+"    length instead of by the metric of this function\n" \
+"\n" \
+"Returns\n" \
+"-------\n" \
+"numpy.ndarray\n"
+
+#define DOC_BIEN_RAGGED \
+"bien_ragged(data, offsets, bit_lengths=None, threads=None, " \
+"summary=None, weights=None)\n" \
+"\n" \
+"BiEn of each record in a ragged batch.\n" \
+"\n" \
+DOC_RAGGED_PARAMS \
+"    the BiEntropy of each record, as float64\n"
+static PyObject *
+bientropy_bien_ragged(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    return bientropy_ragged_wrapper(self, args, kwds, BIN_METRIC_BIEN);
+}
+
+#define DOC_TBIEN_RAGGED \
+"tbien_ragged(data, offsets, bit_lengths=None, threads=None, " \
+"summary=None, weights=None)\n" \
+"\n" \
+"TBiEn of each record in a ragged batch.\n" \
+"\n" \
+DOC_RAGGED_PARAMS \
+"    the TBiEntropy of each record, as float64\n"
+static PyObject *
+bientropy_tbien_ragged(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    return bientropy_ragged_wrapper(self, args, kwds, BIN_METRIC_TBIEN);
+}
+
+/** brief normal_quantile - the quantile function of the standard normal
+ * distribution, by the rational approximation of P. J. Acklam (relative
+ * error below 1.2e-9), which needs nothing beyond C89 math functions.
+ *
+ * param p double a probability in (0, 1)
+ *
+ * return double
+ */
+static double
+normal_quantile(double p)
+{
+    static const double a[6] = {
+        -3.969683028665376e+01, 2.209460984245205e+02,
+        -2.759285104469687e+02, 1.383577518672690e+02,
+        -3.066479806614716e+01, 2.506628277459239e+00};
+    static const double b[5] = {
+        -5.447609879822406e+01, 1.615858368580409e+02,
+        -1.556989798598866e+02, 6.680131188771972e+01,
+        -1.328068155288572e+01};
+    static const double c[6] = {
+        -7.784894002430293e-03, -3.223964580411365e-01,
+        -2.400758277161838e+00, -2.549732539343734e+00,
+        4.374664141464968e+00, 2.938163982698783e+00};
+    static const double d[4] = {
+        7.784695709041462e-03, 3.224671290700398e-01,
+        2.445134137142996e+00, 3.754408661907416e+00};
+    double q, r;
+
+    if (p < 0.02425 || p > 1 - 0.02425) {
+        q = sqrt(-2*log(p < 0.5 ? p : 1 - p));
+        r = (((((c[0]*q + c[1])*q + c[2])*q + c[3])*q + c[4])*q + c[5]) /
+            ((((d[0]*q + d[1])*q + d[2])*q + d[3])*q + 1);
+        return p < 0.5 ? r : -r;
+    }
+    q = p - 0.5;
+    r = q*q;
+    return (((((a[0]*r + a[1])*r + a[2])*r + a[3])*r + a[4])*r + a[5])*q /
+        (((((b[0]*r + b[1])*r + b[2])*r + b[3])*r + b[4])*r + 1);
+}
+
+/** brief student_quantile - the quantile of Student's t distribution with
+ * df degrees of freedom for the quantile z of the standard normal
+ * distribution, by the Cornish-Fisher expansion, which is accurate to a few
+ * parts in a thousand for df of at least 3.
+ *
+ * param z double the normal quantile
+ * param df double the degrees of freedom, at least 1
+ *
+ * return double
+ */
+static double
+student_quantile(double z, double df)
+{
+    double z2 = z*z;
+
+    return z + z*(z2 + 1)/(4*df) +
+        z*((5*z2 + 16)*z2 + 3)/(96*df*df) +
+        z*(((3*z2 + 19)*z2 + 17)*z2 - 15)/(384*df*df*df) +
+        z*((((79*z2 + 776)*z2 + 1482)*z2 - 1920)*z2 - 945)/
+        (92160*df*df*df*df);
+}
+
+struct estimate_ctx {
+    const uint64_t *row;
+    size_t nbits;
+    const size_t *levels;
+    size_t samples;
+    double *h;
+    int failed;
+};
+
+static void
+estimate_worker(void *arg, int worker, int nworkers)
+{
+    struct estimate_ctx *ctx = (struct estimate_ctx*)arg;
+    uint64_t *work;
+    size_t i;
+
+    work = (uint64_t*)malloc(bin_row_words(ctx->nbits)*sizeof(uint64_t));
+    if (work == NULL) {
+        ctx->failed = 1;
+        return;
+    }
+    for (i = worker; i < ctx->samples; i += nworkers) {
+        ctx->h[i] = bin_level_entropy(ctx->row, work, ctx->nbits,
+                                      ctx->levels[i]);
+    }
+    free(work);
+}
+
+/** brief random_seed - draws a seed from os.urandom() for estimates that are
+ * not given one.
+ *
+ * return int 0 on success, -1 with an exception set
+ */
+static int
+random_seed(uint64_t *seed)
+{
+    PyObject *os_mod, *bytestr;
+    const unsigned char *s;
+    int i;
+
+    os_mod = PyImport_ImportModule("os");
+    if (os_mod == NULL)
+        return -1;
+    bytestr = PyObject_CallMethod(os_mod, "urandom", "i", 8);
+    Py_DECREF(os_mod);
+    if (bytestr == NULL)
+        return -1;
+    s = (const unsigned char*)PyString_AsString(bytestr);
+    *seed = 0;
+    for (i = 0; i < 8; i++) {
+        *seed = (*seed << 8) | s[i];
+    }
+    Py_DECREF(bytestr);
+    return 0;
+}
+
+#define DOC_TBIEN_ESTIMATE \
+"tbien_estimate(data, samples=64, seed=None, confidence=0.95, bits=None,\n" \
+"               threads=None)\n" \
+"\n" \
+"An estimate of TBiEn with a confidence interval, at a cost set by the\n" \
+"number of samples rather than by the square of the length of the input.\n" \
+"\n" \
+"The last derivative levels, of at most 256 bits, carry the largest weights\n" \
+"and have the most variable entropies, so they are computed exactly. The\n" \
+"longer levels are split into strata whose lengths differ by a factor of at\n" \
+"most sqrt(2), and each stratum is sampled about equally, with levels drawn\n" \
+"in proportion to their TBiEn weights, so that the weighted sum of the mean\n" \
+"entropies of the strata is an unbiased estimate of TBiEn. Each level k is\n" \
+"computed directly from the input with one shifted XOR per binary digit of k\n" \
+"that is set, so a sample costs at most about log2(n) passes over the\n" \
+"input. Levels are scored in full, since the entropy of a sample of the bits\n" \
+"of a level would be a biased estimate of the entropy of the level. The\n" \
+"interval is Student's t interval for the stratified mean, with the degrees\n" \
+"of freedom of Welch and Satterthwaite, clipped to [0, 1]. A stratum whose\n" \
+"samples are all the same, as happens for periodic strings, widens it by\n" \
+"the binomial bound on the fraction of its levels that may differ. If every\n" \
+"level is computed exactly, because samples is at least the number of\n" \
+"levels or the string is short, the interval is empty.\n" \
+"\n" \
+"Parameters\n" \
+"----------\n" \
+"data : bytes-like object or bitstring-like object\n" \
+"    the input string\n" \
+"samples : int\n" \
+"    the number of levels to sample, at least 2; at most half as many\n" \
+"    strata are used\n" \
+"seed : int, optional\n" \
+"    the seed for sampling; drawn from os.urandom() by default\n" \
+"confidence : float\n" \
+"    the confidence level of the interval\n" \
+"bits : int, optional\n" \
+"    the length of the string in bits, if less than that of the data\n" \
+"threads : int, optional\n" \
+"    the number of threads, each of which keeps a copy of the input;\n" \
+"    defaults to the number of CPUs\n" \
+"\n" \
+"Returns\n" \
+"-------\n" \
+"tuple of float\n" \
+"    the estimate and the lower and upper bounds of the interval\n"
+static PyObject *
+bientropy_tbien_estimate(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"data", "samples", "seed", "confidence", "bits",
+                             "threads", NULL};
+    PyObject *data_obj = NULL, *seed_obj = Py_None, *bits_obj = Py_None;
+    PyObject *threads_obj = Py_None, *bytestr = NULL;
+    Py_ssize_t samples = 64, nbits, avail;
+    double confidence = 0.95, mean, m2, delta, est, t, l, w, v, vs, dv = 0.0;
+    double se, z, r, below = 0.0, above = 0.0;
+    uint64_t seed = 0, *row = NULL;
+    size_t *levels = NULL, i, j, m, s, nstrata;
+    double *h = NULL;
+    struct estimate_ctx ctx;
+    Py_buffer data;
+    int nthreads, rc = 0;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|nOdOO", kwlist,
+                                     &data_obj, &samples, &seed_obj,
+                                     &confidence, &bits_obj, &threads_obj))
+        return NULL;
+
+    if (samples < 2) {
+        PyErr_SetString(PyExc_ValueError,
+                        "At least two samples are required.");
+        return NULL;
+    }
+    if (!(confidence > 0 && confidence < 1)) {
+        PyErr_SetString(PyExc_ValueError,
+                        "The confidence level must be between 0 and 1.");
+        return NULL;
+    }
+    if (seed_obj == Py_None) {
+        if (random_seed(&seed) < 0)
+            return NULL;
+    } else {
+        seed = PyLong_AsUnsignedLongLongMask(seed_obj);
+        if (PyErr_Occurred())
+            return NULL;
+    }
+    nthreads = parse_threads(self, threads_obj);
+    if (nthreads < 0)
+        return NULL;
+
+    if (PyObject_CheckBuffer(data_obj)) {
+        if (PyObject_GetBuffer(data_obj, &data, PyBUF_SIMPLE) < 0)
+            return NULL;
+        avail = data.len*8;
+    } else {
+        bytestr = as_bit_bytes(data_obj, 0, &avail);
+        if (bytestr == NULL)
+            return NULL;
+        if (PyObject_GetBuffer(bytestr, &data, PyBUF_SIMPLE) < 0) {
+            Py_DECREF(bytestr);
+            return NULL;
+        }
+    }
+
+    nbits = avail;
+    if (bits_obj != Py_None) {
+        nbits = PyNumber_AsSsize_t(bits_obj, PyExc_OverflowError);
+        if (nbits == -1 && PyErr_Occurred())
+            goto done;
+        if (nbits < 0 || nbits > avail) {
+            PyErr_SetString(
+                PyExc_ValueError,
+                "The number of bits must be between zero and the length of "
+                "the data in bits.");
+            goto done;
+        }
+    }
+    if (nbits < 2) {
+        PyErr_SetString(
+            PyExc_ValueError,
+            "The input string is too short for the TBiEn algorithm.");
+        goto done;
+    }
+
+    row = (uint64_t*)malloc(bin_row_words(nbits)*sizeof(uint64_t));
+    if (row == NULL) {
+        PyErr_NoMemory();
+        goto done;
+    }
+    nstrata = bin_estimate_strata(nbits, samples);
+    if ((size_t)samples >= (size_t)nbits - 1 || nstrata == 0) {
+        Py_BEGIN_ALLOW_THREADS
+        bin_import_row(row, (const unsigned char*)data.buf, nbits);
+        est = bin_score_row(row, nbits, BIN_METRIC_TBIEN);
+        Py_END_ALLOW_THREADS
+        free(row);
+        PyBuffer_Release(&data);
+        Py_XDECREF(bytestr);
+        return Py_BuildValue("(ddd)", est, est, est);
+    }
+
+    levels = (size_t*)malloc(samples*sizeof(size_t));
+    h = (double*)malloc(samples*sizeof(double));
+    if (levels == NULL || h == NULL) {
+        PyErr_NoMemory();
+        goto done;
+    }
+    ctx.row = row;
+    ctx.nbits = nbits;
+    ctx.levels = levels;
+    ctx.samples = samples;
+    ctx.h = h;
+    ctx.failed = 0;
+    if (nthreads > samples)
+        nthreads = (int)samples;
+
+    Py_BEGIN_ALLOW_THREADS
+    bin_import_row(row, (const unsigned char*)data.buf, nbits);
+    bin_sample_levels(nbits, samples, seed, levels);
+    rc = run_parallel(nthreads, estimate_worker, &ctx);
+    // the short levels are computed exactly, overwriting the row
+    if (rc == 0 && !ctx.failed) {
+        bin_score_levels(row, nbits, BIN_METRIC_TBIEN,
+                         bin_stratum_level(nbits, nstrata, nstrata),
+                         nbits - 1, &t, &l);
+    }
+    Py_END_ALLOW_THREADS
+
+    if (rc < 0 || ctx.failed) {
+        PyErr_NoMemory();
+        goto done;
+    }
+
+    // the weighted sum of the entropies and its variance, from the samples
+    // of each stratum in order, so that the result does not depend on the
+    // number of threads
+    v = 0.0;
+    for (s = 0, i = 0; s < nstrata; s++) {
+        m = bin_stratum_samples(samples, nstrata, s);
+        mean = m2 = 0.0;
+        for (j = 0; j < m; j++, i++) {
+            delta = h[i] - mean;
+            mean += delta/(j + 1);
+            m2 += delta*(h[i] - mean);
+        }
+        w = bin_level_weights(bin_stratum_level(nbits, nstrata, s),
+                              bin_stratum_level(nbits, nstrata, s + 1));
+        t += w*mean;
+        l += w;
+        // the variance of the stratum's share of the sum, and the terms of
+        // the degrees of freedom
+        vs = w*w*m2/(m - 1)/m;
+        v += vs;
+        dv += vs*vs/(m - 1);
+        if (m2 == 0) {
+            // every sample is the same, as for levels of periodic strings
+            // that are all zero, so the variance says nothing; at the
+            // confidence level, at most a fraction r of the levels differ,
+            // by at most the distance to 0 or 1
+            r = 1 - pow(1 - confidence, 1.0/m);
+            below += w*r*mean;
+            above += w*r*(1 - mean);
+        }
+    }
+    est = t/l;
+    se = sqrt(v)/l;
+    z = normal_quantile(0.5 + confidence/2);
+    if (dv > 0) {
+        z = student_quantile(z, v*v/dv > 1 ? v*v/dv : 1);
+    }
+    below = z*se + below/l;
+    above = z*se + above/l;
+
+    free(h);
+    free(levels);
+    free(row);
+    PyBuffer_Release(&data);
+    Py_XDECREF(bytestr);
+    return Py_BuildValue("(ddd)", est,
+                         est - below > 0 ? est - below : 0.0,
+                         est + above < 1 ? est + above : 1.0);
+
+done:
+    free(h);
+    free(levels);
+    free(row);
+    PyBuffer_Release(&data);
+    Py_XDECREF(bytestr);
+    return NULL;
+}
+
+struct scan_ctx {
+    const unsigned char *data;
+    size_t len;
+    size_t block_bytes;
+    size_t nblocks;
+    bin_scan_result *out;
+    int failed;
+};
+
+static void
+scan_worker(void *arg, int worker, int nworkers)
+{
+    struct scan_ctx *ctx = (struct scan_ctx*)arg;
+    uint64_t *row;
+    size_t i, first, last, start;
+
+    row = (uint64_t*)malloc(
+        bin_row_words(ctx->block_bytes*8)*sizeof(uint64_t));
+    if (row == NULL) {
+        ctx->failed = 1;
+        return;
+    }
+    // each worker reads one contiguous run of blocks
+    first = ctx->nblocks*worker/nworkers;
+    last = ctx->nblocks*(worker + 1)/nworkers;
+    for (i = first; i < last; i++) {
+        start = i*ctx->block_bytes;
+        bin_scan_block(ctx->data + start,
+                       ctx->len - start < ctx->block_bytes ?
+                           ctx->len - start : ctx->block_bytes,
+                       row, &ctx->out[i]);
+    }
+    free(row);
+}
+
+/** brief scan_field - the offset in bin_scan_result of the field of a given
+ * name, or -1 if there is none
+ */
+static Py_ssize_t
+scan_field(PyObject *name)
+{
+    static const char *names[] = {"bien", "tbien", "entropy", "monobit",
+                                  "runs", "chi2"};
+    static const size_t offsets[] = {
+        offsetof(bin_scan_result, bien), offsetof(bin_scan_result, tbien),
+        offsetof(bin_scan_result, entropy),
+        offsetof(bin_scan_result, monobit), offsetof(bin_scan_result, runs),
+        offsetof(bin_scan_result, chi2)};
+    size_t i;
+
+    for (i = 0; i < sizeof(names)/sizeof(names[0]); i++) {
+#if PY_MAJOR_VERSION >= 3
+        if (PyUnicode_Check(name) &&
+                PyUnicode_CompareWithASCIIString(name, names[i]) == 0)
+#else
+        if (PyString_Check(name) &&
+                strcmp(PyString_AsString(name), names[i]) == 0)
+#endif
+            return (Py_ssize_t)offsets[i];
+    }
+    return -1;
+}
+
+/** brief check_scan_summaries - checks the summaries argument of
+ * scan_metrics, a dict of Summary objects by field name, or None
+ *
+ * return int 0 if it is valid, -1 with an exception set
+ */
+static int
+check_scan_summaries(PyObject *module, PyObject *summaries)
+{
+    PyObject *key, *value;
+    Py_ssize_t pos = 0;
+
+    if (summaries == Py_None)
+        return 0;
+    if (!PyDict_Check(summaries)) {
+        PyErr_SetString(PyExc_TypeError,
+                        "summaries must be a dict of Summary objects by "
+                        "field name.");
+        return -1;
+    }
+    while (PyDict_Next(summaries, &pos, &key, &value)) {
+        if (scan_field(key) < 0) {
+            PyErr_Format(PyExc_ValueError, "Unknown field %R.", key);
+            return -1;
+        }
+        if (value == Py_None || check_summary(module, value) < 0) {
+            PyErr_SetString(PyExc_TypeError,
+                            "The values of summaries must be Summary "
+                            "objects.");
+            return -1;
+        }
+    }
+    return 0;
+}
+
+/** brief feed_scan_summaries - adds the fields of the results of a scan to
+ * the summaries checked by check_scan_summaries()
+ */
+static void
+feed_scan_summaries(PyObject *summaries, const bin_scan_result *results,
+                    size_t n)
+{
+    PyObject *key, *value;
+    Py_ssize_t pos = 0, offset;
+    size_t i;
+
+    while (PyDict_Next(summaries, &pos, &key, &value)) {
+        offset = scan_field(key);
+        if (offset == (Py_ssize_t)offsetof(bin_scan_result, runs)) {
+            // the only integer field, so convert it one value at a time
+#ifdef Py_BEGIN_CRITICAL_SECTION
+            Py_BEGIN_CRITICAL_SECTION(value);
+#endif
+            for (i = 0; i < n; i++)
+                bin_summary_add(&((SummaryObject*)value)->s,
+                                (double)results[i].runs);
+#ifdef Py_BEGIN_CRITICAL_SECTION
+            Py_END_CRITICAL_SECTION();
+#endif
+        } else {
+            feed_summary(value,
+                         (const double*)((const char*)results + offset), n,
+                         sizeof(bin_scan_result)/sizeof(double));
+        }
+    }
+}
+
+#define DOC_SCAN_METRICS \
+"scan_metrics(data, block_bytes, threads=None, summaries=None)\n" \
+"\n" \
+"Compute a set of randomness statistics for each block of a buffer in a\n" \
+"single pass over the data. The bytes of each block are counted as they\n" \
+"are loaded, and one chain of binary derivatives gives both BiEn and TBiEn\n" \
+"along with the monobit and runs statistics, which are the popcounts of\n" \
+"its first two levels. The last block is shorter if the length of the data\n" \
+"is not a multiple of block_bytes.\n" \
+"\n" \
+"Parameters\n" \
+"----------\n" \
+"data : bytes-like object\n" \
+"    the data to scan; any object supporting the buffer protocol\n" \
+"block_bytes : int\n" \
+"    the size of each block in bytes\n" \
+"threads : int, optional\n" \
+"    the number of threads; defaults to the number of CPUs\n" \
+"summaries : dict, optional\n" \
+"    Summary objects by field name, such as {'tbien': Summary()}, to add\n" \
+"    the values of those fields to\n" \
+"\n" \
+"Returns\n" \
+"-------\n" \
+"numpy.ndarray\n" \
+"    a structured array with one record per block and the fields\n" \
+"    'bien' and 'tbien', the metrics of the block; 'entropy', the Shannon\n" \
+"    entropy of its bytes in bits per byte; 'monobit', the fraction of\n" \
+"    ones less one half; 'runs', the number of runs of identical bits; and\n" \
+"    'chi2', the chi-square statistic of its byte counts against a uniform\n" \
+"    distribution, with 255 degrees of freedom\n"
+static PyObject *
+bientropy_scan_metrics(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"data", "block_bytes", "threads", "summaries",
+                             NULL};
+    PyObject *data_obj = NULL, *threads_obj = Py_None, *dtype, *retval;
+    PyObject *summaries = Py_None;
+    Py_ssize_t block_bytes;
+    Py_buffer data, out;
+    struct scan_ctx ctx;
+    int nthreads, rc;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "On|OO", kwlist, &data_obj,
+                                     &block_bytes, &threads_obj, &summaries))
+        return NULL;
+    if (block_bytes < 1) {
+        PyErr_SetString(PyExc_ValueError,
+                        "block_bytes must be at least one.");
+        return NULL;
+    }
+    nthreads = parse_threads(self, threads_obj);
+    if (nthreads < 0)
+        return NULL;
+    if (check_scan_summaries(self, summaries) < 0)
+        return NULL;
+
+    if (PyObject_GetBuffer(data_obj, &data, PyBUF_C_CONTIGUOUS) < 0)
+        return NULL;
+
+    // the fields of bin_scan_result
+    dtype = Py_BuildValue("[(ss)(ss)(ss)(ss)(ss)(ss)]",
+                          "bien", "f8", "tbien", "f8", "entropy", "f8",
+                          "monobit", "f8", "runs", "i8", "chi2", "f8");
+    if (dtype == NULL) {
+        PyBuffer_Release(&data);
+        return NULL;
+    }
+    ctx.data = (const unsigned char*)data.buf;
+    ctx.len = data.len;
+    ctx.block_bytes = block_bytes;
+    ctx.nblocks = (data.len + block_bytes - 1)/block_bytes;
+    ctx.failed = 0;
+    retval = new_array_of(ctx.nblocks, dtype, 0, &out);
+    Py_DECREF(dtype);
+    if (retval == NULL) {
+        PyBuffer_Release(&data);
+        return NULL;
+    }
+    ctx.out = (bin_scan_result*)out.buf;
+    if ((size_t)nthreads > ctx.nblocks)
+        nthreads = ctx.nblocks > 0 ? (int)ctx.nblocks : 1;
+
+    rc = 0;
+    if (ctx.nblocks > 0) {
+        Py_BEGIN_ALLOW_THREADS
+        rc = run_parallel(nthreads, scan_worker, &ctx);
+        Py_END_ALLOW_THREADS
+    }
+
+    if (rc == 0 && !ctx.failed && summaries != Py_None)
+        feed_scan_summaries(summaries, ctx.out, ctx.nblocks);
+    PyBuffer_Release(&out);
+    PyBuffer_Release(&data);
+    if (rc < 0 || ctx.failed) {
+        Py_DECREF(retval);
+        return PyErr_NoMemory();
+    }
+    return retval;
+}
+
+struct pairwise_ctx {
+    const bin_metric *m;
+    const uint64_t *rows; // the records, nwords words each
+    size_t nwords;
+    size_t nrec;
+    size_t tile; // the number of records on a side of a tile
+    int condensed;
+    double *out;
+    int failed;
+};
+
+static void
+pairwise_worker(void *arg, int worker, int nworkers)
+{
+    struct pairwise_ctx *ctx = (struct pairwise_ctx*)arg;
+    uint64_t *row;
+    size_t n = ctx->nrec, ntiles, ti, tj, i, j, jlo, ihi, jhi, count = 0;
+    double result;
+
+    row = (uint64_t*)malloc(ctx->nwords*sizeof(uint64_t));
+    if (row == NULL) {
+        ctx->failed = 1;
+        return;
+    }
+    // the tiles on and above the diagonal are dealt out in turn, so each
+    // worker gets tiles from every part of the triangle
+    ntiles = (n + ctx->tile - 1)/ctx->tile;
+    for (ti = 0; ti < ntiles; ti++) {
+        for (tj = ti; tj < ntiles; tj++) {
+            if (count++ % nworkers != (size_t)worker)
+                continue;
+            ihi = (ti + 1)*ctx->tile < n ? (ti + 1)*ctx->tile : n;
+            jhi = (tj + 1)*ctx->tile < n ? (tj + 1)*ctx->tile : n;
+            for (i = ti*ctx->tile; i < ihi; i++) {
+                jlo = tj == ti ? i + 1 : tj*ctx->tile;
+                for (j = jlo; j < jhi; j++) {
+                    result = bin_metric_score_xor(
+                        ctx->m, ctx->rows + i*ctx->nwords,
+                        ctx->rows + j*ctx->nwords, row);
+                    if (ctx->condensed) {
+                        // the order of scipy.spatial.distance.pdist
+                        ctx->out[n*i - i*(i + 1)/2 + j - i - 1] = result;
+                    } else {
+                        ctx->out[i*n + j] = result;
+                        ctx->out[j*n + i] = result;
+                    }
+                }
+            }
+        }
+    }
+    free(row);
+}
+
+/** brief bientropy_pairwise_wrapper - translates parameters from Python for
+ * the pairwise functions, which score the exclusive or of every pair of
+ * records in a two-dimensional array. The records are loaded into words
+ * once, and the pairs are scored in tiles small enough for both sets of
+ * records to stay in cache, spread across threads. Shared by bien_pairwise
+ * and tbien_pairwise.
+ *
+ * param self PyObject* the module
+ * param args PyObject* positional arguments from the Python interpreter
+ * param kwds PyObject* keyword arguments from the Python interpreter
+ * param metric int BIN_METRIC_BIEN or BIN_METRIC_TBIEN
+ *
+ * return PyObject* a NumPy array of results
+ */
+static PyObject *
+bientropy_pairwise_wrapper(PyObject *self, PyObject *args, PyObject *kwds,
+                           int metric)
+{
+    static char *kwlist[] = {"data", "bits", "condensed", "threads", NULL};
+    PyObject *data_obj, *bits_obj = Py_None, *condensed_obj = Py_False;
+    PyObject *threads_obj = Py_None, *retval = NULL, *square;
+    Py_buffer data, out;
+    Py_ssize_t nrec, record_bytes, nbits, nout, i;
+    struct pairwise_ctx ctx;
+    bin_metric m;
+    uint64_t *rows;
+    int nthreads, rc;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|OOO", kwlist, &data_obj,
+                                     &bits_obj, &condensed_obj,
+                                     &threads_obj))
+        return NULL;
+    nthreads = parse_threads(self, threads_obj);
+    if (nthreads < 0)
+        return NULL;
+    ctx.condensed = PyObject_IsTrue(condensed_obj);
+    if (ctx.condensed < 0)
+        return NULL;
+
+    if (PyObject_GetBuffer(data_obj, &data, PyBUF_C_CONTIGUOUS) < 0)
+        return NULL;
+    if (data.ndim != 2) {
+        PyErr_SetString(PyExc_ValueError,
+                        "data must be a two-dimensional array with one "
+                        "record per row.");
+        PyBuffer_Release(&data);
+        return NULL;
+    }
+    nrec = data.shape[0];
+    record_bytes = data.shape[1]*data.itemsize;
+    nbits = record_bytes*8;
+    if (bits_obj != Py_None) {
+        nbits = PyLong_AsSsize_t(bits_obj);
+        if (nbits == -1 && PyErr_Occurred()) {
+            PyBuffer_Release(&data);
+            return NULL;
+        }
+        if (nbits > record_bytes*8) {
+            PyErr_SetString(PyExc_ValueError,
+                            "The number of bits must not exceed the length "
+                            "of the records in bits.");
+            PyBuffer_Release(&data);
+            return NULL;
+        }
+    }
+    if (check_batch_bits(nbits, nbits, metric, BIN_ENGINE_WORDS) < 0) {
+        PyBuffer_Release(&data);
+        return NULL;
+    }
+
+    nout = ctx.condensed ? nrec*(nrec - 1)/2 : nrec*nrec;
+    retval = new_array(nout, "float64", 1, &out);
+    if (retval == NULL) {
+        PyBuffer_Release(&data);
+        return NULL;
+    }
+    ctx.nwords = bin_row_words(nbits);
+    rows = (uint64_t*)malloc((nrec > 0 ? nrec : 1)*ctx.nwords*
+                             sizeof(uint64_t));
+    if (rows == NULL || bin_metric_init(&m, nbits, metric) < 0) {
+        free(rows);
+        PyBuffer_Release(&out);
+        PyBuffer_Release(&data);
+        Py_DECREF(retval);
+        return PyErr_NoMemory();
+    }
+    ctx.m = &m;
+    ctx.rows = rows;
+    ctx.nrec = nrec;
+    ctx.tile = BIN_PAIRWISE_TILE_BYTES/(2*ctx.nwords*sizeof(uint64_t));
+    if (ctx.tile < 1)
+        ctx.tile = 1;
+    ctx.out = (double*)out.buf;
+    ctx.failed = 0;
+    if (nthreads > nrec/2)
+        nthreads = nrec > 3 ? (int)(nrec/2) : 1;
+
+    Py_BEGIN_ALLOW_THREADS
+    for (i = 0; i < nrec; i++) {
+        bin_import_row(rows + i*ctx.nwords,
+                       (const unsigned char*)data.buf + i*record_bytes,
+                       nbits);
+    }
+    rc = run_parallel(nthreads, pairwise_worker, &ctx);
+    Py_END_ALLOW_THREADS
+
+    bin_metric_free(&m);
+    free(rows);
+    PyBuffer_Release(&out);
+    PyBuffer_Release(&data);
+    if (rc < 0 || ctx.failed) {
+        Py_DECREF(retval);
+        return PyErr_NoMemory();
+    }
+    if (ctx.condensed)
+        return retval;
+    square = PyObject_CallMethod(retval, "reshape", "(nn)", nrec, nrec);
+    Py_DECREF(retval);
+    return square;
+}
+
+#define DOC_PAIRWISE_PARAMS \
+"The exclusive or of each pair is formed as its records are loaded for\n" \
+"scoring, the pairs are scored in cache-sized tiles, and the tiles are\n" \
+"split across threads. This is meant for studies of the uniqueness and\n" \
+"reliability of PUF responses and similar sets of equal-length strings.\n" \
+"\n" \
+"Parameters\n" \
+"----------\n" \
+"data : bytes-like object\n" \
+"    a two-dimensional, C-contiguous array, such as an N x B array of\n" \
+"    uint8, with one record per row\n" \
+"bits : int, optional\n" \
+"    the number of bits of each record to use, from the start of the row;\n" \
+"    defaults to every bit\n" \
+"condensed : bool, optional\n" \
+"    return the N*(N-1)/2 scores of the pairs i < j in the order of\n" \
+"    scipy.spatial.distance.pdist instead of the N x N matrix\n" \
+"threads : int, optional\n" \
+"    the number of threads; defaults to the number of CPUs\n" \
+"\n" \
+"Returns\n" \
+"-------\n" \
+"numpy.ndarray\n"
+
+#define DOC_BIEN_PAIRWISE \
+"bien_pairwise(data, bits=None, condensed=False, threads=None)\n" \
+"\n" \
+"BiEn of the exclusive or of every pair of records.\n" \
+"\n" \
+DOC_PAIRWISE_PARAMS \
+"    the symmetric N x N matrix of BiEntropies, with zeros on the diagonal,\n" \
+"    or the condensed scores, as float64\n"
+static PyObject *
+bientropy_bien_pairwise(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    return bientropy_pairwise_wrapper(self, args, kwds, BIN_METRIC_BIEN);
+}
+
+#define DOC_TBIEN_PAIRWISE \
+"tbien_pairwise(data, bits=None, condensed=False, threads=None)\n" \
+"\n" \
+"TBiEn of the exclusive or of every pair of records.\n" \
+"\n" \
+DOC_PAIRWISE_PARAMS \
+"    the symmetric N x N matrix of TBiEntropies, with zeros on the\n" \
+"    diagonal, or the condensed scores, as float64\n"
+static PyObject *
+bientropy_tbien_pairwise(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    return bientropy_pairwise_wrapper(self, args, kwds, BIN_METRIC_TBIEN);
+}
+
+// The most dimensions of an array given to the nd functions
+#define ND_MAX_DIMS 64
+
+struct nd_ctx {
+    const unsigned char *buf;
+    // the dimensions other than the axis, numbered in C order
+    int ndim;
+    Py_ssize_t shape[ND_MAX_DIMS];
+    Py_ssize_t strides[ND_MAX_DIMS];
+    Py_ssize_t nvec;
+    // the elements along the axis
+    Py_ssize_t length;
+    Py_ssize_t stride;
+    Py_ssize_t itemsize;
+    int bit;
+    Py_ssize_t nbits;
+    int metric;
+    double *out;
+    int failed;
+};
+
+static void
+nd_worker(void *arg, int worker, int nworkers)
+{
+    struct nd_ctx *ctx = (struct nd_ctx*)arg;
+    unsigned char *packed;
+    uint64_t *row;
+    Py_ssize_t i, start, stop, rem, offset;
+    int d;
+
+    packed = (unsigned char*)malloc((ctx->nbits + 7)/8);
+    row = (uint64_t*)malloc(bin_row_words(ctx->nbits)*sizeof(uint64_t));
+    if (packed == NULL || row == NULL) {
+        free(packed);
+        free(row);
+        ctx->failed = 1;
+        return;
+    }
+    // neighbouring vectors share cache lines, so each worker takes a run
+    start = ctx->nvec*worker/nworkers;
+    stop = ctx->nvec*(worker + 1)/nworkers;
+    for (i = start; i < stop; i++) {
+        offset = 0;
+        rem = i;
+        for (d = ctx->ndim - 1; d >= 0; d--) {
+            offset += (rem % ctx->shape[d])*ctx->strides[d];
+            rem /= ctx->shape[d];
+        }
+        bin_pack_strided(ctx->buf + offset, ctx->length, ctx->stride,
+                         ctx->itemsize, ctx->bit, packed);
+        bin_import_row(row, packed, ctx->nbits);
+        ctx->out[i] = bin_score_row(row, ctx->nbits, ctx->metric);
+    }
+    free(row);
+    free(packed);
+}
+
+/** brief nd_format - checks the element type of an array for the nd
+ * functions, which take bool and integers in native byte order
+ *
+ * return int 1 for bool, 0 for integers, or -1 with an exception set
+ */
+static int
+nd_format(const Py_buffer *view)
+{
+    const char *format = view->format == NULL ? "B" : view->format;
+    const int one = 1;
+    int little = *(const char*)&one;
+
+    if (view->itemsize > 1 && ((format[0] == '<' && !little) ||
+            ((format[0] == '>' || format[0] == '!') && little))) {
+        PyErr_SetString(PyExc_ValueError,
+                        "The array must be in native byte order.");
+        return -1;
+    }
+    if (strchr("@=<>!", format[0]) != NULL && format[0] != '\0')
+        format++;
+    if (strcmp(format, "?") == 0)
+        return 1;
+    if (strlen(format) == 1 && strchr("bBhHiIlLqQnN", format[0]) != NULL &&
+            (view->itemsize == 1 || view->itemsize == 2 ||
+             view->itemsize == 4 || view->itemsize == 8))
+        return 0;
+    PyErr_SetString(PyExc_TypeError,
+                    "The array must hold bool or integers.");
+    return -1;
+}
+
+/** brief bientropy_nd_wrapper - translates parameters from Python for the nd
+ * functions, which score every vector along one axis of an N-dimensional
+ * array. The vectors are read in place through the strides of the array,
+ * so columns are scored without transposing, and are split across threads.
+ * Shared by bien_nd and tbien_nd.
+ *
+ * param self PyObject* the module
+ * param args PyObject* positional arguments from the Python interpreter
+ * param kwds PyObject* keyword arguments from the Python interpreter
+ * param metric int BIN_METRIC_BIEN or BIN_METRIC_TBIEN
+ *
+ * return PyObject* a NumPy array of results
+ */
+static PyObject *
+bientropy_nd_wrapper(PyObject *self, PyObject *args, PyObject *kwds,
+                     int metric)
+{
+    static char *kwlist[] = {"arr", "axis", "bitplane", "threads", NULL};
+    PyObject *arr_obj, *bitplane_obj = Py_None, *threads_obj = Py_None;
+    PyObject *retval = NULL, *shape = NULL, *reshaped;
+    Py_buffer arr, out;
+    struct nd_ctx ctx;
+    Py_ssize_t axis = -1;
+    long bitplane;
+    int d, is_bool, nthreads, rc = 0;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|nOO", kwlist, &arr_obj,
+                                     &axis, &bitplane_obj, &threads_obj))
+        return NULL;
+    nthreads = parse_threads(self, threads_obj);
+    if (nthreads < 0)
+        return NULL;
+
+    if (PyObject_GetBuffer(arr_obj, &arr, PyBUF_STRIDES | PyBUF_FORMAT) < 0)
+        return NULL;
+    is_bool = nd_format(&arr);
+    if (is_bool < 0)
+        goto done;
+    if (arr.ndim < 1 || arr.ndim > ND_MAX_DIMS) {
+        PyErr_Format(PyExc_ValueError,
+                     "The array must have from 1 to %d dimensions.",
+                     ND_MAX_DIMS);
+        goto done;
+    }
+    if (axis < -arr.ndim || axis >= arr.ndim) {
+        PyErr_Format(PyExc_ValueError,
+                     "axis %zd is out of bounds for an array of %d "
+                     "dimensions.", axis, arr.ndim);
+        goto done;
+    }
+    if (axis < 0)
+        axis += arr.ndim;
+
+    if (bitplane_obj == Py_None) {
+        // bool is one bit per element, integers all of their bits
+        ctx.bit = is_bool ? 0 : -1;
+    } else {
+        bitplane = PyLong_AsLong(bitplane_obj);
+        if (bitplane == -1 && PyErr_Occurred())
+            goto done;
+        if (bitplane < 0 || bitplane >= (is_bool ? 1 : 8*arr.itemsize)) {
+            PyErr_Format(PyExc_ValueError,
+                         "bitplane must be from 0 to %d for this array.",
+                         is_bool ? 0 : (int)(8*arr.itemsize) - 1);
+            goto done;
+        }
+        ctx.bit = (int)bitplane;
+    }
+
+    ctx.buf = (const unsigned char*)arr.buf;
+    ctx.ndim = 0;
+    ctx.nvec = 1;
+    shape = PyTuple_New(arr.ndim - 1);
+    if (shape == NULL)
+        goto done;
+    for (d = 0; d < arr.ndim; d++) {
+        if (d == axis)
+            continue;
+        ctx.shape[ctx.ndim] = arr.shape[d];
+        ctx.strides[ctx.ndim] = arr.strides[d];
+        PyTuple_SET_ITEM(shape, ctx.ndim, PyLong_FromSsize_t(arr.shape[d]));
+        if (PyTuple_GET_ITEM(shape, ctx.ndim) == NULL)
+            goto done;
+        ctx.nvec *= arr.shape[d];
+        ctx.ndim++;
+    }
+    ctx.length = arr.shape[axis];
+    ctx.stride = arr.strides[axis];
+    ctx.itemsize = arr.itemsize;
+    ctx.nbits = ctx.bit < 0 ? ctx.length*8*arr.itemsize : ctx.length;
+    ctx.metric = metric;
+    ctx.failed = 0;
+    if (ctx.nvec > 0 &&
+            check_batch_bits(ctx.nbits, ctx.nbits, metric,
+                             BIN_ENGINE_WORDS) < 0)
+        goto done;
+
+    retval = new_double_array(ctx.nvec, &out);
+    if (retval == NULL)
+        goto done;
+    ctx.out = (double*)out.buf;
+    if (nthreads > ctx.nvec)
+        nthreads = ctx.nvec > 0 ? (int)ctx.nvec : 1;
+    if (ctx.nvec > 0) {
+        Py_BEGIN_ALLOW_THREADS
+        rc = run_parallel(nthreads, nd_worker, &ctx);
+        Py_END_ALLOW_THREADS
+    }
+    PyBuffer_Release(&out);
+    if (rc < 0 || ctx.failed) {
+        Py_CLEAR(retval);
+        PyErr_NoMemory();
+        goto done;
+    }
+    reshaped = PyObject_CallMethod(retval, "reshape", "(O)", shape);
+    Py_DECREF(retval);
+    retval = reshaped;
+
+done:
+    Py_XDECREF(shape);
+    PyBuffer_Release(&arr);
+    return retval;
+}
+
+#define DOC_ND_PARAMS \
+"Each vector is read in place through the strides of the array, so\n" \
+"columns and other axes are scored without transposing or copying, and\n" \
+"the vectors are split across threads. This is meant for two-dimensional\n" \
+"maps such as SRAM PUF responses and for the bit-planes of images.\n" \
+"\n" \
+"Parameters\n" \
+"----------\n" \
+"arr : buffer\n" \
+"    an array of bool, with one bit per element, or of integers of 1, 2, 4\n" \
+"    or 8 bytes in native byte order, with any strides\n" \
+"axis : int, optional\n" \
+"    the axis along which the vectors run; defaults to the last\n" \
+"bitplane : int, optional\n" \
+"    score bit-plane k of integers, bit k of each element from 0 for the\n" \
+"    least significant bit, with one bit per element; by default each\n" \
+"    element of an integer array contributes all of its bits, from the\n" \
+"    most significant\n" \
+"threads : int, optional\n" \
+"    the number of threads; defaults to the number of CPUs\n" \
+"\n" \
+"Returns\n" \
+"-------\n" \
+"numpy.ndarray\n"
+
+#define DOC_BIEN_ND \
+"bien_nd(arr, axis=-1, bitplane=None, threads=None)\n" \
+"\n" \
+"BiEn of each vector along an axis of an N-dimensional array.\n" \
+"\n" \
+DOC_ND_PARAMS \
+"    the BiEntropy of each vector, as float64, in the shape of arr\n" \
+"    without axis\n"
+static PyObject *
+bientropy_bien_nd(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    return bientropy_nd_wrapper(self, args, kwds, BIN_METRIC_BIEN);
+}
+
+#define DOC_TBIEN_ND \
+"tbien_nd(arr, axis=-1, bitplane=None, threads=None)\n" \
+"\n" \
+"TBiEn of each vector along an axis of an N-dimensional array.\n" \
+"\n" \
+DOC_ND_PARAMS \
+"    the TBiEntropy of each vector, as float64, in the shape of arr\n" \
+"    without axis\n"
+static PyObject *
+bientropy_tbien_nd(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    return bientropy_nd_wrapper(self, args, kwds, BIN_METRIC_TBIEN);
+}
+
+// Records scored together by the bit-sliced engine in top-k searches
+#define TOPK_CHUNK 1024
+
+struct topk_entry {
+    double score;
+    Py_ssize_t index;
+};
+
+struct topk_ctx {
+    const unsigned char *data;
+    Py_ssize_t nrec;
+    Py_ssize_t record_bytes;
+    Py_ssize_t k;
+    const bin_metric *m;
+    int largest;
+    // k entries per worker, and the number each holds
+    struct topk_entry *heaps;
+    Py_ssize_t *sizes;
+    int failed;
+};
+
+/** brief topk_worse - whether entry a ranks after entry b: a higher score,
+ * or with largest a lower one, and ties to the later record
+ */
+static int
+topk_worse(const struct topk_entry *a, const struct topk_entry *b,
+           int largest)
+{
+    if (a->score != b->score)
+        return largest ? a->score < b->score : a->score > b->score;
+    return a->index > b->index;
+}
+
+/** brief topk_offer - offers a score to a heap of up to k entries whose root
+ * is the worst of them, replacing the root if the score is better
+ */
+static void
+topk_offer(struct topk_entry *heap, Py_ssize_t *n, Py_ssize_t k,
+           int largest, double score, Py_ssize_t index)
+{
+    struct topk_entry e, t;
+    Py_ssize_t i, c;
+
+    e.score = score;
+    e.index = index;
+    if (*n < k) {
+        // sift up
+        i = (*n)++;
+        heap[i] = e;
+        while (i > 0 && topk_worse(&heap[i], &heap[(i - 1)/2], largest)) {
+            t = heap[i];
+            heap[i] = heap[(i - 1)/2];
+            heap[(i - 1)/2] = t;
+            i = (i - 1)/2;
+        }
+        return;
+    }
+    if (topk_worse(&e, &heap[0], largest))
+        return;
+    // replace the root and sift down
+    heap[0] = e;
+    for (i = 0; (c = 2*i + 1) < k; i = c) {
+        if (c + 1 < k && topk_worse(&heap[c + 1], &heap[c], largest))
+            c++;
+        if (!topk_worse(&heap[c], &heap[i], largest))
+            break;
+        t = heap[i];
+        heap[i] = heap[c];
+        heap[c] = t;
+    }
+}
+
+static void
+topk_worker(void *arg, int worker, int nworkers)
+{
+    struct topk_ctx *ctx = (struct topk_ctx*)arg;
+    struct topk_entry *heap = ctx->heaps + worker*ctx->k;
+    const bin_metric *m = ctx->m;
+    Py_ssize_t i, j, start, stop, count, n = 0;
+    double *scores, score;
+    uint64_t *row;
+
+    start = ctx->nrec*worker/nworkers;
+    stop = ctx->nrec*(worker + 1)/nworkers;
+    if (m->nbits <= BIN_BITSLICE_MAX_BITS) {
+        // short records are scored fastest 64 at a time by the bit-sliced
+        // engine, which cannot stop early for one of them
+        scores = (double*)malloc(TOPK_CHUNK*sizeof(double));
+        if (scores == NULL) {
+            ctx->failed = 1;
+            return;
+        }
+        for (i = start; i < stop; i += TOPK_CHUNK) {
+            count = stop - i < TOPK_CHUNK ? stop - i : TOPK_CHUNK;
+            if (bin_metric_batch(m, ctx->data + i*ctx->record_bytes, count,
+                                 ctx->record_bytes, scores) < 0) {
+                ctx->failed = 1;
+                break;
+            }
+            for (j = 0; j < count; j++) {
+                topk_offer(heap, &n, ctx->k, ctx->largest, scores[j], i + j);
+            }
+        }
+        free(scores);
+    } else {
+        row = (uint64_t*)malloc(bin_row_words(m->nbits)*sizeof(uint64_t));
+        if (row == NULL) {
+            ctx->failed = 1;
+            return;
+        }
+        for (i = start; i < stop; i++) {
+            bin_import_row(row, ctx->data + i*ctx->record_bytes, m->nbits);
+            if (n < ctx->k) {
+                score = bin_metric_score(m, row);
+            } else {
+                score = bin_metric_score_bound(m, row, heap[0].score,
+                                               ctx->largest);
+            }
+            topk_offer(heap, &n, ctx->k, ctx->largest, score, i);
+        }
+        free(row);
+    }
+    ctx->sizes[worker] = n;
+}
+
+static int
+topk_compare_smallest(const void *a, const void *b)
+{
+    return topk_worse((const struct topk_entry*)a,
+                      (const struct topk_entry*)b, 0) ? 1 : -1;
+}
+
+static int
+topk_compare_largest(const void *a, const void *b)
+{
+    return topk_worse((const struct topk_entry*)a,
+                      (const struct topk_entry*)b, 1) ? 1 : -1;
+}
+
+/** brief bientropy_topk - finds the k records of a batch with the lowest or
+ * highest scores. Each thread keeps a heap of the best k records of its
+ * share of the batch, and stops scoring a record once bounds on its partial
+ * score show that it cannot enter the heap; the heaps are merged at the
+ * end.
+ *
+ * param self PyObject* the module
+ * param args PyObject* positional arguments from the Python interpreter
+ * param kwds PyObject* keyword arguments from the Python interpreter
+ *
+ * return PyObject* a tuple of the indices and scores of the records
+ */
+static PyObject *
+bientropy_topk(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"data", "k", "metric", "largest",
+                             "record_bytes", "bits", "threads", "unpacked",
+                             NULL};
+    PyObject *data_obj, *largest_obj = Py_False, *rb_obj = Py_None;
+    PyObject *bits_obj = Py_None, *threads_obj = Py_None;
+    PyObject *unpacked_obj = Py_False, *metric_obj = NULL;
+    PyObject *indices = NULL, *scores = NULL, *retval = NULL;
+    const char *metric_name = "tbien";
+    const MetricObject *prepared = NULL;
+    Py_ssize_t k, nrec, record_bytes, nbits, total, w, i;
+    Py_buffer data, idx_out, score_out;
+    unsigned char *packed;
+    struct topk_ctx ctx;
+    bin_metric m;
+    int metric, unpacked, nthreads, rc;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "On|OOOOOO", kwlist,
+                                     &data_obj, &k, &metric_obj,
+                                     &largest_obj, &rb_obj, &bits_obj,
+                                     &threads_obj, &unpacked_obj))
+        return NULL;
+    if (metric_obj != NULL && PyObject_TypeCheck(metric_obj,
+            (PyTypeObject*)get_state(self)->metric_type)) {
+        // prepared and only read afterwards, so shared with the threads
+        prepared = (const MetricObject*)metric_obj;
+        metric = BIN_METRIC_CUSTOM;
+    } else {
+        if (metric_obj != NULL && !PyArg_Parse(metric_obj, "s",
+                                               &metric_name)) {
+            PyErr_SetString(PyExc_TypeError,
+                            "metric must be 'bien', 'tbien' or a Metric.");
+            return NULL;
+        }
+        metric = parse_metric(metric_name);
+        if (metric < 0)
+            return NULL;
+    }
+    if (k < 1) {
+        PyErr_SetString(PyExc_ValueError, "k must be at least one.");
+        return NULL;
+    }
+    ctx.largest = PyObject_IsTrue(largest_obj);
+    if (ctx.largest < 0)
+        return NULL;
+    unpacked = PyObject_IsTrue(unpacked_obj);
+    if (unpacked < 0)
+        return NULL;
+    nthreads = parse_threads(self, threads_obj);
+    if (nthreads < 0)
+        return NULL;
+
+    if (batch_records(data_obj, rb_obj, bits_obj, unpacked, &data, &packed,
+                      &nrec, &record_bytes, &nbits) < 0)
+        return NULL;
+    if (check_batch_bits(nbits, nbits, metric, BIN_ENGINE_WORDS) < 0)
+        goto done;
+    if (prepared != NULL && prepared->m.nbits != (size_t)nbits) {
+        PyErr_Format(PyExc_ValueError,
+                     "The Metric is prepared for strings of %zd bits, but "
+                     "the records are %zd bits long.",
+                     (Py_ssize_t)prepared->m.nbits, nbits);
+        goto done;
+    }
+    if (k > nrec)
+        k = nrec;
+    if (nthreads > nrec)
+        nthreads = nrec > 0 ? (int)nrec : 1;
+
+    ctx.data = packed != NULL ? packed : (const unsigned char*)data.buf;
+    ctx.nrec = nrec;
+    ctx.record_bytes = record_bytes;
+    ctx.k = k;
+    ctx.m = prepared != NULL ? &prepared->m : &m;
+    ctx.failed = 0;
+    ctx.heaps = (struct topk_entry*)malloc(
+        (k > 0 ? k : 1)*nthreads*sizeof(struct topk_entry));
+    ctx.sizes = (Py_ssize_t*)calloc(nthreads, sizeof(Py_ssize_t));
+    // an unused metric is freed as an empty one
+    m.weights = m.table = NULL;
+    if (ctx.heaps == NULL || ctx.sizes == NULL ||
+            (prepared == NULL && bin_metric_init(&m, nbits, metric) < 0)) {
+        free(ctx.heaps);
+        free(ctx.sizes);
+        PyErr_NoMemory();
+        goto done;
+    }
+
+    rc = 0;
+    if (k > 0) {
+        Py_BEGIN_ALLOW_THREADS
+        rc = run_parallel(nthreads, topk_worker, &ctx);
+        Py_END_ALLOW_THREADS
+    }
+    bin_metric_free(&m);
+    if (rc < 0 || ctx.failed) {
+        free(ctx.heaps);
+        free(ctx.sizes);
+        PyErr_NoMemory();
+        goto done;
+    }
+
+    // gather the heaps of the workers and keep the best k of them
+    total = 0;
+    for (w = 0; w < nthreads; w++) {
+        memmove(ctx.heaps + total, ctx.heaps + w*k,
+                ctx.sizes[w]*sizeof(struct topk_entry));
+        total += ctx.sizes[w];
+    }
+    qsort(ctx.heaps, total, sizeof(struct topk_entry),
+          ctx.largest ? topk_compare_largest : topk_compare_smallest);
+    if (total > k)
+        total = k;
+    indices = new_array(total, "int64", 0, &idx_out);
+    if (indices != NULL) {
+        scores = new_double_array(total, &score_out);
+        if (scores == NULL) {
+            PyBuffer_Release(&idx_out);
+        } else {
+            for (i = 0; i < total; i++) {
+                ((int64_t*)idx_out.buf)[i] = ctx.heaps[i].index;
+                ((double*)score_out.buf)[i] = ctx.heaps[i].score;
+            }
+            PyBuffer_Release(&idx_out);
+            PyBuffer_Release(&score_out);
+            retval = PyTuple_Pack(2, indices, scores);
+        }
+    }
+    Py_XDECREF(indices);
+    Py_XDECREF(scores);
+    free(ctx.heaps);
+    free(ctx.sizes);
+
+done:
+    release_records(&data, packed);
+    return retval;
+}
+
+// The most block sizes pyramid() takes at once
+#define PYRAMID_MAX_SCALES 16
+
+struct pyramid_ctx {
+    const unsigned char *data;
+    const bin_metric *m; // the scales, largest first
+    const size_t *block_bytes;
+    double **out; // the scores of each scale
+    size_t nscales;
+    size_t first_scale; // the scale of the blocks of this pass
+    size_t base; // the offset of the first block of this pass
+    size_t nblocks;
+    int failed;
+};
+
+static void
+pyramid_worker(void *arg, int worker, int nworkers)
+{
+    struct pyramid_ctx *ctx = (struct pyramid_ctx*)arg;
+    const bin_metric *m = ctx->m + ctx->first_scale;
+    size_t nscales = ctx->nscales - ctx->first_scale;
+    size_t block = ctx->block_bytes[ctx->first_scale], i, s, first, last;
+    size_t start;
+    double *out[PYRAMID_MAX_SCALES];
+    uint64_t *row;
+    size_t *counts;
+
+    row = (uint64_t*)malloc(bin_row_words(m->nbits)*sizeof(uint64_t));
+    counts = (size_t*)malloc(
+        2*(m->nbits/m[nscales-1].nbits)*sizeof(size_t));
+    if (row == NULL || counts == NULL) {
+        free(row);
+        free(counts);
+        ctx->failed = 1;
+        return;
+    }
+    // each worker reads one contiguous run of blocks
+    first = ctx->nblocks*worker/nworkers;
+    last = ctx->nblocks*(worker + 1)/nworkers;
+    for (i = first; i < last; i++) {
+        start = ctx->base + i*block;
+        for (s = 0; s < nscales; s++) {
+            out[s] = ctx->out[ctx->first_scale + s] +
+                     start/ctx->block_bytes[ctx->first_scale + s];
+        }
+        bin_import_row(row, ctx->data + start, m->nbits);
+        bin_pyramid_block(row, m, nscales, counts, out);
+    }
+    free(row);
+    free(counts);
+}
+
+/** brief pyramid_sizes - reads the block sizes of pyramid() and sorts them
+ * from the largest, checking that each divides the one before
+ *
+ * return Py_ssize_t the number of sizes, or -1 with an exception set
+ */
+static Py_ssize_t
+pyramid_sizes(PyObject *sizes_obj, size_t *sizes, Py_ssize_t *order)
+{
+    PyObject *seq;
+    Py_ssize_t n, i, j, t;
+
+    seq = PySequence_Fast(sizes_obj, "block_sizes must be a sequence.");
+    if (seq == NULL)
+        return -1;
+    n = PySequence_Fast_GET_SIZE(seq);
+    if (n < 1 || n > PYRAMID_MAX_SCALES) {
+        PyErr_Format(PyExc_ValueError,
+                     "Between 1 and %d block sizes are supported.",
+                     PYRAMID_MAX_SCALES);
+        Py_DECREF(seq);
+        return -1;
+    }
+    for (i = 0; i < n; i++) {
+        t = PyNumber_AsSsize_t(PySequence_Fast_GET_ITEM(seq, i),
+                               PyExc_OverflowError);
+        if (t == -1 && PyErr_Occurred()) {
+            Py_DECREF(seq);
+            return -1;
+        }
+        if (t < 1) {
+            PyErr_SetString(PyExc_ValueError,
+                            "The block sizes must be at least one byte.");
+            Py_DECREF(seq);
+            return -1;
+        }
+        sizes[i] = t;
+        order[i] = i;
+    }
+    Py_DECREF(seq);
+    // insertion sort of the few sizes, largest first
+    for (i = 1; i < n; i++) {
+        for (j = i; j > 0 && sizes[order[j-1]] < sizes[order[j]]; j--) {
+            t = order[j];
+            order[j] = order[j-1];
+            order[j-1] = t;
+        }
+    }
+    for (i = 1; i < n; i++) {
+        if (sizes[order[i-1]] == sizes[order[i]] ||
+                sizes[order[i-1]] % sizes[order[i]] != 0) {
+            PyErr_SetString(PyExc_ValueError,
+                            "Each block size must divide every larger one "
+                            "and appear once.");
+            return -1;
+        }
+    }
+    return n;
+}
+
+#define DOC_PYRAMID \
+"pyramid(data, block_sizes, metric='tbien', threads=None)\n" \
+"\n" \
+"Score the blocks of a buffer at several block sizes at once, such as\n" \
+"blocks of 64 bytes, 512 bytes and 4 KiB. Level k of the derivatives of a\n" \
+"block is, where its windows lie inside a sub-block, level k of the\n" \
+"sub-block, so one chain of derivatives per largest block gives the\n" \
+"popcounts of every scale. The buffer is read once, only the largest scale\n" \
+"pays for deriving, and each level is counted once, in the ranges of the\n" \
+"smallest scale and the gaps between them, whose sums give the counts of\n" \
+"the larger ones. The pyramid costs about as much as the largest scale\n" \
+"alone. Only whole blocks are scored, and the bytes after the last whole\n" \
+"block of a scale are scored at the smaller scales only.\n" \
+"\n" \
+"Parameters\n" \
+"----------\n" \
+"data : bytes-like object\n" \
+"    the data to score; any object supporting the buffer protocol, such as\n" \
+"    an mmap.mmap of a file\n" \
+"block_sizes : sequence of int\n" \
+"    the block sizes in bytes, in any order; each must divide every larger\n" \
+"    one\n" \
+"metric : str, optional\n" \
+"    'bien' or 'tbien' (the default)\n" \
+"threads : int, optional\n" \
+"    the number of threads; defaults to the number of CPUs\n" \
+"\n" \
+"Returns\n" \
+"-------\n" \
+"list of numpy.ndarray\n" \
+"    for each block size in the order given, the score of each of the\n" \
+"    len(data)//size whole blocks, as float64\n"
+static PyObject *
+bientropy_pyramid(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"data", "block_sizes", "metric", "threads",
+                             NULL};
+    PyObject *data_obj, *sizes_obj, *threads_obj = Py_None;
+    PyObject *arrays[PYRAMID_MAX_SCALES], *retval = NULL;
+    const char *metric_name = "tbien";
+    size_t sizes[PYRAMID_MAX_SCALES], bytes[PYRAMID_MAX_SCALES];
+    Py_ssize_t order[PYRAMID_MAX_SCALES], nscales, s, ninit = 0;
+    double *out[PYRAMID_MAX_SCALES];
+    bin_metric m[PYRAMID_MAX_SCALES];
+    struct pyramid_ctx ctx;
+    Py_buffer data, view;
+    size_t offset;
+    int metric, nthreads, rc = 0;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "OO|sO", kwlist, &data_obj,
+                                     &sizes_obj, &metric_name, &threads_obj))
+        return NULL;
+    metric = parse_metric(metric_name);
+    if (metric < 0)
+        return NULL;
+    nthreads = parse_threads(self, threads_obj);
+    if (nthreads < 0)
+        return NULL;
+    nscales = pyramid_sizes(sizes_obj, sizes, order);
+    if (nscales < 0)
+        return NULL;
+    for (s = 0; s < nscales; s++)
+        bytes[s] = sizes[order[s]];
+    if (check_batch_bits(8*bytes[nscales-1], 8*bytes[0], metric,
+                         BIN_ENGINE_WORDS) < 0)
+        return NULL;
+
+    if (PyObject_GetBuffer(data_obj, &data, PyBUF_C_CONTIGUOUS) < 0)
+        return NULL;
+    for (s = 0; s < nscales; s++)
+        arrays[s] = NULL;
+    for (s = 0; s < nscales; s++) {
+        arrays[order[s]] = new_double_array(data.len/bytes[s], &view);
+        if (arrays[order[s]] == NULL)
+            goto done;
+        // the arrays own their data, so it outlives the view
+        out[s] = (double*)view.buf;
+        PyBuffer_Release(&view);
+    }
+    for (ninit = 0; ninit < nscales; ninit++) {
+        if (bin_metric_init(&m[ninit], 8*bytes[ninit], metric) < 0) {
+            PyErr_NoMemory();
+            goto done;
+        }
+    }
+
+    ctx.data = (const unsigned char*)data.buf;
+    ctx.m = m;
+    ctx.block_bytes = bytes;
+    ctx.out = out;
+    ctx.nscales = nscales;
+    ctx.failed = 0;
+    offset = 0;
+    Py_BEGIN_ALLOW_THREADS
+    // the whole largest blocks, then what is left over at each smaller
+    // scale in turn
+    for (s = 0; s < nscales && rc == 0; s++) {
+        ctx.first_scale = s;
+        ctx.base = offset;
+        ctx.nblocks = (data.len - offset)/bytes[s];
+        if (ctx.nblocks == 0)
+            continue;
+        rc = run_parallel((size_t)nthreads > ctx.nblocks ?
+                              (int)ctx.nblocks : nthreads,
+                          pyramid_worker, &ctx);
+        offset += ctx.nblocks*bytes[s];
+    }
+    Py_END_ALLOW_THREADS
+    if (rc < 0 || ctx.failed) {
+        PyErr_NoMemory();
+        goto done;
+    }
+
+    retval = PyList_New(nscales);
+    if (retval == NULL)
+        goto done;
+    for (s = 0; s < nscales; s++) {
+        PyList_SET_ITEM(retval, s, arrays[s]);
+        arrays[s] = NULL;
+    }
+
+done:
+    for (s = 0; s < ninit; s++)
+        bin_metric_free(&m[s]);
+    for (s = 0; s < nscales; s++)
+        Py_XDECREF(arrays[s]);
+    PyBuffer_Release(&data);
+    return retval;
+}
+
+#define DOC_TOPK \
+"topk(data, k, metric='tbien', largest=False, record_bytes=None, " \
+"bits=None, threads=None, unpacked=False)\n" \
+"\n" \
+"The k records of a batch with the lowest scores, or the highest.\n" \
+"\n" \
+"This finds the least random records of a large batch, such as the\n" \
+"weakest keys, without keeping every score. Each thread keeps a heap of\n" \
+"the best k records of its share of the batch. Once its heap is full, the\n" \
+"derivative loop of a record is abandoned as soon as bounds on the partial\n" \
+"weighted sum show that the record cannot enter the heap. Records of up\n" \
+"to 64 bits are scored by the bit-sliced engine instead. The heaps are\n" \
+"merged at the end.\n" \
+"\n" \
+"Parameters\n" \
+"----------\n" \
+"data : buffer\n" \
+"    the records, as the rows of a C-contiguous two-dimensional buffer\n" \
+"    such as a NumPy array of uint8, a flat buffer cut into records of\n" \
+"    record_bytes bytes or the rows of a two-dimensional NumPy array of\n" \
+"    bool with one bit per element\n" \
+"k : int\n" \
+"    the number of records to find\n" \
+"metric : str or Metric, optional\n" \
+"    'bien', 'tbien' (the default) or a Metric prepared for the length of\n" \
+"    the records, for any other weighting of the levels\n" \
+"largest : bool, optional\n" \
+"    find the records with the highest scores rather than the lowest\n" \
+"record_bytes : int, optional\n" \
+"    the size of each record for a flat buffer\n" \
+"bits : int, optional\n" \
+"    the length of each record in bits, if less than 8*record_bytes\n" \
+"threads : int, optional\n" \
+"    the number of threads; defaults to the number of CPUs\n" \
+"unpacked : bool, optional\n" \
+"    read a two-dimensional array of uint8 as one bit per byte\n" \
+"\n" \
+"Returns\n" \
+"-------\n" \
+"tuple of numpy.ndarray\n" \
+"    the indices of the min(k, N) records, as int64, and their scores, as\n" \
+"    float64, from the best; ties go to the earlier record\n"
+
+/* An iterator over the derivative levels of a string. The string is kept in
+ * one row of words, which is derived in place, and each level is exported
+ * through one buffer of bytes, which the memoryviews it yields share.
+ */
+typedef struct {
+    PyObject_HEAD
+    uint64_t *row;
+    unsigned char *level; // the bytes of the last level yielded
+    size_t nbits;
+    size_t row_k; // the level held in the row
+    size_t k; // the next level to yield
+    size_t stop;
+    Py_ssize_t level_bytes; // the length of the last level in bytes
+} DerivativesObject;
+
+static void
+derivatives_dealloc(DerivativesObject *self)
+{
+    PyTypeObject *type = Py_TYPE(self);
+
+    free(self->row);
+    free(self->level);
+    type->tp_free((PyObject*)self);
+#if PY_MAJOR_VERSION >= 3
+    // instances of heap types hold a reference to their type
+    Py_DECREF(type);
+#endif
+}
+
+static int
+derivatives_getbuffer(DerivativesObject *self, Py_buffer *view, int flags)
+{
+    return PyBuffer_FillInfo(view, (PyObject*)self, self->level,
+                             self->level_bytes, 1, flags);
+}
+
+static PyObject *
+derivatives_next(DerivativesObject *self)
+{
+    PyObject *retval = NULL;
+
+    // on free-threaded builds, calls from several threads take turns, so
+    // that each derives and exports a whole level
+#ifdef Py_BEGIN_CRITICAL_SECTION
+    Py_BEGIN_CRITICAL_SECTION((PyObject*)self);
+#endif
+    if (self->k < self->stop) {
+        while (self->row_k < self->k) {
+            bin_row_deriv(self->row, self->nbits - self->row_k);
+            self->row_k++;
+        }
+        bin_export_row(self->level, self->row, self->nbits - self->k);
+        self->level_bytes = (self->nbits - self->k + 7)/8;
+        self->k++;
+        retval = PyMemoryView_FromObject((PyObject*)self);
+    }
+#ifdef Py_BEGIN_CRITICAL_SECTION
+    Py_END_CRITICAL_SECTION();
+#endif
+    return retval;
+}
+
+#if PY_MAJOR_VERSION >= 3
+static PyType_Slot derivatives_slots[] = {
+    {Py_tp_dealloc, (void*)derivatives_dealloc},
+    {Py_tp_iter, (void*)PyObject_SelfIter},
+    {Py_tp_iternext, (void*)derivatives_next},
+    {Py_bf_getbuffer, (void*)derivatives_getbuffer},
+    {0, NULL}
+};
+
+static PyType_Spec derivatives_spec = {
+    "bientropy.cbientropy.DerivativeIterator",
+    sizeof(DerivativesObject),
+    0,
+    Py_TPFLAGS_DEFAULT,
+    derivatives_slots
+};
+#else
+static PyBufferProcs derivatives_as_buffer = {
+    0, 0, 0, 0, // the old buffer protocol
+    (getbufferproc)derivatives_getbuffer, // bf_getbuffer
+    0, // bf_releasebuffer
+};
+
+static PyTypeObject DerivativesType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "bientropy.cbientropy.DerivativeIterator", // tp_name
+    sizeof(DerivativesObject), // tp_basicsize
+    0, // tp_itemsize
+    (destructor)derivatives_dealloc, // tp_dealloc
+    0, 0, 0, 0, // tp_print, tp_getattr, tp_setattr, tp_compare
+    0, // tp_repr
+    0, 0, 0, 0, 0, // tp_as_number to tp_call
+    0, 0, 0, // tp_str, tp_getattro, tp_setattro
+    &derivatives_as_buffer, // tp_as_buffer
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_NEWBUFFER, // tp_flags
+    0, // tp_doc
+    0, 0, 0, 0, // tp_traverse to tp_weaklistoffset
+    PyObject_SelfIter, // tp_iter
+    (iternextfunc)derivatives_next, // tp_iternext
+};
+#endif
+
+#define DOC_ITER_DERIVATIVES \
+"iter_derivatives(bits, start_k=0, stop_k=None, unpacked=False)\n" \
+"\n" \
+"Iterate over the binary derivatives of a string, from level start_k up\n" \
+"to but not including level stop_k. Level 0 is the string itself and\n" \
+"level k is n-k bits long. Level start_k is reached with one shifted XOR\n" \
+"per set bit of start_k, and each level after it with one derivative\n" \
+"step, in place in one row. Each level is yielded as a read-only\n" \
+"memoryview of (n-k+7)//8 bytes, most significant bit first, with any\n" \
+"bits past n-k zeroed. The memoryviews share one buffer, which is\n" \
+"overwritten by the next level, so walking every level takes O(n) memory;\n" \
+"copy a level with bytes() to keep it.\n" \
+"\n" \
+"Parameters\n" \
+"----------\n" \
+"bits : binary string or bitstring-like object\n" \
+"    the string, as for bien()\n" \
+"start_k : int, optional\n" \
+"    the first level\n" \
+"stop_k : int, optional\n" \
+"    the level to stop before; defaults to n-1, the levels that BiEn and\n" \
+"    TBiEn weigh, and may be from 0 to n\n" \
+"unpacked : bool, optional\n" \
+"    read an array of uint8 as one bit per byte\n" \
+"\n" \
+"Returns\n" \
+"-------\n" \
+"iterator of memoryview\n" \
+"    the levels\n"
+static PyObject *
+bientropy_iter_derivatives(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"bits", "start_k", "stop_k", "unpacked", NULL};
+    PyObject *in_obj, *stop_obj = Py_None, *unpacked_obj = Py_False;
+    PyObject *bytestr;
+    PyTypeObject *type;
+    DerivativesObject *it;
+    Py_ssize_t nbits, start_k = 0, stop_k;
+    int unpacked;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|nOO", kwlist, &in_obj,
+                                     &start_k, &stop_obj, &unpacked_obj))
+        return NULL;
+    unpacked = PyObject_IsTrue(unpacked_obj);
+    if (unpacked < 0)
+        return NULL;
+    bytestr = as_bit_bytes(in_obj, unpacked, &nbits);
+    if (bytestr == NULL)
+        return NULL;
+    if (nbits < 1) {
+        PyErr_SetString(PyExc_ValueError, "The input string is empty.");
+        Py_DECREF(bytestr);
+        return NULL;
+    }
+    stop_k = nbits - 1;
+    if (stop_obj != Py_None) {
+        stop_k = PyNumber_AsSsize_t(stop_obj, PyExc_OverflowError);
+        if (stop_k == -1 && PyErr_Occurred()) {
+            Py_DECREF(bytestr);
+            return NULL;
+        }
+    }
+    if (start_k < 0 || start_k > nbits || stop_k < 0 || stop_k > nbits) {
+        PyErr_Format(PyExc_ValueError,
+                     "The levels must be between 0 and %zd.", nbits);
+        Py_DECREF(bytestr);
+        return NULL;
+    }
+
+    type = (PyTypeObject*)get_state(self)->derivatives_type;
+    it = (DerivativesObject*)type->tp_alloc(type, 0);
+    if (it == NULL) {
+        Py_DECREF(bytestr);
+        return NULL;
+    }
+    it->nbits = nbits;
+    it->k = start_k;
+    it->stop = stop_k > start_k ? stop_k : start_k;
+    it->level_bytes = 0;
+    it->row = (uint64_t*)malloc(bin_row_words(nbits)*sizeof(uint64_t));
+    it->level = (unsigned char*)malloc((nbits + 7)/8);
+    if (it->row == NULL || it->level == NULL) {
+        Py_DECREF(bytestr);
+        Py_DECREF(it);
+        return PyErr_NoMemory();
+    }
+    bin_import_row(it->row, (const unsigned char*)PyString_AsString(bytestr),
+                   nbits);
+    Py_DECREF(bytestr);
+    it->row_k = 0;
+    if (start_k > 0 && start_k < nbits) {
+        bin_row_level(it->row, nbits, start_k);
+        it->row_k = start_k;
+    }
+    return (PyObject*)it;
+}
+
+static PyMethodDef BiEntropyMethods[] = {
+    {"bien", (PyCFunction)bientropy_bien, METH_VARARGS | METH_KEYWORDS,
+        DOC_BIEN},
+    {"tbien", (PyCFunction)bientropy_tbien, METH_VARARGS | METH_KEYWORDS,
+        DOC_TBIEN},
+    {"bien_scratch", (PyCFunction)bientropy_bien_scratch,
+        METH_VARARGS | METH_KEYWORDS, DOC_BIEN_SCRATCH},
+    {"tbien_scratch", (PyCFunction)bientropy_tbien_scratch,
+        METH_VARARGS | METH_KEYWORDS, DOC_TBIEN_SCRATCH},
+    {"bien_batch", (PyCFunction)bientropy_bien_batch,
+        METH_VARARGS | METH_KEYWORDS, DOC_BIEN_BATCH},
+    {"tbien_batch", (PyCFunction)bientropy_tbien_batch,
+        METH_VARARGS | METH_KEYWORDS, DOC_TBIEN_BATCH},
+    {"bien_range", (PyCFunction)bientropy_bien_range,
+        METH_VARARGS | METH_KEYWORDS, DOC_BIEN_RANGE},
+    {"tbien_range", (PyCFunction)bientropy_tbien_range,
+        METH_VARARGS | METH_KEYWORDS, DOC_TBIEN_RANGE},
+    {"bien_ragged", (PyCFunction)bientropy_bien_ragged,
+        METH_VARARGS | METH_KEYWORDS, DOC_BIEN_RAGGED},
+    {"tbien_ragged", (PyCFunction)bientropy_tbien_ragged,
+        METH_VARARGS | METH_KEYWORDS, DOC_TBIEN_RAGGED},
+    {"bien_pairwise", (PyCFunction)bientropy_bien_pairwise,
+        METH_VARARGS | METH_KEYWORDS, DOC_BIEN_PAIRWISE},
+    {"tbien_pairwise", (PyCFunction)bientropy_tbien_pairwise,
+        METH_VARARGS | METH_KEYWORDS, DOC_TBIEN_PAIRWISE},
+    {"bien_nd", (PyCFunction)bientropy_bien_nd,
+        METH_VARARGS | METH_KEYWORDS, DOC_BIEN_ND},
+    {"tbien_nd", (PyCFunction)bientropy_tbien_nd,
+        METH_VARARGS | METH_KEYWORDS, DOC_TBIEN_ND},
+    {"topk", (PyCFunction)bientropy_topk, METH_VARARGS | METH_KEYWORDS,
+        DOC_TOPK},
+    {"pyramid", (PyCFunction)bientropy_pyramid,
+        METH_VARARGS | METH_KEYWORDS, DOC_PYRAMID},
+    {"iter_derivatives", (PyCFunction)bientropy_iter_derivatives,
+        METH_VARARGS | METH_KEYWORDS, DOC_ITER_DERIVATIVES},
+    {"tbien_estimate", (PyCFunction)bientropy_tbien_estimate,
+        METH_VARARGS | METH_KEYWORDS, DOC_TBIEN_ESTIMATE},
+    {"scan_metrics", (PyCFunction)bientropy_scan_metrics,
+        METH_VARARGS | METH_KEYWORDS, DOC_SCAN_METRICS},
+    {NULL, NULL, 0, NULL}
+};
+
+// Strings of up to this many words are scored from the stack with the GIL
+// held, since releasing it would cost more than scoring them
+#define METRIC_STACK_WORDS 64
+
+/** brief metric_get_record - gets the bytes of one input to a Metric, which
+ * is a binary string or buffer of just enough bytes to hold the length of
+ * the metric, or a bitstring-like object of that length.
+ *
+ * return int 0 on success, -1 with an exception set
+ */
+static int
+metric_get_record(MetricObject *self, PyObject *obj, Py_buffer *view)
+{
+    PyObject *bytestr;
+    Py_ssize_t nbits, nbytes = (self->m.nbits + 7)/8;
+    int rc;
+
+    if (PyObject_CheckBuffer(obj)) {
+        if (PyObject_GetBuffer(obj, view, PyBUF_SIMPLE) < 0)
+            return -1;
+        if (view->len != nbytes) {
+            PyErr_Format(PyExc_ValueError,
+                         "The input must be %zd bytes long.", nbytes);
+            PyBuffer_Release(view);
+            return -1;
+        }
+        return 0;
+    }
+    bytestr = as_bit_bytes(obj, 0, &nbits);
+    if (bytestr == NULL)
+        return -1;
+    if ((size_t)nbits != self->m.nbits) {
+        PyErr_Format(PyExc_ValueError, "The input must be %zd bits long.",
+                     (Py_ssize_t)self->m.nbits);
+        Py_DECREF(bytestr);
+        return -1;
+    }
+    // the view keeps its own reference to the string
+    rc = PyObject_GetBuffer(bytestr, view, PyBUF_SIMPLE);
+    Py_DECREF(bytestr);
+    return rc;
+}
+
+/** brief metric_score - scores one input with a Metric, the body of both
+ * calling conventions
+ *
+ * return PyObject* the score, or NULL on error
+ */
+static PyObject *
+metric_score(MetricObject *self, PyObject *obj)
+{
+    uint64_t stack_row[METRIC_STACK_WORDS], *row = stack_row;
+    size_t nwords = bin_row_words(self->m.nbits);
+    Py_buffer view;
+    double result;
+
+    if (metric_get_record(self, obj, &view) < 0)
+        return NULL;
+    if (nwords <= METRIC_STACK_WORDS) {
+        bin_import_row(row, (const unsigned char*)view.buf, self->m.nbits);
+        PyBuffer_Release(&view);
+        return PyFloat_FromDouble(bin_metric_score(&self->m, row));
+    }
+    row = (uint64_t*)malloc(nwords*sizeof(uint64_t));
+    if (row == NULL) {
+        PyBuffer_Release(&view);
+        return PyErr_NoMemory();
+    }
+    Py_BEGIN_ALLOW_THREADS
+    bin_import_row(row, (const unsigned char*)view.buf, self->m.nbits);
+    result = bin_metric_score(&self->m, row);
+    Py_END_ALLOW_THREADS
+    free(row);
+    PyBuffer_Release(&view);
+    return PyFloat_FromDouble(result);
+}
+
+static PyObject *
+metric_call(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    PyObject *obj;
+
+    if (kwds != NULL && PyDict_Size(kwds) > 0) {
+        PyErr_SetString(PyExc_TypeError,
+                        "Metric objects take no keyword arguments.");
+        return NULL;
+    }
+    if (!PyArg_UnpackTuple(args, "Metric", 1, 1, &obj))
+        return NULL;
+    return metric_score((MetricObject*)self, obj);
+}
+
+#if PY_VERSION_HEX >= 0x03090000
+static PyObject *
+metric_vectorcall(PyObject *self, PyObject *const *args, size_t nargsf,
+                  PyObject *kwnames)
+{
+    if (PyVectorcall_NARGS(nargsf) != 1 ||
+            (kwnames != NULL && PyTuple_GET_SIZE(kwnames) > 0)) {
+        PyErr_SetString(PyExc_TypeError,
+                        "Metric objects take exactly one positional "
+                        "argument.");
+        return NULL;
+    }
+    return metric_score((MetricObject*)self, args[0]);
+}
+#endif
+
+static PyObject *
+metric_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"kind", "bits", NULL};
+    PyObject *kind_obj;
+    Py_ssize_t nbits;
+    MetricObject *self;
+    double *weights;
+    int metric, rc;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "On", kwlist, &kind_obj,
+                                     &nbits))
+        return NULL;
+    if (nbits < 2) {
+        PyErr_SetString(PyExc_ValueError,
+                        "The strings must be at least two bits long.");
+        return NULL;
+    }
+    if (parse_kind(kind_obj, nbits, &metric, &weights) < 0)
+        return NULL;
+
+    self = (MetricObject*)type->tp_alloc(type, 0);
+    if (self == NULL) {
+        free(weights);
+        return NULL;
+    }
+    if (weights != NULL) {
+        rc = bin_metric_init_weights(&self->m, nbits, weights);
+        free(weights);
+    } else {
+        rc = bin_metric_init(&self->m, nbits, metric);
+    }
+    if (rc < 0) {
+        Py_DECREF(self);
+        return PyErr_NoMemory();
+    }
+#if PY_VERSION_HEX >= 0x03090000
+    self->vectorcall = metric_vectorcall;
+#endif
+    return (PyObject*)self;
+}
+
+static void
+metric_dealloc(MetricObject *self)
+{
+    PyTypeObject *type = Py_TYPE(self);
+
+    bin_metric_free(&self->m);
+    type->tp_free((PyObject*)self);
+#if PY_MAJOR_VERSION >= 3
+    // instances of heap types hold a reference to their type
+    Py_DECREF(type);
+#endif
+}
+
+static const char *
+metric_kind(MetricObject *self)
+{
+    switch (self->m.metric) {
+    case BIN_METRIC_BIEN:
+        return "bien";
+    case BIN_METRIC_TBIEN:
+        return "tbien";
+    case BIN_METRIC_UNIFORM:
+        return "uniform";
+    default:
+        return "custom";
+    }
+}
+
+static PyObject *
+metric_repr(MetricObject *self)
+{
+#if PY_MAJOR_VERSION >= 3
+    return PyUnicode_FromFormat(
+#else
+    return PyString_FromFormat(
+#endif
+        "Metric(kind='%s', bits=%zd)", metric_kind(self),
+        (Py_ssize_t)self->m.nbits);
+}
+
+static PyObject *
+metric_get_kind(MetricObject *self, void *closure)
+{
+#if PY_MAJOR_VERSION >= 3
+    return PyUnicode_FromString(metric_kind(self));
+#else
+    return PyString_FromString(metric_kind(self));
+#endif
+}
+
+static PyObject *
+metric_get_weights(MetricObject *self, void *closure)
+{
+    PyObject *retval;
+    Py_buffer out;
+
+    retval = new_double_array(self->m.nbits - 1, &out);
+    if (retval == NULL)
+        return NULL;
+    memcpy(out.buf, self->m.weights, (self->m.nbits - 1)*sizeof(double));
+    PyBuffer_Release(&out);
+    return retval;
+}
+
+static PyObject *
+metric_get_bits(MetricObject *self, void *closure)
+{
+    return PyLong_FromSize_t(self->m.nbits);
+}
+
+#define DOC_METRIC_BATCH \
+"batch(data)\n" \
+"\n" \
+"Score a batch of records of the length of the metric.\n" \
+"\n" \
+"Parameters\n" \
+"----------\n" \
+"data : buffer or sequence\n" \
+"    the records, as either the rows of a C-contiguous two-dimensional\n" \
+"    buffer such as a NumPy array of uint8, a flat buffer cut into records\n" \
+"    of just enough bytes to hold the length of the metric, or a sequence\n" \
+"    of such records\n" \
+"\n" \
+"Returns\n" \
+"-------\n" \
+"numpy.ndarray\n" \
+"    the score of each record, as float64\n"
+static PyObject *
+metric_batch(MetricObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"data", NULL};
+    PyObject *data_obj = NULL, *seq = NULL, *retval = NULL;
+    Py_ssize_t i, nrec, stride, nbytes = (self->m.nbits + 7)/8;
+    unsigned char *packed = NULL;
+    Py_buffer data, item, out;
+    int rc;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O", kwlist, &data_obj))
+        return NULL;
+
+    if (PyObject_CheckBuffer(data_obj)) {
+        if (PyObject_GetBuffer(data_obj, &data, PyBUF_C_CONTIGUOUS) < 0)
+            return NULL;
+        if (data.ndim >= 2) {
+            nrec = data.shape[0];
+            stride = nrec > 0 ? data.len/nrec : nbytes;
+        } else {
+            nrec = data.len/nbytes;
+            stride = nbytes;
+        }
+        if (stride < nbytes || (data.ndim < 2 && data.len % nbytes != 0)) {
+            PyErr_Format(PyExc_ValueError,
+                         "The records must be %zd bytes long.", nbytes);
+            PyBuffer_Release(&data);
+            return NULL;
+        }
+    } else {
+        seq = PySequence_Fast(data_obj,
+            "A buffer of records or a sequence of records is required.");
+        if (seq == NULL)
+            return NULL;
+        nrec = PySequence_Fast_GET_SIZE(seq);
+        packed = (unsigned char*)malloc(nrec > 0 ? nrec*nbytes : 1);
+        if (packed == NULL) {
+            Py_DECREF(seq);
+            return PyErr_NoMemory();
+        }
+        for (i = 0; i < nrec; i++) {
+            if (metric_get_record(self, PySequence_Fast_GET_ITEM(seq, i),
+                                  &item) < 0) {
+                free(packed);
+                Py_DECREF(seq);
+                return NULL;
+            }
+            memcpy(packed + i*nbytes, item.buf, nbytes);
+            PyBuffer_Release(&item);
+        }
+        Py_DECREF(seq);
+        data.obj = NULL;
+        data.buf = packed;
+        stride = nbytes;
+    }
+
+    retval = new_double_array(nrec, &out);
+    if (retval != NULL) {
+        Py_BEGIN_ALLOW_THREADS
+        rc = bin_metric_batch(&self->m, (const unsigned char*)data.buf, nrec,
+                              stride, (double*)out.buf);
+        Py_END_ALLOW_THREADS
+        PyBuffer_Release(&out);
+        if (rc < 0) {
+            Py_CLEAR(retval);
+            PyErr_NoMemory();
+        }
+    }
+
+    if (packed != NULL) {
+        free(packed);
+    } else {
+        PyBuffer_Release(&data);
+    }
+    return retval;
+}
+
+static PyMethodDef metric_methods[] = {
+    {"batch", (PyCFunction)metric_batch, METH_VARARGS | METH_KEYWORDS,
+        DOC_METRIC_BATCH},
+    {NULL, NULL, 0, NULL}
+};
+
+static PyGetSetDef metric_getset[] = {
+    {"kind", (getter)metric_get_kind, NULL,
+        "the name of the metric, 'bien', 'tbien', 'uniform' or 'custom'",
+        NULL},
+    {"weights", (getter)metric_get_weights, NULL,
+        "the normalized weight of each level, as a NumPy array", NULL},
+    {"bits", (getter)metric_get_bits, NULL,
+        "the length of the strings in bits", NULL},
+    {NULL}
+};
+
+#define DOC_METRIC \
+"Metric(kind, bits)\n" \
+"\n" \
+"BiEn, TBiEn or another weighting of the levels prepared for strings of a\n" \
+"fixed length. The normalized weight of each level, and for strings of up\n" \
+"to 512 bits the weighted entropy of each level and count of ones, are\n" \
+"computed once when the metric is created, so scoring a string only takes\n" \
+"the popcounts of its derivatives and a sum. Call the metric on a string\n" \
+"to score it, or use batch() to score many.\n" \
+"\n" \
+"Parameters\n" \
+"----------\n" \
+"kind : str or sequence of float\n" \
+"    'bien', 'tbien', 'uniform' to weight every level equally, or the\n" \
+"    bits-1 weights of levels 0 (the string itself) to bits-2, which are\n" \
+"    normalized to sum to one\n" \
+"bits : int\n" \
+"    the length of the strings in bits; inputs are binary strings or\n" \
+"    buffers of just enough bytes to hold them, or bitstring-like objects\n" \
+"    of this length\n"
+
+#if PY_MAJOR_VERSION >= 3
+#if PY_VERSION_HEX >= 0x03090000
+static PyMemberDef metric_members[] = {
+    {"__vectorcalloffset__", T_PYSSIZET, offsetof(MetricObject, vectorcall),
+        READONLY, NULL},
+    {NULL}
+};
+#endif
+
+static PyType_Slot metric_slots[] = {
+    {Py_tp_doc, (void*)DOC_METRIC},
+    {Py_tp_new, (void*)metric_new},
+    {Py_tp_dealloc, (void*)metric_dealloc},
+    {Py_tp_repr, (void*)metric_repr},
+    {Py_tp_call, (void*)metric_call},
+    {Py_tp_methods, metric_methods},
+    {Py_tp_getset, metric_getset},
+#if PY_VERSION_HEX >= 0x03090000
+    {Py_tp_members, metric_members},
+#endif
+    {0, NULL}
+};
+
+// A heap type, created for each interpreter that loads the module
+static PyType_Spec metric_spec = {
+    "bientropy.cbientropy.Metric",
+    sizeof(MetricObject),
+    0,
+#if PY_VERSION_HEX >= 0x03090000
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_VECTORCALL,
+#else
+    Py_TPFLAGS_DEFAULT,
+#endif
+    metric_slots
+};
+#else
+static PyTypeObject MetricType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "bientropy.cbientropy.Metric", // tp_name
+    sizeof(MetricObject), // tp_basicsize
+    0, // tp_itemsize
+    (destructor)metric_dealloc, // tp_dealloc
+    0, 0, 0, 0, // tp_print, tp_getattr, tp_setattr, tp_compare
+    (reprfunc)metric_repr, // tp_repr
+    0, 0, 0, 0, // tp_as_number, tp_as_sequence, tp_as_mapping, tp_hash
+    (ternaryfunc)metric_call, // tp_call
+    0, 0, 0, 0, // tp_str, tp_getattro, tp_setattro, tp_as_buffer
+    Py_TPFLAGS_DEFAULT, // tp_flags
+    DOC_METRIC, // tp_doc
+    0, 0, 0, 0, 0, 0, // tp_traverse to tp_iternext
+    metric_methods, // tp_methods
+    0, // tp_members
+    metric_getset, // tp_getset
+    0, 0, 0, 0, 0, 0, 0, // tp_base to tp_alloc
+    metric_new, // tp_new
+};
+#endif
+
+/** brief summary_values - adds a float, a buffer of float64 or a sequence of
+ * numbers to a Summary
+ *
+ * return int 0 on success, -1 with an exception set
+ */
+static int
+summary_values(SummaryObject *self, PyObject *obj)
+{
+    PyObject *seq;
+    Py_buffer view;
+    Py_ssize_t i, n;
+    double x;
+
+    if (PyFloat_Check(obj) || PyLong_Check(obj)
+#if PY_MAJOR_VERSION < 3
+            || PyInt_Check(obj)
+#endif
+            ) {
+        x = PyFloat_AsDouble(obj);
+        if (x == -1.0 && PyErr_Occurred())
+            return -1;
+        feed_summary((PyObject*)self, &x, 1, 1);
+        return 0;
+    }
+    if (PyObject_CheckBuffer(obj) &&
+            PyObject_GetBuffer(obj, &view, PyBUF_STRIDES | PyBUF_FORMAT)
+                == 0) {
+        const char *format = view.format == NULL ? "B" : view.format;
+
+        // the values must be in native order
+        if (format[0] == '@' || format[0] == '=')
+            format++;
+        if (view.ndim == 1 && strcmp(format, "d") == 0 &&
+                view.strides[0] % (Py_ssize_t)sizeof(double) == 0) {
+            feed_summary((PyObject*)self, (const double*)view.buf,
+                         view.shape[0],
+                         view.strides[0]/(Py_ssize_t)sizeof(double));
+            PyBuffer_Release(&view);
+            return 0;
+        }
+        PyBuffer_Release(&view);
+    }
+    PyErr_Clear();
+    // anything else is read one number at a time
+    seq = PySequence_Fast(obj,
+        "A number, a buffer of float64 or a sequence of numbers is "
+        "required.");
+    if (seq == NULL)
+        return -1;
+    n = PySequence_Fast_GET_SIZE(seq);
+    for (i = 0; i < n; i++) {
+        x = PyFloat_AsDouble(PySequence_Fast_GET_ITEM(seq, i));
+        if (x == -1.0 && PyErr_Occurred()) {
+            Py_DECREF(seq);
+            return -1;
+        }
+        feed_summary((PyObject*)self, &x, 1, 1);
+    }
+    Py_DECREF(seq);
+    return 0;
+}
+
+/** brief summary_snapshot - copies the fields of a Summary, and its histogram
+ * if with_hist, holding its lock on free-threaded builds. A histogram copied
+ * must be freed with bin_summary_free().
+ *
+ * return int 0 on success, -1 with MemoryError set
+ */
+static int
+summary_snapshot(SummaryObject *self, bin_summary *copy, int with_hist)
+{
+    int64_t *hist = NULL;
+
+    // the bins never change, so they may be read without the lock
+    if (with_hist) {
+        hist = (int64_t*)malloc(self->s.nbins*sizeof(int64_t));
+        if (hist == NULL) {
+            PyErr_NoMemory();
+            return -1;
+        }
+    }
+#ifdef Py_BEGIN_CRITICAL_SECTION
+    Py_BEGIN_CRITICAL_SECTION((PyObject*)self);
+#endif
+    *copy = self->s;
+    if (hist != NULL)
+        memcpy(hist, self->s.hist, self->s.nbins*sizeof(int64_t));
+#ifdef Py_BEGIN_CRITICAL_SECTION
+    Py_END_CRITICAL_SECTION();
+#endif
+    copy->hist = hist;
+    return 0;
+}
+
+#define DOC_SUMMARY_ADD \
+"add(values)\n" \
+"\n" \
+"Add a number, or each value of a buffer of float64 such as a NumPy array\n" \
+"or of a sequence of numbers, to the summary. NaNs are ignored.\n"
+static PyObject *
+summary_add(SummaryObject *self, PyObject *values)
+{
+    if (summary_values(self, values) < 0)
+        return NULL;
+    Py_RETURN_NONE;
+}
+
+#define DOC_SUMMARY_MERGE \
+"merge(other)\n" \
+"\n" \
+"Add the values summarized by another Summary with the same bins, as if\n" \
+"they had been added to this one. The count, extremes and histogram are\n" \
+"combined exactly, and the mean and variance up to rounding.\n"
+static PyObject *
+summary_merge(SummaryObject *self, PyObject *other_obj)
+{
+    SummaryObject *other = (SummaryObject*)other_obj;
+
+    if (Py_TYPE(other_obj) != Py_TYPE(self)) {
+        PyErr_SetString(PyExc_TypeError, "other must be a Summary.");
+        return NULL;
+    }
+    if (other->s.nbins != self->s.nbins || other->s.lo != self->s.lo ||
+            other->s.hi != self->s.hi) {
+        PyErr_SetString(PyExc_ValueError,
+                        "Only summaries with the same bins can be merged.");
+        return NULL;
+    }
+    if (other == self) {
+        // merge a copy, since the summary changes as it is merged
+        bin_summary copy;
+
+        if (summary_snapshot(self, &copy, 1) < 0)
+            return NULL;
+#ifdef Py_BEGIN_CRITICAL_SECTION
+        Py_BEGIN_CRITICAL_SECTION((PyObject*)self);
+#endif
+        bin_summary_merge(&self->s, &copy);
+#ifdef Py_BEGIN_CRITICAL_SECTION
+        Py_END_CRITICAL_SECTION();
+#endif
+        bin_summary_free(&copy);
+        Py_RETURN_NONE;
+    }
+#ifdef Py_BEGIN_CRITICAL_SECTION2
+    Py_BEGIN_CRITICAL_SECTION2((PyObject*)self, other_obj);
+#endif
+    bin_summary_merge(&self->s, &other->s);
+#ifdef Py_BEGIN_CRITICAL_SECTION2
+    Py_END_CRITICAL_SECTION2();
+#endif
+    Py_RETURN_NONE;
+}
+
+#define DOC_SUMMARY_QUANTILE \
+"quantile(q)\n" \
+"\n" \
+"Estimate the q-quantile of the values from the histogram, interpolating\n" \
+"within the bin where it falls; the error is at most the width of a bin.\n" \
+"Returns NaN if the summary is empty.\n"
+static PyObject *
+summary_quantile(SummaryObject *self, PyObject *q_obj)
+{
+    double q = PyFloat_AsDouble(q_obj), result;
+    bin_summary s;
+
+    if (q == -1.0 && PyErr_Occurred())
+        return NULL;
+    if (!(q >= 0.0 && q <= 1.0)) {
+        PyErr_SetString(PyExc_ValueError, "q must be between 0 and 1.");
+        return NULL;
+    }
+    if (summary_snapshot(self, &s, 1) < 0)
+        return NULL;
+    result = bin_summary_quantile(&s, q);
+    bin_summary_free(&s);
+    return PyFloat_FromDouble(result);
+}
+
+#define DOC_SUMMARY_FRACTION_BELOW \
+"fraction_below(x)\n" \
+"\n" \
+"Estimate the fraction of the values that are less than x from the\n" \
+"histogram. This is exact when x is the edge of a bin that no value falls\n" \
+"on. Returns NaN if the summary is empty.\n"
+static PyObject *
+summary_fraction_below(SummaryObject *self, PyObject *x_obj)
+{
+    double x = PyFloat_AsDouble(x_obj), result;
+    bin_summary s;
+
+    if (x == -1.0 && PyErr_Occurred())
+        return NULL;
+    if (summary_snapshot(self, &s, 1) < 0)
+        return NULL;
+    result = bin_summary_fraction_below(&s, x);
+    bin_summary_free(&s);
+    return PyFloat_FromDouble(result);
+}
+
+#define DOC_SUMMARY_HISTOGRAM \
+"histogram()\n" \
+"\n" \
+"Returns\n" \
+"-------\n" \
+"tuple of numpy.ndarray\n" \
+"    the count in each bin, as int64, and the bins+1 edges of the bins, as\n" \
+"    numpy.histogram() returns them\n"
+static PyObject *
+summary_histogram(SummaryObject *self, PyObject *unused)
+{
+    PyObject *counts, *edges;
+    Py_buffer view;
+    size_t b;
+
+    counts = new_array(self->s.nbins, "int64", 0, &view);
+    if (counts == NULL)
+        return NULL;
+#ifdef Py_BEGIN_CRITICAL_SECTION
+    Py_BEGIN_CRITICAL_SECTION((PyObject*)self);
+#endif
+    memcpy(view.buf, self->s.hist, self->s.nbins*sizeof(int64_t));
+#ifdef Py_BEGIN_CRITICAL_SECTION
+    Py_END_CRITICAL_SECTION();
+#endif
+    PyBuffer_Release(&view);
+    edges = new_double_array(self->s.nbins + 1, &view);
+    if (edges == NULL) {
+        Py_DECREF(counts);
+        return NULL;
+    }
+    for (b = 0; b <= self->s.nbins; b++) {
+        ((double*)view.buf)[b] = self->s.lo +
+            (self->s.hi - self->s.lo)*((double)b/self->s.nbins);
+    }
+    PyBuffer_Release(&view);
+    return Py_BuildValue("(NN)", counts, edges);
+}
+
+static PyObject *
+summary_reduce(SummaryObject *self, PyObject *unused)
+{
+    PyObject *hist;
+    bin_summary s;
+    size_t b;
+
+    if (summary_snapshot(self, &s, 1) < 0)
+        return NULL;
+    hist = PyList_New(s.nbins);
+    if (hist == NULL) {
+        bin_summary_free(&s);
+        return NULL;
+    }
+    for (b = 0; b < s.nbins; b++) {
+        PyObject *count = PyLong_FromLongLong(s.hist[b]);
+
+        if (count == NULL) {
+            Py_DECREF(hist);
+            bin_summary_free(&s);
+            return NULL;
+        }
+        PyList_SET_ITEM(hist, b, count);
+    }
+    bin_summary_free(&s);
+    return Py_BuildValue("(O(ndd)(LddddLLN))", Py_TYPE(self),
+                         (Py_ssize_t)s.nbins, s.lo, s.hi, (long long)s.count,
+                         s.mean, s.m2, s.min, s.max, (long long)s.below,
+                         (long long)s.above, hist);
+}
+
+/** brief summary_setstate - restores a Summary from the state returned by
+ * __reduce__, or from a worker, checking it before any of it is stored so
+ * that an inconsistent state leaves the summary unchanged
+ */
+static PyObject *
+summary_setstate(SummaryObject *self, PyObject *state)
+{
+    PyObject *hist_obj, *seq;
+    long long count, below, above, total;
+    double mean, m2, min, max;
+    int64_t *hist;
+    const char *problem = NULL;
+    size_t b;
+
+    if (!PyArg_ParseTuple(state, "LddddLLO", &count, &mean, &m2, &min, &max,
+                          &below, &above, &hist_obj))
+        return NULL;
+    seq = PySequence_Fast(hist_obj, "The histogram must be a sequence.");
+    if (seq == NULL)
+        return NULL;
+    if ((size_t)PySequence_Fast_GET_SIZE(seq) != self->s.nbins) {
+        PyErr_SetString(PyExc_ValueError,
+                        "The histogram does not match the bins.");
+        Py_DECREF(seq);
+        return NULL;
+    }
+    hist = (int64_t*)malloc(self->s.nbins*sizeof(int64_t));
+    if (hist == NULL) {
+        Py_DECREF(seq);
+        return PyErr_NoMemory();
+    }
+    for (b = 0; b < self->s.nbins; b++) {
+        hist[b] = PyLong_AsLongLong(PySequence_Fast_GET_ITEM(seq, b));
+        if (hist[b] == -1 && PyErr_Occurred()) {
+            Py_DECREF(seq);
+            free(hist);
+            return NULL;
+        }
+    }
+    Py_DECREF(seq);
+    if (count < 0 || below < 0 || above < 0) {
+        problem = "The counts of a summary cannot be negative.";
+    } else if (m2 < 0.0) {
+        // NaN is allowed, as infinite values leave it
+        problem = "The sum of squares of a summary cannot be negative.";
+    } else if (count > 0 && !(min <= max)) {
+        problem = "The minimum of a summary cannot exceed its maximum.";
+    } else {
+        total = below;
+        // compared before adding, so that the sum cannot overflow
+        if (above > count - total) {
+            problem = "The histogram and the counts outside it do not add "
+                "up to the count.";
+        } else {
+            total += above;
+        }
+        for (b = 0; problem == NULL && b < self->s.nbins; b++) {
+            if (hist[b] < 0) {
+                problem = "The counts of a summary cannot be negative.";
+            } else if (hist[b] > count - total) {
+                problem = "The histogram and the counts outside it do not "
+                    "add up to the count.";
+            } else {
+                total += hist[b];
+            }
+        }
+        if (problem == NULL && total != count) {
+            problem = "The histogram and the counts outside it do not add "
+                "up to the count.";
+        }
+    }
+    if (problem != NULL) {
+        PyErr_SetString(PyExc_ValueError, problem);
+        free(hist);
+        return NULL;
+    }
+#ifdef Py_BEGIN_CRITICAL_SECTION
+    Py_BEGIN_CRITICAL_SECTION((PyObject*)self);
+#endif
+    memcpy(self->s.hist, hist, self->s.nbins*sizeof(int64_t));
+    self->s.count = count;
+    self->s.mean = mean;
+    self->s.m2 = m2;
+    self->s.min = min;
+    self->s.max = max;
+    self->s.below = below;
+    self->s.above = above;
+#ifdef Py_BEGIN_CRITICAL_SECTION
+    Py_END_CRITICAL_SECTION();
+#endif
+    free(hist);
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+summary_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"bins", "lo", "hi", NULL};
+    Py_ssize_t nbins = 1000;
+    double lo = 0.0, hi = 1.0;
+    SummaryObject *self;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "|ndd", kwlist, &nbins,
+                                     &lo, &hi))
+        return NULL;
+    if (nbins < 1) {
+        PyErr_SetString(PyExc_ValueError,
+                        "There must be at least one bin.");
+        return NULL;
+    }
+    if (!(lo < hi && hi - lo <= DBL_MAX)) {
+        PyErr_SetString(PyExc_ValueError,
+                        "lo must be less than hi, and both finite.");
+        return NULL;
+    }
+    self = (SummaryObject*)type->tp_alloc(type, 0);
+    if (self == NULL)
+        return NULL;
+    if (bin_summary_init(&self->s, nbins, lo, hi) < 0) {
+        Py_DECREF(self);
+        return PyErr_NoMemory();
+    }
+    return (PyObject*)self;
+}
+
+static void
+summary_dealloc(SummaryObject *self)
+{
+    PyTypeObject *type = Py_TYPE(self);
+
+    bin_summary_free(&self->s);
+    type->tp_free((PyObject*)self);
+#if PY_MAJOR_VERSION >= 3
+    // instances of heap types hold a reference to their type
+    Py_DECREF(type);
+#endif
+}
+
+static PyObject *
+summary_repr(SummaryObject *self)
+{
+#if PY_MAJOR_VERSION >= 3
+    PyObject *lo, *hi, *retval;
+    bin_summary s;
+
+    summary_snapshot(self, &s, 0);
+    lo = PyFloat_FromDouble(s.lo);
+    hi = PyFloat_FromDouble(s.hi);
+    retval = lo == NULL || hi == NULL ? NULL : PyUnicode_FromFormat(
+        "<Summary(bins=%zd, lo=%R, hi=%R) of %lld values>",
+        (Py_ssize_t)s.nbins, lo, hi, (long long)s.count);
+    Py_XDECREF(lo);
+    Py_XDECREF(hi);
+    return retval;
+#else
+    bin_summary s;
+
+    summary_snapshot(self, &s, 0);
+    return PyString_FromFormat("<Summary(bins=%zd) of %lld values>",
+                               (Py_ssize_t)s.nbins, (long long)s.count);
+#endif
+}
+
+// the getters read a snapshot, which without the histogram cannot fail
+
+static PyObject *
+summary_get_count(SummaryObject *self, void *closure)
+{
+    bin_summary s;
+
+    summary_snapshot(self, &s, 0);
+    return PyLong_FromLongLong(s.count);
+}
+
+static PyObject *
+summary_get_mean(SummaryObject *self, void *closure)
+{
+    bin_summary s;
+
+    summary_snapshot(self, &s, 0);
+    return PyFloat_FromDouble(s.count > 0 ? s.mean : HUGE_VAL - HUGE_VAL);
+}
+
+static PyObject *
+summary_get_variance(SummaryObject *self, void *closure)
+{
+    bin_summary s;
+
+    summary_snapshot(self, &s, 0);
+    return PyFloat_FromDouble(s.count > 0 ? s.m2/s.count :
+                              HUGE_VAL - HUGE_VAL);
+}
+
+static PyObject *
+summary_get_std(SummaryObject *self, void *closure)
+{
+    bin_summary s;
+
+    summary_snapshot(self, &s, 0);
+    return PyFloat_FromDouble(s.count > 0 ? sqrt(s.m2/s.count) :
+                              HUGE_VAL - HUGE_VAL);
+}
+
+static PyObject *
+summary_get_min(SummaryObject *self, void *closure)
+{
+    bin_summary s;
+
+    summary_snapshot(self, &s, 0);
+    return PyFloat_FromDouble(s.count > 0 ? s.min : HUGE_VAL - HUGE_VAL);
+}
+
+static PyObject *
+summary_get_max(SummaryObject *self, void *closure)
+{
+    bin_summary s;
+
+    summary_snapshot(self, &s, 0);
+    return PyFloat_FromDouble(s.count > 0 ? s.max : HUGE_VAL - HUGE_VAL);
+}
+
+static PyObject *
+summary_get_outside(SummaryObject *self, void *closure)
+{
+    bin_summary s;
+
+    summary_snapshot(self, &s, 0);
+    return Py_BuildValue("(LL)", (long long)s.below, (long long)s.above);
+}
+
+static PyMethodDef summary_methods[] = {
+    {"add", (PyCFunction)summary_add, METH_O, DOC_SUMMARY_ADD},
+    {"merge", (PyCFunction)summary_merge, METH_O, DOC_SUMMARY_MERGE},
+    {"quantile", (PyCFunction)summary_quantile, METH_O,
+        DOC_SUMMARY_QUANTILE},
+    {"fraction_below", (PyCFunction)summary_fraction_below, METH_O,
+        DOC_SUMMARY_FRACTION_BELOW},
+    {"histogram", (PyCFunction)summary_histogram, METH_NOARGS,
+        DOC_SUMMARY_HISTOGRAM},
+    {"__reduce__", (PyCFunction)summary_reduce, METH_NOARGS, NULL},
+    {"__setstate__", (PyCFunction)summary_setstate, METH_O, NULL},
+    {NULL, NULL, 0, NULL}
+};
+
+static PyGetSetDef summary_getset[] = {
+    {"count", (getter)summary_get_count, NULL,
+        "the number of values", NULL},
+    {"mean", (getter)summary_get_mean, NULL,
+        "the mean of the values, or NaN if there are none", NULL},
+    {"variance", (getter)summary_get_variance, NULL,
+        "the population variance of the values, or NaN if there are none",
+        NULL},
+    {"std", (getter)summary_get_std, NULL,
+        "the population standard deviation of the values, or NaN if there "
+        "are none", NULL},
+    {"min", (getter)summary_get_min, NULL,
+        "the least value, or NaN if there are none", NULL},
+    {"max", (getter)summary_get_max, NULL,
+        "the greatest value, or NaN if there are none", NULL},
+    {"outside", (getter)summary_get_outside, NULL,
+        "the number of values below lo and above hi", NULL},
+    {NULL}
+};
+
+#define DOC_SUMMARY \
+"Summary(bins=1000, lo=0.0, hi=1.0)\n" \
+"\n" \
+"A mergeable summary of a stream of values, such as the scores of a large\n" \
+"corpus, for when only aggregate statistics are kept. It holds the count,\n" \
+"the mean and variance by Welford's method, the extremes, and a histogram\n" \
+"of equal bins over [lo, hi], from which quantiles and the fractions of\n" \
+"values below thresholds are estimated. The batch, ragged and scan\n" \
+"functions add their results to summaries given to them, and summaries of\n" \
+"parts of a corpus, such as from worker processes, are pickled and\n" \
+"combined with merge().\n" \
+"\n" \
+"Parameters\n" \
+"----------\n" \
+"bins : int\n" \
+"    the number of bins of the histogram\n" \
+"lo, hi : float\n" \
+"    the range of the histogram; the metrics are between 0 and 1\n"
+
+#if PY_MAJOR_VERSION >= 3
+static PyType_Slot summary_slots[] = {
+    {Py_tp_doc, (void*)DOC_SUMMARY},
+    {Py_tp_new, (void*)summary_new},
+    {Py_tp_dealloc, (void*)summary_dealloc},
+    {Py_tp_repr, (void*)summary_repr},
+    {Py_tp_methods, summary_methods},
+    {Py_tp_getset, summary_getset},
+    {0, NULL}
+};
+
+static PyType_Spec summary_spec = {
+    "bientropy.cbientropy.Summary",
+    sizeof(SummaryObject),
+    0,
+    Py_TPFLAGS_DEFAULT,
+    summary_slots
+};
+#else
+static PyTypeObject SummaryType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "bientropy.cbientropy.Summary", // tp_name
+    sizeof(SummaryObject), // tp_basicsize
+    0, // tp_itemsize
+    (destructor)summary_dealloc, // tp_dealloc
+    0, 0, 0, 0, // tp_print, tp_getattr, tp_setattr, tp_compare
+    (reprfunc)summary_repr, // tp_repr
+    0, 0, 0, 0, 0, // tp_as_number to tp_call
+    0, 0, 0, 0, // tp_str, tp_getattro, tp_setattro, tp_as_buffer
+    Py_TPFLAGS_DEFAULT, // tp_flags
+    DOC_SUMMARY, // tp_doc
+    0, 0, 0, 0, 0, 0, // tp_traverse to tp_iternext
+    summary_methods, // tp_methods
+    0, // tp_members
+    summary_getset, // tp_getset
+    0, 0, 0, 0, 0, 0, 0, // tp_base to tp_alloc
+    summary_new, // tp_new
+};
+#endif
+
+/** brief bientropy_exec - fills in a new module object: its constants, its
+ * types and its state. Run once per interpreter that imports the module.
+ *
+ * return int 0 on success, -1 with an exception set
+ */
+static int
+bientropy_exec(PyObject *m)
+{
+    PyObject *type;
+    int ncpus;
+
+    // Stamps cached results, see bientropy.cache
+    if (PyModule_AddIntConstant(m, "ENGINE_VERSION", BIN_ENGINE_VERSION) < 0)
+        return -1;
+
+#if PY_MAJOR_VERSION >= 3
+    type = PyType_FromSpec(&metric_spec);
+    if (type == NULL)
+        return -1;
+#else
+    if (PyType_Ready(&MetricType) < 0)
+        return -1;
+    type = (PyObject*)&MetricType;
+    Py_INCREF(type);
+#endif
+    // the state keeps its own reference to check arguments with
+    Py_INCREF(type);
+    get_state(m)->metric_type = type;
+    if (PyModule_AddObject(m, "Metric", type) < 0) {
+        Py_DECREF(type);
+        return -1;
+    }
+
+#if PY_MAJOR_VERSION >= 3
+    type = PyType_FromSpec(&summary_spec);
+    if (type == NULL)
+        return -1;
+#else
+    if (PyType_Ready(&SummaryType) < 0)
+        return -1;
+    type = (PyObject*)&SummaryType;
+    Py_INCREF(type);
+#endif
+    // the state keeps its own reference to check arguments with
+    Py_INCREF(type);
+    get_state(m)->summary_type = type;
+    if (PyModule_AddObject(m, "Summary", type) < 0) {
+        Py_DECREF(type);
+        return -1;
+    }
+
+#if PY_MAJOR_VERSION >= 3
+    type = PyType_FromSpec(&derivatives_spec);
+    if (type == NULL)
+        return -1;
+#else
+    if (PyType_Ready(&DerivativesType) < 0)
+        return -1;
+    type = (PyObject*)&DerivativesType;
+    Py_INCREF(type);
+#endif
+    // only iter_derivatives() creates these, so the type is not exported
+    get_state(m)->derivatives_type = type;
+
+    ncpus = default_threads();
+    if (ncpus < 0)
+        return -1;
+    get_state(m)->ncpus = ncpus;
+    return 0;
+}
+
+#if PY_VERSION_HEX >= 0x03050000
+static PyModuleDef_Slot BiEntropySlots[] = {
+    {Py_mod_exec, (void*)bientropy_exec},
+#if PY_VERSION_HEX >= 0x030C0000
+    // no objects are shared between interpreters
+    {Py_mod_multiple_interpreters, Py_MOD_PER_INTERPRETER_GIL_SUPPORTED},
+#endif
+#if PY_VERSION_HEX >= 0x030D0000
+    // the functions hold no shared mutable state, so the GIL is not needed
+    {Py_mod_gil, Py_MOD_GIL_NOT_USED},
+#endif
+    {0, NULL}
+};
+#endif
+
+#if PY_MAJOR_VERSION >= 3
+static int
+bientropy_traverse(PyObject *m, visitproc visit, void *arg)
+{
+    bientropy_state *state = get_state(m);
+
+    // the state is not allocated until the module is executed
+    if (state != NULL) {
+        Py_VISIT(state->metric_type);
+        Py_VISIT(state->summary_type);
+        Py_VISIT(state->derivatives_type);
+    }
+    return 0;
+}
+
+static int
+bientropy_clear(PyObject *m)
+{
+    bientropy_state *state = get_state(m);
+
+    if (state != NULL) {
+        Py_CLEAR(state->metric_type);
+        Py_CLEAR(state->summary_type);
+        Py_CLEAR(state->derivatives_type);
+    }
+    return 0;
+}
+
+static void
+bientropy_free(void *m)
+{
+    bientropy_clear((PyObject*)m);
+}
+
+static PyModuleDef BiEntropyModule = {
+    PyModuleDef_HEAD_INIT,
+    "cbientropy", // module name
+    NULL, // doc string
+    sizeof(bientropy_state), // per-module state, see get_state()
+    BiEntropyMethods,
+#if PY_VERSION_HEX >= 0x03050000
+    BiEntropySlots, // multi-phase initialization
+#else
+    NULL, // single-phase initialization
+#endif
+    bientropy_traverse, // the state holds the Summary type
+    bientropy_clear,
+    bientropy_free,
+};
+#endif
+
+PyMODINIT_FUNC
+#if PY_MAJOR_VERSION >= 3
+PyInit_cbientropy(void)
+#else
+initcbientropy(void)
+#endif
+{
+#if PY_VERSION_HEX >= 0x03050000
+    return PyModuleDef_Init(&BiEntropyModule);
+#else
+    PyObject* m;
+
+#if PY_MAJOR_VERSION >= 3
+    m = PyModule_Create(&BiEntropyModule);
+    if (m == NULL)
+      return m;
+#else
+    m = Py_InitModule("cbientropy", BiEntropyMethods);
+    if (m == NULL)
+      return;
+#endif
+
+    if (bientropy_exec(m) < 0) {
+#if PY_MAJOR_VERSION >= 3
+        Py_DECREF(m);
+        return NULL;
+#else
+        return;
+#endif
+    }
+
+#if PY_MAJOR_VERSION >= 3
+    return m;
+#endif
 #endif
 }
@@ -23,6 +23,8 @@ This file allows the user to compile, test and install the package using
 the `setuptools` package. See the README for more information.
 
 On the Windows platform, the MPIR library http://mpir.org/ is used.
+
+On PyPy, the cffi binding in bientropy/_cffi_build.py is built as well.
 '''
 import platform
 import sys
@@ -148,6 +150,10 @@ def run_setup(with_ext):
                 )
     else:
         kw = dict()
+    if platform.python_implementation() == 'PyPy':
+        kw.update(setup_requires=['cffi>=1.12'],
+                  cffi_modules=['bientropy/_cffi_build.py:ffibuilder'])
+        requirements.append('cffi>=1.12')
 
     setup(name='BiEntropy',
           version='1.1.5',